@@ -0,0 +1,184 @@
+"""
+Admission Control
+Load shedding for generation endpoints: admit, defer to the queue, or reject with Retry-After
+"""
+import math
+import threading
+from typing import Dict, Optional
+
+from server.config import TaskPriority
+
+ADMIT = "admit"    # Start now
+DEFER = "defer"    # Accept, but queue until capacity frees up
+REJECT = "reject"  # 503 + Retry-After; nothing is charged or stored
+
+PRIORITY_NAMES = {
+    TaskPriority.LOW: "low",
+    TaskPriority.NORMAL: "normal",
+    TaskPriority.HIGH: "high",
+    TaskPriority.URGENT: "urgent",
+}
+
+# Default plan tier -> priority (plans.priority overrides; no plan -> LOW)
+PLAN_PRIORITY = {
+    "STARTER": TaskPriority.NORMAL,
+    "CREATOR": TaskPriority.HIGH,
+    "PRO": TaskPriority.HIGH,
+    "UNLIMITED": TaskPriority.URGENT,
+}
+
+
+def normalize_priority(value) -> int:
+    """Clamp a stored / submitted value to a TaskPriority level (names or ints)."""
+    if isinstance(value, str):
+        by_name = {v: k for k, v in PRIORITY_NAMES.items()}
+        if value.strip().lower() in by_name:
+            return by_name[value.strip().lower()]
+        try:
+            value = int(value)
+        except ValueError:
+            return TaskPriority.NORMAL
+    if value is None:
+        return TaskPriority.NORMAL
+    return max(TaskPriority.LOW, min(TaskPriority.URGENT, int(value)))
+
+
+class ClassPolicy:
+    """Limits for one priority class, relative to upstream capacity.
+
+    start_utilization: new work starts only while in-flight < capacity * this; the rest of
+        the capacity is headroom kept for higher classes.
+    queue_factor: new work is deferred while queue depth < capacity * this, rejected beyond.
+    """
+
+    __slots__ = ("start_utilization", "queue_factor")
+
+    def __init__(self, start_utilization: float, queue_factor: float):
+        self.start_utilization = start_utilization
+        self.queue_factor = queue_factor
+
+
+DEFAULT_POLICIES = {
+    TaskPriority.LOW: ClassPolicy(0.7, 1.0),
+    TaskPriority.NORMAL: ClassPolicy(0.85, 2.0),
+    TaskPriority.HIGH: ClassPolicy(1.0, 4.0),
+    TaskPriority.URGENT: ClassPolicy(1.0, 8.0),
+}
+
+
+class PoolLoad:
+    """Point-in-time load of one provider pool (e.g. voicer, whisk)."""
+
+    __slots__ = ("kind", "pool", "capacity", "in_flight", "queued")
+
+    def __init__(self, kind: str, pool: str, capacity: int, in_flight: int, queued: int):
+        self.kind = kind
+        self.pool = pool
+        self.capacity = max(0, int(capacity or 0))
+        self.in_flight = max(0, int(in_flight or 0))
+        self.queued = max(0, int(queued or 0))
+
+    def to_dict(self) -> Dict:
+        return {
+            "kind": self.kind,
+            "pool": self.pool,
+            "capacity": self.capacity,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "utilization": round(self.in_flight / self.capacity, 3) if self.capacity else None,
+        }
+
+
+class Decision:
+    __slots__ = ("action", "reason", "retry_after")
+
+    def __init__(self, action: str, reason: str = "", retry_after: int = 0):
+        self.action = action
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def admitted(self) -> bool:
+        return self.action != REJECT
+
+
+class AdmissionController:
+    """Stateless decisions over a PoolLoad plus per-class counters for the admin view."""
+
+    def __init__(self, policies: Optional[Dict[int, ClassPolicy]] = None, max_queue: int = 1000,
+                 job_seconds: Optional[Dict[str, float]] = None, max_retry_after: int = 120):
+        self.policies = dict(policies or DEFAULT_POLICIES)
+        self.max_queue = max_queue
+        self.job_seconds = dict(job_seconds or {"image": 20.0, "voice": 30.0})
+        self.max_retry_after = max_retry_after
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    def policy(self, priority: int) -> ClassPolicy:
+        return self.policies.get(normalize_priority(priority)) or self.policies[TaskPriority.NORMAL]
+
+    def can_start(self, load: PoolLoad, priority: int, units: int = 1) -> bool:
+        """Whether work of this class may take upstream slots now (new or queued)."""
+        if not self.enabled or not load.capacity:
+            return True
+        return load.in_flight + units <= load.capacity * self.policy(priority).start_utilization
+
+    def retry_after(self, load: PoolLoad, backlog: int) -> int:
+        """Seconds until roughly `backlog` queued units have drained at full capacity."""
+        per_job = self.job_seconds.get(load.kind, 30.0)
+        waves = math.ceil(max(1, backlog) / max(1, load.capacity))
+        return int(max(1, min(self.max_retry_after, waves * per_job)))
+
+    def decide(self, load: PoolLoad, priority: int, units: int = 1) -> Decision:
+        if not self.enabled or not load.capacity:
+            # Without capacity info (no keys / breaker wait) the endpoints' own checks apply
+            decision = Decision(ADMIT, "unmetered")
+        elif self.can_start(load, priority, units):
+            decision = Decision(ADMIT)
+        else:
+            queue_limit = min(self.max_queue, load.capacity * self.policy(priority).queue_factor)
+            # An empty queue always takes the work, so a batch bigger than the limit can still be submitted
+            if load.queued + units <= queue_limit or not load.queued:
+                decision = Decision(DEFER, "capacity")
+            else:
+                decision = Decision(REJECT, "queue_full", self.retry_after(load, load.queued + units))
+        self._count(load.kind, priority, decision.action)
+        return decision
+
+    def _count(self, kind: str, priority: int, action: str):
+        key = f"{kind}:{PRIORITY_NAMES.get(normalize_priority(priority), 'normal')}"
+        with self._lock:
+            c = self._counters.setdefault(key, {ADMIT: 0, DEFER: 0, REJECT: 0})
+            c[action] += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            counters = {k: dict(v) for k, v in self._counters.items()}
+        return {
+            "enabled": self.enabled,
+            "max_queue": self.max_queue,
+            "policies": {
+                PRIORITY_NAMES[p]: {"start_utilization": c.start_utilization, "queue_factor": c.queue_factor}
+                for p, c in sorted(self.policies.items())
+            },
+            "decisions": counters,
+        }
+
+
+controller = AdmissionController()
+
+__all__ = [
+    "ADMIT",
+    "DEFER",
+    "REJECT",
+    "PRIORITY_NAMES",
+    "PLAN_PRIORITY",
+    "normalize_priority",
+    "ClassPolicy",
+    "DEFAULT_POLICIES",
+    "PoolLoad",
+    "Decision",
+    "AdmissionController",
+    "controller",
+]
@@ -0,0 +1,290 @@
+"""
+Database Backups
+Online snapshots of the SQLite database through the backup API, copied a few pages at a time so
+writers only wait for one step, then integrity-checked, optionally gzipped and checksummed
+
+Each snapshot is <name>-<UTC timestamp>.db[.gz] with a sha256sum-compatible <file>.sha256 next to it.
+Run `python -m server.backup [list|now|verify <file>|restore <file> [--yes]]` against DB_PATH;
+stop the server before restoring.
+
+Snapshots on the database's own volume only cover a corrupt or mis-migrated file, not a lost disk:
+point BACKUP_DIR at another volume (or sync it off the host). same_volume() tells which case applies.
+"""
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from server.migrate import MigrationLock
+
+_CHUNK = 1024 * 1024
+
+
+class BackupError(Exception):
+    pass
+
+
+class _Restarted(Exception):
+    pass
+
+
+def _sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _integrity_check(path: Path) -> str:
+    con = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return con.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        con.close()
+
+
+def _read_checksum(path: Path) -> Optional[str]:
+    sidecar = Path(f"{path}.sha256")
+    if not sidecar.exists():
+        return None
+    return sidecar.read_text().split()[0]
+
+
+def _unpack(path: Path, dest: Path):
+    """Plain copy of a snapshot (gunzipped if needed) to dest."""
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "rb") as src, open(dest, "wb") as out:
+        shutil.copyfileobj(src, out, _CHUNK)
+
+
+class BackupManager:
+    """Takes, verifies, prunes and restores snapshots of one database file.
+
+    snapshot() copies `pages_per_step` pages per backup step and sleeps `step_pause` between steps;
+    the source is only read-locked during a step. A write from another connection makes SQLite
+    restart the copy, so after `max_restarts` it falls back to one step: a single read transaction,
+    which in WAL mode does not block writers either.
+    """
+
+    def __init__(self, db_path: str, backup_dir: str, keep: int = 7, compress: bool = True,
+                 pages_per_step: int = 256, step_pause: float = 0.01, max_restarts: int = 3):
+        self.db_path = Path(db_path)
+        self.backup_dir = Path(backup_dir)
+        self.keep = keep
+        self.compress = compress
+        self.pages_per_step = pages_per_step
+        self.step_pause = step_pause
+        self.max_restarts = max_restarts
+        self.prefix = self.db_path.stem
+        self.stats = {
+            "count": 0, "failures": 0, "last_started_ms": None, "last_duration_ms": None,
+            "last_copy_ms": None, "last_steps": 0, "last_restarts": 0, "last_mode": None,
+            "last_db_bytes": None, "last_size_bytes": None, "last_file": None, "last_error": None,
+        }
+
+    def list(self) -> List[Path]:
+        """Snapshots, newest first."""
+        files = [p for p in self.backup_dir.glob(f"{self.prefix}-*.db*") if not p.name.endswith((".sha256", ".tmp"))]
+        return sorted(files, key=lambda p: p.name, reverse=True)
+
+    def latest_age_seconds(self) -> Optional[float]:
+        files = self.list()
+        return time.time() - files[0].stat().st_mtime if files else None
+
+    def snapshot(self) -> Dict:
+        """Take one backup; returns its metrics. Raises BackupError if the copy fails its check."""
+        started = time.perf_counter()
+        self.stats["last_started_ms"] = int(time.time() * 1000)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        name = f"{self.prefix}-{stamp}.db" + (".gz" if self.compress else "")
+        final = self.backup_dir / name
+        raw = self.backup_dir / f"{self.prefix}-{stamp}.db.tmp"
+        self.backup_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            steps, restarts, last_remaining, mode = 0, 0, None, "incremental"
+
+            def progress(status, remaining, total):
+                nonlocal steps, restarts, last_remaining
+                steps += 1
+                if last_remaining is not None and remaining > last_remaining:
+                    restarts += 1  # Source changed under us: SQLite started over
+                    if restarts > self.max_restarts:
+                        raise _Restarted()
+                last_remaining = remaining
+                if remaining and self.step_pause:
+                    time.sleep(self.step_pause)  # Source is unlocked here: let writers in
+
+            src = sqlite3.connect(self.db_path, timeout=30)
+            try:
+                dst = sqlite3.connect(raw)
+                try:
+                    src.backup(dst, pages=self.pages_per_step, progress=progress)
+                except _Restarted:
+                    mode = "single_step"
+                    src.backup(dst)
+                finally:
+                    dst.close()
+            finally:
+                src.close()
+            copy_ms = int((time.perf_counter() - started) * 1000)
+
+            check = _integrity_check(raw)
+            if check != "ok":
+                raise BackupError(f"Integrity check failed on {raw.name}: {check}")
+            db_bytes = raw.stat().st_size
+
+            if self.compress:
+                packed = Path(f"{final}.tmp")
+                with open(raw, "rb") as f, gzip.open(packed, "wb", compresslevel=6) as out:
+                    shutil.copyfileobj(f, out, _CHUNK)
+                raw.unlink()
+            else:
+                packed = raw
+            digest = _sha256_file(packed)
+            os.replace(packed, final)
+            Path(f"{final}.sha256").write_text(f"{digest}  {final.name}\n")
+        except BaseException as e:
+            for leftover in (raw, Path(f"{final}.tmp")):
+                leftover.unlink(missing_ok=True)
+            self.stats["failures"] += 1
+            self.stats["last_error"] = str(e)
+            raise
+
+        self.stats.update({
+            "count": self.stats["count"] + 1,
+            "last_duration_ms": int((time.perf_counter() - started) * 1000),
+            "last_copy_ms": copy_ms,
+            "last_steps": steps,
+            "last_restarts": restarts,
+            "last_mode": mode,
+            "last_db_bytes": db_bytes,
+            "last_size_bytes": final.stat().st_size,
+            "last_file": final.name,
+            "last_error": None,
+        })
+        self.prune()
+        return {"file": str(final), "sha256": digest, **{k: self.stats[k] for k in (
+            "last_duration_ms", "last_copy_ms", "last_steps", "last_restarts", "last_mode", "last_db_bytes", "last_size_bytes")}}
+
+    def prune(self) -> List[str]:
+        """Delete all but the newest `keep` snapshots."""
+        removed = []
+        for path in self.list()[self.keep:]:
+            path.unlink(missing_ok=True)
+            Path(f"{path}.sha256").unlink(missing_ok=True)
+            removed.append(path.name)
+        return removed
+
+    def verify(self, path: Path) -> Dict:
+        """Checksum (when a sidecar exists) and integrity check of a snapshot."""
+        path = Path(path)
+        expected = _read_checksum(path)
+        actual = _sha256_file(path)
+        if expected and expected != actual:
+            raise BackupError(f"Checksum mismatch for {path.name}: expected {expected}, got {actual}")
+        tmp = self.backup_dir / f".verify-{os.getpid()}.db"
+        try:
+            _unpack(path, tmp)
+            check = _integrity_check(tmp)
+        finally:
+            tmp.unlink(missing_ok=True)
+        if check != "ok":
+            raise BackupError(f"Integrity check failed on {path.name}: {check}")
+        return {"file": path.name, "sha256": actual, "checksum": "ok" if expected else "missing", "integrity": check}
+
+    def same_volume(self) -> bool:
+        """True when snapshots land on the same filesystem as the database."""
+        self.backup_dir.mkdir(parents=True, exist_ok=True)
+        return os.stat(self.backup_dir).st_dev == os.stat(self.db_path.parent).st_dev
+
+    def _checkpoint(self):
+        """Fold the WAL into the main file so the kept copy is complete on its own. Fails while
+        another connection is mid-transaction, i.e. the server is still running."""
+        con = sqlite3.connect(self.db_path, timeout=5)
+        try:
+            busy, _, _ = con.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        finally:
+            con.close()
+        if busy:
+            raise BackupError(f"{self.db_path.name} is in use; stop the server before restoring")
+
+    def restore(self, path: Path) -> Path:
+        """Replace the database with a verified snapshot. The current file is checkpointed and kept
+        as <db>.pre-restore-<timestamp>; the server must not be running."""
+        path = Path(path)
+        self.verify(path)
+        if self.db_path.exists():
+            self._checkpoint()
+        staged = Path(f"{self.db_path}.restore.tmp")
+        _unpack(path, staged)
+        kept = Path(f"{self.db_path}.pre-restore-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}")
+        if self.db_path.exists():
+            os.replace(self.db_path, kept)
+        for suffix in ("-wal", "-shm", "-journal"):
+            Path(f"{self.db_path}{suffix}").unlink(missing_ok=True)  # Empty after the checkpoint
+        os.replace(staged, self.db_path)
+        return kept
+
+    def run_once(self) -> Optional[Dict]:
+        """snapshot() unless another process is already taking one (then None)."""
+        lock = MigrationLock(f"{self.db_path}.backup.lock")
+        if not lock.acquire(blocking=False):
+            return None
+        try:
+            return self.snapshot()
+        finally:
+            lock.release()
+
+    def snapshot_stats(self) -> Dict:
+        files = self.list()
+        return {**self.stats, "dir": str(self.backup_dir), "same_volume": self.same_volume(), "keep": self.keep, "compress": self.compress,
+                "files": len(files), "total_bytes": sum(p.stat().st_size for p in files)}
+
+
+def main():
+    # Imported here: paths and settings come from server.main's environment
+    from server import main as app
+
+    args = sys.argv[1:] or ["list"]
+    manager = app.backup_manager
+    if args[0] == "list":
+        for path in manager.list():
+            stamp = datetime.fromtimestamp(path.stat().st_mtime, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+            print(f"  {path.name:<48}{path.stat().st_size:>14}  {stamp}")
+    elif args[0] == "now":
+        result = manager.snapshot()
+        print(f"{result['file']}: {result['last_size_bytes']} bytes "
+              f"({result['last_db_bytes']} raw) in {result['last_duration_ms']} ms, {result['last_steps']} steps ({result['last_mode']})")
+    elif args[0] in ("verify", "restore") and len(args) > 1:
+        path = Path(args[1])
+        if not path.exists():
+            path = manager.backup_dir / args[1]
+        try:
+            if args[0] == "verify":
+                result = manager.verify(path)
+                print(f"{result['file']}: integrity {result['integrity']}, checksum {result['checksum']}")
+                return
+            if "--yes" not in args:
+                print(f"Replace {manager.db_path} with {path.name}? Stop the server first. Re-run with --yes.")
+                sys.exit(1)
+            kept = manager.restore(path)
+            print(f"restored {path.name} -> {manager.db_path} (previous database kept as {kept.name})")
+        except BackupError as e:
+            print(f"error: {e}")
+            sys.exit(1)
+    else:
+        print("usage: python -m server.backup [list|now|verify <file>|restore <file> [--yes]]")
+        sys.exit(2)
+
+
+__all__ = ["BackupManager", "BackupError"]
+
+if __name__ == "__main__":
+    main()
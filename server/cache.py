@@ -0,0 +1,468 @@
+"""
+Two-Tier Cache
+Per-process LRU (L1) in front of a shared Redis (L2), with namespaced keys and TTLs, single-flight
+loads, probabilistic early refresh, pub/sub invalidation and per-namespace hit ratios
+
+A miss is loaded once per process (concurrent callers wait on the same load) and written to both
+tiers. Entries are refreshed in the background a little before they expire, earlier the slower
+their loader (XFetch: refresh when now - delta * beta * ln(rand) >= expiry), so hot keys are rarely
+missed and processes do not all reload the same key at the same moment. invalidate() drops the key
+here at once, deletes it from Redis and publishes it so the other processes drop their L1 copy.
+
+Redis is optional. Without it, or while it is unreachable, the cache runs L1-only: L1 entries are
+then capped at `l1_ttl` (how stale another process's change may be seen here) and reconnection is
+attempted every `retry_seconds`, with one event per outage instead of an error per call.
+Cached values are shared between callers and must not be mutated.
+"""
+import asyncio
+import inspect
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+def _encode_json(value: Any) -> bytes:
+    return json.dumps(value, separators=(",", ":"), default=str).encode()
+
+
+def _decode_json(data: bytes) -> Any:
+    return json.loads(data)
+
+
+class _Namespace:
+    __slots__ = ("name", "ttl", "encode", "decode", "stats")
+
+    def __init__(self, name: str, ttl: float, encode: Callable[[Any], bytes], decode: Callable[[bytes], Any]):
+        self.name = name
+        self.ttl = ttl
+        self.encode = encode
+        self.decode = decode
+        self.stats = {"hits_l1": 0, "hits_l2": 0, "misses": 0, "coalesced": 0, "early_refreshes": 0,
+                      "load_errors": 0, "invalidations": 0, "stale_loads": 0}
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "delta", "l1_expires_at")
+
+    def __init__(self, value: Any, expires_at: float, delta: float, l1_expires_at: float):
+        self.value = value
+        self.expires_at = expires_at      # Wall clock (shared with other processes through L2)
+        self.delta = delta                # Seconds the load took, scales the early refresh
+        self.l1_expires_at = l1_expires_at
+
+
+class _Flight:
+    __slots__ = ("future", "stale")
+
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.stale = False  # Invalidated while loading: hand the value to waiters but don't store it
+
+
+class TwoTierCache:
+    """Namespaced cache over an in-process LRU and an optional RedisClient.
+
+    Register each namespace with namespace() before use. get() takes a loader (sync or async)
+    that returns the value, or None for "nothing to cache"; loader exceptions propagate to every
+    caller waiting on that load and nothing is stored. `cache_if(value)` can refuse to store a
+    loaded value (a job that is still running) while concurrent callers still share the load.
+    """
+
+    def __init__(self, client=None, prefix: str = "cache:", max_items: int = 10000, l1_ttl: float = 15.0,
+                 beta: float = 1.0, retry_seconds: float = 30.0, timeout: float = 0.5,
+                 on_event: Optional[Callable[[str, str, str], None]] = None):
+        self.client = client  # server.redis_client.RedisClient, or None for L1-only
+        self.prefix = prefix
+        self.channel = prefix + "invalidate"
+        self.max_items = max_items
+        self.l1_ttl = l1_ttl
+        self.beta = beta
+        self.retry_seconds = retry_seconds
+        self.timeout = timeout
+        self.on_event = on_event  # (level, event_type, message)
+        self.origin = uuid.uuid4().hex
+        self._namespaces: Dict[str, _Namespace] = {}
+        self._l1: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._lock = threading.Lock()  # invalidate() may run on other threads (db writer, to_thread)
+        self._flights: Dict[Tuple[str, str], _Flight] = {}
+        self._tasks: set = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._listener: Optional[asyncio.Task] = None
+        self._l2_up = False
+        self._retry_at = 0.0
+        self._pending: Dict[str, Optional[set]] = {}  # Invalidations Redis missed while down (None = whole namespace)
+        self.stats = {"evictions": 0, "l2_errors": 0, "l2_outages": 0, "remote_invalidations": 0}
+
+    def namespace(self, name: str, ttl: float, encode: Callable[[Any], bytes] = _encode_json,
+                  decode: Callable[[bytes], Any] = _decode_json) -> str:
+        self._namespaces[name] = _Namespace(name, ttl, encode, decode)
+        return name
+
+    # -- reads ------------------------------------------------------------------
+
+    def peek(self, ns: str, key: str) -> Any:
+        """L1 value for key if present and fresh, else None (no loading, no stats)."""
+        with self._lock:
+            entry = self._l1.get((ns, key))
+        if entry and entry.l1_expires_at > time.monotonic() and entry.expires_at > time.time():
+            return entry.value
+        return None
+
+    async def get(self, ns: str, key: str, loader: Callable[[], Any],
+                  cache_if: Optional[Callable[[Any], bool]] = None) -> Any:
+        space = self._namespaces[ns]
+        full = (ns, key)
+        with self._lock:
+            entry = self._l1.get(full)
+            if entry is not None:
+                if entry.l1_expires_at > time.monotonic() and entry.expires_at > time.time():
+                    self._l1.move_to_end(full)
+                else:
+                    entry = None
+        if entry is not None:
+            space.stats["hits_l1"] += 1
+            if self._refresh_due(entry):
+                self._refresh(space, key, loader, cache_if)
+            return entry.value
+
+        while full in self._flights:
+            flight = self._flights[full]
+            space.stats["coalesced"] += 1
+            try:
+                return await asyncio.shield(flight.future)
+            except asyncio.CancelledError:
+                if not flight.future.cancelled():
+                    raise  # We were cancelled, not the load we were waiting on
+
+        flight = self._begin(full)
+        refresh = False
+        try:
+            entry = await self._l2_get(space, key)
+            if entry is not None:
+                space.stats["hits_l2"] += 1
+                if not flight.stale:
+                    self._l1_put(full, entry)
+                refresh = self._refresh_due(entry)
+                value = entry.value
+            else:
+                space.stats["misses"] += 1
+                value = await self._load(space, key, loader, flight, cache_if)
+        except BaseException as e:
+            self._end(full, flight, error=e)  # Cancelled: waiters start their own load
+            raise
+        self._end(full, flight, value=value)
+        if refresh:
+            self._refresh(space, key, loader, cache_if)
+        return value
+
+    def _refresh_due(self, entry: _Entry) -> bool:
+        if entry.delta <= 0 or self.beta <= 0:
+            return False
+        return time.time() - entry.delta * self.beta * math.log(random.random() or 1e-12) >= entry.expires_at
+
+    def _refresh(self, space: _Namespace, key: str, loader: Callable[[], Any], cache_if: Optional[Callable[[Any], bool]]):
+        """Reload key in the background unless a load is already running."""
+        full = (space.name, key)
+        if full in self._flights:
+            return
+        space.stats["early_refreshes"] += 1
+        flight = self._begin(full)
+
+        async def refresh():
+            try:
+                value = await self._load(space, key, loader, flight, cache_if)
+            except BaseException as e:
+                self._end(full, flight, error=e)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                return
+            self._end(full, flight, value=value)
+
+        self._spawn(refresh())
+
+    async def _load(self, space: _Namespace, key: str, loader: Callable[[], Any], flight: _Flight,
+                    cache_if: Optional[Callable[[Any], bool]] = None) -> Any:
+        started = time.perf_counter()
+        try:
+            value = loader()
+            if inspect.isawaitable(value):
+                value = await value
+        except Exception:
+            space.stats["load_errors"] += 1
+            raise
+        if value is None or (cache_if is not None and not cache_if(value)):
+            return value
+        if flight.stale:
+            space.stats["stale_loads"] += 1
+            return value
+        delta = time.perf_counter() - started
+        expires_at = time.time() + space.ttl
+        self._l1_put((space.name, key), _Entry(value, expires_at, delta, 0.0))
+        await self._l2_set(space, key, value, expires_at, delta, flight)
+        return value
+
+    def _begin(self, full: Tuple[str, str]) -> _Flight:
+        flight = _Flight(asyncio.get_running_loop().create_future())
+        self._flights[full] = flight
+        return flight
+
+    def _end(self, full: Tuple[str, str], flight: _Flight, value: Any = None, error: Optional[BaseException] = None):
+        if self._flights.get(full) is flight:
+            del self._flights[full]
+        if flight.future.done():
+            return
+        if isinstance(error, asyncio.CancelledError):
+            flight.future.cancel()
+        elif error is not None:
+            flight.future.set_exception(error)
+            flight.future.exception()  # Nobody may be waiting: don't warn about it
+        else:
+            flight.future.set_result(value)
+
+    # -- L1 ---------------------------------------------------------------------
+
+    def _l1_put(self, full: Tuple[str, str], entry: _Entry):
+        # Without Redis pub/sub nothing tells us about changes made by other processes
+        remaining = entry.expires_at - time.time()
+        entry.l1_expires_at = time.monotonic() + (remaining if self._l2_up else min(remaining, self.l1_ttl))
+        with self._lock:
+            self._l1[full] = entry
+            self._l1.move_to_end(full)
+            while len(self._l1) > self.max_items:
+                self._l1.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def _l1_drop(self, ns: str, keys: Tuple[str, ...]):
+        with self._lock:
+            if keys:
+                for key in keys:
+                    self._l1.pop((ns, key), None)
+            else:
+                for full in [k for k in self._l1 if k[0] == ns]:
+                    del self._l1[full]
+
+    def _mark_stale(self, ns: str, keys: Tuple[str, ...]):
+        """Loads of invalidated keys that are still running must not store what they read."""
+        for full, flight in list(self._flights.items()):
+            if full[0] == ns and (not keys or full[1] in keys):
+                flight.stale = True
+                del self._flights[full]  # Later callers start a fresh load
+
+    # -- L2 ---------------------------------------------------------------------
+
+    def _l2_key(self, ns: str, key: str) -> str:
+        return f"{self.prefix}{ns}:{key}"
+
+    async def _redis(self):
+        """Connected redis.asyncio client, or None while Redis is disabled or down."""
+        if self.client is None:
+            return None
+        if self._l2_up:
+            return self.client.redis
+        if time.monotonic() < self._retry_at:
+            return None
+        self._retry_at = time.monotonic() + self.retry_seconds  # Other callers skip Redis meanwhile
+        try:
+            if self.client.is_connected:
+                await asyncio.wait_for(self.client.redis.ping(), self.timeout)
+            else:
+                await asyncio.wait_for(self.client.connect(), max(self.timeout, 5.0))
+        except Exception as e:
+            self._l2_down(e)
+            return None
+        self._l2_up = True
+        self._event("info", "cache_l2_up", "Redis cache available")
+        if self._pending:
+            self._spawn(self._replay_pending())
+        return self.client.redis
+
+    def _l2_down(self, error: Exception):
+        self.stats["l2_errors"] += 1
+        self._retry_at = time.monotonic() + self.retry_seconds
+        if self._l2_up or not self.stats["l2_outages"]:
+            self.stats["l2_outages"] += 1
+            self._event("warning", "cache_l2_down",
+                        f"Redis cache unavailable, L1 only (retry every {self.retry_seconds:g}s): {error}")
+        self._l2_up = False
+
+    async def _l2_get(self, space: _Namespace, key: str) -> Optional[_Entry]:
+        redis = await self._redis()
+        if redis is None:
+            return None
+        try:
+            data = await asyncio.wait_for(redis.get(self._l2_key(space.name, key)), self.timeout)
+        except Exception as e:
+            self._l2_down(e)
+            return None
+        if not data:
+            return None
+        try:
+            header, _, payload = data.partition(b"\n")
+            expires_at, delta = (float(x) for x in header.split())
+            value = space.decode(payload)
+        except (ValueError, TypeError):
+            return None  # Written by an incompatible version: reload
+        if expires_at <= time.time():
+            return None
+        return _Entry(value, expires_at, delta, 0.0)
+
+    async def _l2_set(self, space: _Namespace, key: str, value: Any, expires_at: float, delta: float, flight: _Flight):
+        redis = await self._redis()
+        if redis is None or flight.stale:
+            return
+        data = f"{expires_at:.3f} {delta:.4f}\n".encode() + space.encode(value)
+        try:
+            await asyncio.wait_for(redis.set(self._l2_key(space.name, key), data, px=int(space.ttl * 1000)), self.timeout)
+        except Exception as e:
+            self._l2_down(e)
+
+    # -- invalidation -------------------------------------------------------------
+
+    def invalidate(self, ns: str, *keys: str, local: bool = False):
+        """Drop keys (the whole namespace when none are given) here now, then from Redis and
+        every other process. Callable from any thread; `local` skips Redis and the broadcast."""
+        keys = tuple(str(k) for k in keys)
+        self._namespaces[ns].stats["invalidations"] += 1
+        self._l1_drop(ns, keys)
+        in_loop = _in_loop()
+        if in_loop:
+            self._mark_stale(ns, keys)
+        elif self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._mark_stale, ns, keys)
+        if local or self.client is None:
+            return
+        if in_loop:
+            self._spawn(self._invalidate_remote(ns, keys))
+        elif self._loop is not None and not self._loop.is_closed():
+            asyncio.run_coroutine_threadsafe(self._invalidate_remote(ns, keys), self._loop)
+        else:
+            self._remember(ns, keys)
+
+    def _remember(self, ns: str, keys: Tuple[str, ...]):
+        pending = self._pending.get(ns, set())
+        if pending is None or not keys or len(pending) + len(keys) > 1000:
+            self._pending[ns] = None
+        else:
+            self._pending[ns] = pending | set(keys)
+
+    async def _invalidate_remote(self, ns: str, keys: Tuple[str, ...]):
+        redis = await self._redis()
+        if redis is None:
+            self._remember(ns, keys)
+            return
+        try:
+            if keys:
+                await redis.delete(*(self._l2_key(ns, k) for k in keys))
+            else:
+                async for name in redis.scan_iter(match=self._l2_key(ns, "*"), count=500):
+                    await redis.unlink(name)
+            await redis.publish(self.channel, json.dumps({"o": self.origin, "n": ns, "k": list(keys)}))
+        except Exception as e:
+            self._l2_down(e)
+            self._remember(ns, keys)
+
+    async def _replay_pending(self):
+        pending, self._pending = self._pending, {}
+        for ns, keys in pending.items():
+            await self._invalidate_remote(ns, tuple(keys or ()))
+
+    def _apply_remote(self, data: bytes):
+        try:
+            message = json.loads(data)
+        except ValueError:
+            return
+        if message.get("o") == self.origin or message.get("n") not in self._namespaces:
+            return
+        self.stats["remote_invalidations"] += 1
+        keys = tuple(message.get("k") or ())
+        self._l1_drop(message["n"], keys)
+        self._mark_stale(message["n"], keys)
+
+    # -- lifecycle ------------------------------------------------------------------
+
+    def start(self):
+        """Remember the event loop (for invalidate() from threads) and listen for invalidations.
+        Call from the event loop."""
+        self._loop = asyncio.get_running_loop()
+        if self.client is not None and self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except BaseException:
+                pass
+            self._listener = None
+        for task in list(self._tasks):
+            task.cancel()
+
+    async def _listen(self):
+        subscribed_before = False
+        while True:
+            redis = await self._redis()
+            if redis is None:
+                await asyncio.sleep(max(0.5, self._retry_at - time.monotonic()))
+                continue
+            pubsub = redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                if subscribed_before:
+                    # Invalidations published while we were not listening are lost: start clean
+                    with self._lock:
+                        self._l1.clear()
+                subscribed_before = True
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self._apply_remote(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._l2_down(e)
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _event(self, level: str, event_type: str, message: str):
+        if self.on_event:
+            self.on_event(level, event_type, message)
+
+    def snapshot(self) -> Dict:
+        namespaces = {}
+        for name, space in self._namespaces.items():
+            s = space.stats
+            hits = s["hits_l1"] + s["hits_l2"] + s["coalesced"]  # Coalesced callers did not load either
+            lookups = hits + s["misses"]
+            namespaces[name] = {**s, "ttl": space.ttl, "hit_ratio": round(hits / lookups, 4) if lookups else None}
+        if self.client is None:
+            l2 = "disabled"
+        else:
+            l2 = "up" if self._l2_up else "down"
+        return {**self.stats, "l2": l2, "l1_items": len(self._l1), "l1_max_items": self.max_items,
+                "l1_ttl": self.l1_ttl, "inflight": len(self._flights),
+                "pending_invalidations": sum(len(v) if v else 1 for v in self._pending.values()),
+                "namespaces": namespaces}
+
+
+def _in_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+__all__ = ["TwoTierCache"]
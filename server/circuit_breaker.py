@@ -0,0 +1,327 @@
+"""
+Circuit Breaker
+Per-provider, per-key circuit breakers with half-open probing and jittered, budgeted retries
+"""
+import asyncio
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+STATE_CLOSED = "closed"        # Traffic flows; consecutive failures are counted
+STATE_OPEN = "open"            # Key is skipped until the cooldown expires
+STATE_HALF_OPEN = "half_open"  # Cooldown expired; exactly one probe request is let through
+
+# HTTP statuses that mean "the provider is unhealthy / overloaded", not "the request is bad"
+RETRYABLE_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504, 520, 521, 522, 523, 524})
+
+
+def is_retryable_status(status_code: Optional[int]) -> bool:
+    return status_code is not None and (status_code in RETRYABLE_STATUSES or status_code >= 500)
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Full-jitter exponential backoff: uniform(0, min(cap, base * 2**attempt))."""
+    return random.uniform(0, min(cap, base * (2 ** max(0, attempt))))
+
+
+class UpstreamError(RuntimeError):
+    """Upstream call failed. retryable=True means the provider (not the request) is at fault."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, retryable: bool = False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retryable = retryable
+
+
+class CircuitBreaker:
+    """State machine for one (provider, key).
+
+    closed -> open after failure_threshold consecutive failures; the cooldown doubles on
+    every re-open (with jitter) up to max_cooldown. Once it expires the breaker is
+    half-open and hands out a single probe; the probe's outcome closes or re-opens it.
+    A probe that is never reported (caller crashed) is released after probe_timeout.
+    """
+
+    def __init__(self, failure_threshold: int = 5, base_cooldown: float = 15.0,
+                 max_cooldown: float = 300.0, probe_timeout: float = 120.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.probe_timeout = probe_timeout
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.open_count = 0           # Re-opens since last close; drives the cooldown exponent
+        self.open_until = 0.0
+        self.probe_started = 0.0
+        self.total_failures = 0
+        self.total_successes = 0
+        self.last_error: Optional[str] = None
+        self.last_failure_at: Optional[float] = None
+        self.opened_at: Optional[float] = None
+
+    def _refresh(self, now: float):
+        if self.state == STATE_OPEN and now >= self.open_until:
+            self.state = STATE_HALF_OPEN
+            self.probe_started = 0.0
+        if self.state == STATE_HALF_OPEN and self.probe_started and now - self.probe_started > self.probe_timeout:
+            self.probe_started = 0.0
+
+    def available(self, now: float) -> bool:
+        """Would a request be let through right now (without claiming the probe)?"""
+        self._refresh(now)
+        if self.state == STATE_CLOSED:
+            return True
+        return self.state == STATE_HALF_OPEN and not self.probe_started
+
+    def acquire(self, now: float) -> bool:
+        """Let a request through; in half-open this claims the single probe slot."""
+        if not self.available(now):
+            return False
+        if self.state == STATE_HALF_OPEN:
+            self.probe_started = now
+        return True
+
+    def record_success(self, now: float):
+        self.total_successes += 1
+        self.consecutive_failures = 0
+        self.open_count = 0
+        self.probe_started = 0.0
+        self.opened_at = None
+        self.state = STATE_CLOSED
+
+    def record_failure(self, now: float, error: Optional[str] = None):
+        self.total_failures += 1
+        self.consecutive_failures += 1
+        self.last_error = (error or "")[:300] or None
+        self.last_failure_at = now
+        self._refresh(now)
+        if self.state == STATE_HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self._open(now)
+
+    def _open(self, now: float):
+        cooldown = min(self.max_cooldown, self.base_cooldown * (2 ** self.open_count))
+        cooldown *= random.uniform(0.8, 1.2)
+        self.open_count += 1
+        self.state = STATE_OPEN
+        self.open_until = now + cooldown
+        self.probe_started = 0.0
+        if self.opened_at is None:
+            self.opened_at = now
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        self._refresh(now)
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "open_count": self.open_count,
+            "retry_in_seconds": round(max(0.0, self.open_until - now), 1) if self.state == STATE_OPEN else 0,
+            "probe_in_flight": bool(self.probe_started),
+            "total_failures": self.total_failures,
+            "total_successes": self.total_successes,
+            "last_error": self.last_error,
+            "last_failure_age_seconds": round(now - self.last_failure_at, 1) if self.last_failure_at else None,
+            "open_for_seconds": round(now - self.opened_at, 1) if self.opened_at else None,
+        }
+
+
+class RetryBudget:
+    """Caps retries at a fraction of first attempts so retries can't amplify an outage.
+
+    Every first attempt deposits `ratio` tokens (up to max_tokens); every retry spends one.
+    """
+
+    def __init__(self, ratio: float = 0.2, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.retries = 0
+        self.denied = 0
+
+    def deposit(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            self.retries += 1
+            return True
+        self.denied += 1
+        return False
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "tokens": round(self.tokens, 2),
+            "max_tokens": self.max_tokens,
+            "retries": self.retries,
+            "denied": self.denied,
+        }
+
+
+class BreakerBoard:
+    """All breakers and retry budgets, keyed by (provider, key_id) and provider respectively."""
+
+    def __init__(self, failure_threshold: int = 5, base_cooldown: float = 15.0, max_cooldown: float = 300.0,
+                 retry_ratio: float = 0.2, retry_max_tokens: float = 10.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.retry_ratio = retry_ratio
+        self.retry_max_tokens = retry_max_tokens
+        self.clock = clock
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+        self._budgets: Dict[str, RetryBudget] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, **kwargs):
+        """Update thresholds; existing breakers keep their state but adopt the new limits."""
+        with self._lock:
+            for k, v in kwargs.items():
+                if v is not None and hasattr(self, k):
+                    setattr(self, k, v)
+            for b in self._breakers.values():
+                b.failure_threshold = max(1, self.failure_threshold)
+                b.base_cooldown = self.base_cooldown
+                b.max_cooldown = self.max_cooldown
+            for budget in self._budgets.values():
+                budget.ratio = self.retry_ratio
+                budget.max_tokens = self.retry_max_tokens
+
+    def _breaker(self, provider: str, key_id: Any) -> CircuitBreaker:
+        k = (provider, str(key_id))
+        b = self._breakers.get(k)
+        if b is None:
+            b = CircuitBreaker(self.failure_threshold, self.base_cooldown, self.max_cooldown)
+            self._breakers[k] = b
+        return b
+
+    def _budget(self, provider: str) -> RetryBudget:
+        budget = self._budgets.get(provider)
+        if budget is None:
+            budget = RetryBudget(self.retry_ratio, self.retry_max_tokens)
+            self._budgets[provider] = budget
+        return budget
+
+    def available(self, provider: str, key_id: Any) -> bool:
+        with self._lock:
+            return self._breaker(provider, key_id).available(self.clock())
+
+    def acquire(self, provider: str, key_id: Any) -> bool:
+        with self._lock:
+            return self._breaker(provider, key_id).acquire(self.clock())
+
+    def record_success(self, provider: str, key_id: Any):
+        with self._lock:
+            self._breaker(provider, key_id).record_success(self.clock())
+
+    def record_failure(self, provider: str, key_id: Any, error: Optional[str] = None):
+        with self._lock:
+            self._breaker(provider, key_id).record_failure(self.clock(), error)
+
+    def state(self, provider: str, key_id: Any) -> str:
+        with self._lock:
+            b = self._breakers.get((provider, str(key_id)))
+            if b is None:
+                return STATE_CLOSED
+            b._refresh(self.clock())
+            return b.state
+
+    def all_open(self, provider: str, key_ids: List[Any]) -> bool:
+        """True when every given key of the provider is refusing traffic."""
+        if not key_ids:
+            return False
+        with self._lock:
+            now = self.clock()
+            return not any(self._breaker(provider, k).available(now) for k in key_ids)
+
+    def start_attempt(self, provider: str):
+        with self._lock:
+            self._budget(provider).deposit()
+
+    def allow_retry(self, provider: str) -> bool:
+        with self._lock:
+            return self._budget(provider).withdraw()
+
+    def reset(self, provider: Optional[str] = None, key_id: Any = None):
+        with self._lock:
+            for k in list(self._breakers):
+                if (provider is None or k[0] == provider) and (key_id is None or k[1] == str(key_id)):
+                    del self._breakers[k]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            now = self.clock()
+            providers: Dict[str, Dict[str, Any]] = {}
+            for (provider, key_id), b in sorted(self._breakers.items()):
+                p = providers.setdefault(provider, {"keys": {}})
+                p["keys"][key_id] = b.snapshot(now)
+            for provider, budget in self._budgets.items():
+                providers.setdefault(provider, {"keys": {}})["retry_budget"] = budget.snapshot()
+            for p in providers.values():
+                states = [k["state"] for k in p["keys"].values()]
+                p["open_keys"] = sum(1 for s in states if s != STATE_CLOSED)
+                p["state"] = (
+                    STATE_OPEN if states and all(s == STATE_OPEN for s in states)
+                    else STATE_HALF_OPEN if p["open_keys"] else STATE_CLOSED
+                )
+            return {
+                "failure_threshold": self.failure_threshold,
+                "base_cooldown_seconds": self.base_cooldown,
+                "max_cooldown_seconds": self.max_cooldown,
+                "providers": providers,
+            }
+
+
+async def retry_async(provider: str, key_id: Any, call: Callable[[], Awaitable[Any]],
+                      classify: Callable[[Any], Optional[str]],
+                      board: "BreakerBoard", max_attempts: int = 3,
+                      base_delay: float = 1.0, max_delay: float = 20.0,
+                      retry_on: Tuple[type, ...] = ()) -> Any:
+    """Run call() with breaker bookkeeping and jittered exponential retries.
+
+    classify(result) returns an error string when the result is a provider failure that
+    should be retried, or None when it should be returned as-is (success or a request
+    error the caller handles). Exceptions in retry_on count as provider failures too.
+    Retries stop early when the key's breaker opens or the provider's retry budget is spent;
+    the last result is then returned (or the last exception re-raised).
+    """
+    board.start_attempt(provider)
+    attempt = 0
+    while True:
+        error: Optional[str] = None
+        result: Any = None
+        try:
+            result = await call()
+        except retry_on as e:
+            board.record_failure(provider, key_id, f"{type(e).__name__}: {e}")
+            if attempt + 1 >= max_attempts or not board.available(provider, key_id) or not board.allow_retry(provider):
+                raise
+        else:
+            error = classify(result)
+            if error is None:
+                board.record_success(provider, key_id)
+                return result
+            board.record_failure(provider, key_id, error)
+            if attempt + 1 >= max_attempts or not board.available(provider, key_id) or not board.allow_retry(provider):
+                return result
+        await asyncio.sleep(backoff_delay(attempt, base_delay, max_delay))
+        attempt += 1
+
+
+breakers = BreakerBoard()
+
+__all__ = [
+    "STATE_CLOSED",
+    "STATE_OPEN",
+    "STATE_HALF_OPEN",
+    "RETRYABLE_STATUSES",
+    "is_retryable_status",
+    "backoff_delay",
+    "UpstreamError",
+    "CircuitBreaker",
+    "RetryBudget",
+    "BreakerBoard",
+    "retry_async",
+    "breakers",
+]
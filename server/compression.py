@@ -0,0 +1,312 @@
+"""
+Compression
+Negotiated gzip / brotli response compression (ASGI middleware) and a fast JSON codec
+(orjson when installed, stdlib json otherwise) for responses and stored *_json columns
+
+Run `python -m server.compression` for a benchmark of encode time and wire size on payloads shaped
+like the admin task list, task log, user list and inline image status.
+"""
+import asyncio
+import json
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # Optional: same output shape, just slower
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip only
+    brotli = None
+
+# Worth compressing; images, audio and archives are already compressed
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "application/javascript", "application/xml",
+                      "text/", "image/svg+xml")
+
+
+# =============================================================================
+# JSON codec
+# =============================================================================
+
+def _orjson_default(obj: Any) -> Any:
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, bytes):
+        return obj.decode("utf-8", "replace")
+    raise TypeError
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """UTF-8 JSON. orjson output is compact ("a":1); readers and LIKE filters accept both forms."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass  # e.g. integers beyond 64 bits: let the stdlib encoder handle (or reject) it
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def dumps(obj: Any) -> str:
+    if orjson is not None:
+        return dumps_bytes(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def loads(data: Any) -> Any:
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass  # NaN / Infinity written by the stdlib encoder: fall through
+    return json.loads(data)
+
+
+# =============================================================================
+# Compression middleware
+# =============================================================================
+
+def choose_encoding(accept_encoding: str, brotli_enabled: bool = True) -> Optional[str]:
+    """"br" or "gzip" from an Accept-Encoding header, honouring q=0; None for identity."""
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        params = params.strip()
+        try:
+            q = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            q = 0.0
+        accepted[token.strip().lower()] = q
+    for encoding in (("br", "gzip") if brotli_enabled and brotli is not None else ("gzip",)):
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+class _Encoder:
+    """Incremental gzip / brotli encoder; flush() emits everything so far (for streamed responses)."""
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._br = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._z = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)  # 31 = gzip container
+
+    def compress(self, data: bytes, flush: bool = False) -> bytes:
+        if self.encoding == "br":
+            return self._br.process(data) + (self._br.flush() if flush else b"")
+        return self._z.compress(data) + (self._z.flush(zlib.Z_SYNC_FLUSH) if flush else b"")
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.encoding == "br":
+            return self._br.process(data) + self._br.finish()
+        return self._z.compress(data) + self._z.flush()
+
+
+def compress(data: bytes, encoding: str, gzip_level: int = 6, brotli_quality: int = 4) -> bytes:
+    return _Encoder(encoding, gzip_level, brotli_quality).finish(data)
+
+
+class CompressionMiddleware:
+    """Compresses responses the client accepts, when they are compressible and large enough.
+
+    Pure ASGI, so bodies are not copied through BaseHTTPMiddleware. Whole bodies are compressed
+    in one go; streamed bodies (NDJSON progress, downloads) chunk by chunk with a sync flush so
+    each chunk still reaches the client immediately. Responses that already carry a
+    Content-Encoding (precompressed static assets) pass through. Strong ETags become weak, since
+    the bytes on the wire are no longer the representation the tag was computed for.
+    Bodies over thread_min_bytes are compressed in a thread (zlib / brotli release the GIL), so a
+    multi-MB response does not stall the event loop.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4,
+                 brotli_enabled: bool = True, thread_min_bytes: int = 256 * 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.thread_min_bytes = thread_min_bytes
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.brotli_enabled = brotli_enabled
+        self.stats = {"compressed": 0, "skipped": 0, "bytes_in": 0, "bytes_out": 0}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        accept = ""
+        for name, value in scope.get("headers") or ():
+            if name == b"accept-encoding":
+                accept = value.decode("latin-1")
+                break
+        encoding = choose_encoding(accept, self.brotli_enabled) if accept else None
+        if not encoding:
+            return await self.app(scope, receive, send)
+
+        start: Optional[Dict] = None
+        encoder: Optional[_Encoder] = None
+        passthrough = False
+
+        async def wrapped_send(message):
+            nonlocal start, encoder, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                return await send(message)
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+
+            if encoder is None:
+                headers = _Headers(start["headers"])
+                length = headers.get(b"content-length")
+                if not self._eligible(start["status"], headers, len(body) if not more else (int(length) if length else None)):
+                    passthrough = True
+                    self.stats["skipped"] += 1
+                    await send(start)
+                    return await send(message)
+                encoder = _Encoder(encoding, self.gzip_level, self.brotli_quality)
+                headers.set(b"content-encoding", encoding.encode())
+                headers.vary_accept_encoding()
+                headers.weaken_etag()
+                self.stats["compressed"] += 1
+                if not more:
+                    out = await self._run(encoder.finish, body)
+                    headers.set(b"content-length", str(len(out)).encode())
+                    self._count(len(body), len(out))
+                    await send({**start, "headers": headers.items})
+                    return await send({"type": "http.response.body", "body": out, "more_body": False})
+                headers.remove(b"content-length")
+                await send({**start, "headers": headers.items})
+
+            out = await (self._run(encoder.compress, body, True) if more else self._run(encoder.finish, body))
+            self._count(len(body), len(out))
+            await send({"type": "http.response.body", "body": out, "more_body": more})
+
+        await self.app(scope, receive, wrapped_send)
+
+    async def _run(self, fn, body: bytes, *args) -> bytes:
+        if len(body) >= self.thread_min_bytes:
+            return await asyncio.to_thread(fn, body, *args)
+        return fn(body, *args)
+
+    def _eligible(self, status: int, headers: "_Headers", size: Optional[int]) -> bool:
+        if status < 200 or status in (204, 206, 304):
+            return False
+        if headers.get(b"content-encoding"):
+            return False
+        ctype = (headers.get(b"content-type") or b"").decode("latin-1").lower()
+        if not ctype.startswith(COMPRESSIBLE_TYPES):
+            return False
+        return size is None or size >= self.minimum_size
+
+    def _count(self, n_in: int, n_out: int):
+        self.stats["bytes_in"] += n_in
+        self.stats["bytes_out"] += n_out
+
+    def snapshot(self) -> Dict:
+        saved = self.stats["bytes_in"] - self.stats["bytes_out"]
+        return {"brotli": self.brotli_enabled and brotli is not None, "json_codec": "orjson" if orjson else "json",
+                "minimum_size": self.minimum_size, "bytes_saved": saved, **self.stats}
+
+
+class _Headers:
+    """Mutable view over ASGI raw headers (list of (name, value) byte pairs, names lower-case)."""
+
+    def __init__(self, raw):
+        self.items: List[Tuple[bytes, bytes]] = [(k.lower(), v) for k, v in raw]
+
+    def get(self, name: bytes) -> Optional[bytes]:
+        for k, v in self.items:
+            if k == name:
+                return v
+        return None
+
+    def set(self, name: bytes, value: bytes):
+        self.remove(name)
+        self.items.append((name, value))
+
+    def remove(self, name: bytes):
+        self.items = [(k, v) for k, v in self.items if k != name]
+
+    def vary_accept_encoding(self):
+        vary = self.get(b"vary")
+        if not vary:
+            self.set(b"vary", b"Accept-Encoding")
+        elif b"accept-encoding" not in vary.lower() and vary.strip() != b"*":
+            self.set(b"vary", vary + b", Accept-Encoding")
+
+    def weaken_etag(self):
+        etag = self.get(b"etag")
+        if etag and not etag.startswith(b"W/"):
+            self.set(b"etag", b"W/" + etag)
+
+
+# =============================================================================
+# Benchmark
+# =============================================================================
+
+def _payloads() -> Dict[str, Any]:
+    import base64
+    import os
+    import random
+    rng = random.Random(5)
+    fake_png = base64.b64encode(os.urandom(1_500_000)).decode("ascii")  # Incompressible, like real PNG data
+
+    def job(i: int, with_image: bool) -> Dict:
+        meta = {"type": "image", "provider": "grok", "model": "grok-2-image", "aspect_ratio": "1:1",
+                "seed": rng.randint(0, 2**31), "num_images": 1, "full_prompt": "a cat " * 80}
+        if with_image:
+            meta["data_uri"] = meta["result"] = "data:image/png;base64," + fake_png
+        return {"id": f"FFS_{i:07d}", "user_id": f"u{i % 40}", "status": rng.choice(["processing", "queued"]),
+                "prompt": "a cat " * 20, "created_at_ms": 1_700_000_000_000 + i, "metadata": meta}
+
+    return {
+        "admin_active_tasks (200 jobs)": {"ok": True, "tasks": [job(i, False) for i in range(200)]},
+        "admin_task_log (1000 items)": {"ok": True, "logs": [
+            {"id": i, "level": "info", "event_type": "job_completed", "message": f"Job FFS_{i:07d} completed in {rng.random():.3f}s",
+             "user_id": f"u{i % 40}", "metadata": {"task_id": f"FFS_{i:07d}", "credits": rng.randint(1, 500)},
+             "created_at_ms": 1_700_000_000_000 + i} for i in range(1000)]},
+        "admin_list_users (500 users)": {"ok": True, "users": [
+            {"id": f"u{i}", "nickname": f"user{i}", "email": f"user{i}@example.com", "plan": "pro", "credits": rng.randint(0, 10**6),
+             "credit_packages": [{"id": j, "credits": 10_000, "remaining": rng.randint(0, 10_000), "expires_at_ms": 1_800_000_000_000}
+                                 for j in range(3)]} for i in range(500)]},
+        "image_status inline (4 images)": {"status": "completed", "result": "data:image/png;base64," + fake_png,
+                                           "all_images": [{"data_uri": "data:image/png;base64," + fake_png} for _ in range(4)]},
+    }
+
+
+def _timed(fn, repeat: int = 5) -> Tuple[float, Any]:
+    best, out = float("inf"), None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t)
+    return best * 1000, out
+
+
+def main():
+    print(f"json codec: {'orjson' if orjson else 'stdlib (orjson not installed)'}; brotli: {'yes' if brotli else 'no'}")
+    print(f"  {'payload':<34}{'json ms':>9}{'fast ms':>9}{'bytes':>11}{'gzip':>10}{'gz ms':>7}{'br':>10}{'br ms':>7}")
+    for name, payload in _payloads().items():
+        std_ms, raw = _timed(lambda: json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+        fast_ms, _ = _timed(lambda: dumps_bytes(payload))
+        gz_ms, gz = _timed(lambda: compress(raw, "gzip"))
+        row = f"  {name:<34}{std_ms:>9.2f}{fast_ms:>9.2f}{len(raw):>11}{len(gz):>10}{gz_ms:>7.1f}"
+        if brotli is not None:
+            br_ms, br = _timed(lambda: compress(raw, "br"))
+            row += f"{len(br):>10}{br_ms:>7.1f}"
+        print(row)
+        # metadata_json decode, as done on every status poll / list row
+        if name.startswith("admin_active_tasks"):
+            rows = [json.dumps(t["metadata"]) for t in payload["tasks"]]
+            std_ms, _ = _timed(lambda: [json.loads(r) for r in rows])
+            fast_ms, _ = _timed(lambda: [loads(r) for r in rows])
+            print(f"  {'  decode 200 metadata_json':<34}{std_ms:>9.2f}{fast_ms:>9.2f}")
+
+
+__all__ = ["dumps", "dumps_bytes", "loads", "CompressionMiddleware", "choose_encoding", "compress"]
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Database Writer
+Single writer thread that applies queued write intents in grouped transactions (group commit)
+
+SQLite allows one writer at a time, and every commit pays for a journal sync. Many small commits
+from request handlers therefore queue on the write lock ("database is locked") and each pays the
+sync on its own. Here one thread owns a connection, drains whatever intents are queued (waiting
+up to max_delay for more), runs each in a savepoint inside one BEGIN IMMEDIATE ... COMMIT, and only
+then resolves the callers' futures. A failing intent rolls back its own savepoint, not the batch.
+
+Intents run on the writer thread: they must not commit, use executescript, or wait on the writer.
+"""
+import asyncio
+import atexit
+import concurrent.futures
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Sequence
+
+_STOP = object()
+
+
+class _Intent:
+    __slots__ = ("sql", "params", "fn", "future", "queued_at")
+
+    def __init__(self, sql: Optional[str], params: Sequence, fn: Optional[Callable[[sqlite3.Connection], Any]],
+                 future: Optional[concurrent.futures.Future]):
+        self.sql = sql
+        self.params = params
+        self.fn = fn
+        self.future = future  # None = fire-and-forget
+        self.queued_at = time.perf_counter()
+
+
+class DBWriter:
+    """Group-commit writer.
+
+    execute()/run() (async) and execute_sync()/run_sync() return once the intent is committed;
+    defer() queues bookkeeping writes nobody waits for (last-used timestamps, event log). The
+    thread starts on first use, so processes that never write (media pool children) never start it.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], max_batch: int = 256,
+                 max_delay: float = 0.002, on_error: Optional[Callable[[str, Exception], None]] = None):
+        self.connect = connect
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.on_error = on_error
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._atexit = False
+        self.stats = {"batches": 0, "intents": 0, "deferred": 0, "failed_intents": 0, "failed_batches": 0,
+                      "max_batch": 0, "last_commit_ms": 0.0, "max_commit_ms": 0.0, "max_wait_ms": 0.0}
+
+    # -- submission -----------------------------------------------------------
+
+    def _put(self, intent: _Intent):
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+        self._queue.put(intent)
+
+    def submit(self, sql: Optional[str] = None, params: Sequence = (),
+               fn: Optional[Callable[[sqlite3.Connection], Any]] = None) -> concurrent.futures.Future:
+        """Queue one statement (result: rowcount) or fn(con) (result: its return value)."""
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("Writer intents cannot wait on the writer; use defer()")
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        self._put(_Intent(sql, params, fn, future))
+        return future
+
+    def defer(self, sql: str, params: Sequence = ()):
+        """Fire-and-forget write, committed with the next batch; failures go to on_error."""
+        self.stats["deferred"] += 1
+        self._put(_Intent(sql, params, None, None))
+
+    async def execute(self, sql: str, params: Sequence = ()) -> int:
+        return await asyncio.wrap_future(self.submit(sql, params))
+
+    async def run(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """fn(con) inside the writer's transaction; exceptions it raises (HTTPException included)
+        roll back only its own changes and are re-raised here."""
+        return await asyncio.wrap_future(self.submit(fn=fn))
+
+    def execute_sync(self, sql: str, params: Sequence = (), timeout: float = 30.0) -> int:
+        return self.submit(sql, params).result(timeout)
+
+    def run_sync(self, fn: Callable[[sqlite3.Connection], Any], timeout: float = 30.0) -> Any:
+        return self.submit(fn=fn).result(timeout)
+
+    # -- lifecycle --------------------------------------------------------------
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._loop, name="db-writer", daemon=True)
+            self._thread.start()
+            if not self._atexit:
+                atexit.register(self.stop)  # Deferred writes still queued at exit are committed
+                self._atexit = True
+
+    def flush(self, timeout: float = 30.0):
+        """Wait until everything queued so far is committed."""
+        if self._thread is not None and self._thread.is_alive():
+            self.submit(fn=lambda con: None).result(timeout)
+
+    def stop(self, timeout: float = 30.0):
+        """Commit what is queued and stop the thread (a later write starts it again)."""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    # -- writer thread ----------------------------------------------------------
+
+    def _loop(self):
+        con = self.connect()
+        con.isolation_level = None  # Transactions are explicit below
+        try:
+            while True:
+                first = self._queue.get()
+                if first is _STOP:
+                    return
+                batch = [first]
+                stop = self._collect(batch)
+                self._apply(con, batch)
+                if stop:
+                    return
+        finally:
+            con.close()
+
+    def _collect(self, batch: list) -> bool:
+        """Add queued intents to batch, waiting up to max_delay for more; True if _STOP was seen."""
+        deadline = time.perf_counter() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                remaining = deadline - time.perf_counter()
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                return False
+            if item is _STOP:
+                return True
+            batch.append(item)
+        return False
+
+    def _apply(self, con: sqlite3.Connection, batch: list):
+        started = time.perf_counter()
+        outcomes = []
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            for intent in batch:
+                if intent.future is not None and not intent.future.set_running_or_notify_cancel():
+                    continue  # Caller gave up before its turn: nothing to write
+                con.execute("SAVEPOINT intent")
+                try:
+                    if intent.fn is not None:
+                        result = intent.fn(con)
+                    else:
+                        result = con.execute(intent.sql, intent.params).rowcount
+                    con.execute("RELEASE intent")
+                    outcomes.append((intent, result, None))
+                except Exception as e:
+                    con.execute("ROLLBACK TO intent")
+                    con.execute("RELEASE intent")
+                    outcomes.append((intent, None, e))
+            con.execute("COMMIT")
+        except Exception as e:
+            # BEGIN / COMMIT itself failed (busy beyond the timeout, disk full): nothing was written
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            self.stats["failed_batches"] += 1
+            outcomes = [(intent, None, e) for intent in batch if not (intent.future and intent.future.cancelled())]
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        s = self.stats
+        s["batches"] += 1
+        s["intents"] += len(batch)
+        s["max_batch"] = max(s["max_batch"], len(batch))
+        s["last_commit_ms"] = round(elapsed_ms, 2)
+        s["max_commit_ms"] = max(s["max_commit_ms"], s["last_commit_ms"])
+        s["max_wait_ms"] = max(s["max_wait_ms"], round((started - batch[0].queued_at) * 1000, 2))
+        for intent, result, error in outcomes:
+            if error is not None:
+                s["failed_intents"] += 1
+            if intent.future is None:
+                if error is not None and self.on_error:
+                    self.on_error(intent.sql or "", error)
+                continue
+            try:
+                if error is not None:
+                    intent.future.set_exception(error)
+                else:
+                    intent.future.set_result(result)
+            except concurrent.futures.InvalidStateError:
+                pass  # Cancelled while the batch was failing
+
+    def snapshot(self) -> Dict:
+        s = self.stats
+        return {**s, "queued": self._queue.qsize(), "running": bool(self._thread and self._thread.is_alive()),
+                "avg_batch": round(s["intents"] / s["batches"], 2) if s["batches"] else 0.0}
+
+
+__all__ = ["DBWriter"]
@@ -0,0 +1,233 @@
+"""
+Idempotency Keys
+Runs a generation request once per Idempotency-Key: a retry of a finished request gets the stored
+response back, a retry of one still running waits for it, and neither charges credits or calls a
+provider again
+
+A request with a key first claims a row in idempotency_keys (one upsert: it succeeds for a new key,
+an expired one, or a running one whose owner stopped renewing its lock by dying). The owner runs the
+handler through run(), which renews the lock every lock_seconds / 3 while the handler is working, and
+stores a compact copy of its JSON response; on an error the row is dropped so the client can retry
+for real. Any other request with the same key either replays the stored response, or
+attaches to the running one, polling the row (woken at once when the owner is in this process)
+until it finishes or `wait_seconds` pass. The same key with a different body is rejected (422).
+
+Rows live `ttl_seconds` after completion and are purged by purge().
+"""
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    status TEXT NOT NULL,
+    owner TEXT,
+    locked_until_ms INTEGER,
+    task_id TEXT,
+    response_json TEXT,
+    created_at_ms INTEGER NOT NULL,
+    expires_at_ms INTEGER NOT NULL,
+    PRIMARY KEY (scope, key)
+);
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys(expires_at_ms);
+"""
+
+RUNNING, DONE = "running", "done"
+MAX_KEY_LENGTH = 255
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+class IdempotencyError(Exception):
+    def __init__(self, status_code: int, message: str, retry_after: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class Claim:
+    """Outcome of begin(): either this request owns the key (replay is None) or `replay` is the
+    stored response of the request that did."""
+
+    __slots__ = ("scope", "key", "owner", "replay", "task_id")
+
+    def __init__(self, scope: str, key: str, owner: Optional[str] = None, replay: Optional[Dict] = None,
+                 task_id: Optional[str] = None):
+        self.scope = scope
+        self.key = key
+        self.owner = owner
+        self.replay = replay
+        self.task_id = task_id
+
+
+def fingerprint(body: bytes) -> str:
+    """Hash of the request body; JSON is canonicalised so key order and spacing do not matter."""
+    try:
+        body = json.dumps(json.loads(body or b"null"), sort_keys=True, separators=(",", ":")).encode()
+    except ValueError:
+        pass
+    return hashlib.sha256(body).hexdigest()
+
+
+def compact_response(response: Dict, max_bytes: int) -> str:
+    """The response as stored for replay. Large ones (inline images) keep only their short scalar
+    fields; the client reads the rest from the task's status endpoint."""
+    text = json.dumps(response, ensure_ascii=False, separators=(",", ":"), default=str)
+    if len(text) <= max_bytes:
+        return text
+    small = {k: v for k, v in response.items()
+             if isinstance(v, (bool, int, float, type(None))) or (isinstance(v, str) and len(v) <= 500)}
+    small["replay_truncated"] = True
+    return json.dumps(small, ensure_ascii=False, separators=(",", ":"))
+
+
+class IdempotencyStore:
+    """`storage` is a server.storage.Storage. An owner that has not renewed its lock for lock_seconds
+    counts as dead and a retry takes the key over; run() renews it for as long as the handler runs."""
+
+    def __init__(self, storage, ttl_seconds: float = 86400, lock_seconds: float = 120, wait_seconds: float = 30,
+                 max_response_bytes: int = 16384, poll_interval: float = 0.25):
+        self.storage = storage
+        self.ttl_seconds = ttl_seconds
+        self.lock_seconds = lock_seconds
+        self.wait_seconds = wait_seconds
+        self.max_response_bytes = max_response_bytes
+        self.poll_interval = poll_interval
+        self._local: Dict[Tuple[str, str], asyncio.Event] = {}
+        self.stats = {"claimed": 0, "replayed": 0, "attached": 0, "conflicts": 0, "in_progress": 0,
+                      "abandoned": 0, "taken_over": 0, "renewals": 0, "lost_locks": 0, "purged": 0}
+
+    async def begin(self, scope: str, key: str, request_fingerprint: str) -> Claim:
+        if not key or len(key) > MAX_KEY_LENGTH or not key.isprintable():
+            raise IdempotencyError(400, f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} printable characters")
+        deadline = time.monotonic() + self.wait_seconds
+        attached = False
+        while True:
+            owner = uuid.uuid4().hex
+            now = _now_ms()
+            claimed = await self.storage.execute(
+                """INSERT INTO idempotency_keys (scope, key, fingerprint, status, owner, locked_until_ms, created_at_ms, expires_at_ms)
+                   VALUES (?, ?, ?, 'running', ?, ?, ?, ?)
+                   ON CONFLICT(scope, key) DO UPDATE SET
+                       fingerprint = excluded.fingerprint, status = 'running', owner = excluded.owner,
+                       locked_until_ms = excluded.locked_until_ms, task_id = NULL, response_json = NULL,
+                       created_at_ms = excluded.created_at_ms, expires_at_ms = excluded.expires_at_ms
+                   WHERE idempotency_keys.expires_at_ms < ?
+                      OR (idempotency_keys.status = 'running' AND idempotency_keys.locked_until_ms < ?)""",
+                (scope, key, request_fingerprint, owner, now + int(self.lock_seconds * 1000), now,
+                 now + int((self.lock_seconds + self.ttl_seconds) * 1000), now, now)
+            )
+            if claimed:
+                self.stats["claimed"] += 1
+                self._local[(scope, key)] = asyncio.Event()
+                return Claim(scope, key, owner=owner)
+
+            row = await self.storage.fetchone(
+                "SELECT fingerprint, status, task_id, response_json, locked_until_ms FROM idempotency_keys WHERE scope = ? AND key = ?",
+                (scope, key))
+            if row is None:
+                continue  # Owner gave up between our insert and read: claim it
+            if row["fingerprint"] != request_fingerprint:
+                self.stats["conflicts"] += 1
+                raise IdempotencyError(422, "Idempotency-Key was already used with a different request")
+            if row["status"] == DONE:
+                self.stats["attached" if attached else "replayed"] += 1
+                return Claim(scope, key, replay=json.loads(row["response_json"] or "{}"), task_id=row["task_id"])
+            if row["locked_until_ms"] is not None and row["locked_until_ms"] < _now_ms():
+                self.stats["taken_over"] += 1
+                continue
+
+            # Running elsewhere: wait for that request's response instead of starting another
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.stats["in_progress"] += 1
+                raise IdempotencyError(409, "A request with this Idempotency-Key is still in progress", retry_after=1)
+            attached = True
+            event = self._local.get((scope, key))
+            try:
+                if event is not None:
+                    await asyncio.wait_for(event.wait(), min(remaining, self.wait_seconds))
+                else:
+                    await asyncio.sleep(min(remaining, self.poll_interval))
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self, claim: Claim, handler: Callable[[], Awaitable[Any]]) -> Any:
+        """Run the owner's handler with its lock kept alive, then store a dict result (anything
+        else, or an exception, abandons the key)."""
+        heartbeat = asyncio.create_task(self._keep_alive(claim))
+        try:
+            result = await handler()
+        except BaseException:
+            heartbeat.cancel()
+            await self.abandon(claim)
+            raise
+        heartbeat.cancel()
+        if isinstance(result, dict):
+            await self.complete(claim, result)
+        else:
+            await self.abandon(claim)
+        return result
+
+    async def _keep_alive(self, claim: Claim):
+        while True:
+            await asyncio.sleep(self.lock_seconds / 3)
+            try:
+                if not await self.renew(claim):
+                    self.stats["lost_locks"] += 1
+                    return
+            except Exception:
+                pass  # Database busy: the next beat tries again before the lock runs out
+
+    async def renew(self, claim: Claim) -> bool:
+        """Push the lock of a running claim lock_seconds ahead; False if it is no longer ours."""
+        renewed = await self.storage.execute(
+            "UPDATE idempotency_keys SET locked_until_ms = ? WHERE scope = ? AND key = ? AND owner = ? AND status = 'running'",
+            (_now_ms() + int(self.lock_seconds * 1000), claim.scope, claim.key, claim.owner))
+        self.stats["renewals"] += 1
+        return renewed == 1
+
+    async def complete(self, claim: Claim, response: Dict):
+        now = _now_ms()
+        task_id = response.get("task_id") if isinstance(response.get("task_id"), str) else None
+        await self.storage.execute(
+            """UPDATE idempotency_keys SET status = 'done', response_json = ?, task_id = ?, locked_until_ms = NULL,
+                   expires_at_ms = ? WHERE scope = ? AND key = ? AND owner = ?""",
+            (compact_response(response, self.max_response_bytes), task_id, now + int(self.ttl_seconds * 1000),
+             claim.scope, claim.key, claim.owner)
+        )
+        self._release(claim)
+
+    async def abandon(self, claim: Claim):
+        """The handler failed: forget the key so a retry runs the request again."""
+        self.stats["abandoned"] += 1
+        try:
+            await self.storage.execute(
+                "DELETE FROM idempotency_keys WHERE scope = ? AND key = ? AND owner = ? AND status = 'running'",
+                (claim.scope, claim.key, claim.owner))
+        finally:
+            self._release(claim)
+
+    def _release(self, claim: Claim):
+        event = self._local.pop((claim.scope, claim.key), None)
+        if event is not None:
+            event.set()
+
+    async def purge(self) -> int:
+        removed = await self.storage.execute("DELETE FROM idempotency_keys WHERE expires_at_ms < ?", (_now_ms(),))
+        self.stats["purged"] += removed
+        return removed
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "running_here": len(self._local), "ttl_seconds": self.ttl_seconds}
+
+
+__all__ = ["IdempotencyStore", "IdempotencyError", "Claim", "fingerprint", "compact_response", "SCHEMA"]
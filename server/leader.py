@@ -0,0 +1,218 @@
+"""
+Leader Election
+Lease-based leadership (a SQLite lease row or Redis SET NX PX) and a runner that keeps a periodic
+background loop alive in exactly one process
+
+Every process runs a SingletonService per loop; the one holding the lease runs the loop and renews
+the lease every ttl/3. If it dies, the lease expires and another process takes over within about
+one ttl. A holder that fails to renew stops its loop before the lease can run out, so two copies
+never overlap by more than a renew interval. Each takeover bumps the lease's epoch (fencing token).
+"""
+import asyncio
+import sqlite3
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leader_leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    epoch INTEGER NOT NULL DEFAULT 1,
+    expires_ms INTEGER NOT NULL,
+    acquired_ms INTEGER NOT NULL,
+    renewed_ms INTEGER NOT NULL
+);
+"""
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+class SQLiteLease:
+    """Lease row in the application database. Acquire and renew are the same upsert: it only
+    takes effect when we already hold the lease or the current one has expired."""
+
+    backend = "sqlite"
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], name: str, holder: str, ttl: float = 10.0):
+        self.connect = connect
+        self.name = name
+        self.holder = holder
+        self.ttl = ttl
+        self.epoch = 0
+
+    def _acquire(self) -> bool:
+        now = _now_ms()
+        con = self.connect()
+        try:
+            cur = con.execute(
+                """INSERT INTO leader_leases (name, holder, epoch, expires_ms, acquired_ms, renewed_ms)
+                   VALUES (?, ?, 1, ?, ?, ?)
+                   ON CONFLICT(name) DO UPDATE SET
+                       epoch = CASE WHEN leader_leases.holder = excluded.holder THEN leader_leases.epoch ELSE leader_leases.epoch + 1 END,
+                       acquired_ms = CASE WHEN leader_leases.holder = excluded.holder THEN leader_leases.acquired_ms ELSE excluded.acquired_ms END,
+                       holder = excluded.holder, expires_ms = excluded.expires_ms, renewed_ms = excluded.renewed_ms
+                   WHERE leader_leases.holder = excluded.holder OR leader_leases.expires_ms < ?""",
+                (self.name, self.holder, now + int(self.ttl * 1000), now, now, now)
+            )
+            con.commit()
+            if cur.rowcount != 1:
+                return False
+            self.epoch = con.execute("SELECT epoch FROM leader_leases WHERE name = ?", (self.name,)).fetchone()[0]
+            return True
+        finally:
+            con.close()
+
+    def _release(self):
+        con = self.connect()
+        try:
+            con.execute("UPDATE leader_leases SET expires_ms = 0 WHERE name = ? AND holder = ?", (self.name, self.holder))
+            con.commit()
+        finally:
+            con.close()
+
+    async def acquire(self) -> bool:
+        """Take or renew the lease; False while another live holder has it."""
+        return await asyncio.to_thread(self._acquire)
+
+    async def release(self):
+        await asyncio.to_thread(self._release)
+
+
+# KEYS[1] = lease key, ARGV[1] = holder, ARGV[2] = ttl ms
+_REDIS_RENEW = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_REDIS_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisLease:
+    """SET key holder NX PX ttl; renew and release only if the key still holds our id.
+    `client` is a server.redis_client.RedisClient, connected on first use."""
+
+    backend = "redis"
+
+    def __init__(self, client, name: str, holder: str, ttl: float = 10.0, prefix: str = "leader:"):
+        self.client = client
+        self.name = name
+        self.key = prefix + name
+        self.holder = holder
+        self.ttl = ttl
+        self.epoch = 0
+        self._held = False
+
+    async def acquire(self) -> bool:
+        if not self.client.is_connected:
+            await self.client.connect()
+        redis = self.client.redis
+        ttl_ms = int(self.ttl * 1000)
+        if self._held and await redis.eval(_REDIS_RENEW, 1, self.key, self.holder, ttl_ms):
+            return True
+        self._held = bool(await redis.set(self.key, self.holder, nx=True, px=ttl_ms))
+        if self._held:
+            self.epoch = await redis.incr(self.key + ":epoch")
+        return self._held
+
+    async def release(self):
+        self._held = False
+        await self.client.redis.eval(_REDIS_RELEASE, 1, self.key, self.holder)
+
+
+class SingletonService:
+    """Runs factory() only while this process holds the lease.
+
+    The loop is cancelled when leadership is lost (renewal failed or errored) and started again
+    from scratch by whichever process takes over. A loop that raises is restarted after
+    `restart_delay` while we are still leader; one that returns is done, and the lease is kept
+    (idle) so no other process starts it again while this one lives.
+    """
+
+    def __init__(self, lease, factory: Callable[[], Awaitable], restart_delay: float = 5.0,
+                 on_event: Optional[Callable[[str, str, str], None]] = None):
+        self.lease = lease
+        self.name = lease.name
+        self.factory = factory
+        self.restart_delay = restart_delay
+        self.on_event = on_event  # (level, event_type, message)
+        self.leader = False
+        self.finished = False
+        self.leader_since_ms: Optional[int] = None
+        self.stats = {"terms": 0, "lost": 0, "restarts": 0, "last_error": None}
+
+    def _event(self, level: str, event_type: str, message: str):
+        if self.on_event:
+            self.on_event(level, event_type, message)
+
+    async def _acquire(self) -> bool:
+        try:
+            return await self.lease.acquire()
+        except Exception as e:
+            self.stats["last_error"] = f"lease: {e}"
+            return False
+
+    async def run(self):
+        interval = self.lease.ttl / 3
+        task: Optional[asyncio.Task] = None
+        retry_at = 0.0
+        try:
+            while True:
+                held = await self._acquire()
+                if held and not self.leader:
+                    self.leader, self.leader_since_ms = True, _now_ms()
+                    self.stats["terms"] += 1
+                    self._event("info", "leader_acquired", f"{self.name}: leader (epoch {self.lease.epoch})")
+                elif not held and self.leader:
+                    # Renewal failed: stop now, the lease may already belong to someone else
+                    self.leader, self.leader_since_ms, self.finished = False, None, False
+                    self.stats["lost"] += 1
+                    self._event("warning", "leader_lost", f"{self.name}: leadership lost")
+                    await _cancel(task)
+                    task = None
+
+                if task is not None and task.done():
+                    if task.cancelled() or task.exception() is None:
+                        self.finished = True
+                    else:
+                        self.stats["restarts"] += 1
+                        self.stats["last_error"] = str(task.exception())
+                        self._event("error", "singleton_crashed", f"{self.name}: {task.exception()}")
+                        retry_at = time.monotonic() + self.restart_delay
+                    task = None
+                if self.leader and task is None and not self.finished and time.monotonic() >= retry_at:
+                    task = asyncio.create_task(self.factory())
+                await asyncio.sleep(interval)
+        finally:
+            await _cancel(task)
+            if self.leader:
+                self.leader = False
+                try:
+                    await self.lease.release()  # Hand over now instead of after the ttl
+                except Exception:
+                    pass
+
+    def snapshot(self) -> Dict:
+        return {"name": self.name, "backend": self.lease.backend, "holder": self.lease.holder,
+                "leader": self.leader, "leader_since_ms": self.leader_since_ms, "epoch": self.lease.epoch,
+                "finished": self.finished, **self.stats}
+
+
+async def _cancel(task: Optional[asyncio.Task]):
+    if task is None or task.done():
+        return
+    task.cancel()
+    try:
+        await task
+    except BaseException:
+        pass
+
+
+__all__ = ["SQLiteLease", "RedisLease", "SingletonService", "SCHEMA"]
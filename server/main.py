@@ -4,29 +4,55 @@ Backend API Server
 """
 
 import os
-import json
+import re
 import uuid
 import time
 import math
 import hashlib
+import hmac
 import secrets
 import sqlite3
 import asyncio
+import shutil
 from pathlib import Path
-from typing import Any, Dict, Optional, List, Tuple
+from typing import Any, Awaitable, Callable, Dict, Optional, List, Tuple
 from datetime import datetime, timedelta, timezone
 from contextlib import asynccontextmanager
+from urllib.parse import parse_qs
 
-import base64
 import httpx
 import aiofiles
-from fastapi import FastAPI, HTTPException, Header, Query, Body, Request, Response, Depends, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Header, Query, Body, Request, Response, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
 from starlette.middleware.base import BaseHTTPMiddleware
 from pydantic import BaseModel, Field
 
+from server import result_cache
+from server.response_cache import CachedResponse, etag_matches
+from server.model_registry import registry as model_registry
+from server import admission
+from server.circuit_breaker import breakers, retry_async, backoff_delay, is_retryable_status, UpstreamError, STATE_CLOSED
+from server.scheduler import Candidate, FairScheduler
+from server.work_queue import WorkQueue, WorkRunner, RetryLater, make_worker_id
+from server.migrate import Migration, Backfill, Migrator, add_column
+from server.static_assets import StaticAssets
+from server import compression
+from server.compression import CompressionMiddleware
+from server.backup import BackupManager
+from server.db_writer import DBWriter
+from server.storage import SQLiteStorage
+from server import leader
+from server.cache import TwoTierCache
+from server.status_watch import StatusWatcher
+from server import webhooks
+from server.webhooks import WebhookDispatcher, WebhookError
+from server import idempotency
+from server.idempotency import IdempotencyStore, IdempotencyError
+from server.zipstream import iter_zip
+from server.media import (MediaProcessor, MediaError, LoopLagMonitor, DERIVATIVES, DERIVATIVE_MIME, data_uri,
+                          derivative_format, derivative_path, sniff_mime)
+
 # =============================================================================
 # Configuration
 # =============================================================================
@@ -35,7 +61,7 @@ DB_PATH = Path(os.getenv("DB_PATH", str(_PROJECT_ROOT / "data" / "fiftyfive.db")
 DATA_DIR = Path(os.getenv("DATA_DIR", str(_PROJECT_ROOT / "data"))).resolve()
 IMAGES_DIR = DATA_DIR / "images"
 AUDIO_STORAGE_PATH = DATA_DIR / "audio"
-BACKUP_DIR = DATA_DIR / "backups"
+BACKUP_DIR = Path(os.getenv("BACKUP_DIR", str(DATA_DIR / "backups"))).resolve()  # Put on another volume: see server/backup.py
 
 os.makedirs(IMAGES_DIR, exist_ok=True)
 os.makedirs(AUDIO_STORAGE_PATH, exist_ok=True)
@@ -62,6 +88,135 @@ DEFAULT_HOURLY_LIMIT = int(os.getenv("DEFAULT_HOURLY_LIMIT", "2000"))  # Images
 DEFAULT_CONCURRENT_LIMIT = int(os.getenv("DEFAULT_CONCURRENT_LIMIT", "3"))  # Concurrent generations per user
 MAX_CONCURRENT_PER_KEY = int(os.getenv("MAX_CONCURRENT_PER_KEY", "10"))  # Concurrent generations per API key
 
+# Batch image generation
+IMAGE_BATCH_MAX_ITEMS = int(os.getenv("IMAGE_BATCH_MAX_ITEMS", "100"))  # Prompts per batch request
+IMAGE_BATCH_MAX_CONCURRENCY = int(os.getenv("IMAGE_BATCH_MAX_CONCURRENCY", "16"))  # In-flight upstream calls per batch
+IMAGE_BATCH_POLL_TIMEOUT = float(os.getenv("IMAGE_BATCH_POLL_TIMEOUT", "300"))  # Seconds to wait for a Fast Gen operation
+
+# Long-form voice synthesis
+VOICE_SEGMENT_MAX_CHARS = int(os.getenv("VOICE_SEGMENT_MAX_CHARS", "2500"))  # Max characters per Voicer segment
+VOICE_SEGMENT_MAX_ATTEMPTS = int(os.getenv("VOICE_SEGMENT_MAX_ATTEMPTS", "3"))  # Tries per segment (rotating keys)
+VOICE_SEGMENT_TIMEOUT = float(os.getenv("VOICE_SEGMENT_TIMEOUT", "600"))  # Seconds to wait for one segment
+
+# Result cache (deduplication of identical requests)
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", "3600"))  # How long a result can be reused
+RESULT_CACHE_VOICE_POLICY = os.getenv("RESULT_CACHE_VOICE_POLICY", "off")  # off | seeded | always
+
+# Catalog response cache (/api/plans, /api/models, /api/model-pricing, /api/elevenlabs/filters)
+CATALOG_CACHE_TTL_SECONDS = float(os.getenv("CATALOG_CACHE_TTL_SECONDS", "60"))  # Safety net; admin edits invalidate immediately
+
+# Two-tier read cache: per-process LRU in front of Redis (see server/cache.py). Without Redis, or while it is
+# down, it runs L1-only and changes made by other workers show up here after CACHE_L1_TTL_SECONDS at most
+CACHE_REDIS = os.getenv("CACHE_REDIS", "false").lower() == "true"  # Shared L2 + pub/sub invalidation (REDIS_URL)
+CACHE_L1_MAX_ITEMS = int(os.getenv("CACHE_L1_MAX_ITEMS", "10000"))
+CACHE_L1_TTL_SECONDS = float(os.getenv("CACHE_L1_TTL_SECONDS", "15"))
+CACHE_REDIS_RETRY_SECONDS = float(os.getenv("CACHE_REDIS_RETRY_SECONDS", "30"))  # Reconnect attempts while Redis is down
+# Token -> user; writes to users invalidate it. Without CACHE_REDIS that only reaches this process: a ban or
+# revoked key takes effect on the other workers within CACHE_L1_TTL_SECONDS (lower that to shorten the window)
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+VOICE_LIBRARY_CACHE_TTL_SECONDS = float(os.getenv("VOICE_LIBRARY_CACHE_TTL_SECONDS", "600"))  # ElevenLabs voice lists
+JOB_STATUS_CACHE_TTL_SECONDS = float(os.getenv("JOB_STATUS_CACHE_TTL_SECONDS", "300"))  # Finished jobs only
+
+# Bulk / long-poll status (GET /api/v1/status?ids=...&wait=...)
+STATUS_BULK_MAX_IDS = int(os.getenv("STATUS_BULK_MAX_IDS", "100"))
+STATUS_WAIT_MAX_SECONDS = float(os.getenv("STATUS_WAIT_MAX_SECONDS", "30"))  # Longest a request may be parked
+STATUS_WAIT_POLL_MS = int(os.getenv("STATUS_WAIT_POLL_MS", "500"))  # One state query per tick for all parked requests
+
+# Completion webhooks for API keys (see server/webhooks.py)
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))  # Failed attempts before a delivery is dead-lettered
+WEBHOOK_BACKOFF_BASE_SECONDS = float(os.getenv("WEBHOOK_BACKOFF_BASE_SECONDS", "10"))  # Jittered, doubles per attempt
+WEBHOOK_BACKOFF_MAX_SECONDS = float(os.getenv("WEBHOOK_BACKOFF_MAX_SECONDS", "3600"))
+WEBHOOK_TIMEOUT_SECONDS = float(os.getenv("WEBHOOK_TIMEOUT_SECONDS", "10"))  # Per POST to the client's endpoint
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "16"))  # Deliveries in flight per worker process
+WEBHOOK_POLL_SECONDS = float(os.getenv("WEBHOOK_POLL_SECONDS", "1"))  # How soon a finished job's event is picked up
+WEBHOOK_ALLOW_PRIVATE = os.getenv("WEBHOOK_ALLOW_PRIVATE", "false").lower() == "true"  # Local/private URLs (receiver stub, dev)
+WEBHOOK_RETENTION_DAYS = int(os.getenv("WEBHOOK_RETENTION_DAYS", "7"))  # Delivered rows kept for the log; dead ones stay
+
+# Idempotency-Key on /api/v1/synthesize, /api/voice/synthesize and /api/image/generate (see server/idempotency.py)
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))  # How long a finished request can be replayed
+IDEMPOTENCY_LOCK_SECONDS = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "120"))  # Renewed while running; a request that stops renewing counts as dead after this
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "30"))  # A retry waits this long for the original, then 409
+IDEMPOTENCY_MAX_RESPONSE_BYTES = int(os.getenv("IDEMPOTENCY_MAX_RESPONSE_BYTES", "16384"))  # Larger responses are stored trimmed
+
+# ZIP export of a user's outputs (streamed, stored entries)
+EXPORT_MAX_JOBS = int(os.getenv("EXPORT_MAX_JOBS", "5000"))  # Jobs per archive; narrow the filter for more
+EXPORT_CHUNK_KB = int(os.getenv("EXPORT_CHUNK_KB", "256"))  # Read size per file chunk, i.e. the memory per export
+
+# Model registry
+MODEL_REGISTRY_REFRESH_SECONDS = int(os.getenv("MODEL_REGISTRY_REFRESH_SECONDS", "30"))  # Pick up edits made by other workers
+
+# Upstream circuit breakers (per provider key) and retries
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))  # Consecutive upstream failures before a key is skipped
+BREAKER_BASE_COOLDOWN = float(os.getenv("BREAKER_BASE_COOLDOWN", "15"))  # Seconds before the first half-open probe; doubles per re-open
+BREAKER_MAX_COOLDOWN = float(os.getenv("BREAKER_MAX_COOLDOWN", "300"))
+UPSTREAM_MAX_ATTEMPTS = int(os.getenv("UPSTREAM_MAX_ATTEMPTS", "3"))  # Tries per upstream call on 5xx/429/network errors
+UPSTREAM_RETRY_RATIO = float(os.getenv("UPSTREAM_RETRY_RATIO", "0.2"))  # Retries allowed per first attempt (per provider)
+
+# Admission control (load shedding on /api/image/generate, /api/voice/synthesize and their v1 twins)
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "1000"))  # Hard cap on queued jobs per kind
+ADMISSION_IMAGE_JOB_SECONDS = float(os.getenv("ADMISSION_IMAGE_JOB_SECONDS", "20"))  # Typical job time, for Retry-After
+ADMISSION_VOICE_JOB_SECONDS = float(os.getenv("ADMISSION_VOICE_JOB_SECONDS", "30"))
+
+# Process role: "all" serves the API and runs background work in one process (single-container deploys);
+# "api" only validates, enqueues and reads, with `python -m server.worker` (WORKER_MODE=worker) doing the rest
+WORKER_MODE = os.getenv("WORKER_MODE", "all").strip().lower()
+API_ONLY = WORKER_MODE == "api"
+UPSTREAM_IN_WORKER = WORKER_MODE != "all"  # Processing jobs are polled by work items instead of by status requests
+
+# Fair-share scheduler (starts queued image/voice jobs across users by plan weight)
+# Always on in split mode: status polls in API processes no longer start jobs
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() == "true" or UPSTREAM_IN_WORKER  # false = queued jobs start from their owner's status polls
+SCHEDULER_TICK_SECONDS = float(os.getenv("SCHEDULER_TICK_SECONDS", "1"))
+SCHEDULER_MAX_WAIT_SECONDS = int(os.getenv("SCHEDULER_MAX_WAIT_SECONDS", "300"))  # Starved jobs older than this go first
+SCHEDULER_CLAIM_SECONDS = int(os.getenv("SCHEDULER_CLAIM_SECONDS", "600"))  # Start claim lease; only matters if a worker dies mid-start
+SCHEDULER_USER_SCAN_LIMIT = int(os.getenv("SCHEDULER_USER_SCAN_LIMIT", "20"))  # Oldest queued jobs per user considered per tick
+VOICE_COST_CHARS = int(os.getenv("VOICE_COST_CHARS", "2500"))  # Characters per unit of fair-share cost for voice jobs
+
+# Durable work queue (background work survives restarts; see server/work_queue.py)
+WORK_LEASE_SECONDS = float(os.getenv("WORK_LEASE_SECONDS", "60"))  # A dead worker's items / jobs are picked up after this
+WORK_CONCURRENCY = int(os.getenv("WORK_CONCURRENCY", "16"))  # Work items run at once per process
+WORK_POLL_SECONDS = float(os.getenv("WORK_POLL_SECONDS", "5"))  # Upstream status poll interval for worker-polled jobs
+WORK_MAX_ATTEMPTS = int(os.getenv("WORK_MAX_ATTEMPTS", "5"))  # Failed attempts before an item is dead-lettered
+
+# Media stage: base64 decode, validation and image writes run off the event loop
+MEDIA_EXECUTOR = os.getenv("MEDIA_EXECUTOR", "process")  # process | thread | inline
+MEDIA_WORKERS = int(os.getenv("MEDIA_WORKERS", str(min(4, os.cpu_count() or 1))))
+MEDIA_INLINE_MAX_BYTES = int(os.getenv("MEDIA_INLINE_MAX_BYTES", "65536"))  # Smaller payloads are cheaper on the loop
+LOOP_LAG_INTERVAL_MS = int(os.getenv("LOOP_LAG_INTERVAL_MS", "100"))
+LOOP_LAG_THRESHOLD_MS = int(os.getenv("LOOP_LAG_THRESHOLD_MS", "50"))  # Lag samples above this are counted as stalls
+
+# Image derivatives: thumbnails / previews written next to each original, served from signed URLs
+IMAGE_DERIVATIVES_ENABLED = os.getenv("IMAGE_DERIVATIVES_ENABLED", "true").lower() == "true"
+IMAGE_DERIVATIVE_FORMAT = derivative_format(os.getenv("IMAGE_DERIVATIVE_FORMAT", "webp").lower())  # webp | avif (falls back to webp)
+MEDIA_URL_SECRET = os.getenv("MEDIA_URL_SECRET", "").strip()  # Empty = generated once into DATA_DIR
+MEDIA_URL_TTL_HOURS = int(os.getenv("MEDIA_URL_TTL_HOURS", "24"))  # Minimum lifetime of a signed image URL
+
+# Schema migrations (see server/migrate.py)
+MIGRATE_ON_BOOT = os.getenv("MIGRATE_ON_BOOT", "true").lower() == "true"  # false = refuse to start on a stale schema
+MIGRATE_BACKFILL_BATCH = int(os.getenv("MIGRATE_BACKFILL_BATCH", "500"))  # Rows per backfill transaction
+
+# Write path: one writer thread per process applies small writes in grouped transactions (see server/db_writer.py)
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "wal").lower()  # wal: readers and the writer do not block each other
+DB_WRITER_MAX_BATCH = int(os.getenv("DB_WRITER_MAX_BATCH", "256"))  # Intents per transaction
+DB_WRITER_MAX_DELAY_MS = float(os.getenv("DB_WRITER_MAX_DELAY_MS", "2"))  # How long a batch waits for more intents
+
+# Leader election: cleanup, backup and backfill loops run in one process of the deployment (see server/leader.py)
+LEADER_BACKEND = os.getenv("LEADER_BACKEND", "sqlite").lower()  # sqlite | redis (REDIS_URL)
+LEADER_LEASE_SECONDS = float(os.getenv("LEADER_LEASE_SECONDS", "10"))  # A dead leader is replaced within about this long
+
+# Online database backups (see server/backup.py); taken by one worker process at a time
+BACKUP_ENABLED = os.getenv("BACKUP_ENABLED", "true").lower() == "true"
+BACKUP_INTERVAL_HOURS = float(os.getenv("BACKUP_INTERVAL_HOURS", "6"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))  # Snapshots kept in BACKUP_DIR
+BACKUP_COMPRESS = os.getenv("BACKUP_COMPRESS", "true").lower() == "true"
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))  # Pages copied per lock; smaller = shorter writer waits
+
+# Response compression (gzip, or brotli when installed) for compressible bodies of at least this size
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))  # Per-request: favour speed over ratio
+
 # Timing
 REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "120"))
 IMAGE_TTL_SECONDS = int(os.getenv("IMAGE_TTL_SECONDS", "86400"))  # 24 hours
@@ -80,6 +235,14 @@ def db_conn() -> sqlite3.Connection:
     con.row_factory = sqlite3.Row
     return con
 
+def _db_writer_error(sql: str, error: Exception):
+    _debug_log("[DB] Deferred write failed:", sql[:120], error)
+
+# Small writes nobody reads back immediately (event log, last-used stamps) and short write
+# transactions go through here instead of opening their own connection and commit
+db_writer = DBWriter(db_conn, max_batch=DB_WRITER_MAX_BATCH, max_delay=DB_WRITER_MAX_DELAY_MS / 1000,
+                     on_error=_db_writer_error)
+
 async def download_and_save_audio(audio_url: str, task_id: str) -> Optional[str]:
     """Download audio from external URL and save locally"""
     try:
@@ -135,7 +298,116 @@ def _require_admin(x_admin_token: Optional[str]) -> None:
         raise HTTPException(403, "Admin token required")
 
 def _json_dumps(obj: Any) -> str:
-    return json.dumps(obj, ensure_ascii=False)
+    return compression.dumps(obj)
+
+def _json_loads(data: Any) -> Any:
+    return compression.loads(data)
+
+class FastJSONResponse(JSONResponse):
+    """Default response class: the same JSON, rendered with orjson when it is installed."""
+
+    def render(self, content: Any) -> bytes:
+        return compression.dumps_bytes(content)
+
+# Strong references for fire-and-forget tasks (asyncio only keeps weak ones)
+_background_tasks: set = set()
+
+def _spawn(coro) -> asyncio.Task:
+    """Start a background task and keep it alive until it finishes."""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+breakers.configure(
+    failure_threshold=BREAKER_FAILURE_THRESHOLD,
+    base_cooldown=BREAKER_BASE_COOLDOWN,
+    max_cooldown=BREAKER_MAX_COOLDOWN,
+    retry_ratio=UPSTREAM_RETRY_RATIO,
+)
+
+def _response_error(resp: httpx.Response) -> Optional[str]:
+    """Breaker classifier: a provider-side failure message for retryable statuses, else None."""
+    if is_retryable_status(resp.status_code):
+        return f"HTTP {resp.status_code}: {resp.text[:200]}"
+    return None
+
+async def _upstream_request(client: httpx.AsyncClient, method: str, url: str, provider: str, key_id: Any,
+                            max_attempts: Optional[int] = None, **kwargs) -> httpx.Response:
+    """HTTP call to a provider through its key's circuit breaker, retrying 5xx/429/network
+    errors with jittered backoff. Returns the final response; raises the last transport error."""
+    return await retry_async(
+        provider, key_id,
+        lambda: client.request(method, url, **kwargs),
+        _response_error,
+        breakers,
+        max_attempts=max_attempts or UPSTREAM_MAX_ATTEMPTS,
+        retry_on=(httpx.TransportError,),
+    )
+
+def _is_provider_outage(e: BaseException) -> bool:
+    """Errors that mean "try again later" rather than "this request is bad"."""
+    if isinstance(e, UpstreamError):
+        return e.retryable
+    return isinstance(e, (httpx.TransportError, asyncio.TimeoutError))
+
+admission.controller.enabled = ADMISSION_ENABLED
+admission.controller.max_queue = ADMISSION_MAX_QUEUE
+admission.controller.job_seconds = {"image": ADMISSION_IMAGE_JOB_SECONDS, "voice": ADMISSION_VOICE_JOB_SECONDS}
+
+fair_scheduler = FairScheduler(max_wait_ms=SCHEDULER_MAX_WAIT_SECONDS * 1000)
+
+# This process's identity in work_workers / jobs.worker_id (jobs of dead workers get recovered)
+WORKER_ID = make_worker_id("worker" if WORKER_MODE == "worker" else "api")
+work_queue = WorkQueue(db_conn, lease_seconds=WORK_LEASE_SECONDS)
+work_runner: Optional[WorkRunner] = None
+
+media_processor = MediaProcessor(workers=MEDIA_WORKERS, executor=MEDIA_EXECUTOR, inline_max_bytes=MEDIA_INLINE_MAX_BYTES,
+                                 derivatives=DERIVATIVES if IMAGE_DERIVATIVES_ENABLED else None,
+                                 derivative_fmt=IMAGE_DERIVATIVE_FORMAT)
+loop_lag = LoopLagMonitor(interval=LOOP_LAG_INTERVAL_MS / 1000, threshold_ms=LOOP_LAG_THRESHOLD_MS)
+
+def _job_states(ids: List[str]) -> Dict[str, str]:
+    """id -> status for the long-poll watcher (primary-key lookups, in chunks under SQLite's variable limit)."""
+    states = {}
+    con = db_conn()
+    try:
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            rows = con.execute(f"SELECT id, status FROM jobs WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+            states.update((r["id"], r["status"]) for r in rows)
+    finally:
+        con.close()
+    return states
+
+status_watcher = StatusWatcher(_job_states, interval=STATUS_WAIT_POLL_MS / 1000)
+
+def _cache_event(level: str, event_type: str, message: str):
+    log_event(level, event_type, message)
+
+def _cache_client():
+    if not CACHE_REDIS:
+        return None
+    from server.redis_client import redis_client  # Optional dependency: only with CACHE_REDIS=true
+    return redis_client
+
+read_cache = TwoTierCache(_cache_client(), max_items=CACHE_L1_MAX_ITEMS, l1_ttl=CACHE_L1_TTL_SECONDS,
+                          retry_seconds=CACHE_REDIS_RETRY_SECONDS, on_event=_cache_event)
+# Pre-serialized catalog responses (L2 holds the body; the ETag is derived from it); admin mutators invalidate them
+CATALOG = read_cache.namespace("catalog", CATALOG_CACHE_TTL_SECONDS, encode=lambda entry: entry.body, decode=CachedResponse)
+AUTH_TOKENS = read_cache.namespace("auth", AUTH_CACHE_TTL_SECONDS)  # sha256(token) -> user id
+USERS = read_cache.namespace("user", AUTH_CACHE_TTL_SECONDS)  # user id -> users row without secrets
+USER_API_KEYS = read_cache.namespace("api_key", AUTH_CACHE_TTL_SECONDS)  # sha256(api key) -> user_api_keys row
+VOICE_LIBRARY = read_cache.namespace("voice_library", VOICE_LIBRARY_CACHE_TTL_SECONDS)
+JOB_STATUS = read_cache.namespace("job_status", JOB_STATUS_CACHE_TTL_SECONDS)
+
+async def _catalog_response(request: Request, key: str, build, cache_control: str = "no-cache") -> Response:
+    """Serve a cached JSON body for key with ETag / Cache-Control, or 304 if the client copy is current."""
+    entry = await read_cache.get(CATALOG, key, lambda: CachedResponse(compression.dumps_bytes(build())))
+    headers = {"ETag": entry.etag, "Cache-Control": cache_control}
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
 
 # =============================================================================
 # Rate Limiting
@@ -245,10 +517,11 @@ class RateLimiter:
 rate_limiter = RateLimiter()
 
 # =============================================================================
-# Database Initialization
+# Database Schema (versioned migrations, see server/migrate.py)
 # =============================================================================
-def init_db():
-    con = db_conn()
+def _m001_baseline(con: sqlite3.Connection):
+    """Schema as of the first versioned release. Idempotent, so it also adopts databases created
+    by the old create-everything-on-boot init_db."""
     cur = con.cursor()
     
     # Users table
@@ -276,21 +549,17 @@ def init_db():
         )
     """)
 
-    # Migration: user plan/referral columns (backwards compatible)
-    for stmt in [
-        "ALTER TABLE users ADD COLUMN plan_id TEXT",
-        "ALTER TABLE users ADD COLUMN plan_expires_at_ms INTEGER",
-        "ALTER TABLE users ADD COLUMN referral_code TEXT",
-        "ALTER TABLE users ADD COLUMN referrer_id TEXT",
-        "ALTER TABLE users ADD COLUMN referral_credits_earned INTEGER DEFAULT 0",
-        "ALTER TABLE users ADD COLUMN concurrent_slots INTEGER DEFAULT 1",
-        "ALTER TABLE users ADD COLUMN image_concurrent_slots INTEGER DEFAULT 3",
+    # Columns added to users after its first release
+    for column, decl in [
+        ("plan_id", "TEXT"),
+        ("plan_expires_at_ms", "INTEGER"),
+        ("referral_code", "TEXT"),
+        ("referrer_id", "TEXT"),
+        ("referral_credits_earned", "INTEGER DEFAULT 0"),
+        ("concurrent_slots", "INTEGER DEFAULT 1"),
+        ("image_concurrent_slots", "INTEGER DEFAULT 3"),
     ]:
-        try:
-            cur.execute(stmt)
-            con.commit()
-        except Exception:
-            pass  # Column already exists
+        add_column(con, "users", column, decl)
     
     # API Keys table (admin-managed pool)
     cur.execute("""
@@ -353,12 +622,18 @@ def init_db():
         )
     """)
     
-    # Migration: Add char_count column if it doesn't exist
-    try:
-        cur.execute("ALTER TABLE jobs ADD COLUMN char_count INTEGER DEFAULT 0")
-        con.commit()
-    except:
-        pass  # Column already exists
+    # Columns added to jobs: char_count, result-cache fingerprint, start claim (scheduler / status
+    # polls), owning process (recovery after restarts)
+    for column, decl in [
+        ("char_count", "INTEGER DEFAULT 0"),
+        ("request_hash", "TEXT"),
+        ("claimed_at_ms", "INTEGER"),
+        ("worker_id", "TEXT"),
+    ]:
+        add_column(con, "jobs", column, decl)
+    
+    # Durable work queue tables
+    work_queue.ensure_schema(con)
     
     # Event Log
     cur.execute("""
@@ -399,6 +674,26 @@ def init_db():
         )
     """)
     
+    # Per-model result cache policy (off | seeded | always), enable flag and limits
+    add_column(con, "model_pricing", "cache_policy", "TEXT DEFAULT 'off'")
+    add_column(con, "model_pricing", "is_active", "INTEGER DEFAULT 1")
+    add_column(con, "model_pricing", "max_images", "INTEGER DEFAULT 10")
+    
+    # Model routes: which provider/upstream model serves a logical model_id (weights split traffic)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS model_routes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            model_id TEXT NOT NULL,
+            provider TEXT NOT NULL,
+            upstream_model TEXT NOT NULL,
+            weight INTEGER DEFAULT 1,
+            is_active INTEGER DEFAULT 1,
+            size_map_json TEXT,
+            updated_at_ms INTEGER
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_model_routes_model ON model_routes(model_id)")
+    
     # Initialize default pricing if table is empty (all image generation models)
     default_pricing = [
         ('IMAGEN_4', 1),
@@ -414,13 +709,16 @@ def init_db():
         ('NAGA_FLUX', 1),
     ]
     for model_id, credits in default_pricing:
-        try:
-            cur.execute("INSERT OR IGNORE INTO model_pricing (model_id, credits_per_image, updated_at_ms) VALUES (?, ?, ?)",
-                       (model_id, credits, now_ms()))
-        except:
-            pass
-    
-    con.commit()
+        cur.execute("INSERT OR IGNORE INTO model_pricing (model_id, credits_per_image, updated_at_ms) VALUES (?, ?, ?)",
+                   (model_id, credits, now_ms()))
+    
+    # Seed routes for the built-in models once; afterwards they are managed from the admin panel
+    if not cur.execute("SELECT 1 FROM model_routes LIMIT 1").fetchone():
+        for model_id, provider, upstream_model, size_map in _default_model_routes():
+            cur.execute(
+                "INSERT INTO model_routes (model_id, provider, upstream_model, weight, is_active, size_map_json, updated_at_ms) VALUES (?, ?, ?, 1, 1, ?, ?)",
+                (model_id, provider, upstream_model, _json_dumps(size_map) if size_map else None, now_ms())
+            )
     
     # Payments table
     cur.execute("""
@@ -463,6 +761,7 @@ def init_db():
     cur.execute("CREATE INDEX IF NOT EXISTS idx_users_plan_id ON users(plan_id)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs(user_id)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_request_hash ON jobs(request_hash, created_at_ms)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_user_api_keys_key ON user_api_keys(api_key)")
     
     # Insert default plans
@@ -479,28 +778,132 @@ def init_db():
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, plan)
     
-    con.commit()
-    con.close()
+    # plans.priority (admission control class, TaskPriority level)
+    add_column(con, "plans", "priority", "INTEGER")
+    for plan_id, priority in admission.PLAN_PRIORITY.items():
+        cur.execute("UPDATE plans SET priority = ? WHERE id = ? AND priority IS NULL", (priority, plan_id))
+
+# 'image' / 'voice' from metadata_json, for rows written before jobs.kind existed
+_JOB_KIND_SQL = """CASE WHEN metadata_json LIKE '%"type":"image"%' OR metadata_json LIKE '%"type": "image"%'
+                   THEN 'image' ELSE 'voice' END"""
+
+def _m002_jobs_kind(con: sqlite3.Connection):
+    """jobs.kind replaces the metadata_json LIKE scans in history filters. New rows are tagged by a
+    trigger; existing rows by the jobs_kind backfill, online, after boot."""
+    add_column(con, "jobs", "kind", "TEXT")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user_kind ON jobs(user_id, kind, created_at_ms)")
+    con.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_jobs_kind AFTER INSERT ON jobs WHEN NEW.kind IS NULL
+        BEGIN
+            UPDATE jobs SET kind = {_JOB_KIND_SQL.replace("metadata_json", "NEW.metadata_json")} WHERE rowid = NEW.rowid;
+        END
+    """)
 
-def log_event(level: str, event_type: str, message: str, user_id: str = None, meta: dict = None):
-    """Log an event to the database"""
+def _backfill_jobs_kind(con: sqlite3.Connection, cursor: int, size: int) -> Optional[int]:
+    rows = con.execute("SELECT rowid FROM jobs WHERE rowid > ? ORDER BY rowid LIMIT ?", (cursor, size)).fetchall()
+    if not rows:
+        return None
+    last = rows[-1][0]
+    con.execute(f"UPDATE jobs SET kind = {_JOB_KIND_SQL} WHERE rowid > ? AND rowid <= ? AND kind IS NULL", (cursor, last))
+    return last
+
+def _m004_api_key_webhooks(con: sqlite3.Connection):
+    """Per-key webhook endpoint, the key a job was submitted with, and the delivery outbox that a
+    trigger on jobs fills when such a job finishes (server/webhooks.py)."""
+    add_column(con, "user_api_keys", "webhook_url", "TEXT")
+    add_column(con, "user_api_keys", "webhook_secret", "TEXT")
+    add_column(con, "jobs", "user_api_key_id", "TEXT")
+    con.executescript(webhooks.SCHEMA)
+
+# Append only: a released step is never edited, a later step changes it
+MIGRATIONS = [
+    Migration(1, "baseline", _m001_baseline),
+    Migration(2, "jobs_kind", _m002_jobs_kind),
+    Migration(3, "leader_leases", lambda con: con.execute(leader.SCHEMA)),
+    Migration(4, "api_key_webhooks", _m004_api_key_webhooks),
+    Migration(5, "idempotency_keys", lambda con: con.executescript(idempotency.SCHEMA)),
+]
+BACKFILLS = [
+    Backfill("jobs_kind", _backfill_jobs_kind, after_version=2),
+]
+migrator = Migrator(db_conn, f"{DB_PATH}.migrate.lock", MIGRATIONS, BACKFILLS)
+
+# PostgreSQL equivalents of SQLite-only schema objects, applied by `python -m server.storage copy`
+POSTGRES_EXTRA_DDL = [
+    f"""CREATE OR REPLACE FUNCTION jobs_set_kind() RETURNS trigger AS $$
+        BEGIN
+            IF NEW.kind IS NULL THEN
+                NEW.kind := {_JOB_KIND_SQL.replace("metadata_json", "NEW.metadata_json")};
+            END IF;
+            RETURN NEW;
+        END $$ LANGUAGE plpgsql""",
+    "DROP TRIGGER IF EXISTS trg_jobs_kind ON jobs",
+    "CREATE TRIGGER trg_jobs_kind BEFORE INSERT ON jobs FOR EACH ROW EXECUTE FUNCTION jobs_set_kind()",
+    *webhooks.POSTGRES_DDL,
+]
+
+# Backend-neutral access (server/storage.py) for code written against the Storage interface;
+# writes share this process's group-commit writer
+storage = SQLiteStorage(db_conn, writer=db_writer)
+
+idempotency_store = IdempotencyStore(storage, ttl_seconds=IDEMPOTENCY_TTL_HOURS * 3600, lock_seconds=IDEMPOTENCY_LOCK_SECONDS,
+                                     wait_seconds=IDEMPOTENCY_WAIT_SECONDS, max_response_bytes=IDEMPOTENCY_MAX_RESPONSE_BYTES)
+
+backup_manager = BackupManager(DB_PATH, BACKUP_DIR, keep=BACKUP_KEEP, compress=BACKUP_COMPRESS,
+                               pages_per_step=BACKUP_PAGES_PER_STEP)
+
+def init_db():
+    """Boot-time schema check: one query when the schema is current. Pending steps are applied
+    under the migration lock, or refused with MIGRATE_ON_BOOT=false (run `python -m server.migrate up`)."""
     con = db_conn()
     try:
-        con.execute(
+        con.execute(f"PRAGMA journal_mode={DB_JOURNAL_MODE}")  # Persistent: a no-op after the first boot
+    except sqlite3.OperationalError as e:
+        _debug_log("[DB] journal_mode unchanged:", e)  # Another process holds the database; it switches next boot
+    finally:
+        con.close()
+    for name in migrator.ensure_current(apply=MIGRATE_ON_BOOT):
+        log_event("info", "schema_migrated", f"Applied migration {name}")
+
+async def schema_backfill_loop():
+    """Run pending backfills in small batches until all are done (one process at a time)."""
+    while True:
+        results = await asyncio.to_thread(migrator.run_backfills, MIGRATE_BACKFILL_BATCH)
+        if results and all(results.values()):
+            return
+        await asyncio.sleep(60)
+
+async def backup_loop():
+    """Snapshot the database every BACKUP_INTERVAL_HOURS; a restart does not trigger an early one."""
+    interval = BACKUP_INTERVAL_HOURS * 3600
+    if await asyncio.to_thread(backup_manager.same_volume):
+        log_event("warning", "backup_same_volume", f"BACKUP_DIR {BACKUP_DIR} is on the database's volume; snapshots will not survive losing that disk")
+    age = await asyncio.to_thread(backup_manager.latest_age_seconds)
+    await asyncio.sleep(max(0.0, interval - age) if age is not None else 60)
+    while True:
+        try:
+            result = await asyncio.to_thread(backup_manager.run_once)
+            if result:
+                log_event("info", "backup_done", f"Backup {Path(result['file']).name} in {result['last_duration_ms']} ms", meta=result)
+        except Exception as e:
+            log_event("error", "backup_failed", str(e))
+        await asyncio.sleep(interval)
+
+def log_event(level: str, event_type: str, message: str, user_id: str = None, meta: dict = None):
+    """Log an event to the database (committed with the writer's next batch)"""
+    try:
+        db_writer.defer(
             "INSERT INTO event_log (level, event_type, message, user_id, metadata_json, created_at_ms) VALUES (?, ?, ?, ?, ?, ?)",
             (level, event_type, message, user_id, _json_dumps(meta or {}), now_ms())
         )
-        con.commit()
     except Exception as e:
         _debug_log("Log error:", e)
-    finally:
-        con.close()
 
 # =============================================================================
 # Lifespan
 # =============================================================================
 async def cleanup_expired_files():
-    """Background task to clean up expired audio files"""
+    """Background task to clean up expired audio and image files"""
     while True:
         try:
             con = db_conn()
@@ -518,6 +921,9 @@ async def cleanup_expired_files():
                             if path.exists():
                                 path.unlink()
                                 log_event("info", "file_deleted", f"Deleted expired file: {path}")
+                            # Other images of the job and thumbnails / previews: <id>_<n>.png, <id>[_<n>].<variant>.<fmt>
+                            for extra in list(IMAGES_DIR.glob(f"{job['id']}.*")) + list(IMAGES_DIR.glob(f"{job['id']}_*")):
+                                extra.unlink(missing_ok=True)
                         except Exception as e:
                             log_event("error", "file_delete_failed", str(e))
                     
@@ -568,21 +974,107 @@ async def cleanup_stuck_tasks():
         # Run every 5 minutes
         await asyncio.sleep(300)
 
+def _reload_model_registry():
+    """Rebuild the in-memory model registry from model_pricing/model_routes."""
+    con = db_conn()
+    try:
+        model_registry.load(con, now_ms())
+    finally:
+        con.close()
+
+async def model_registry_refresh_loop():
+    """Reload the model registry when another worker changed pricing or routes"""
+    while True:
+        await asyncio.sleep(MODEL_REGISTRY_REFRESH_SECONDS)
+        try:
+            con = db_conn()
+            try:
+                if model_registry.current_version(con) != model_registry.version:
+                    model_registry.load(con, now_ms())
+                    read_cache.invalidate(CATALOG, "model-pricing", local=True)  # The editing worker already told the others
+            finally:
+                con.close()
+        except Exception as e:
+            log_event("error", "model_registry_refresh_error", str(e))
+
+async def worker_heartbeat_loop():
+    """Keep this process in work_workers so its in-flight jobs are not recovered (API-only mode)"""
+    while True:
+        await asyncio.sleep(WORK_LEASE_SECONDS / 3)
+        try:
+            work_queue.worker_heartbeat(WORKER_ID)
+        except Exception as e:
+            log_event("error", "worker_heartbeat_error", str(e))
+
+singletons: List[leader.SingletonService] = []
+
+def _leader_lease(name: str):
+    if LEADER_BACKEND == "redis":
+        from server.redis_client import redis_client  # Optional dependency: only with LEADER_BACKEND=redis
+        return leader.RedisLease(redis_client, name, WORKER_ID, ttl=LEADER_LEASE_SECONDS)
+    return leader.SQLiteLease(db_conn, name, WORKER_ID, ttl=LEADER_LEASE_SECONDS)
+
+def start_services(role: str) -> List["asyncio.Task"]:
+    """Start this process's periodic loops. With WORKER_MODE=api that is only the registry refresh
+    and a heartbeat; otherwise also cleanup, the scheduler, the work queue and orphan recovery."""
+    global work_runner
+    work_queue.register_worker(WORKER_ID, role)
+    read_cache.start()
+    tasks = [asyncio.create_task(model_registry_refresh_loop()), asyncio.create_task(loop_lag.run())]
+    if API_ONLY:
+        tasks.append(asyncio.create_task(worker_heartbeat_loop()))
+        return tasks
+    
+    # Once per deployment, not once per process: each loop runs where its lease is held
+    singleton_loops = [("cleanup_expired_files", cleanup_expired_files), ("cleanup_stuck_tasks", cleanup_stuck_tasks),
+                       ("schema_backfill", schema_backfill_loop)]
+    if BACKUP_ENABLED:
+        singleton_loops.append(("backup", backup_loop))
+    for name, factory in singleton_loops:
+        service = leader.SingletonService(_leader_lease(name), factory, on_event=log_event)
+        singletons.append(service)
+        tasks.append(asyncio.create_task(service.run()))
+    if SCHEDULER_ENABLED:
+        tasks.append(asyncio.create_task(scheduler_dispatch_loop()))
+    
+    # Durable work queue: run items, and resume jobs whose worker died (first sweep runs now)
+    work_runner = WorkRunner(work_queue, WORK_HANDLERS, WORKER_ID, role=role,
+                             concurrency=WORK_CONCURRENCY, on_error=_work_on_error)
+    tasks.append(asyncio.create_task(work_runner.run()))
+    tasks.append(asyncio.create_task(work_recovery_loop()))
+    tasks.append(asyncio.create_task(webhook_dispatcher.run()))
+    return tasks
+
+async def stop_services(tasks: List["asyncio.Task"]):
+    # Hand unfinished items back first; the next process picks them (and this worker's jobs) up
+    if work_runner:
+        await work_runner.stop()
+    await webhook_dispatcher.stop()
+    migrator.stop()
+    for task in tasks:
+        task.cancel()  # Singleton services release their leases on the way out
+    await asyncio.gather(*tasks, return_exceptions=True)
+    singletons.clear()
+    await read_cache.stop()
+    work_queue.unregister_worker(WORKER_ID)
+    media_processor.shutdown()
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     init_db()
+    _reload_model_registry()
     log_event("info", "server_start", "FiftyFive Labs API started")
     
-    # Start cleanup tasks
-    cleanup_task = asyncio.create_task(cleanup_expired_files())
-    stuck_cleanup_task = asyncio.create_task(cleanup_stuck_tasks())
+    services = start_services("api")
+    if static_assets:
+        # Read (and compress, if the build step didn't) the frontend once, before serving
+        await asyncio.to_thread(static_assets.load)
     
     yield
     
-    # Cancel cleanup tasks
-    cleanup_task.cancel()
-    stuck_cleanup_task.cancel()
+    await stop_services(services)
     log_event("info", "server_stop", "FiftyFive Labs API stopped")
+    await asyncio.to_thread(db_writer.stop)  # Commit queued writes (event log, last-used stamps)
 
 # =============================================================================
 # FastAPI App
@@ -591,7 +1083,8 @@ app = FastAPI(
     title="FiftyFive Labs API",
     description="AI Image Generation Platform",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
 
 class SecurityHeadersMiddleware(BaseHTTPMiddleware):
@@ -605,6 +1098,9 @@ class SecurityHeadersMiddleware(BaseHTTPMiddleware):
             response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
         return response
 
+# Innermost, so it sees whole response bodies rather than BaseHTTPMiddleware's re-streamed ones
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_BYTES, gzip_level=COMPRESSION_GZIP_LEVEL,
+                   brotli_quality=COMPRESSION_BROTLI_QUALITY)
 app.add_middleware(SecurityHeadersMiddleware)
 app.add_middleware(
     CORSMiddleware,
@@ -661,6 +1157,10 @@ class AdminUpdateApiKey(BaseModel):
     concurrent_limit: Optional[int] = None
     is_active: Optional[bool] = None
 
+class AdminResetBreakers(BaseModel):
+    provider: Optional[str] = None
+    key_id: Optional[str] = None
+
 # =============================================================================
 # Auth Helpers
 # =============================================================================
@@ -671,45 +1171,94 @@ def _extract_token(authorization: Optional[str], token: Optional[str]) -> Option
         return authorization
     return token
 
-def require_user(token: Optional[str]) -> Dict:
-    if not token:
-        raise HTTPException(401, "Authentication required")
-    
+# Cached auth reads (read_cache): secrets are never cached, tokens and API keys only as sha256 digests
+_USER_SECRET_COLUMNS = ("password_salt", "password_hash", "auth_token")
+
+def _secret_digest(secret: str) -> str:
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+def _user_id_for_token(token: str) -> Optional[str]:
     con = db_conn()
     try:
-        user = con.execute("SELECT * FROM users WHERE auth_token = ? AND is_active = 1", (token,)).fetchone()
-        if not user:
-            raise HTTPException(401, "Invalid or expired token")
-        return dict(user)
+        row = con.execute("SELECT id FROM users WHERE auth_token = ?", (token,)).fetchone()
+        return row["id"] if row else None
+    finally:
+        con.close()
+
+def _load_user(user_id: str) -> Optional[Dict]:
+    con = db_conn()
+    try:
+        row = con.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+    finally:
+        con.close()
+    if not row:
+        return None
+    user = {k: row[k] for k in row.keys() if k not in _USER_SECRET_COLUMNS}
+    user["auth_token_sha256"] = _secret_digest(row["auth_token"]) if row["auth_token"] else None
+    return user
+
+def _load_user_api_key(api_key: str) -> Optional[Dict]:
+    con = db_conn()
+    try:
+        row = con.execute("SELECT * FROM user_api_keys WHERE api_key = ? AND is_active = 1", (api_key,)).fetchone()
+        return {k: row[k] for k in row.keys() if k not in ("api_key", "webhook_secret")} if row else None
     finally:
         con.close()
 
-def require_api_key(api_key: Optional[str]) -> Tuple[Dict, Dict]:
+def _user_changed(user_id: str):
+    """Drop the cached users row; call after writes to users (login, logout, credits, admin edits)."""
+    read_cache.invalidate(USERS, user_id)
+
+async def _cached_user(user_id: str) -> Optional[Dict]:
+    return await read_cache.get(USERS, user_id, lambda: _load_user(user_id))
+
+async def require_user(token: Optional[str]) -> Dict:
+    if not token:
+        raise HTTPException(401, "Authentication required")
+    
+    digest = _secret_digest(token)
+    user_id = await read_cache.get(AUTH_TOKENS, digest, lambda: _user_id_for_token(token))
+    user = await _cached_user(user_id) if user_id else None
+    # token -> id is never invalidated: the users row (dropped on login/logout) says which token is current
+    if not user or not user["is_active"] or user["auth_token_sha256"] != digest:
+        raise HTTPException(401, "Invalid or expired token")
+    return {k: v for k, v in user.items() if k != "auth_token_sha256"}
+
+async def require_api_key(api_key: Optional[str]) -> Tuple[Dict, Dict]:
     """Validate user API key and return (user, api_key_record)"""
     if not api_key:
         raise HTTPException(401, "API key required")
     
-    con = db_conn()
+    key_record = await read_cache.get(USER_API_KEYS, _secret_digest(api_key), lambda: _load_user_api_key(api_key))
+    if not key_record:
+        raise HTTPException(401, "Invalid API key")
+    
+    user = await _cached_user(key_record["user_id"])
+    if not user or not user["is_active"]:
+        raise HTTPException(401, "User not found or inactive")
+    
+    return {k: v for k, v in user.items() if k != "auth_token_sha256"}, dict(key_record)
+
+async def _idempotent(request: Request, idempotency_key: Optional[str], owner: str, endpoint: str,
+                      handler: Callable[[], Awaitable[Dict]]):
+    """Run a generation handler at most once per (owner, endpoint, Idempotency-Key header); owner
+    is the user id for web requests and "key:<api key id>" for API-key requests.
+
+    A repeat of a finished request gets the first response back (Idempotent-Replayed: true); a
+    repeat of one still running waits for it. Errors are not stored, so a failed request can be
+    retried with the same key. Without the header the handler just runs.
+    """
+    if not idempotency_key:
+        return await handler()
     try:
-        key_record = con.execute(
-            "SELECT * FROM user_api_keys WHERE api_key = ? AND is_active = 1",
-            (api_key,)
-        ).fetchone()
-        
-        if not key_record:
-            raise HTTPException(401, "Invalid API key")
-        
-        user = con.execute(
-            "SELECT * FROM users WHERE id = ? AND is_active = 1",
-            (key_record["user_id"],)
-        ).fetchone()
-        
-        if not user:
-            raise HTTPException(401, "User not found or inactive")
-        
-        return dict(user), dict(key_record)
-    finally:
-        con.close()
+        claim = await idempotency_store.begin(f"{owner}:{endpoint}", idempotency_key.strip(),
+                                              idempotency.fingerprint(await request.body()))
+    except IdempotencyError as e:
+        headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+        raise HTTPException(e.status_code, str(e), headers=headers)
+    if claim.replay is not None:
+        return JSONResponse(claim.replay, headers={"Idempotent-Replayed": "true"})
+    return await idempotency_store.run(claim, handler)
 
 def _generate_referral_code() -> str:
     # Short, URL-safe, readable-ish code
@@ -731,12 +1280,14 @@ def _ensure_referral_code(con: sqlite3.Connection, user_id: str) -> str:
         if not dup:
             con.execute("UPDATE users SET referral_code = ? WHERE id = ?", (code, user_id))
             con.commit()
+            _user_changed(user_id)
             return code
 
     # Fallback: longer token if collisions keep happening
     code = secrets.token_urlsafe(12).replace("-", "").replace("_", "")[:12].upper()
     con.execute("UPDATE users SET referral_code = ? WHERE id = ?", (code, user_id))
     con.commit()
+    _user_changed(user_id)
     return code
 
 def _get_referral_tier_rate(con: sqlite3.Connection, referrer_id: str) -> float:
@@ -780,6 +1331,7 @@ def _apply_referral_bonus(con: sqlite3.Connection, referred_user_id: str, credit
         "UPDATE users SET referral_credits_earned = COALESCE(referral_credits_earned, 0) + ? WHERE id = ?",
         (bonus, referrer_id),
     )
+    _user_changed(referrer_id)
 
     log_event(
         "info",
@@ -1086,6 +1638,7 @@ async def login(body: LoginRequest):
                    (auth_token, now_ms(), user["id"]))
         _ensure_referral_code(con, user["id"])
         con.commit()
+        _user_changed(user["id"])
         
         log_event("info", "user_login", f"User logged in: {nickname}", user_id=user["id"])
         
@@ -1121,7 +1674,7 @@ async def get_me(
     token: Optional[str] = Query(None)
 ):
     tok = _extract_token(authorization, token)
-    user = require_user(tok)
+    user = await require_user(tok)
     
     con = db_conn()
     try:
@@ -1161,7 +1714,7 @@ async def user_profile(
     token: Optional[str] = Query(None)
 ):
     tok = _extract_token(authorization, token)
-    user = require_user(tok)
+    user = await require_user(tok)
 
     con = db_conn()
     try:
@@ -1217,7 +1770,7 @@ async def user_usage(
     token: Optional[str] = Query(None)
 ):
     tok = _extract_token(authorization, token)
-    user = require_user(tok)
+    user = await require_user(tok)
     con = db_conn()
     try:
         rows = _fetch_usage_rows(con, period=period, user_id=user["id"])
@@ -1232,12 +1785,13 @@ async def logout(
     token: Optional[str] = Query(None)
 ):
     tok = _extract_token(authorization, token)
-    user = require_user(tok)
+    user = await require_user(tok)
     
     con = db_conn()
     try:
         con.execute("UPDATE users SET auth_token = NULL WHERE id = ?", (user["id"],))
         con.commit()
+        _user_changed(user["id"])
         return {"ok": True}
     finally:
         con.close()
@@ -1251,7 +1805,7 @@ async def list_user_api_keys(
     token: Optional[str] = Query(None)
 ):
     tok = _extract_token(authorization, token)
-    user = require_user(tok)
+    user = await require_user(tok)
     
     con = db_conn()
     try:
@@ -1271,7 +1825,8 @@ async def list_user_api_keys(
                     "is_active": bool(k["is_active"]),
                     "total_requests": k["total_requests"],
                     "created_at_ms": k["created_at_ms"],
-                    "last_used_ms": k["last_used_ms"]
+                    "last_used_ms": k["last_used_ms"],
+                    "webhook_url": k["webhook_url"]
                 }
                 for k in keys
             ]
@@ -1286,7 +1841,7 @@ async def create_user_api_key(
     token: Optional[str] = Query(None)
 ):
     tok = _extract_token(authorization, token)
-    user = require_user(tok)
+    user = await require_user(tok)
     
     con = db_conn()
     try:
@@ -1327,15 +1882,20 @@ async def delete_user_api_key(
     token: Optional[str] = Query(None)
 ):
     tok = _extract_token(authorization, token)
-    user = require_user(tok)
+    user = await require_user(tok)
     
     con = db_conn()
     try:
+        row = con.execute("SELECT api_key FROM user_api_keys WHERE id = ? AND user_id = ?", (key_id, user["id"])).fetchone()
         con.execute(
             "DELETE FROM user_api_keys WHERE id = ? AND user_id = ?",
             (key_id, user["id"])
         )
+        if row:
+            con.execute("DELETE FROM webhook_deliveries WHERE api_key_id = ?", (key_id,))
         con.commit()
+        if row:
+            read_cache.invalidate(USER_API_KEYS, _secret_digest(row["api_key"]))
         return {"ok": True}
     finally:
         con.close()
@@ -1344,11 +1904,11 @@ async def delete_user_api_key(
 # Image Generation
 # =============================================================================
 async def generate_image_task(job_id: str, api_key_id: str, user_id: str):
-    """Background task to generate image"""
+    """Generate an image (work queue item "image.generate"; safe to run again after a restart)"""
     con = db_conn()
     try:
         job = con.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
-        if not job:
+        if not job or job["status"] not in ("pending", "processing"):
             return
         
         # Get API key
@@ -1359,7 +1919,7 @@ async def generate_image_task(job_id: str, api_key_id: str, user_id: str):
             return
         
         # Update job status
-        con.execute("UPDATE jobs SET status = 'processing', started_at_ms = ? WHERE id = ?", (now_ms(), job_id))
+        con.execute("UPDATE jobs SET status = 'processing', started_at_ms = ?, worker_id = ? WHERE id = ?", (now_ms(), WORKER_ID, job_id))
         con.commit()
         
         # Make API request
@@ -1409,8 +1969,7 @@ async def generate_image_task(job_id: str, api_key_id: str, user_id: str):
                     
                     if image_data:
                         image_path = IMAGES_DIR / f"{job_id}.png"
-                        async with aiofiles.open(image_path, "wb") as f:
-                            await f.write(base64.b64decode(image_data))
+                        await media_processor.process(image_data, image_path)
                         
                         # Update job
                         expires_at = now_ms() + (IMAGE_TTL_SECONDS * 1000)
@@ -1457,7 +2016,6 @@ async def generate_image_task(job_id: str, api_key_id: str, user_id: str):
 @app.post("/api/generate")
 async def generate_image(
     body: GenerateRequest,
-    background_tasks: BackgroundTasks,
     authorization: Optional[str] = Header(None),
     token: Optional[str] = Query(None),
     x_api_key: Optional[str] = Header(None)
@@ -1466,11 +2024,11 @@ async def generate_image(
     
     # Authenticate via token or API key
     if x_api_key:
-        user, user_key = require_api_key(x_api_key)
+        user, user_key = await require_api_key(x_api_key)
         user_id = user["id"]
     else:
         tok = _extract_token(authorization, token)
-        user = require_user(tok)
+        user = await require_user(tok)
         user_id = user["id"]
         user_key = None
     
@@ -1524,6 +2082,7 @@ async def generate_image(
                 "UPDATE users SET credits_balance = credits_balance - 1, credits_used = credits_used + 1 WHERE id = ?",
                 (user_id,)
             )
+            _user_changed(user_id)
         
         # Update user API key stats if used
         if user_key:
@@ -1532,12 +2091,13 @@ async def generate_image(
                 (now_ms(), user_key["id"])
             )
         
+        # Generation runs from the durable work queue (committed with the job)
+        work_queue.enqueue(con, "image.generate", {"job_id": job_id, "api_key_id": api_key_id, "user_id": user_id},
+                           job_id=job_id, dedupe_key=f"image.generate:{job_id}", max_attempts=WORK_MAX_ATTEMPTS)
         con.commit()
     finally:
         con.close()
-    
-    # Start background generation
-    background_tasks.add_task(generate_image_task, job_id, api_key_id, user_id)
+    _wake_work()
     
     log_event("info", "generation_started", f"Generation started: {job_id}", user_id=user_id)
     
@@ -1556,36 +2116,39 @@ async def get_job(
 ):
     """Get job status"""
     if x_api_key:
-        user, _ = require_api_key(x_api_key)
+        user, _ = await require_api_key(x_api_key)
     else:
         tok = _extract_token(authorization, token)
-        user = require_user(tok)
+        user = await require_user(tok)
     
+    job = await read_cache.get(JOB_STATUS, f"job:{job_id}", lambda: _load_job_status(job_id), cache_if=_job_finished)
+    if not job or job["user_id"] != user["id"]:
+        raise HTTPException(404, "Job not found")
+    
+    return {"ok": True, "job": {k: v for k, v in job.items() if k != "user_id"}}
+
+# Status reads of jobs in these states are cached (read_cache JOB_STATUS); code that moves a job out
+# of one, or requeues it, calls _job_status_changed
+_FINISHED_JOB_STATUSES = ("completed", "failed", "cancelled")
+
+def _job_finished(body: Dict) -> bool:
+    return body.get("status") in _FINISHED_JOB_STATUSES
+
+def _load_job_status(job_id: str) -> Optional[Dict]:
     con = db_conn()
     try:
-        job = con.execute("SELECT * FROM jobs WHERE id = ? AND user_id = ?", (job_id, user["id"])).fetchone()
-        
-        if not job:
-            raise HTTPException(404, "Job not found")
-        
-        return {
-            "ok": True,
-            "job": {
-                "id": job["id"],
-                "status": job["status"],
-                "prompt": job["prompt"],
-                "model": job["model"],
-                "width": job["width"],
-                "height": job["height"],
-                "error": job["error"],
-                "created_at_ms": job["created_at_ms"],
-                "completed_at_ms": job["completed_at_ms"],
-                "expires_at_ms": job["expires_at_ms"]
-            }
-        }
+        job = con.execute(
+            """SELECT id, user_id, status, prompt, model, width, height, error, created_at_ms, completed_at_ms, expires_at_ms
+               FROM jobs WHERE id = ?""", (job_id,)
+        ).fetchone()
+        return dict(job) if job else None
     finally:
         con.close()
 
+def _job_status_changed(job_id: str, user_id: str):
+    """Drop cached status bodies of a job that was deleted, requeued or retried."""
+    read_cache.invalidate(JOB_STATUS, f"job:{job_id}", f"image:{user_id}:{job_id}")
+
 @app.delete("/api/jobs/{job_id}")
 async def delete_job(
     job_id: str,
@@ -1594,7 +2157,7 @@ async def delete_job(
 ):
     """Delete a job"""
     tok = _extract_token(authorization, token)
-    user = require_user(tok)
+    user = await require_user(tok)
     
     con = db_conn()
     try:
@@ -1607,6 +2170,7 @@ async def delete_job(
         
         con.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
         con.commit()
+        _job_status_changed(job_id, user["id"])
         
         return {"ok": True, "message": "Job deleted"}
     finally:
@@ -1621,10 +2185,10 @@ async def get_job_image(
 ):
     """Download generated image"""
     if x_api_key:
-        user, _ = require_api_key(x_api_key)
+        user, _ = await require_api_key(x_api_key)
     else:
         tok = _extract_token(authorization, token)
-        user = require_user(tok)
+        user = await require_user(tok)
     
     con = db_conn()
     try:
@@ -1651,6 +2215,171 @@ async def get_job_image(
     finally:
         con.close()
 
+# =============================================================================
+# Image Derivatives (thumbnails / previews for list views)
+# =============================================================================
+IMAGE_VARIANTS = ("thumb", "preview", "full")
+_media_url_key: Optional[bytes] = None
+
+
+def _media_secret() -> bytes:
+    """HMAC key for image URLs: MEDIA_URL_SECRET, else a random key shared through DATA_DIR."""
+    global _media_url_key
+    if _media_url_key is None:
+        if MEDIA_URL_SECRET:
+            _media_url_key = MEDIA_URL_SECRET.encode()
+        else:
+            path = DATA_DIR / ".media_url_secret"
+            if not path.exists():
+                # Write then hard-link: concurrent processes agree on whichever key lands first
+                tmp = DATA_DIR / f".media_url_secret.{os.getpid()}"
+                tmp.write_text(secrets.token_hex(32))
+                try:
+                    os.link(tmp, path)
+                except FileExistsError:
+                    pass
+                finally:
+                    tmp.unlink(missing_ok=True)
+            _media_url_key = path.read_text().strip().encode()
+    return _media_url_key
+
+
+def _image_sig(task_id: str, variant: str, index: int, exp: int) -> str:
+    msg = f"{task_id}:{variant}:{index}:{exp}".encode()
+    return hmac.new(_media_secret(), msg, hashlib.sha256).hexdigest()[:32]
+
+
+def _image_url(task_id: str, variant: str, index: int = 0) -> str:
+    """Signed URL for one stored image. <img> tags cannot send the bearer token, so the link itself
+    is the credential. Expiry is rounded up to a day boundary: the same image keeps the same URL
+    all day and the browser cache keeps hitting."""
+    exp = ((now_ms() + MEDIA_URL_TTL_HOURS * 3600 * 1000) // DAY_MS + 1) * DAY_MS
+    return f"/api/images/{task_id}/{variant}?i={index}&exp={exp}&sig={_image_sig(task_id, variant, index, exp)}"
+
+
+def _image_links(task_id: str, index: int = 0) -> Dict[str, str]:
+    return {f"{v}_url": _image_url(task_id, v, index) for v in IMAGE_VARIANTS}
+
+
+def _is_image_job(job: Any, metadata: Dict) -> bool:
+    if metadata.get("type") == "image":
+        return True
+    # Legacy /api/generate jobs have no metadata type, only a file under IMAGES_DIR
+    return bool(job["image_path"]) and Path(job["image_path"]).parent == IMAGES_DIR
+
+
+def _slim_image_metadata(job: Any, metadata: Dict) -> Dict:
+    """Image metadata for list views: inline data URIs replaced by signed thumb / preview / full URLs.
+    "result" and all_images[].url point at the full image so older clients keep working."""
+    if not _is_image_job(job, metadata):
+        return metadata
+    slim = {k: v for k, v in metadata.items() if k not in ("data_uri", "all_images", "full_prompt")}
+    result = metadata.get("result")
+    inline_result = isinstance(result, str) and result.startswith("data:")
+    if inline_result:
+        slim.pop("result")
+    images = [img for img in metadata.get("all_images") or [] if isinstance(img, dict)]
+    if not (job["image_path"] or metadata.get("data_uri") or images or inline_result):
+        return slim
+    slim.update(_image_links(job["id"]))
+    slim["result"] = slim["full_url"]
+    if images:
+        slim["all_images"] = []
+        for i, img in enumerate(images):
+            links = _image_links(job["id"], i)
+            entry = {k: v for k, v in img.items() if k != "data_uri"}
+            entry.update(links, url=links["full_url"])
+            slim["all_images"].append(entry)
+    return slim
+
+
+async def _image_original(con: sqlite3.Connection, job: Any, metadata: Dict, index: int) -> Optional[Path]:
+    """Path of stored image #index, writing it from the metadata data URI if it was never stored
+    (jobs from before file storage, clones, failed writes)."""
+    task_id = job["id"]
+    candidates = [IMAGES_DIR / f"{task_id}_{index}.png"]
+    if index == 0:
+        candidates = ([Path(job["image_path"])] if job["image_path"] else []) + candidates + [IMAGES_DIR / f"{task_id}.png"]
+    for path in candidates:
+        if path.exists():
+            return path
+
+    images = [img for img in metadata.get("all_images") or [] if isinstance(img, dict)]
+    source = images[index].get("data_uri") if index < len(images) else None
+    if not source and index == 0:
+        source = metadata.get("data_uri") or metadata.get("result")
+    if not isinstance(source, str) or not source.startswith("data:"):
+        return None
+    target = IMAGES_DIR / (f"{task_id}_{index}.png" if index else f"{task_id}.png")
+    try:
+        await media_processor.process(source, target)
+    except (MediaError, OSError) as e:
+        _debug_log(f"[IMAGE] {task_id}: cannot store image {index}: {e}")
+        return None
+    if index == 0:
+        # So cleanup_expired_files removes it (and its derivatives) with the job
+        con.execute("UPDATE jobs SET image_path = ? WHERE id = ? AND image_path IS NULL", (str(target), task_id))
+        con.commit()
+    return target
+
+
+@app.get("/api/images/{task_id}/{variant}")
+async def get_image_variant(
+    task_id: str,
+    variant: str,
+    request: Request,
+    i: int = Query(0, ge=0, le=63),
+    exp: int = Query(...),
+    sig: str = Query(...)
+):
+    """Serve an image or one of its derivatives (thumb, preview) from a signed URL (see _image_url).
+    Derivatives missing on disk are built on first request."""
+    if variant not in IMAGE_VARIANTS:
+        raise HTTPException(404, "Unknown image variant")
+    if exp < now_ms() or not hmac.compare_digest(sig, _image_sig(task_id, variant, i, exp)):
+        raise HTTPException(403, "Invalid or expired image link")
+
+    con = db_conn()
+    try:
+        job = con.execute("SELECT id, image_path, metadata_json, expires_at_ms FROM jobs WHERE id = ?", (task_id,)).fetchone()
+        if not job:
+            raise HTTPException(404, "Image not found")
+        metadata = _json_loads(job["metadata_json"] or "{}")
+        if not _is_image_job(job, metadata):
+            raise HTTPException(404, "Image not found")
+        if job["expires_at_ms"] and now_ms() > job["expires_at_ms"]:
+            raise HTTPException(410, "Image expired")
+        original = await _image_original(con, job, metadata, i)
+    finally:
+        con.close()
+    if not original:
+        raise HTTPException(404, "Image not found")
+
+    path = original
+    if variant != "full":
+        derived = Path(derivative_path(original, variant, IMAGE_DERIVATIVE_FORMAT))
+        if not derived.exists() and IMAGE_DERIVATIVES_ENABLED:
+            try:
+                await media_processor.derive(original)
+            except (MediaError, OSError) as e:
+                _debug_log(f"[IMAGE] {task_id}: derivatives failed: {e}")
+        if derived.exists():
+            path = derived  # Otherwise the original: larger, but still the right picture
+
+    if path is original:
+        with open(path, "rb") as f:
+            media_type = sniff_mime(f.read(32)) or "image/png"
+    else:
+        media_type = DERIVATIVE_MIME[IMAGE_DERIVATIVE_FORMAT]
+    st = path.stat()
+    etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    # The bytes behind a URL never change, so the browser may keep them until the link expires
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={max(0, (exp - now_ms()) // 1000)}, immutable"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+
 @app.get("/api/history")
 async def get_history(
     page: int = Query(1, ge=1),
@@ -1661,14 +2390,23 @@ async def get_history(
 ):
     """Get generation history"""
     tok = _extract_token(authorization, token)
-    user = require_user(tok)
+    user = await require_user(tok)
     
     con = db_conn()
     try:
         offset = (page - 1) * limit
         
         # Build query with optional type filter
-        if type == 'image':
+        if type in ('image', 'voice') and migrator.backfill_done("jobs_kind"):
+            # Every row is tagged: use the (user_id, kind, created_at_ms) index instead of scanning metadata
+            query = f"""
+                SELECT * FROM jobs 
+                WHERE user_id = ? AND kind = '{type}'
+                ORDER BY created_at_ms DESC 
+                LIMIT ? OFFSET ?
+            """
+            count_query = f"SELECT COUNT(*) as cnt FROM jobs WHERE user_id = ? AND kind = '{type}'"
+        elif type == 'image':
             # Filter for image type - check for "type":"image" in metadata_json
             query = """
                 SELECT * FROM jobs 
@@ -1726,7 +2464,8 @@ async def get_history(
                     "completed_at_ms": j["completed_at_ms"],
                     "expires_at_ms": j["expires_at_ms"],
                     "is_expired": j["expires_at_ms"] and now_ms() > j["expires_at_ms"],
-                    "metadata_json": j["metadata_json"]
+                    "metadata_json": _json_dumps(_slim_image_metadata(j, _json_loads(j["metadata_json"])))
+                    if j["metadata_json"] else j["metadata_json"]
                 }
                 for j in jobs
             ],
@@ -1744,7 +2483,7 @@ async def get_active_tasks(
 ):
     """Get user's active (processing/pending/queued) VOICE tasks with progress"""
     tok = _extract_token(authorization, token)
-    user = require_user(tok)
+    user = await require_user(tok)
     
     con = db_conn()
     try:
@@ -1761,7 +2500,7 @@ async def get_active_tasks(
             # Витягуємо metadata для прогресу
             metadata = {}
             try:
-                metadata = json.loads(j["metadata_json"] or "{}")
+                metadata = _json_loads(j["metadata_json"] or "{}")
             except:
                 pass
             
@@ -1808,7 +2547,7 @@ async def cancel_task(
 ):
     """Cancel user's own task"""
     tok = _extract_token(authorization, token)
-    user = require_user(tok)
+    user = await require_user(tok)
     
     con = db_conn()
     try:
@@ -1820,11 +2559,11 @@ async def cancel_task(
             raise HTTPException(400, "Task cannot be cancelled")
         
         # Try to cancel in Voicer API only for voice tasks (image tasks use different providers)
-        metadata = json.loads(job["metadata_json"] or "{}")
+        metadata = _json_loads(job["metadata_json"] or "{}")
         if job["status"] == "processing" and metadata.get("type") != "image":
             try:
                 voicer_task_id = metadata.get("voicer_task_id") or task_id
-                key_data = get_voicer_api_key()
+                key_data = get_voicer_api_key(claim=False)
                 if key_data:
                     _, voicer_key = key_data
                     async with httpx.AsyncClient(timeout=10) as client:
@@ -1851,6 +2590,7 @@ async def cancel_task(
                 "UPDATE users SET credits_used = credits_used - ? WHERE id = ?",
                 (job["credits_charged"], user["id"])
             )
+            _user_changed(user["id"])
         
         con.commit()
         log_event("info", "task_cancelled_by_user", f"Task {task_id} cancelled by user", user_id=user["id"], meta={"task_id": task_id})
@@ -1862,9 +2602,7 @@ async def cancel_task(
 # =============================================================================
 # Plans
 # =============================================================================
-@app.get("/api/plans")
-async def get_plans():
-    """Get available plans"""
+def _build_plans_payload() -> Dict:
     con = db_conn()
     try:
         plans = con.execute("SELECT * FROM plans WHERE is_active = 1 ORDER BY sort_order ASC").fetchall()
@@ -1880,7 +2618,7 @@ async def get_plans():
                     "credits": p["credits"],
                     "duration_days": p["duration_days"],
                     "description": p["description"],
-                    "features": json.loads(p["features_json"]) if p["features_json"] else [],
+                    "features": _json_loads(p["features_json"]) if p["features_json"] else [],
                     "popular": bool(p["popular"])
                 }
                 for p in plans
@@ -1889,6 +2627,11 @@ async def get_plans():
     finally:
         con.close()
 
+@app.get("/api/plans")
+async def get_plans(request: Request):
+    """Get available plans"""
+    return await _catalog_response(request, "plans", _build_plans_payload)
+
 # Admin: Get all plans (including inactive)
 @app.get("/api/admin/plans")
 async def admin_get_plans(x_admin_token: str = Header(None)):
@@ -1911,10 +2654,11 @@ async def admin_get_plans(x_admin_token: str = Header(None)):
                     "credits": p["credits"],
                     "duration_days": p["duration_days"],
                     "description": p["description"],
-                    "features": json.loads(p["features_json"]) if p["features_json"] else [],
+                    "features": _json_loads(p["features_json"]) if p["features_json"] else [],
                     "popular": bool(p["popular"]),
                     "is_active": bool(p["is_active"]),
-                    "sort_order": p["sort_order"]
+                    "sort_order": p["sort_order"],
+                    "priority": admission.PRIORITY_NAMES.get(admission.normalize_priority(p["priority"]))
                 }
                 for p in plans
             ]
@@ -1942,11 +2686,11 @@ async def admin_create_plan(request: Request, x_admin_token: str = Header(None))
         if existing:
             raise HTTPException(status_code=400, detail="Plan with this ID already exists")
         
-        features_json = json.dumps(data.get("features", []))
+        features_json = _json_dumps(data.get("features", []))
         
         con.execute("""
-            INSERT INTO plans (id, title, subtitle, price_usd, credits, duration_days, description, features_json, is_active, sort_order, popular)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO plans (id, title, subtitle, price_usd, credits, duration_days, description, features_json, is_active, sort_order, popular, priority)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, (
             plan_id,
             data.get("title", ""),
@@ -1958,9 +2702,11 @@ async def admin_create_plan(request: Request, x_admin_token: str = Header(None))
             features_json,
             1 if data.get("is_active", True) else 0,
             int(data.get("sort_order", 0)),
-            1 if data.get("popular", False) else 0
+            1 if data.get("popular", False) else 0,
+            admission.normalize_priority(data.get("priority"))
         ))
         con.commit()
+        read_cache.invalidate(CATALOG, "plans")
         
         return {"ok": True, "message": "Plan created", "plan_id": plan_id}
     finally:
@@ -2005,7 +2751,7 @@ async def admin_update_plan(plan_id: str, request: Request, x_admin_token: str =
             params.append(data["description"])
         if "features" in data:
             updates.append("features_json = ?")
-            params.append(json.dumps(data["features"]))
+            params.append(_json_dumps(data["features"]))
         if "is_active" in data:
             updates.append("is_active = ?")
             params.append(1 if data["is_active"] else 0)
@@ -2015,11 +2761,15 @@ async def admin_update_plan(plan_id: str, request: Request, x_admin_token: str =
         if "popular" in data:
             updates.append("popular = ?")
             params.append(1 if data["popular"] else 0)
+        if "priority" in data:
+            updates.append("priority = ?")
+            params.append(admission.normalize_priority(data["priority"]))
         
         if updates:
             params.append(plan_id)
             con.execute(f"UPDATE plans SET {', '.join(updates)} WHERE id = ?", params)
             con.commit()
+            read_cache.invalidate(CATALOG, "plans")
         
         return {"ok": True, "message": "Plan updated"}
     finally:
@@ -2040,6 +2790,7 @@ async def admin_delete_plan(plan_id: str, x_admin_token: str = Header(None)):
         
         con.execute("DELETE FROM plans WHERE id = ?", (plan_id,))
         con.commit()
+        read_cache.invalidate(CATALOG, "plans")
         
         return {"ok": True, "message": "Plan deleted"}
     finally:
@@ -2048,9 +2799,7 @@ async def admin_delete_plan(plan_id: str, x_admin_token: str = Header(None)):
 # =============================================================================
 # Models
 # =============================================================================
-@app.get("/api/models")
-async def get_models():
-    """Get available models"""
+def _build_models_payload() -> Dict:
     models = [
         {
             "id": "black-forest-labs/FLUX.1-schnell-Free",
@@ -2077,6 +2826,11 @@ async def get_models():
     
     return {"ok": True, "models": models}
 
+@app.get("/api/models")
+async def get_models(request: Request):
+    """Get available models"""
+    return await _catalog_response(request, "models", _build_models_payload, "public, max-age=3600")
+
 # =============================================================================
 # Admin Endpoints
 # =============================================================================
@@ -2400,6 +3154,7 @@ async def admin_update_user(
             params.append(user_id)
             con.execute(f"UPDATE users SET {', '.join(updates)} WHERE id = ?", params)
             con.commit()
+            _user_changed(user_id)
             
             log_event("info", "admin_update_user", f"User updated: {user_id}", meta=body.model_dump())
 
@@ -2658,7 +3413,8 @@ async def admin_list_api_keys(x_admin_token: Optional[str] = Header(None)):
                 "created_at_ms": k["created_at_ms"],
                 "last_used_ms": k["last_used_ms"],
                 "current_usage": rate_limiter.api_key_usage.get(k["id"], {}).get("count", 0),
-                "current_concurrent": concurrent_by_key.get(k["id"], 0)
+                "current_concurrent": concurrent_by_key.get(k["id"], 0),
+                "breaker_state": breakers.state(provider, k["id"])
             })
         
         return {
@@ -2669,9 +3425,7 @@ async def admin_list_api_keys(x_admin_token: Optional[str] = Header(None)):
         con.close()
 
 # Get model pricing (public endpoint for users)
-@app.get("/api/model-pricing")
-async def get_model_pricing():
-    """Get model pricing for current user"""
+def _build_model_pricing_payload() -> Dict:
     con = db_conn()
     try:
         pricing = con.execute("SELECT * FROM model_pricing ORDER BY model_id").fetchall()
@@ -2682,6 +3436,11 @@ async def get_model_pricing():
     finally:
         con.close()
 
+@app.get("/api/model-pricing")
+async def get_model_pricing(request: Request):
+    """Get model pricing for current user"""
+    return await _catalog_response(request, "model-pricing", _build_model_pricing_payload)
+
 # Admin: Get model pricing
 @app.get("/api/admin/model-pricing")
 async def admin_get_model_pricing(x_admin_token: Optional[str] = Header(None)):
@@ -2693,7 +3452,16 @@ async def admin_get_model_pricing(x_admin_token: Optional[str] = Header(None)):
         pricing = con.execute("SELECT * FROM model_pricing ORDER BY model_id").fetchall()
         return {
             "ok": True,
-            "pricing": [{"model_id": p["model_id"], "credits_per_image": p["credits_per_image"]} for p in pricing]
+            "pricing": [
+                {
+                    "model_id": p["model_id"],
+                    "credits_per_image": p["credits_per_image"],
+                    "cache_policy": result_cache.normalize_policy(p["cache_policy"]),
+                    "is_active": bool(p["is_active"]) if p["is_active"] is not None else True,
+                    "max_images": p["max_images"],
+                }
+                for p in pricing
+            ]
         }
     finally:
         con.close()
@@ -2714,6 +3482,14 @@ async def admin_update_model_pricing(
     if credits_per_image < 1 or credits_per_image > 100000:
         raise HTTPException(400, "Credits per image must be between 1 and 100,000")
     
+    cache_policy = body.get("cache_policy")
+    if cache_policy is not None and cache_policy not in result_cache.POLICIES:
+        raise HTTPException(400, f"cache_policy must be one of: {', '.join(result_cache.POLICIES)}")
+    is_active = None if body.get("is_active") is None else (1 if body["is_active"] else 0)
+    max_images = None if body.get("max_images") is None else int(body["max_images"])
+    if max_images is not None and not 1 <= max_images <= 10:
+        raise HTTPException(400, "max_images must be between 1 and 10")
+    
     con = db_conn()
     try:
         # Check if pricing exists
@@ -2721,49 +3497,170 @@ async def admin_update_model_pricing(
         
         if existing:
             con.execute(
-                "UPDATE model_pricing SET credits_per_image = ?, updated_at_ms = ? WHERE model_id = ?",
-                (credits_per_image, now_ms(), model_id)
+                """UPDATE model_pricing SET credits_per_image = ?, cache_policy = COALESCE(?, cache_policy),
+                   is_active = COALESCE(?, is_active), max_images = COALESCE(?, max_images), updated_at_ms = ?
+                   WHERE model_id = ?""",
+                (credits_per_image, cache_policy, is_active, max_images, now_ms(), model_id)
             )
         else:
             con.execute(
-                "INSERT INTO model_pricing (model_id, credits_per_image, updated_at_ms) VALUES (?, ?, ?)",
-                (model_id, credits_per_image, now_ms())
+                "INSERT INTO model_pricing (model_id, credits_per_image, cache_policy, is_active, max_images, updated_at_ms) VALUES (?, ?, ?, ?, ?, ?)",
+                (model_id, credits_per_image, cache_policy or result_cache.POLICY_OFF,
+                 1 if is_active is None else is_active, max_images or 10, now_ms())
             )
         
         con.commit()
+        model_registry.load(con, now_ms())
+        read_cache.invalidate(CATALOG, "model-pricing")
         log_event("info", "admin_update_model_pricing", f"Model {model_id} pricing updated to {credits_per_image} credits/image")
         
         return {"ok": True, "message": "Pricing updated"}
     finally:
         con.close()
 
-@app.post("/api/admin/api-keys")
-async def admin_create_api_key(
-    body: AdminCreateApiKey,
-    x_admin_token: Optional[str] = Header(None)
-):
-    """Create API key"""
+# Admin: Model routes (which provider serves a model, with traffic weights)
+@app.get("/api/admin/model-routes")
+async def admin_list_model_routes(x_admin_token: Optional[str] = Header(None)):
+    """List models from the registry with their provider routes"""
     _require_admin(x_admin_token)
     
-    # Validate and normalize provider - ensure it's exactly as sent
-    provider = body.provider
-    if not provider:
-        provider = "together"
+    return {
+        "ok": True,
+        "providers": sorted(IMAGE_KEY_PROVIDER.keys()),
+        "loaded_at_ms": model_registry.loaded_at_ms,
+        "models": [m.to_dict() for m in model_registry.all()],
+    }
+
+def _validate_model_route(body: Dict, partial: bool = False) -> Dict:
+    """Validate model route fields from an admin request body."""
+    fields = {}
+    if "provider" in body or not partial:
+        provider = (body.get("provider") or "").strip()
+        if provider not in IMAGE_KEY_PROVIDER:
+            raise HTTPException(400, f"provider must be one of: {', '.join(sorted(IMAGE_KEY_PROVIDER))}")
+        fields["provider"] = provider
+    if "upstream_model" in body or not partial:
+        upstream_model = (body.get("upstream_model") or "").strip()
+        if not upstream_model:
+            raise HTTPException(400, "upstream_model is required")
+        fields["upstream_model"] = upstream_model
+    if "weight" in body:
+        weight = int(body["weight"])
+        if weight < 0 or weight > 1000:
+            raise HTTPException(400, "weight must be between 0 and 1000")
+        fields["weight"] = weight
+    if "is_active" in body:
+        fields["is_active"] = 1 if body["is_active"] else 0
+    if "size_map" in body:
+        size_map = body["size_map"] or {}
+        if not isinstance(size_map, dict) or any(k not in ("landscape", "portrait", "square") for k in size_map):
+            raise HTTPException(400, "size_map keys must be landscape, portrait or square")
+        fields["size_map_json"] = _json_dumps(size_map) if size_map else None
+    return fields
+
+@app.post("/api/admin/model-routes")
+async def admin_create_model_route(request: Request, x_admin_token: Optional[str] = Header(None)):
+    """Add a provider route for a model (creates the model with default pricing if it is new)"""
+    _require_admin(x_admin_token)
     
-    # Normalize provider name (lowercase, trim)
-    provider = provider.strip().lower()
+    body = await request.json()
+    model_id = (body.get("model_id") or "").strip()
+    if not model_id:
+        raise HTTPException(400, "model_id is required")
+    fields = _validate_model_route(body)
     
-    valid_providers = ["voicer", "elevenlabs", "whisk", "voidai", "naga", "together"]
-    if provider not in valid_providers:
-        raise HTTPException(400, f"Invalid provider: '{body.provider}'. Valid providers: {', '.join(valid_providers)}")
+    con = db_conn()
+    try:
+        con.execute(
+            "INSERT OR IGNORE INTO model_pricing (model_id, credits_per_image, updated_at_ms) VALUES (?, ?, ?)",
+            (model_id, int(body.get("credits_per_image", 1)), now_ms())
+        )
+        cur = con.execute(
+            "INSERT INTO model_routes (model_id, provider, upstream_model, weight, is_active, size_map_json, updated_at_ms) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (model_id, fields["provider"], fields["upstream_model"], fields.get("weight", 1),
+             fields.get("is_active", 1), fields.get("size_map_json"), now_ms())
+        )
+        con.commit()
+        model_registry.load(con, now_ms())
+        read_cache.invalidate(CATALOG, "model-pricing")
+        log_event("info", "admin_create_model_route", f"Route {model_id} -> {fields['provider']}/{fields['upstream_model']}")
+        
+        return {"ok": True, "route_id": cur.lastrowid}
+    finally:
+        con.close()
+
+@app.patch("/api/admin/model-routes/{route_id}")
+async def admin_update_model_route(route_id: int, request: Request, x_admin_token: Optional[str] = Header(None)):
+    """Update a model route (weight, enable/disable, provider, upstream model, size map)"""
+    _require_admin(x_admin_token)
     
-    _debug_log(f"[ADMIN] Creating API key - received provider: '{body.provider}', normalized: '{provider}', name: {body.name}")
+    body = await request.json()
+    fields = _validate_model_route(body, partial=True)
+    if not fields:
+        raise HTTPException(400, "Nothing to update")
     
     con = db_conn()
     try:
-        key_id = str(uuid.uuid4())
+        if not con.execute("SELECT id FROM model_routes WHERE id = ?", (route_id,)).fetchone():
+            raise HTTPException(404, "Route not found")
+        fields["updated_at_ms"] = now_ms()
+        con.execute(
+            f"UPDATE model_routes SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+            (*fields.values(), route_id)
+        )
+        con.commit()
+        model_registry.load(con, now_ms())
+        log_event("info", "admin_update_model_route", f"Route {route_id} updated: {', '.join(fields)}")
         
-        # Insert with explicit provider value
+        return {"ok": True, "message": "Route updated"}
+    finally:
+        con.close()
+
+@app.delete("/api/admin/model-routes/{route_id}")
+async def admin_delete_model_route(route_id: int, x_admin_token: Optional[str] = Header(None)):
+    """Delete a model route"""
+    _require_admin(x_admin_token)
+    
+    con = db_conn()
+    try:
+        if not con.execute("SELECT id FROM model_routes WHERE id = ?", (route_id,)).fetchone():
+            raise HTTPException(404, "Route not found")
+        con.execute("DELETE FROM model_routes WHERE id = ?", (route_id,))
+        con.commit()
+        model_registry.load(con, now_ms())
+        log_event("info", "admin_delete_model_route", f"Route {route_id} deleted")
+        
+        return {"ok": True, "message": "Route deleted"}
+    finally:
+        con.close()
+
+@app.post("/api/admin/api-keys")
+async def admin_create_api_key(
+    body: AdminCreateApiKey,
+    x_admin_token: Optional[str] = Header(None)
+):
+    """Create API key"""
+    _require_admin(x_admin_token)
+    
+    # Validate and normalize provider - ensure it's exactly as sent
+    provider = body.provider
+    if not provider:
+        provider = "together"
+    
+    # Normalize provider name (lowercase, trim)
+    provider = provider.strip().lower()
+    
+    valid_providers = ["voicer", "elevenlabs", "whisk", "voidai", "naga", "together"]
+    if provider not in valid_providers:
+        raise HTTPException(400, f"Invalid provider: '{body.provider}'. Valid providers: {', '.join(valid_providers)}")
+    
+    _debug_log(f"[ADMIN] Creating API key - received provider: '{body.provider}', normalized: '{provider}', name: {body.name}")
+    
+    con = db_conn()
+    try:
+        key_id = str(uuid.uuid4())
+        
+        # Insert with explicit provider value
         con.execute("""
             INSERT INTO api_keys (id, name, api_key, provider, hourly_limit, concurrent_limit, created_at_ms)
             VALUES (?, ?, ?, ?, ?, ?, ?)
@@ -2847,11 +3744,42 @@ async def admin_delete_api_key(
         con.commit()
         
         log_event("info", "admin_delete_api_key", f"API key deleted: {key_id}")
+        breakers.reset(key_id=key_id)
         
         return {"ok": True}
     finally:
         con.close()
 
+@app.get("/api/admin/circuit-breakers")
+async def admin_circuit_breakers(x_admin_token: Optional[str] = Header(None)):
+    """Circuit breaker state per provider and key, plus per-provider retry budgets"""
+    _require_admin(x_admin_token)
+    
+    snapshot = breakers.snapshot()
+    con = db_conn()
+    try:
+        names = {r["id"]: r["name"] for r in con.execute("SELECT id, name FROM api_keys").fetchall()}
+    finally:
+        con.close()
+    for provider in snapshot["providers"].values():
+        for key_id, state in provider["keys"].items():
+            state["name"] = names.get(key_id, "env" if key_id == "env" else None)
+    return {"ok": True, **snapshot}
+
+@app.post("/api/admin/circuit-breakers/reset")
+async def admin_reset_circuit_breakers(
+    body: AdminResetBreakers,
+    x_admin_token: Optional[str] = Header(None)
+):
+    """Close breakers by hand (e.g. after rotating a key). Empty body resets all."""
+    _require_admin(x_admin_token)
+    
+    provider = body.provider or None
+    key_id = body.key_id or None
+    breakers.reset(provider=provider, key_id=key_id)
+    log_event("info", "admin_reset_circuit_breakers", f"Circuit breakers reset: provider={provider} key={key_id}")
+    return {"ok": True}
+
 @app.get("/api/admin/logs")
 async def admin_logs(
     page: int = Query(1, ge=1),
@@ -2912,7 +3840,7 @@ async def admin_logs(
                     "message": l["message"],
                     "user_id": l["user_id"],
                     "user_nickname": l["user_nickname"],
-                    "metadata": json.loads(l["metadata_json"]) if l["metadata_json"] else {},
+                    "metadata": _json_loads(l["metadata_json"]) if l["metadata_json"] else {},
                     "created_at_ms": l["created_at_ms"]
                 }
                 for l in logs
@@ -2931,20 +3859,51 @@ VOICER_API_BASE = "https://elevenlabs-unlimited.net/api/v1"
 AUDIO_DIR = Path(DB_PATH).parent / "audio"
 AUDIO_DIR.mkdir(exist_ok=True)
 
-def get_voicer_api_key() -> Optional[tuple]:
-    """Get an active Voicer API key from the pool. Returns (key_id, api_key) or None"""
+def _pick_pool_key(con: sqlite3.Connection, provider: str, claim: bool = True) -> Optional[sqlite3.Row]:
+    """Least recently used active key of a provider whose circuit breaker lets traffic through.
+
+    claim=True takes a half-open key's single probe, so only callers that report the outcome (a
+    submission through _upstream_request) may use it. Polls, cancels, listings and downloads pass
+    claim=False: they prefer closed keys and never hold the probe.
+    """
+    keys = con.execute("""
+        SELECT id, api_key FROM api_keys
+        WHERE is_active = 1 AND provider = ?
+        ORDER BY last_used_ms ASC NULLS FIRST
+    """, (provider,)).fetchall()
+    if not claim:
+        usable = [k for k in keys if breakers.available(provider, k["id"])]
+        closed = [k for k in usable if breakers.state(provider, k["id"]) == STATE_CLOSED]
+        return (closed or usable or [None])[0]
+    for key in keys:
+        if breakers.acquire(provider, key["id"]):
+            return key
+    return None
+
+def _pool_key_id(provider: str, api_key: str) -> str:
+    """api_keys.id for a raw key (breaker bookkeeping for callers that only hold the key), "env" otherwise."""
     con = db_conn()
     try:
-        key = con.execute("""
-            SELECT id, api_key FROM api_keys 
-            WHERE is_active = 1 AND provider = 'voicer'
-            ORDER BY last_used_ms ASC NULLS FIRST
-            LIMIT 1
-        """).fetchone()
+        row = con.execute("SELECT id FROM api_keys WHERE provider = ? AND api_key = ?", (provider, api_key)).fetchone()
+        return row["id"] if row else "env"
+    finally:
+        con.close()
+
+def _provider_circuit_open(provider: str) -> bool:
+    """True when the provider has keys but every one of them is open-circuited.
+    New jobs then queue (and wait for a half-open probe to succeed) instead of failing."""
+    key_ids = [k["id"] for k in _list_provider_api_keys(provider)]
+    return breakers.all_open(provider, key_ids)
+
+def get_voicer_api_key(claim: bool = True) -> Optional[tuple]:
+    """Get an active Voicer API key from the pool. Returns (key_id, api_key) or None.
+    claim=False for calls that record no breaker outcome (see _pick_pool_key)."""
+    con = db_conn()
+    try:
+        key = _pick_pool_key(con, "voicer", claim)
         if key:
             # Update last_used_ms
-            con.execute("UPDATE api_keys SET last_used_ms = ? WHERE id = ?", (now_ms(), key["id"]))
-            con.commit()
+            db_writer.defer("UPDATE api_keys SET last_used_ms = ? WHERE id = ?", (now_ms(), key["id"]))
             return (key["id"], key["api_key"])
         return None
     finally:
@@ -2966,23 +3925,20 @@ def get_elevenlabs_api_key() -> Optional[str]:
     finally:
         con.close()
 
-def get_whisk_api_key() -> Optional[tuple]:
+def get_whisk_api_key(claim: bool = True) -> Optional[tuple]:
     """Get an active Fast Gen API key from the pool (Imagen 4, Flow, Grok). Returns (key_id, api_key) or None.
-    If no key in DB, uses env WHISK_API_KEY (key_id will be 'env')."""
+    If no key in DB, uses env WHISK_API_KEY (key_id will be 'env'). claim: see _pick_pool_key."""
     con = db_conn()
     try:
-        key = con.execute("""
-            SELECT id, api_key FROM api_keys 
-            WHERE is_active = 1 AND provider = 'whisk'
-            ORDER BY last_used_ms ASC NULLS FIRST
-            LIMIT 1
-        """).fetchone()
+        key = _pick_pool_key(con, "whisk", claim)
         if key:
-            con.execute("UPDATE api_keys SET last_used_ms = ? WHERE id = ?", (now_ms(), key["id"]))
-            con.commit()
+            db_writer.defer("UPDATE api_keys SET last_used_ms = ? WHERE id = ?", (now_ms(), key["id"]))
             return (key["id"], key["api_key"])
+        has_db_keys = con.execute(
+            "SELECT 1 FROM api_keys WHERE is_active = 1 AND provider = 'whisk' LIMIT 1"
+        ).fetchone()
         env_key = os.getenv("WHISK_API_KEY")
-        if env_key:
+        if env_key and not has_db_keys and (breakers.acquire("whisk", "env") if claim else breakers.available("whisk", "env")):
             return ("env", env_key)
         return None
     finally:
@@ -2996,17 +3952,11 @@ def get_voidai_api_key() -> Optional[tuple]:
         all_keys = con.execute("SELECT id, provider, is_active FROM api_keys").fetchall()
         _debug_log(f"[VOIDAI] All API keys in DB: {[(str(k['id'])[:8] if k['id'] else 'None', k['provider'], k['is_active']) for k in all_keys]}")
         
-        key = con.execute("""
-            SELECT id, api_key FROM api_keys 
-            WHERE is_active = 1 AND provider = 'voidai'
-            ORDER BY last_used_ms ASC NULLS FIRST
-            LIMIT 1
-        """).fetchone()
+        key = _pick_pool_key(con, "voidai")
         
         if key:
             # Update last_used_ms
-            con.execute("UPDATE api_keys SET last_used_ms = ? WHERE id = ?", (now_ms(), key["id"]))
-            con.commit()
+            db_writer.defer("UPDATE api_keys SET last_used_ms = ? WHERE id = ?", (now_ms(), key["id"]))
             _debug_log(f"[VOIDAI] Found key: {key['id'][:8]}...")
             return (key["id"], key["api_key"])
         else:
@@ -3022,15 +3972,9 @@ def get_naga_api_key() -> Optional[tuple]:
     """Get an active Naga API key. Returns (key_id, api_key) or None."""
     con = db_conn()
     try:
-        key = con.execute("""
-            SELECT id, api_key FROM api_keys
-            WHERE is_active = 1 AND provider = 'naga'
-            ORDER BY last_used_ms ASC NULLS FIRST
-            LIMIT 1
-        """).fetchone()
+        key = _pick_pool_key(con, "naga")
         if key:
-            con.execute("UPDATE api_keys SET last_used_ms = ? WHERE id = ?", (now_ms(), key["id"]))
-            con.commit()
+            db_writer.defer("UPDATE api_keys SET last_used_ms = ? WHERE id = ?", (now_ms(), key["id"]))
             return (key["id"], key["api_key"])
         return None
     finally:
@@ -3066,6 +4010,13 @@ def _get_elevenlabs_headers():
         headers["xi-api-key"] = api_key
     return headers
 
+class VoiceLibraryError(Exception):
+    """ElevenLabs answered a voice list request with an error status (not cached)."""
+
+def _voice_library_key(endpoint: str, api_key: str, params: Dict) -> str:
+    # The key is part of the cache key: /voices lists that account's own (cloned) voices
+    return _secret_digest(f"{endpoint}|{api_key}|{_json_dumps(sorted(params.items()))}")
+
 @app.get("/api/elevenlabs/voices")
 async def get_elevenlabs_voices(
     page_size: int = Query(100, ge=1, le=100),
@@ -3077,7 +4028,7 @@ async def get_elevenlabs_voices(
 ):
     """Get voices from official ElevenLabs /voices API (premade/cloned)"""
     tok = _extract_token(authorization, token)
-    require_user(tok)
+    await require_user(tok)
     
     api_key = get_elevenlabs_api_key()
     if not api_key:
@@ -3090,15 +4041,16 @@ async def get_elevenlabs_voices(
         if category:
             params["category"] = category
         
-        async with httpx.AsyncClient(timeout=30) as client:
-            resp = await client.get(
-                f"{ELEVENLABS_API_BASE}/voices",
-                params=params,
-                headers=_get_elevenlabs_headers()
-            )
+        async def fetch() -> Dict:
+            async with httpx.AsyncClient(timeout=30) as client:
+                resp = await client.get(
+                    f"{ELEVENLABS_API_BASE}/voices",
+                    params=params,
+                    headers=_get_elevenlabs_headers()
+                )
             if resp.status_code != 200:
                 log_event("warning", "elevenlabs_voices_error", f"Status {resp.status_code}")
-                return {"ok": False, "error": f"ElevenLabs API error: {resp.status_code}"}
+                raise VoiceLibraryError(f"ElevenLabs API error: {resp.status_code}")
             
             data = resp.json()
             voices_raw = data.get("voices", [])
@@ -3121,8 +4073,12 @@ async def get_elevenlabs_voices(
                     "labels": labels
                 }
                 voices.append(voice_data)
-            
-            return {"ok": True, "voices": voices}
+            return {"voices": voices}
+        
+        result = await read_cache.get(VOICE_LIBRARY, _voice_library_key("voices", api_key, params), fetch)
+        return {"ok": True, **result}
+    except VoiceLibraryError as e:
+        return {"ok": False, "error": str(e)}
     except Exception as e:
         log_event("error", "elevenlabs_voices_error", str(e))
         return {"ok": False, "error": str(e)}
@@ -3145,7 +4101,7 @@ async def get_elevenlabs_shared_voices(
 ):
     """Get shared voices from ElevenLabs Voice Library with server-side filtering"""
     tok = _extract_token(authorization, token)
-    require_user(tok)
+    await require_user(tok)
     
     api_key = get_elevenlabs_api_key()
     if not api_key:
@@ -3177,15 +4133,16 @@ async def get_elevenlabs_shared_voices(
         if sort:
             params["sort"] = sort
         
-        async with httpx.AsyncClient(timeout=30) as client:
-            resp = await client.get(
-                f"{ELEVENLABS_API_BASE}/shared-voices",
-                params=params,
-                headers=_get_elevenlabs_headers()
-            )
+        async def fetch() -> Dict:
+            async with httpx.AsyncClient(timeout=30) as client:
+                resp = await client.get(
+                    f"{ELEVENLABS_API_BASE}/shared-voices",
+                    params=params,
+                    headers=_get_elevenlabs_headers()
+                )
             if resp.status_code != 200:
                 log_event("warning", "elevenlabs_shared_error", f"Status {resp.status_code}: {resp.text}")
-                return {"ok": False, "error": f"ElevenLabs API error: {resp.status_code}"}
+                raise VoiceLibraryError(f"ElevenLabs API error: {resp.status_code}")
             
             data = resp.json()
             voices_raw = data.get("voices", [])
@@ -3212,20 +4169,17 @@ async def get_elevenlabs_shared_voices(
                 voices.append(voice_data)
             
             log_event("info", "elevenlabs_shared", f"Page {page}: {len(voices)} voices, has_more={has_more}")
-            return {"ok": True, "voices": voices, "has_more": has_more, "page": page}
+            return {"voices": voices, "has_more": has_more}
+        
+        result = await read_cache.get(VOICE_LIBRARY, _voice_library_key("shared-voices", api_key, params), fetch)
+        return {"ok": True, **result, "page": page}
+    except VoiceLibraryError as e:
+        return {"ok": False, "error": str(e)}
     except Exception as e:
         log_event("error", "elevenlabs_shared_error", str(e))
         return {"ok": False, "error": str(e)}
 
-@app.get("/api/elevenlabs/filters")
-async def get_elevenlabs_filters(
-    authorization: Optional[str] = Header(None),
-    token: Optional[str] = Query(None)
-):
-    """Get available filter options for ElevenLabs voices"""
-    tok = _extract_token(authorization, token)
-    require_user(tok)
-    
+def _build_elevenlabs_filters_payload() -> Dict:
     return {
         "ok": True,
         "filters": {
@@ -3239,6 +4193,18 @@ async def get_elevenlabs_filters(
         }
     }
 
+@app.get("/api/elevenlabs/filters")
+async def get_elevenlabs_filters(
+    request: Request,
+    authorization: Optional[str] = Header(None),
+    token: Optional[str] = Query(None)
+):
+    """Get available filter options for ElevenLabs voices"""
+    tok = _extract_token(authorization, token)
+    await require_user(tok)
+    
+    return await _catalog_response(request, "elevenlabs-filters", _build_elevenlabs_filters_payload, "private, max-age=3600")
+
 # Legacy endpoint for backward compatibility - redirects to new API
 @app.get("/api/voices/library")
 async def get_voice_library(
@@ -3293,7 +4259,8 @@ async def get_voice_library(
 @app.post("/api/v1/synthesize")
 async def api_v1_synthesize(
     request: Request,
-    x_api_key: Optional[str] = Header(None)
+    x_api_key: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """
     Public API endpoint for voice synthesis using user API keys
@@ -3314,7 +4281,8 @@ async def api_v1_synthesize(
             "style": 0.0,
             "use_speaker_boost": true
         },
-        "speed": 1.0  // Optional, 0.25-4.0
+        "speed": 1.0,  // Optional, 0.25-4.0
+        "long_form": false  // Optional: split long text into segments rendered in parallel, stitched into one MP3
     }
     
     Response:
@@ -3326,6 +4294,15 @@ async def api_v1_synthesize(
         "message": "Task started" or "Task queued"
     }
     
+    Completion: poll /api/v1/status/{task_id}, or register a webhook for the key
+    (PUT /api/user/api-keys/{key_id}/webhook) and get a signed task.completed / task.failed /
+    task.cancelled POST instead.
+    
+    Retries: send an Idempotency-Key header (any unique string, e.g. a UUID, up to 255 chars).
+    Repeating the request with the same key and API key within IDEMPOTENCY_TTL_HOURS returns the original
+    response (header Idempotent-Replayed: true) without creating or charging another task; if the
+    original is still being processed, the repeat waits for it.
+    
     Rate limits:
     - Hourly limit: 100 requests per hour (configurable per key)
     - Concurrent slots: Based on user's concurrent_slots setting
@@ -3334,12 +4311,20 @@ async def api_v1_synthesize(
     Error codes:
     - 401: Invalid or missing API key
     - 402: Insufficient credits
+    - 409: A request with this Idempotency-Key is still in progress (retry after Retry-After)
+    - 422: Idempotency-Key reused with a different request body
     - 429: Rate limit exceeded
-    - 503: Service unavailable
+    - 503: Service unavailable, or at capacity (retry after the Retry-After header's seconds)
     """
     if not x_api_key:
         raise HTTPException(401, "API key required. Provide X-API-Key header.")
-    
+    if not idempotency_key:
+        return await _api_v1_synthesize(request, x_api_key)
+    _, key_record = await require_api_key(x_api_key)
+    return await _idempotent(request, idempotency_key, f"key:{key_record['id']}", "v1.synthesize",
+                             lambda: _api_v1_synthesize(request, x_api_key))
+
+async def _api_v1_synthesize(request: Request, x_api_key: str):
     # Validate API key and get user
     con = db_conn()
     try:
@@ -3400,21 +4385,52 @@ async def api_v1_synthesize(
         ).fetchone()["cnt"]
         
         should_queue = active_processing >= concurrent_slots
+        
+        # Load shedding: 503 + Retry-After, or defer to the queue when Voicer capacity is taken
+        if _admission_check(con, user, "voice", "voicer").action == admission.DEFER:
+            should_queue = True
     finally:
         con.close()
     
-    # Get API key for Voicer
-    key_data = get_voicer_api_key()
-    if not key_data:
+    long_form = bool(body.get("long_form"))
+    
+    # Result cache lookup happens before any upstream call (and before a key is picked)
+    request_hash = _voice_request_hash(body, text, long_form)
+    cached = None
+    if request_hash:
+        con = db_conn()
+        try:
+            cached = _find_cached_job(con, request_hash, user["id"])
+        finally:
+            con.close()
+    
+    # Get API key for Voicer; if every key is open-circuited the job waits in the queue
+    key_data = get_voicer_api_key() if not cached else None
+    if key_data:
+        api_key_id, voicer_key = key_data
+    elif cached or _provider_circuit_open("voicer"):
+        api_key_id, voicer_key = None, None
+        should_queue = should_queue or not cached
+    else:
         raise HTTPException(503, "Service temporarily unavailable")
     
-    api_key_id, voicer_key = key_data
+    # With a webhook on the key the job is watched to completion even if the client never polls
+    webhook = bool(key_record["webhook_url"])
     
     # Generate task ID and prepare
-    if should_queue:
+    if cached:
+        task_id = _generate_task_id()
+        task_status = cached["status"]
+        result_msg = "Served from result cache"
+    elif should_queue:
         task_id = _generate_task_id()  # FFS_XXXXXXX format
         task_status = "queued"
         result_msg = "Task queued, will start when slot available"
+    elif long_form:
+        # Segments are submitted by the long-form renderer once the job is saved
+        task_id = _generate_task_id()
+        task_status = "processing"
+        result_msg = "Long-form task started"
     else:
         # Create CLEAN payload - only valid ElevenLabs API fields!
         voicer_payload = {
@@ -3431,19 +4447,27 @@ async def api_v1_synthesize(
                 if k in ["stability", "similarity_boost", "style", "use_speaker_boost", "speed"]
             }
         
-        async with httpx.AsyncClient(timeout=60) as client:
-            response = await client.post(
-                f"{VOICER_API_BASE}/voice/synthesize",
-                headers={
-                    "Authorization": f"Bearer {voicer_key}",
-                    "Content-Type": "application/json"
-                },
-                json=voicer_payload
-            )
-            
-            if response.status_code != 200:
-                raise HTTPException(response.status_code, f"Voicer API error: {response.text}")
-            
+        try:
+            async with httpx.AsyncClient(timeout=60) as client:
+                response = await _upstream_request(
+                    client, "POST", f"{VOICER_API_BASE}/voice/synthesize", "voicer", api_key_id,
+                    headers={
+                        "Authorization": f"Bearer {voicer_key}",
+                        "Content-Type": "application/json"
+                    },
+                    json=voicer_payload
+                )
+        except httpx.TransportError:
+            response = None
+        
+        if response is None or is_retryable_status(response.status_code):
+            # Voicer outage survived the retries: queue instead of failing
+            task_id = _generate_task_id()
+            task_status = "queued"
+            result_msg = "Provider temporarily unavailable, task queued"
+        elif response.status_code != 200:
+            raise HTTPException(response.status_code, f"Voicer API error: {response.text}")
+        else:
             result = response.json()
             task_id = result.get("task_id")
             task_status = "processing"
@@ -3459,36 +4483,55 @@ async def api_v1_synthesize(
             "UPDATE users SET credits_used = credits_used + ? WHERE id = ?",
             (char_count, user["id"])
         )
+        _user_changed(user["id"])
         
         expires_at = now_ms() + (12 * 60 * 60 * 1000)
-        con.execute("""
-            INSERT INTO jobs (id, user_id, api_key_id, status, prompt, model, width, height, 
-                             credits_charged, char_count, created_at_ms, expires_at_ms, metadata_json)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            task_id,
-            user["id"],
-            api_key_id,
-            task_status,
-            text[:500],
-            body.get("model_id", "eleven_multilingual_v2"),
-            char_count,
-            0,
-            char_count,
-            char_count,
-            now_ms(),
-            expires_at,
-            _json_dumps({
+        if cached:
+            _clone_cached_job(con, cached, task_id, user["id"], api_key_id, char_count, request_hash,
+                              {"api_key_name": key_record["name"], "via_api": True, "webhook": webhook or None},
+                              user_api_key_id=key_record["id"])
+            result_cache.stats.record_hit("voice", body.get("model_id", "eleven_multilingual_v2"), cached["status"] != "completed", char_count)
+        else:
+            if request_hash:
+                result_cache.stats.record_miss("voice", body.get("model_id", "eleven_multilingual_v2"))
+            metadata = {
                 "type": "voice",
                 "voice_id": voice_id,
                 "model_id": body.get("model_id", "eleven_multilingual_v2"),
                 "full_text_length": char_count,
                 "voice_settings": body.get("voice_settings", {}),
-                "full_text": text if task_status == "queued" else None,
+                "full_text": text if task_status == "queued" or long_form else None,
+                "long_form": long_form or None,
+                "voicer_task_id": task_id if task_status == "processing" and not long_form else None,
                 "api_key_name": key_record["name"],
-                "via_api": True
-            })
-        ))
+                "via_api": True,
+                "webhook": webhook or None
+            }
+            con.execute("""
+                INSERT INTO jobs (id, user_id, api_key_id, status, prompt, model, width, height, 
+                                 credits_charged, char_count, created_at_ms, expires_at_ms, metadata_json, request_hash, worker_id,
+                                 user_api_key_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                task_id,
+                user["id"],
+                api_key_id,
+                task_status,
+                text[:500],
+                body.get("model_id", "eleven_multilingual_v2"),
+                char_count,
+                0,
+                char_count,
+                char_count,
+                now_ms(),
+                expires_at,
+                _json_dumps(metadata),
+                request_hash,
+                WORKER_ID,
+                key_record["id"]
+            ))
+            if task_status == "processing":
+                _watch_upstream(con, task_id, metadata)
         
         # Update API key stats
         con.execute(
@@ -3503,13 +4546,164 @@ async def api_v1_synthesize(
     finally:
         con.close()
     
+    if long_form and task_status == "processing" and not cached:
+        _enqueue_work("voice.long_form", {"task_id": task_id}, task_id)
+    elif webhook and task_status == "processing":
+        _wake_work()
+    
     return {
         "ok": True,
         "task_id": task_id,
         "status": task_status,
         "credits_charged": char_count,
-        "message": result_msg
+        "message": result_msg,
+        "cached": bool(cached)
+    }
+
+_api_key_touched: Dict[str, float] = {}
+
+def _touch_user_api_key(key_id: str, every: float = 60.0):
+    """Record last_used_ms at most once a minute per key (status polling would write on every call)."""
+    now = time.monotonic()
+    if now - _api_key_touched.get(key_id, -every) < every:
+        return
+    _api_key_touched[key_id] = now
+    db_writer.defer("UPDATE user_api_keys SET last_used_ms = ? WHERE id = ?", (now_ms(), key_id))
+
+def _v1_task_statuses(user_id: str, ids: List[str]) -> List[Dict]:
+    """Status payloads for the user's jobs among ids, read from the database only (workers and the
+    scheduler keep it current); queue positions come from one more query when any job is queued."""
+    con = db_conn()
+    try:
+        placeholders = ",".join("?" * len(ids))
+        jobs = con.execute(
+            f"""SELECT id, kind, status, error, metadata_json, created_at_ms, completed_at_ms
+                FROM jobs WHERE id IN ({placeholders}) AND user_id = ?""", [*ids, user_id]
+        ).fetchall()
+        queued = {}
+        if any(j["status"] == "queued" for j in jobs):
+            for kind in {j["kind"] for j in jobs if j["status"] == "queued"}:
+                order = con.execute(
+                    "SELECT id FROM jobs WHERE user_id = ? AND kind = ? AND status = 'queued' ORDER BY created_at_ms ASC",
+                    (user_id, kind)
+                ).fetchall()
+                queued.update((r["id"], n + 1) for n, r in enumerate(order))
+    finally:
+        con.close()
+
+    tasks = []
+    for job in jobs:
+        status = job["status"]
+        task = {"id": job["id"], "type": job["kind"] or "voice", "status": status,
+                "progress": 100 if status == "completed" else 0,
+                "created_at_ms": job["created_at_ms"], "completed_at_ms": job["completed_at_ms"]}
+        if status == "queued" and job["id"] in queued:
+            task["queue_position"] = queued[job["id"]]
+        elif status == "processing":
+            metadata = _json_loads(job["metadata_json"] or "{}")
+            if metadata.get("long_form"):
+                progress = _long_form_progress(metadata)
+                task.update({k: progress[k] for k in ("progress", "long_form", "segments_total", "segments_done")})
+        elif status in ("failed", "cancelled"):
+            task["error"] = job["error"]
+        elif status == "completed" and task["type"] == "voice":
+            task["download_url"] = f"/api/v1/download/{job['id']}"
+        tasks.append(task)
+    order = {task_id: n for n, task_id in enumerate(ids)}
+    return sorted(tasks, key=lambda t: order[t["id"]])
+
+_v1_voice_polled: Dict[str, float] = {}
+
+async def _v1_poll_upstream(user_id: str, tasks: List[Dict]):
+    """In "all" mode nothing else polls Voicer for API-only clients: check processing voice jobs
+    here, at most once per WORK_POLL_SECONDS each (_poll_voicer_job records final states)."""
+    now = time.monotonic()
+    due = [t["id"] for t in tasks if t["type"] == "voice" and t["status"] == "processing" and not t.get("long_form")
+           and now - _v1_voice_polled.get(t["id"], -WORK_POLL_SECONDS) >= WORK_POLL_SECONDS]
+    if not due:
+        return
+    for task_id in due:
+        _v1_voice_polled[task_id] = now
+    con = db_conn()
+    try:
+        rows = con.execute(
+            f"SELECT id, metadata_json FROM jobs WHERE id IN ({','.join('?' * len(due))}) AND user_id = ? AND status = 'processing'",
+            [*due, user_id]
+        ).fetchall()
+    finally:
+        con.close()
+    polls = [_poll_voicer_job(r["id"], _json_loads(r["metadata_json"] or "{}")) for r in rows]
+    for result in await asyncio.gather(*polls, return_exceptions=True):
+        if isinstance(result, dict) and result.get("status") in _FINISHED_JOB_STATUSES:
+            status_watcher.poke()
+    for task_id in [k for k, t in _v1_voice_polled.items() if now - t > 10 * WORK_POLL_SECONDS]:
+        del _v1_voice_polled[task_id]
+
+@app.get("/api/v1/status")
+async def api_v1_bulk_status(
+    request: Request,
+    ids: str = Query(..., description="Comma-separated task ids"),
+    wait: float = Query(0, ge=0),
+    x_api_key: Optional[str] = Header(None)
+):
+    """
+    Status of several tasks in one call, optionally as a long poll
+    
+    Authentication: X-API-Key header
+    
+    Query parameters:
+    - ids: comma-separated task ids (up to STATUS_BULK_MAX_IDS)
+    - wait: seconds (up to STATUS_WAIT_MAX_SECONDS) to hold the request until any listed task
+      changes state. Send the previous response's ETag as If-None-Match: if something changed
+      since then it returns at once, otherwise it waits for the next change. Without wait, a
+      matching If-None-Match gets 304.
+    
+    Response:
+    {
+        "ok": true,
+        "tasks": [{"id": "...", "type": "voice" | "image", "status": "...", "progress": 0-100,
+                   "queue_position": N, "error": "...", "download_url": "..."}],
+        "missing": ["unknown-or-foreign-id"],
+        "version": "..."   (also the ETag)
     }
+    It returns at once when every listed task has finished.
+    """
+    if not x_api_key:
+        raise HTTPException(401, "API key required")
+    user, key_record = await require_api_key(x_api_key)
+    
+    task_ids = list(dict.fromkeys(i.strip() for i in ids.split(",") if i.strip()))
+    if not task_ids:
+        raise HTTPException(400, "ids is required")
+    if len(task_ids) > STATUS_BULK_MAX_IDS:
+        raise HTTPException(400, f"At most {STATUS_BULK_MAX_IDS} ids per request")
+    _touch_user_api_key(key_record["id"])
+    
+    known = request.headers.get("if-none-match")
+    deadline = time.monotonic() + min(wait, STATUS_WAIT_MAX_SECONDS)
+    while True:
+        tasks = _v1_task_statuses(user["id"], task_ids)
+        body = {"ok": True, "tasks": tasks, "missing": [i for i in task_ids if i not in {t["id"] for t in tasks}]}
+        version = hashlib.sha1(_json_dumps(body).encode()).hexdigest()[:16]
+        remaining = deadline - time.monotonic()
+        unchanged = etag_matches(known, f'"{version}"')
+        finished = all(t["status"] in _FINISHED_JOB_STATUSES for t in tasks)
+        if remaining <= 0 or finished or (known and not unchanged):
+            break
+        if not UPSTREAM_IN_WORKER:
+            await _v1_poll_upstream(user["id"], tasks)
+        # States seen by this response; wake on the first change (ours or another process's)
+        baseline = {t["id"]: t["status"] for t in tasks}
+        if not UPSTREAM_IN_WORKER and any(t["type"] == "voice" and t["status"] == "processing" for t in tasks):
+            remaining = min(remaining, WORK_POLL_SECONDS)  # Come back to poll Voicer again
+        await status_watcher.wait(list(baseline), baseline, remaining)
+        known = known or f'"{version}"'
+    
+    body["version"] = version
+    headers = {"ETag": f'"{version}"', "Cache-Control": "private, no-cache"}
+    if not wait and unchanged:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(body, headers=headers)
 
 @app.get("/api/v1/status/{task_id}")
 async def api_v1_status(
@@ -3557,12 +4751,7 @@ async def api_v1_status(
         if not job:
             raise HTTPException(404, "Task not found or access denied")
         
-        # Update API key last used
-        con.execute(
-            "UPDATE user_api_keys SET last_used_ms = ? WHERE id = ?",
-            (now_ms(), key_record["id"])
-        )
-        con.commit()
+        _touch_user_api_key(key_record["id"])
     finally:
         con.close()
     
@@ -3588,46 +4777,11 @@ async def api_v1_status(
                     (user["id"],)
                 ).fetchone()["cnt"]
                 
-                if active_processing < concurrent_slots:
-                    # Try to start it (same logic as voice_status)
-                    metadata = json.loads(job["metadata_json"] or "{}")
-                    full_text = metadata.get("full_text")
-                    
-                    if full_text:
-                        key_data = get_voicer_api_key()
-                        if key_data:
-                            api_key_id, voicer_key = key_data
-                            
-                            try:
-                                async with httpx.AsyncClient(timeout=60) as client:
-                                    response = await client.post(
-                                        f"{VOICER_API_BASE}/voice/synthesize",
-                                        headers={"Authorization": f"Bearer {voicer_key}", "Content-Type": "application/json"},
-                                        json={
-                                            "text": full_text,
-                                            "voice_id": metadata.get("voice_id"),
-                                            "model_id": job["model"] or "eleven_multilingual_v2",
-                                            "voice_settings": metadata.get("voice_settings", {})
-                                        }
-                                    )
-                                    
-                                    if response.status_code == 200:
-                                        voicer_result = response.json()
-                                        voicer_task_id = voicer_result.get("task_id")
-                                        
-                                        metadata["voicer_task_id"] = voicer_task_id
-                                        metadata["full_text"] = None
-                                        
-                                        con.execute("""
-                                            UPDATE jobs 
-                                            SET status = 'processing', started_at_ms = ?, metadata_json = ?
-                                            WHERE id = ?
-                                        """, (now_ms(), _json_dumps(metadata), task_id))
-                                        con.commit()
-                                        
-                                        return {"status": "processing", "progress": 0}
-                            except Exception as e:
-                                _debug_log(f"[API] Error starting queued task: {e}")
+                # Try to start it (same logic as voice_status); with the scheduler on it starts on its own
+                if not SCHEDULER_ENABLED and active_processing < concurrent_slots and _admission_can_start(con, user, "voice", "voicer"):
+                    started = await _start_queued_voice_job(task_id)
+                    if started:
+                        return started
             
             # Still queued; position among voice queued only
             queue_position = con.execute(
@@ -3639,18 +4793,21 @@ async def api_v1_status(
         finally:
             con.close()
     
-    # If processing, check Voicer API
+    # If processing, check Voicer API (in split mode the worker polls it and updates the job)
     if job["status"] == "processing":
-        metadata = json.loads(job["metadata_json"] or "{}")
+        metadata = _json_loads(job["metadata_json"] or "{}")
+        if metadata.get("long_form"):
+            return _long_form_progress(metadata)
         voicer_task_id = metadata.get("voicer_task_id") or task_id
         
-        key_data = get_voicer_api_key()
+        key_data = None if UPSTREAM_IN_WORKER else get_voicer_api_key(claim=False)
         if key_data:
-            _, voicer_key = key_data
+            status_key_id, voicer_key = key_data
             try:
                 async with httpx.AsyncClient(timeout=30) as client:
-                    response = await client.get(
-                        f"{VOICER_API_BASE}/voice/status/{voicer_task_id}",
+                    response = await _upstream_request(
+                        client, "GET", f"{VOICER_API_BASE}/voice/status/{voicer_task_id}", "voicer", status_key_id,
+                        max_attempts=1,
                         headers={"Authorization": f"Bearer {voicer_key}"}
                     )
                     
@@ -3720,11 +4877,10 @@ async def api_v1_list_tasks(
         jobs = con.execute(query, params).fetchall()
         
         # Update API key last used
-        con.execute(
+        db_writer.defer(
             "UPDATE user_api_keys SET last_used_ms = ? WHERE id = ?",
             (now_ms(), key_record["id"])
         )
-        con.commit()
         
         return {
             "ok": True,
@@ -3787,15 +4943,14 @@ async def api_v1_download(
             raise HTTPException(404, "Audio file not available")
         
         # Update API key stats
-        con.execute(
+        db_writer.defer(
             "UPDATE user_api_keys SET last_used_ms = ? WHERE id = ?",
             (now_ms(), key_record["id"])
         )
-        con.commit()
         
         # Return based on format
         if format == "json":
-            metadata = json.loads(job["metadata_json"] or "{}")
+            metadata = _json_loads(job["metadata_json"] or "{}")
             return {
                 "ok": True,
                 "task_id": task_id,
@@ -3863,10 +5018,10 @@ async def api_v1_cancel_task(
         
         # Try to cancel in external API if processing
         if job["status"] == "processing":
-            metadata = json.loads(job["metadata_json"] or "{}")
+            metadata = _json_loads(job["metadata_json"] or "{}")
             voicer_task_id = metadata.get("voicer_task_id") or task_id
             
-            key_data = get_voicer_api_key()
+            key_data = get_voicer_api_key(claim=False)
             if key_data:
                 _, voicer_key = key_data
                 try:
@@ -3885,6 +5040,7 @@ async def api_v1_cancel_task(
                 "UPDATE users SET credits_used = credits_used - ? WHERE id = ?",
                 (credits_to_refund, user["id"])
             )
+            _user_changed(user["id"])
         
         # Update job status
         con.execute(
@@ -3944,7 +5100,7 @@ async def api_v1_list_voices(
             raise HTTPException(401, "Invalid API key")
         
         # Get voices from Voicer API
-        key_data = get_voicer_api_key()
+        key_data = get_voicer_api_key(claim=False)
         if not key_data:
             raise HTTPException(503, "Service unavailable")
         
@@ -3963,11 +5119,10 @@ async def api_v1_list_voices(
             result = response.json()
         
         # Update API key stats
-        con.execute(
+        db_writer.defer(
             "UPDATE user_api_keys SET last_used_ms = ? WHERE id = ?",
             (now_ms(), key_record["id"])
         )
-        con.commit()
         
         return result
     finally:
@@ -4020,11 +5175,10 @@ async def api_v1_get_balance(
         total_credits = sum(p["credits_remaining"] for p in packages)
         
         # Update API key stats
-        con.execute(
+        db_writer.defer(
             "UPDATE user_api_keys SET last_used_ms = ? WHERE id = ?",
             (now_ms(), key_record["id"])
         )
-        con.commit()
         
         return {
             "ok": True,
@@ -4043,41 +5197,277 @@ async def api_v1_get_balance(
     finally:
         con.close()
 
-@app.post("/api/voice/synthesize")
-async def voice_synthesize(
-    request: Request,
+# =============================================================================
+# Completion webhooks (per user API key; see server/webhooks.py)
+# =============================================================================
+def _webhook_task_data(row: Dict) -> Optional[Dict]:
+    """Event data for a delivery: the task as GET /api/v1/status reports it."""
+    tasks = _v1_task_statuses(row["user_id"], [row["task_id"]])
+    return tasks[0] if tasks else None
+
+webhook_dispatcher = WebhookDispatcher(
+    storage, _webhook_task_data, max_attempts=WEBHOOK_MAX_ATTEMPTS, base_delay=WEBHOOK_BACKOFF_BASE_SECONDS,
+    max_delay=WEBHOOK_BACKOFF_MAX_SECONDS, timeout=WEBHOOK_TIMEOUT_SECONDS, concurrency=WEBHOOK_CONCURRENCY,
+    poll_interval=WEBHOOK_POLL_SECONDS, lease_seconds=max(WORK_LEASE_SECONDS, WEBHOOK_TIMEOUT_SECONDS * 3),
+    allow_private=WEBHOOK_ALLOW_PRIVATE, on_event=log_event
+)
+
+def _owned_api_key(con: sqlite3.Connection, key_id: str, user_id: str) -> sqlite3.Row:
+    row = con.execute("SELECT * FROM user_api_keys WHERE id = ? AND user_id = ?", (key_id, user_id)).fetchone()
+    if not row:
+        raise HTTPException(404, "API key not found")
+    return row
+
+def _delivery_id(value: str) -> int:
+    try:
+        return int(value[4:] if value.startswith("evt_") else value)
+    except ValueError:
+        raise HTTPException(404, "Delivery not found")
+
+async def _webhook_delivery_log(api_key_id: str, status: Optional[str], limit: int, before: Optional[str]) -> Dict:
+    """Newest first; pass the last id as `before` for the next page."""
+    if status and status not in (webhooks.PENDING, webhooks.SENDING, webhooks.DELIVERED, webhooks.DEAD):
+        raise HTTPException(400, "status must be pending, sending, delivered or dead")
+    sql = "SELECT * FROM webhook_deliveries WHERE api_key_id = ?"
+    params: List[Any] = [api_key_id]
+    if status:
+        sql += " AND status = ?"
+        params.append(status)
+    if before:
+        sql += " AND id < ?"
+        params.append(_delivery_id(before))
+    rows = await storage.fetchall(sql + " ORDER BY id DESC LIMIT ?", [*params, limit])
+    deliveries = [webhooks.delivery_view(r) for r in rows]
+    return {"ok": True, "deliveries": deliveries, "next_before": deliveries[-1]["id"] if len(rows) == limit else None}
+
+async def _retry_webhook_delivery(api_key_id: str, delivery_id: str) -> Dict:
+    if not await webhook_dispatcher.retry(_delivery_id(delivery_id), api_key_id):
+        raise HTTPException(409, "Only dead or delivered events can be sent again")
+    return {"ok": True, "id": delivery_id, "status": webhooks.PENDING}
+
+@app.put("/api/user/api-keys/{key_id}/webhook")
+async def set_user_api_key_webhook(
+    key_id: str,
+    url: str = Body(..., embed=True),
+    rotate_secret: bool = Body(False, embed=True),
     authorization: Optional[str] = Header(None),
     token: Optional[str] = Query(None)
 ):
-    """Proxy voice synthesis to Voicer API (for web interface) - STABLE VERSION"""
+    """
+    Set the URL that gets task.completed / task.failed / task.cancelled events for jobs submitted
+    with this key. Each POST is signed: X-Webhook-Signature: t=<unix>,v1=<hex HMAC-SHA256 of
+    "<t>.<body>" with the secret>. The secret is returned when first created or rotated only.
+    """
+    tok = _extract_token(authorization, token)
+    user = await require_user(tok)
     try:
-        tok = _extract_token(authorization, token)
-        user = require_user(tok)
+        url = await asyncio.to_thread(webhooks.check_url, url, WEBHOOK_ALLOW_PRIVATE)
+    except WebhookError as e:
+        raise HTTPException(400, str(e))
     
-        key_data = get_voicer_api_key()
-        if not key_data:
-            _debug_log("[SYNTH] ❌ No Voicer API keys configured")
-            raise HTTPException(503, "No Voicer API keys configured")
-        
-        api_key_id, voicer_key = key_data
-        
-        body = await request.json()
-        
-        # Calculate character count for credits
-        text = body.get("text", "")
-        char_count = len(text)
-        
-        _debug_log(f"[SYNTH] 📝 User {user['id']} requesting synthesis: {char_count} chars")
-        
-        # Check credits and slots in ONE database transaction
-        con = db_conn()
+    con = db_conn()
+    try:
+        row = _owned_api_key(con, key_id, user["id"])
+        secret = None if row["webhook_secret"] and not rotate_secret else webhooks.new_secret()
+        con.execute(
+            "UPDATE user_api_keys SET webhook_url = ?, webhook_secret = COALESCE(?, webhook_secret) WHERE id = ?",
+            (url, secret, key_id)
+        )
+        con.commit()
+    finally:
+        con.close()
+    read_cache.invalidate(USER_API_KEYS, _secret_digest(row["api_key"]))
+    log_event("info", "webhook_set", f"Webhook for API key {row['name']} set to {url}", user_id=user["id"])
+    return {"ok": True, "webhook": {"url": url, "secret": secret}}
+
+@app.delete("/api/user/api-keys/{key_id}/webhook")
+async def delete_user_api_key_webhook(
+    key_id: str,
+    authorization: Optional[str] = Header(None),
+    token: Optional[str] = Query(None)
+):
+    """Stop sending events for this key; undelivered ones go dead with "Webhook removed"."""
+    tok = _extract_token(authorization, token)
+    user = await require_user(tok)
+    
+    con = db_conn()
+    try:
+        row = _owned_api_key(con, key_id, user["id"])
+        con.execute("UPDATE user_api_keys SET webhook_url = NULL, webhook_secret = NULL WHERE id = ?", (key_id,))
+        con.commit()
+    finally:
+        con.close()
+    read_cache.invalidate(USER_API_KEYS, _secret_digest(row["api_key"]))
+    return {"ok": True}
+
+@app.post("/api/user/api-keys/{key_id}/webhook/test")
+async def test_user_api_key_webhook(
+    key_id: str,
+    authorization: Optional[str] = Header(None),
+    token: Optional[str] = Query(None)
+):
+    """Send a signed "ping" event; its outcome shows up in the delivery log."""
+    tok = _extract_token(authorization, token)
+    user = await require_user(tok)
+    
+    con = db_conn()
+    try:
+        row = _owned_api_key(con, key_id, user["id"])
+    finally:
+        con.close()
+    if not row["webhook_url"]:
+        raise HTTPException(400, "No webhook set for this API key")
+    delivery_id = await webhook_dispatcher.ping(key_id, user["id"])
+    return {"ok": True, "id": f"evt_{delivery_id}"}
+
+@app.get("/api/user/api-keys/{key_id}/webhook/deliveries")
+async def user_api_key_webhook_deliveries(
+    key_id: str,
+    status: Optional[str] = Query(None),
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = Query(None),
+    authorization: Optional[str] = Header(None),
+    token: Optional[str] = Query(None)
+):
+    tok = _extract_token(authorization, token)
+    user = await require_user(tok)
+    con = db_conn()
+    try:
+        _owned_api_key(con, key_id, user["id"])
+    finally:
+        con.close()
+    return await _webhook_delivery_log(key_id, status, limit, before)
+
+@app.post("/api/user/api-keys/{key_id}/webhook/deliveries/{delivery_id}/retry")
+async def retry_user_api_key_webhook_delivery(
+    key_id: str,
+    delivery_id: str,
+    authorization: Optional[str] = Header(None),
+    token: Optional[str] = Query(None)
+):
+    tok = _extract_token(authorization, token)
+    user = await require_user(tok)
+    con = db_conn()
+    try:
+        _owned_api_key(con, key_id, user["id"])
+    finally:
+        con.close()
+    return await _retry_webhook_delivery(key_id, delivery_id)
+
+@app.get("/api/v1/webhooks/deliveries")
+async def api_v1_webhook_deliveries(
+    status: Optional[str] = Query(None),
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = Query(None),
+    x_api_key: Optional[str] = Header(None)
+):
+    """
+    Delivery log of the calling key's webhook, newest first
+    
+    Authentication: X-API-Key header
+    
+    Query parameters:
+    - status: pending | sending | delivered | dead (dead = out of attempts; retry it below)
+    - limit: page size (default 50, max 200); before: next_before from the previous page
+    
+    Response:
+    {
+        "ok": true,
+        "deliveries": [
+            {"id": "evt_42", "task_id": "FFS_...", "event": "task.completed", "status": "delivered",
+             "attempts": 1, "last_status_code": 200, "last_error": null, "next_attempt_ms": null, ...}
+        ],
+        "next_before": "evt_12" or null
+    }
+    """
+    user, key_record = await require_api_key(x_api_key)
+    return await _webhook_delivery_log(key_record["id"], status, limit, before)
+
+@app.post("/api/v1/webhooks/deliveries/{delivery_id}/retry")
+async def api_v1_retry_webhook_delivery(
+    delivery_id: str,
+    x_api_key: Optional[str] = Header(None)
+):
+    """Send a dead (or delivered) event again, with a fresh set of attempts."""
+    user, key_record = await require_api_key(x_api_key)
+    return await _retry_webhook_delivery(key_record["id"], delivery_id)
+
+def _requeue_voice_job(task_id: str, text: str, reason: str):
+    """Put a just-started voice job back in the queue after a Voicer outage; it restarts from the
+    owner's next status poll once a key's circuit breaker admits traffic again."""
+    con = db_conn()
+    try:
+        row = con.execute("SELECT user_id, metadata_json FROM jobs WHERE id = ?", (task_id,)).fetchone()
+        metadata = _json_loads(row["metadata_json"] or "{}") if row else {}
+        metadata["full_text"] = text
+        con.execute(
+            "UPDATE jobs SET status = 'queued', api_key_id = NULL, metadata_json = ? WHERE id = ? AND status = 'processing'",
+            (_json_dumps(metadata), task_id),
+        )
+        con.commit()
+    finally:
+        con.close()
+    if row:
+        _job_status_changed(task_id, row["user_id"])
+    log_event("info", "task_requeued", f"Task {task_id} requeued after provider outage: {reason[:200]}")
+
+
+@app.post("/api/voice/synthesize")
+async def voice_synthesize(
+    request: Request,
+    authorization: Optional[str] = Header(None),
+    token: Optional[str] = Query(None),
+    idempotency_key: Optional[str] = Header(None)
+):
+    """Proxy voice synthesis to Voicer API (for web interface). Send an Idempotency-Key header to make
+    retries safe: a repeat returns the first response instead of starting (and charging) another job."""
+    tok = _extract_token(authorization, token)
+    user = await require_user(tok)
+    return await _idempotent(request, idempotency_key, user["id"], "voice.synthesize",
+                             lambda: _voice_synthesize(request, user))
+
+async def _voice_synthesize(request: Request, user: Dict):
+    """STABLE VERSION"""
+    try:
+        body = await request.json()
+        
+        # Calculate character count for credits
+        text = body.get("text", "")
+        char_count = len(text)
+        long_form = bool(body.get("long_form"))
+        request_hash = _voice_request_hash(body, text, long_form)
+        
+        # A likely cache hit needs no key (picking one would claim a half-open probe for nothing)
+        likely_cached = False
+        if request_hash:
+            con = db_conn()
+            try:
+                likely_cached = _find_cached_job(con, request_hash, user["id"]) is not None
+            finally:
+                con.close()
+        
+        key_data = get_voicer_api_key() if not likely_cached else None
+        circuit_wait = False
+        if key_data:
+            api_key_id, voicer_key = key_data
+        elif likely_cached or _provider_circuit_open("voicer"):
+            # Every Voicer key is open-circuited (or the cached job vanished meanwhile): the job queues
+            api_key_id, voicer_key = None, None
+            circuit_wait = True
+        else:
+            _debug_log("[SYNTH] ❌ No Voicer API keys configured")
+            raise HTTPException(503, "No Voicer API keys configured")
+        
+        _debug_log(f"[SYNTH] 📝 User {user['id']} requesting synthesis: {char_count} chars")
+        
+        # Check credits and slots, deduct and save the job in ONE transaction, run by the DB writer
         task_id = _generate_task_id()  # FFS_XXXXXXX format
-        task_status = None
         voicer_task_id = None
         
         _debug_log(f"[SYNTH] 🆔 Generated task ID: {task_id}")
         
-        try:
+        def _reserve(con: sqlite3.Connection) -> Tuple[str, Optional[dict]]:
+            """(task status, cached job it reuses or None). HTTPExceptions roll back this intent only."""
             # Check credits
             total_credits = _get_total_credits_from_packages(con, user["id"])
             if total_credits < char_count:
@@ -4092,7 +5482,9 @@ async def voice_synthesize(
                 (user["id"],)
             ).fetchone()["cnt"]
             
-            should_queue = active_processing >= concurrent_slots
+            should_queue = circuit_wait or active_processing >= concurrent_slots
+            if _admission_check(con, user, "voice", "voicer").action == admission.DEFER:
+                should_queue = True
             _debug_log(f"[SYNTH] 🎯 Voice slots: {active_processing}/{concurrent_slots}, should_queue: {should_queue}")
     
             # Deduct credits BEFORE creating task (atomic operation)
@@ -4106,6 +5498,14 @@ async def voice_synthesize(
                 (char_count, user["id"])
             )
             
+            # Identical request already synthesized (or in progress upstream): reuse it
+            cached = _find_cached_job(con, request_hash, user["id"]) if request_hash else None
+            if cached:
+                cached_meta = _clone_cached_job(con, cached, task_id, user["id"], api_key_id, char_count, request_hash)
+                return cached["status"], {"id": cached["id"], "voicer_task_id": cached_meta.get("voicer_task_id")}
+            if request_hash:
+                result_cache.stats.record_miss("voice", body.get("model_id", "eleven_multilingual_v2"))
+            
             # Determine task status
             if should_queue:
                 task_status = "queued"
@@ -4116,8 +5516,8 @@ async def voice_synthesize(
             # Save job to database FIRST (before external API call)
             expires_at = now_ms() + (12 * 60 * 60 * 1000)  # 12 hours
             con.execute("""
-                INSERT INTO jobs (id, user_id, api_key_id, status, prompt, model, width, height, credits_charged, char_count, created_at_ms, expires_at_ms, metadata_json)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                INSERT INTO jobs (id, user_id, api_key_id, status, prompt, model, width, height, credits_charged, char_count, created_at_ms, expires_at_ms, metadata_json, request_hash, worker_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """, (
                 task_id,
                 user["id"],
@@ -4137,8 +5537,11 @@ async def voice_synthesize(
                     "model_id": body.get("model_id", "eleven_multilingual_v2"),
                     "full_text_length": char_count,
                     "voice_settings": body.get("voice_settings", {}),
-                    "full_text": text if task_status == "queued" else None
-                })
+                    "full_text": text,  # Kept until Voicer accepts the task, so a restart can resubmit it
+                    "long_form": long_form or None
+                }),
+                request_hash,
+                WORKER_ID
             ))
             
             # Update API key stats
@@ -4146,19 +5549,28 @@ async def voice_synthesize(
                 "UPDATE api_keys SET total_requests = total_requests + 1 WHERE id = ?",
                 (api_key_id,)
             )
-            
-            con.commit()
-            _debug_log(f"[SYNTH] ✅ Task saved to DB: {task_id}, status: {task_status}")
-            
+            return task_status, None
+        
+        try:
+            task_status, cached = await db_writer.run(_reserve)
+            _user_changed(user["id"])
         except HTTPException:
-            con.rollback()
             raise
         except Exception as e:
-            con.rollback()
             _debug_log(f"[SYNTH] ❌ Database error: {e}")
             raise HTTPException(500, f"Database error: {str(e)}")
-        finally:
-            con.close()
+        
+        if cached:
+            result_cache.stats.record_hit("voice", body.get("model_id", "eleven_multilingual_v2"), task_status != "completed", char_count)
+            log_event("info", "result_cache_hit", f"Task {task_id} reused {cached['id']}", user_id=user["id"])
+            return {"task_id": task_id, "status": task_status, "voicer_task_id": cached["voicer_task_id"], "cached": True}
+        _debug_log(f"[SYNTH] ✅ Task saved to DB: {task_id}, status: {task_status}")
+        
+        # Long-form: segments are rendered in the background and stitched locally
+        if task_status == "processing" and long_form:
+            _enqueue_work("voice.long_form", {"task_id": task_id}, task_id)
+            return {"task_id": task_id, "status": "processing", "long_form": True,
+                    "segments_total": len(_split_text_segments(text))}
         
         # Now call external API if not queued
         if task_status == "processing":
@@ -4184,8 +5596,8 @@ async def voice_synthesize(
                 _debug_log(f"[SYNTH] 📦 Clean payload keys: {list(voicer_payload.keys())}")
                 
                 async with httpx.AsyncClient(timeout=90) as client:  # Increased timeout
-                    response = await client.post(
-                        f"{VOICER_API_BASE}/voice/synthesize",
+                    response = await _upstream_request(
+                        client, "POST", f"{VOICER_API_BASE}/voice/synthesize", "voicer", api_key_id,
                         headers={
                             "Authorization": f"Bearer {voicer_key}",
                             "Content-Type": "application/json"
@@ -4193,20 +5605,20 @@ async def voice_synthesize(
                         json=voicer_payload
                     )
                     
+                    if is_retryable_status(response.status_code):
+                        await rate_limiter.release_concurrent(api_key_id, user["id"])
+                        _requeue_voice_job(task_id, text, f"Voicer API error: {response.status_code}")
+                        return {"task_id": task_id, "status": "queued", "message": "Provider temporarily unavailable, task queued"}
+                    
                     if response.status_code != 200:
                         _debug_log(f"[SYNTH] ❌ Voicer API error: {response.status_code}")
                         await rate_limiter.release_concurrent(api_key_id, user["id"])
                         
                         # Mark task as failed in database
-                        con2 = db_conn()
-                        try:
-                            con2.execute(
-                                "UPDATE jobs SET status = 'failed', error = ? WHERE id = ?",
-                                (f"Voicer API error: {response.status_code}", task_id)
-                            )
-                            con2.commit()
-                        finally:
-                            con2.close()
+                        await db_writer.execute(
+                            "UPDATE jobs SET status = 'failed', error = ? WHERE id = ?",
+                            (f"Voicer API error: {response.status_code}", task_id)
+                        )
                         
                         raise HTTPException(response.status_code, response.text)
                     
@@ -4214,42 +5626,31 @@ async def voice_synthesize(
                     voicer_task_id = result.get("task_id")
                     _debug_log(f"[SYNTH] ✅ Voicer task created: {voicer_task_id}")
                     
-                    # Update metadata with voicer_task_id
-                    con2 = db_conn()
-                    try:
-                        job = con2.execute("SELECT metadata_json FROM jobs WHERE id = ?", (task_id,)).fetchone()
+                    # Update metadata with voicer_task_id (read-modify-write in one writer intent)
+                    def _record_voicer_task(con: sqlite3.Connection):
+                        job = con.execute("SELECT metadata_json FROM jobs WHERE id = ?", (task_id,)).fetchone()
                         if job:
-                            metadata = json.loads(job["metadata_json"] or "{}")
+                            metadata = _json_loads(job["metadata_json"] or "{}")
                             metadata["voicer_task_id"] = voicer_task_id
-                            con2.execute(
+                            metadata["full_text"] = None
+                            con.execute(
                                 "UPDATE jobs SET metadata_json = ?, started_at_ms = ? WHERE id = ?",
                                 (_json_dumps(metadata), now_ms(), task_id)
                             )
-                            con2.commit()
-                    finally:
-                        con2.close()
+                    await db_writer.run(_record_voicer_task)
                     
                     return {"task_id": task_id, "status": "processing", "voicer_task_id": voicer_task_id}
                     
-            except httpx.TimeoutException:
-                _debug_log(f"[SYNTH] ⏰ Voicer API timeout")
+            except httpx.TransportError as e:
+                # Timeouts / connection errors that survived the retries: wait in the queue
+                _debug_log(f"[SYNTH] ⏰ Voicer API unavailable: {e}")
                 await rate_limiter.release_concurrent(api_key_id, user["id"])
-                con2 = db_conn()
-                try:
-                    con2.execute("UPDATE jobs SET status = 'failed', error = ? WHERE id = ?", ("Voicer API timeout", task_id))
-                    con2.commit()
-                finally:
-                    con2.close()
-                raise HTTPException(504, "Voicer API timeout")
+                _requeue_voice_job(task_id, text, f"Voicer API unavailable: {e}")
+                return {"task_id": task_id, "status": "queued", "message": "Provider temporarily unavailable, task queued"}
             except Exception as e:
                 _debug_log(f"[SYNTH] ❌ Voicer API exception: {e}")
                 await rate_limiter.release_concurrent(api_key_id, user["id"])
-                con2 = db_conn()
-                try:
-                    con2.execute("UPDATE jobs SET status = 'failed', error = ? WHERE id = ?", (str(e), task_id))
-                    con2.commit()
-                finally:
-                    con2.close()
+                await db_writer.execute("UPDATE jobs SET status = 'failed', error = ? WHERE id = ?", (str(e), task_id))
                 raise HTTPException(500, f"Voicer API error: {str(e)}")
         
         # Return result for queued task
@@ -4272,7 +5673,7 @@ async def voice_status(
 ):
     """Proxy voice status check to Voicer API. Voice tasks only."""
     tok = _extract_token(authorization, token)
-    user = require_user(tok)
+    user = await require_user(tok)
     
     # First check our database status - avoid unnecessary API calls
     con = db_conn()
@@ -4285,7 +5686,7 @@ async def voice_status(
             raise HTTPException(403, "Access denied")
         
         # Image tasks must use /api/image/status, not Voicer
-        metadata = json.loads(job["metadata_json"] or "{}")
+        metadata = _json_loads(job["metadata_json"] or "{}")
         if metadata.get("type") == "image":
             raise HTTPException(400, "Not a voice task. Use /api/image/status for image generation.")
         
@@ -4306,7 +5707,7 @@ async def voice_status(
                 
                 _debug_log(f"[QUEUE] Task {task_id} is not the oldest (oldest: {oldest_queued['id']}), position: {queue_position + 1}")
                 
-                metadata = json.loads(job["metadata_json"] or "{}")
+                metadata = _json_loads(job["metadata_json"] or "{}")
                 voicer_task_id = metadata.get("voicer_task_id")
                 return {
                     "status": "queued",
@@ -4319,7 +5720,7 @@ async def voice_status(
         
         # If already completed/failed/cancelled in our DB, return that status immediately
         if job["status"] in ("completed", "failed", "cancelled"):
-            metadata = json.loads(job["metadata_json"] or "{}")
+            metadata = _json_loads(job["metadata_json"] or "{}")
             voicer_task_id = metadata.get("voicer_task_id")
             return {
                 "status": job["status"],
@@ -4341,84 +5742,13 @@ async def voice_status(
             
             _debug_log(f"[QUEUE] User {user['id']}: {active_processing}/{concurrent_slots} voice slots used")
             
-            # If slot available, start the task
-            if active_processing < concurrent_slots:
+            # If slot available, start the task (with the scheduler on, scheduler_dispatch_loop does it)
+            if not SCHEDULER_ENABLED and active_processing < concurrent_slots and _admission_can_start(con, user, "voice", "voicer"):
                 _debug_log(f"[QUEUE] Slot available! Starting task {task_id}")
-                
-                # Get task data from metadata
-                metadata = json.loads(job["metadata_json"] or "{}")
-                full_text = metadata.get("full_text")
-                
-                _debug_log(f"[QUEUE] full_text length: {len(full_text) if full_text else 0}")
-                
-                if full_text:
-                    # Send to Voicer API now
-                    try:
-                        key_data = get_voicer_api_key()
-                        if key_data:
-                            api_key_id, voicer_key = key_data
-                            _debug_log(f"[QUEUE] Sending to Voicer API...")
-                            
-                            try:
-                                payload = {
-                                    "text": full_text,
-                                    "voice_id": metadata.get("voice_id"),
-                                    "model_id": job["model"] or "eleven_multilingual_v2",
-                                    "voice_settings": metadata.get("voice_settings", {})
-                                }
-                                
-                                async with httpx.AsyncClient(timeout=60) as client:
-                                    response = await client.post(
-                                        f"{VOICER_API_BASE}/voice/synthesize",
-                                        headers={
-                                            "Authorization": f"Bearer {voicer_key}",
-                                            "Content-Type": "application/json"
-                                        },
-                                        json=payload
-                                    )
-                                
-                                _debug_log(f"[QUEUE] Voicer API response: {response.status_code}")
-                                
-                                if response.status_code == 200:
-                                    result = response.json()
-                                    voicer_task_id = result.get("task_id")
-                                    _debug_log(f"[QUEUE] Got Voicer task ID: {voicer_task_id}")
-                                    
-                                    # Update job: api_key_id (so release uses same key), status, metadata
-                                    metadata["voicer_task_id"] = voicer_task_id
-                                    metadata["full_text"] = None  # Remove to save space
-                                    
-                                    con.execute("""
-                                        UPDATE jobs 
-                                        SET api_key_id = ?, status = 'processing', 
-                                            started_at_ms = ?,
-                                            metadata_json = ?
-                                        WHERE id = ?
-                                    """, (api_key_id, now_ms(), _json_dumps(metadata), task_id))
-                                    con.commit()
-                                    
-                                    _debug_log(f"[QUEUE] Task started successfully! Task {task_id} now processing (Voicer ID: {voicer_task_id})")
-                                    
-                                    return {
-                                        "status": "processing",
-                                        "progress": 0,
-                                        "voicer_task_id": voicer_task_id
-                                    }
-                                else:
-                                    _debug_log(f"[QUEUE] Voicer API error: {response.text}")
-                            except Exception as e:
-                                _debug_log(f"[QUEUE] Error starting queued task: {e}")
-                                import traceback
-                                traceback.print_exc()
-                        else:
-                            _debug_log(f"[QUEUE] No Voicer API key available!")
-                    except Exception as e:
-                        _debug_log(f"[QUEUE] Error starting queued task: {e}")
-                        import traceback
-                        traceback.print_exc()
-                else:
-                    _debug_log(f"[QUEUE] No full_text in metadata!")
-            else:
+                started = await _start_queued_voice_job(task_id)
+                if started:
+                    return started
+            elif not SCHEDULER_ENABLED:
                 _debug_log(f"[QUEUE] No slots available ({active_processing}/{concurrent_slots})")
             
             # Still queued; position among voice queued only
@@ -4437,83 +5767,105 @@ async def voice_status(
     
     # If job is processing, check with Voicer API using voicer_task_id from metadata
     if job["status"] == "processing":
-        metadata = json.loads(job["metadata_json"] or "{}")
-        voicer_task_id = metadata.get("voicer_task_id")
+        metadata = _json_loads(job["metadata_json"] or "{}")
+        if metadata.get("long_form"):
+            return _long_form_progress(metadata)
+        if UPSTREAM_IN_WORKER:
+            # A "voice.poll" work item checks Voicer; report what the worker last recorded
+            return {"status": "processing", "progress": 0, "voicer_task_id": metadata.get("voicer_task_id")}
+        return await _poll_voicer_job(task_id, metadata)
+
+
+async def _poll_voicer_job(task_id: str, metadata: Dict) -> Dict:
+    """Check a processing Voicer job upstream and record a final status (voice_status and the
+    work queue's recovery polling). Returns the status payload for the client."""
+    voicer_task_id = metadata.get("voicer_task_id")
+    
+    # If no voicer_task_id in metadata, this is an old-style job, use task_id directly
+    if not voicer_task_id:
+        voicer_task_id = task_id
+    
+    key_data = get_voicer_api_key(claim=False)
+    if not key_data:
+        if _provider_circuit_open("voicer"):
+            return {"status": "processing", "progress": 0, "error": "Provider temporarily unavailable, retrying..."}
+        raise HTTPException(503, "No Voicer API keys configured")
+    status_key_id, voicer_key = key_data
+    
+    try:
+        async with httpx.AsyncClient(timeout=30) as client:
+            response = await _upstream_request(
+                client, "GET", f"{VOICER_API_BASE}/voice/status/{voicer_task_id}", "voicer", status_key_id,
+                max_attempts=1,
+                headers={"Authorization": f"Bearer {voicer_key}"}
+            )
         
-        # If no voicer_task_id in metadata, this is an old-style job, use task_id directly
-        if not voicer_task_id:
-            voicer_task_id = task_id
+        # Provider-side errors (5xx/429) are transient: keep the task processing and poll again
+        if is_retryable_status(response.status_code):
+            return {"status": "processing", "progress": 0, "error": "Provider temporarily unavailable, retrying..."}
         
-        key_data = get_voicer_api_key()
-        if not key_data:
-            raise HTTPException(503, "No Voicer API keys configured")
-        _, voicer_key = key_data
+        # If Voicer API returns error, mark task as failed
+        if response.status_code != 200:
+            log_event("error", "voicer_status_error", f"Voicer API error: {response.status_code}", meta={"task_id": task_id})
+            # Mark as failed in our database
+            con = db_conn()
+            try:
+                job = con.execute("SELECT user_id, api_key_id, status FROM jobs WHERE id = ?", (task_id,)).fetchone()
+                if job and job["status"] == "processing":
+                    if job["api_key_id"]:
+                        await rate_limiter.release_concurrent(job["api_key_id"], job["user_id"])
+                    con.execute(
+                        "UPDATE jobs SET status = 'failed', error = ?, completed_at_ms = ? WHERE id = ?",
+                        (f"Voicer API error: {response.status_code}", now_ms(), task_id)
+                    )
+                    con.commit()
+                    log_event("info", "task_failed", f"Task {task_id} marked as failed due to API error")
+            finally:
+                con.close()
+            return {"status": "failed", "error": f"API error: {response.status_code}"}
         
-        try:
-            async with httpx.AsyncClient(timeout=30) as client:
-                response = await client.get(
-                    f"{VOICER_API_BASE}/voice/status/{voicer_task_id}",
-                    headers={"Authorization": f"Bearer {voicer_key}"}
-                )
-            
-            # If Voicer API returns error, mark task as failed
-            if response.status_code != 200:
-                log_event("error", "voicer_status_error", f"Voicer API error: {response.status_code}", meta={"task_id": task_id})
-                # Mark as failed in our database
-                con = db_conn()
-                try:
-                    job = con.execute("SELECT user_id, api_key_id, status FROM jobs WHERE id = ?", (task_id,)).fetchone()
-                    if job and job["status"] == "processing":
-                        if job["api_key_id"]:
-                            await rate_limiter.release_concurrent(job["api_key_id"], job["user_id"])
-                        con.execute(
-                            "UPDATE jobs SET status = 'failed', error = ?, completed_at_ms = ? WHERE id = ?",
-                            (f"Voicer API error: {response.status_code}", now_ms(), task_id)
-                        )
-                        con.commit()
-                        log_event("info", "task_failed", f"Task {task_id} marked as failed due to API error")
-                finally:
-                    con.close()
-                return {"status": "failed", "error": f"API error: {response.status_code}"}
-            
-            result = response.json()
-            
-            # Add voicer_task_id to response
-            result["voicer_task_id"] = voicer_task_id
-            
-            # Update job status in database and release concurrent slot
-            status = result.get("status")
-            if status in ("completed", "failed"):
-                con = db_conn()
-                try:
-                    # Get job and check if still processing (prevent double updates)
-                    job = con.execute("SELECT user_id, api_key_id, image_path, status FROM jobs WHERE id = ?", (task_id,)).fetchone()
+        result = response.json()
+        
+        # Add voicer_task_id to response
+        result["voicer_task_id"] = voicer_task_id
+        
+        # Update job status in database and release concurrent slot
+        status = result.get("status")
+        if status in ("completed", "failed"):
+            con = db_conn()
+            try:
+                # Get job and check if still processing (prevent double updates)
+                job = con.execute("SELECT user_id, api_key_id, image_path, status FROM jobs WHERE id = ?", (task_id,)).fetchone()
+                
+                # Only update if still processing
+                if job and job["status"] == "processing":
+                    audio_path = None
+                    # If completed, try to download audio in background (don't block status response)
+                    if status == "completed":
+                        # Download in the background through the durable work queue (same transaction)
+                        work_queue.enqueue(con, "voice.download", {"task_id": task_id, "key_id": status_key_id},
+                                           job_id=task_id, dedupe_key=f"voice.download:{task_id}",
+                                           max_attempts=WORK_MAX_ATTEMPTS)
                     
-                    # Only update if still processing
-                    if job and job["status"] == "processing":
-                        audio_path = None
-                        # If completed, try to download audio in background (don't block status response)
-                        if status == "completed":
-                            # Start download in background - user can retry if it fails
-                            asyncio.create_task(ensure_audio_downloaded(task_id, voicer_key))
-                        
-                        # Update database status (audio path is updated by ensure_audio_downloaded)
-                        con.execute(
-                            "UPDATE jobs SET status = ?, completed_at_ms = ?, error = ? WHERE id = ?",
-                            (status, now_ms(), result.get("error"), task_id)
-                        )
-                        con.commit()
-                        log_event("info", "task_status_updated", f"Task {task_id} status updated to {status}")
-                finally:
-                    con.close()
-            
-            return result
-        except httpx.TimeoutException:
-            log_event("error", "voicer_timeout", f"Voicer API timeout for task {task_id}")
-            return {"status": "processing", "progress": 0, "error": "Timeout, retrying..."}
-        except Exception as e:
-            log_event("error", "voicer_error", f"Error checking status: {e}", meta={"task_id": task_id})
-            return {"status": "processing", "progress": 0}
+                    # Update database status (audio path is updated by ensure_audio_downloaded)
+                    con.execute(
+                        "UPDATE jobs SET status = ?, completed_at_ms = ?, error = ? WHERE id = ?",
+                        (status, now_ms(), result.get("error"), task_id)
+                    )
+                    con.commit()
+                    _wake_work()
+                    log_event("info", "task_status_updated", f"Task {task_id} status updated to {status}")
+            finally:
+                con.close()
+        
+        return result
+    except httpx.TimeoutException:
+        log_event("error", "voicer_timeout", f"Voicer API timeout for task {task_id}")
+        return {"status": "processing", "progress": 0, "error": "Timeout, retrying..."}
+    except Exception as e:
+        log_event("error", "voicer_error", f"Error checking status: {e}", meta={"task_id": task_id})
+        return {"status": "processing", "progress": 0}
+
 
 async def ensure_audio_downloaded(task_id: str, voicer_key: str) -> Optional[str]:
     """Ensure audio file is downloaded and saved locally. Returns path if successful."""
@@ -4523,63 +5875,1060 @@ async def ensure_audio_downloaded(task_id: str, voicer_key: str) -> Optional[str
     if Path(local_path).exists():
         return local_path
     
-    # Get voicer_task_id from metadata
+    # Get voicer_task_id from metadata
+    con = db_conn()
+    try:
+        job = con.execute("SELECT metadata_json FROM jobs WHERE id = ?", (task_id,)).fetchone()
+        if not job:
+            log_event("error", "task_not_found", f"Task {task_id} not found in database")
+            return None
+        
+        metadata = _json_loads(job["metadata_json"] or "{}")
+        voicer_task_id = metadata.get("voicer_task_id")
+
+        # Long-form audio is stitched locally; there is no single Voicer task to fetch
+        if metadata.get("long_form"):
+            return None
+
+        # If no voicer_task_id in metadata, this is an old-style job, use task_id directly
+        if not voicer_task_id:
+            voicer_task_id = task_id
+    finally:
+        con.close()
+
+    # Download through the key's circuit breaker (jittered retries on 5xx/429/network errors)
+    try:
+        async with httpx.AsyncClient(timeout=120) as client:
+            response = await _upstream_request(
+                client, "GET", f"{VOICER_API_BASE}/voice/download/{voicer_task_id}", "voicer",
+                _pool_key_id("voicer", voicer_key),
+                headers={"Authorization": f"Bearer {voicer_key}"}
+            )
+    except Exception as e:
+        log_event("error", "audio_download_error", f"Error downloading audio: {e}", meta={"task_id": task_id})
+        return None
+
+    if response.status_code != 200:
+        log_event("error", "audio_download_failed", f"Voicer returned {response.status_code} for task {task_id}", meta={"task_id": task_id})
+        return None
+
+    # Save to local file
+    with open(local_path, "wb") as f:
+        f.write(response.content)
+
+    # Verify file was written
+    if not (Path(local_path).exists() and Path(local_path).stat().st_size > 0):
+        log_event("error", "audio_write_failed", f"File write failed for task {task_id}")
+        return None
+
+    log_event("info", "audio_downloaded", f"Audio downloaded for task {task_id}", meta={"path": local_path, "task_id": task_id})
+    con = db_conn()
+    try:
+        con.execute("UPDATE jobs SET image_path = ? WHERE id = ?", (local_path, task_id))
+        con.commit()
+    finally:
+        con.close()
+    return local_path
+
+# =============================================================================
+# Long-form Voice Synthesis
+# =============================================================================
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…;])\s+")
+
+
+def _split_text_segments(text: str, max_chars: int = VOICE_SEGMENT_MAX_CHARS) -> List[str]:
+    """Split text into segments of at most max_chars, preferring paragraph, then sentence,
+    then word boundaries. Joining the segments back with single separators loses no words."""
+    units: List[Tuple[str, str]] = []  # (piece, separator placed before it)
+    for p_idx, paragraph in enumerate(re.split(r"\n\s*\n", text.strip())):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        sep = "\n\n" if p_idx else ""
+        pieces = [paragraph] if len(paragraph) <= max_chars else _SENTENCE_END_RE.split(paragraph)
+        for piece in pieces:
+            if len(piece) <= max_chars:
+                units.append((piece, sep))
+            else:
+                # A single oversized sentence: fall back to word boundaries (hard cut for huge words)
+                line = ""
+                for word in piece.split():
+                    while len(word) > max_chars:
+                        if line:
+                            units.append((line, sep))
+                            sep, line = " ", ""
+                        units.append((word[:max_chars], sep))
+                        sep, word = " ", word[max_chars:]
+                    if line and len(line) + 1 + len(word) > max_chars:
+                        units.append((line, sep))
+                        sep, line = " ", word
+                    else:
+                        line = f"{line} {word}" if line else word
+                if line:
+                    units.append((line, sep))
+            sep = " "
+
+    segments: List[str] = []
+    current = ""
+    for piece, sep in units:
+        if current and len(current) + len(sep) + len(piece) <= max_chars:
+            current += sep + piece
+        else:
+            if current:
+                segments.append(current)
+            current = piece
+    if current:
+        segments.append(current)
+    return segments
+
+
+def _strip_id3(data: bytes) -> bytes:
+    """Drop a leading ID3v2 tag and a trailing ID3v1 tag so MP3 frames can be concatenated."""
+    if len(data) >= 10 and data[:3] == b"ID3":
+        size = ((data[6] & 0x7F) << 21) | ((data[7] & 0x7F) << 14) | ((data[8] & 0x7F) << 7) | (data[9] & 0x7F)
+        footer = 10 if data[5] & 0x10 else 0
+        data = data[10 + size + footer:]
+    if len(data) >= 128 and data[-128:-125] == b"TAG":
+        data = data[:-128]
+    return data
+
+
+async def _concat_mp3_segments(parts: List[bytes], out_path: Path) -> int:
+    """Write MP3 segments back to back into one file. Returns the file size."""
+    size = 0
+    async with aiofiles.open(out_path, "wb") as f:
+        for part in parts:
+            frames = _strip_id3(part)
+            await f.write(frames)
+            size += len(frames)
+    return size
+
+
+def _voicer_payload(text: str, voice_id: Optional[str], model_id: Optional[str], voice_settings: Optional[Dict]) -> Dict:
+    """Voicer synthesize payload with voice_settings filtered to valid ElevenLabs fields."""
+    payload = {"text": text, "voice_id": voice_id, "model_id": model_id or "eleven_multilingual_v2"}
+    if voice_settings:
+        payload["voice_settings"] = {
+            k: v for k, v in voice_settings.items()
+            if k in ["stability", "similarity_boost", "style", "use_speaker_boost", "speed"]
+        }
+    return payload
+
+
+def _long_form_progress(metadata: Dict) -> Dict:
+    """Status payload for a long-form job built from the per-segment state in metadata."""
+    segments = metadata.get("segments") or []
+    total_chars = sum(s.get("chars", 0) for s in segments) or 1
+    done_chars = sum(s.get("chars", 0) for s in segments if s.get("status") == "completed")
+    return {
+        "status": "processing",
+        "progress": min(99, int(done_chars * 100 / total_chars)),
+        "long_form": True,
+        "segments_total": len(segments) or metadata.get("segments_total", 0),
+        "segments_done": sum(1 for s in segments if s.get("status") == "completed"),
+        "segments": [{"index": s["index"], "status": s.get("status"), "chars": s.get("chars")} for s in segments],
+    }
+
+
+def _update_long_form_segment(task_id: str, index: int, **fields) -> Optional[str]:
+    """Merge fields into one segment's metadata entry. Returns the job status (None if gone)."""
+    con = db_conn()
+    try:
+        row = con.execute("SELECT status, metadata_json FROM jobs WHERE id = ?", (task_id,)).fetchone()
+        if not row:
+            return None
+        metadata = _json_loads(row["metadata_json"] or "{}")
+        segments = metadata.get("segments") or []
+        if index < len(segments):
+            segments[index].update(fields)
+            con.execute("UPDATE jobs SET metadata_json = ? WHERE id = ?", (_json_dumps(metadata), task_id))
+            con.commit()
+        return row["status"]
+    finally:
+        con.close()
+
+
+async def _voicer_render_segment(task_id: str, index: int, voicer_key: str, payload: Dict, key_id: Any = None) -> bytes:
+    """Submit one segment to Voicer, wait for it and return the MP3 bytes.
+    The submit goes through the key's circuit breaker once; the caller rotates keys on failure."""
+    async with httpx.AsyncClient(timeout=90) as client:
+        resp = await _upstream_request(
+            client, "POST", f"{VOICER_API_BASE}/voice/synthesize", "voicer", key_id or _pool_key_id("voicer", voicer_key),
+            max_attempts=1,
+            headers={"Authorization": f"Bearer {voicer_key}", "Content-Type": "application/json"},
+            json=payload,
+        )
+        if resp.status_code != 200:
+            raise UpstreamError(f"Voicer API error: {resp.status_code}", resp.status_code, is_retryable_status(resp.status_code))
+        voicer_task_id = resp.json().get("task_id")
+        if not voicer_task_id:
+            raise RuntimeError("No task_id in Voicer response")
+        if _update_long_form_segment(task_id, index, status="processing", voicer_task_id=voicer_task_id) == "cancelled":
+            raise asyncio.CancelledError()
+
+        deadline = time.monotonic() + VOICE_SEGMENT_TIMEOUT
+        while True:
+            await asyncio.sleep(3)
+            resp = await client.get(
+                f"{VOICER_API_BASE}/voice/status/{voicer_task_id}",
+                headers={"Authorization": f"Bearer {voicer_key}"},
+            )
+            if resp.status_code == 200:
+                status = resp.json().get("status")
+                if status == "completed":
+                    break
+                if status == "failed":
+                    raise RuntimeError(resp.json().get("error") or "Voicer segment failed")
+            if time.monotonic() >= deadline:
+                raise RuntimeError("Voicer segment timed out")
+
+        resp = await client.get(
+            f"{VOICER_API_BASE}/voice/download/{voicer_task_id}",
+            headers={"Authorization": f"Bearer {voicer_key}"},
+            timeout=120,
+        )
+        if resp.status_code != 200 or not resp.content:
+            raise RuntimeError(f"Voicer download error: {resp.status_code}")
+        return resp.content
+
+
+async def _run_long_form_voice(task_id: str):
+    """Render a long-form voice job: split, synthesize segments in parallel, stitch one MP3.
+
+    Parallelism is the user's free voice slots (this job already holds one), and segments
+    rotate over every active voicer key. The job keeps its single credit charge for the full text.
+    """
+    con = db_conn()
+    try:
+        job = con.execute("SELECT * FROM jobs WHERE id = ?", (task_id,)).fetchone()
+        if not job or job["status"] != "processing":
+            return
+        user = con.execute("SELECT concurrent_slots FROM users WHERE id = ?", (job["user_id"],)).fetchone()
+        other_active = con.execute(
+            """SELECT COUNT(*) as cnt FROM jobs WHERE user_id = ? AND status = 'processing' AND id != ?
+               AND (metadata_json IS NULL OR (metadata_json NOT LIKE '%"type":"image"%' AND metadata_json NOT LIKE '%"type": "image"%'))""",
+            (job["user_id"], task_id)
+        ).fetchone()["cnt"]
+        metadata = _json_loads(job["metadata_json"] or "{}")
+        text = metadata.get("full_text") or ""
+        segments = _split_text_segments(text)
+        # Rendered parts live in memory only, so a resumed job (after a restart) renders every segment again
+        metadata["segments"] = [{"index": i, "chars": len(s), "status": "pending"} for i, s in enumerate(segments)]
+        metadata["segments_total"] = len(segments)
+        con.execute("UPDATE jobs SET metadata_json = ? WHERE id = ?", (_json_dumps(metadata), task_id))
+        con.commit()
+    finally:
+        con.close()
+
+    def fail(error: str):
+        c = db_conn()
+        try:
+            c.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, completed_at_ms = ? WHERE id = ? AND status = 'processing'",
+                (error[:1000], now_ms(), task_id)
+            )
+            c.commit()
+        finally:
+            c.close()
+        log_event("error", "long_form_failed", f"Long-form task {task_id} failed: {error}", user_id=job["user_id"])
+
+    keys = _list_provider_api_keys("voicer")
+    if not segments or not keys:
+        fail("No text to synthesize" if not segments else "No Voicer API keys available")
+        return
+
+    slots = (user["concurrent_slots"] if user else 1) or 1
+    sem = asyncio.Semaphore(max(1, min(len(segments), slots - other_active)))
+    parts: List[Optional[bytes]] = [None] * len(segments)
+
+    async def render(i: int):
+        async with sem:
+            last_error = None
+            for attempt in range(max(1, VOICE_SEGMENT_MAX_ATTEMPTS)):
+                # Rotate keys, skipping open-circuited ones (fall back to the rotation pick if all are open)
+                rotation = [keys[(i + attempt + k) % len(keys)] for k in range(len(keys))]
+                key = next((k for k in rotation if breakers.acquire("voicer", k["id"])), rotation[0])
+                payload = _voicer_payload(segments[i], metadata.get("voice_id"), job["model"], metadata.get("voice_settings"))
+                try:
+                    parts[i] = await _voicer_render_segment(task_id, i, key["api_key"], payload, key["id"])
+                    _update_long_form_segment(task_id, i, status="completed", attempts=attempt + 1)
+                    return
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    last_error = str(e)
+                    if attempt < VOICE_SEGMENT_MAX_ATTEMPTS - 1:
+                        _update_long_form_segment(task_id, i, status="retrying", error=last_error, attempts=attempt + 1)
+                        await asyncio.sleep(1 + backoff_delay(attempt, 2.0, 30.0))
+            _update_long_form_segment(task_id, i, status="failed", error=last_error)
+            raise RuntimeError(f"Segment {i + 1}/{len(segments)} failed: {last_error}")
+
+    tasks = [asyncio.create_task(render(i)) for i in range(len(segments))]
+    try:
+        await asyncio.gather(*tasks)
+    except (asyncio.CancelledError, Exception) as e:
+        # One failed segment (or a user cancel) stops the rest
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if isinstance(e, asyncio.CancelledError):
+            log_event("info", "long_form_cancelled", f"Long-form task {task_id} cancelled", user_id=job["user_id"])
+        else:
+            fail(str(e))
+        return
+
+    local_path = AUDIO_DIR / f"{task_id}.mp3"
+    try:
+        size = await _concat_mp3_segments(parts, local_path)
+    except Exception as e:
+        fail(f"Failed to write audio: {e}")
+        return
+
+    con = db_conn()
+    try:
+        row = con.execute("SELECT metadata_json FROM jobs WHERE id = ?", (task_id,)).fetchone()
+        metadata = _json_loads(row["metadata_json"] or "{}") if row else metadata
+        metadata["full_text"] = None
+        metadata["audio_bytes"] = size
+        con.execute(
+            "UPDATE jobs SET status = 'completed', error = NULL, image_path = ?, completed_at_ms = ?, metadata_json = ? WHERE id = ? AND status = 'processing'",
+            (str(local_path), now_ms(), _json_dumps(metadata), task_id)
+        )
+        con.commit()
+    finally:
+        con.close()
+    log_event("info", "task_completed", f"Long-form task {task_id} completed: {len(segments)} segment(s)", user_id=job["user_id"])
+
+
+def _start_long_form_voice(con: sqlite3.Connection, task_id: str, metadata: Dict, api_key_id: Optional[str] = None) -> Dict:
+    """Move a queued long-form job to processing and queue its renderer."""
+    con.execute(
+        "UPDATE jobs SET status = 'processing', api_key_id = COALESCE(?, api_key_id), started_at_ms = ?, worker_id = ? WHERE id = ?",
+        (api_key_id, now_ms(), WORKER_ID, task_id)
+    )
+    work_queue.enqueue(con, "voice.long_form", {"task_id": task_id}, job_id=task_id,
+                       dedupe_key=f"voice.long_form:{task_id}", max_attempts=WORK_MAX_ATTEMPTS)
+    con.commit()
+    _wake_work()
+    return _long_form_progress(metadata)
+
+
+def _claim_queued_job(con: sqlite3.Connection, task_id: str) -> bool:
+    """Take the start claim on a queued job so only one poll / scheduler tick / worker starts it."""
+    now = now_ms()
+    cur = con.execute(
+        """UPDATE jobs SET claimed_at_ms = ? WHERE id = ? AND status = 'queued'
+           AND (claimed_at_ms IS NULL OR claimed_at_ms < ?)""",
+        (now, task_id, now - SCHEDULER_CLAIM_SECONDS * 1000)
+    )
+    con.commit()
+    return cur.rowcount == 1
+
+
+def _release_queued_claim(con: sqlite3.Connection, task_id: str):
+    try:
+        con.execute("UPDATE jobs SET claimed_at_ms = NULL WHERE id = ?", (task_id,))
+        con.commit()
+    except Exception as e:
+        _debug_log(f"[QUEUE] Could not release claim on {task_id}: {e}")
+
+
+async def _start_queued_voice_job(task_id: str) -> Optional[Dict]:
+    """Send one queued voice job to Voicer (from the fair-share scheduler, or the owner's status poll
+    when the scheduler is off). Returns the job's new status payload, or None if it stays queued."""
+    con = db_conn()
+    try:
+        if not _claim_queued_job(con, task_id):
+            return None
+        job = con.execute("SELECT * FROM jobs WHERE id = ?", (task_id,)).fetchone()
+        metadata = _json_loads(job["metadata_json"] or "{}")
+        full_text = metadata.get("full_text")
+        if not full_text:
+            _debug_log(f"[QUEUE] No full_text in metadata for {task_id}!")
+            return None
+        if metadata.get("long_form"):
+            return _start_long_form_voice(con, task_id, metadata)
+        
+        key_data = get_voicer_api_key()
+        if not key_data:
+            _debug_log(f"[QUEUE] No Voicer API key available!")
+            return None
+        api_key_id, voicer_key = key_data
+        payload = {
+            "text": full_text,
+            "voice_id": metadata.get("voice_id"),
+            "model_id": job["model"] or "eleven_multilingual_v2",
+            "voice_settings": metadata.get("voice_settings", {})
+        }
+        try:
+            async with httpx.AsyncClient(timeout=60) as client:
+                response = await _upstream_request(
+                    client, "POST", f"{VOICER_API_BASE}/voice/synthesize", "voicer", api_key_id,
+                    headers={
+                        "Authorization": f"Bearer {voicer_key}",
+                        "Content-Type": "application/json"
+                    },
+                    json=payload
+                )
+        except Exception as e:
+            _debug_log(f"[QUEUE] Error starting queued task {task_id}: {e}")
+            return None
+        
+        if response.status_code != 200:
+            # Stays queued and is retried on a later tick / poll
+            _debug_log(f"[QUEUE] Voicer API error for {task_id}: {response.status_code} {response.text[:200]}")
+            return None
+        
+        voicer_task_id = response.json().get("task_id")
+        # api_key_id on the job so the release uses the same key
+        metadata["voicer_task_id"] = voicer_task_id
+        metadata["full_text"] = None  # Remove to save space
+        con.execute("""
+            UPDATE jobs 
+            SET api_key_id = ?, status = 'processing', started_at_ms = ?, metadata_json = ?, worker_id = ?
+            WHERE id = ?
+        """, (api_key_id, now_ms(), _json_dumps(metadata), WORKER_ID, task_id))
+        _watch_upstream(con, task_id, metadata)
+        con.commit()
+        _debug_log(f"[QUEUE] Task {task_id} now processing (Voicer ID: {voicer_task_id})")
+        return {"status": "processing", "progress": 0, "voicer_task_id": voicer_task_id}
+    finally:
+        _release_queued_claim(con, task_id)
+        con.close()
+
+# =============================================================================
+# Admission Control (load shedding by plan priority)
+# =============================================================================
+
+_IMAGE_JOB_FILTER = """(metadata_json LIKE '%"type":"image"%' OR metadata_json LIKE '%"type": "image"%')"""
+_VOICE_JOB_FILTER = """(metadata_json IS NULL OR (metadata_json NOT LIKE '%"type":"image"%' AND metadata_json NOT LIKE '%"type": "image"%'))"""
+
+
+def _user_priority(con: sqlite3.Connection, user: Dict) -> int:
+    """TaskPriority for a user's work: their active plan's priority, LOW without a plan."""
+    user = dict(user)
+    plan_id = user.get("plan_id")
+    expires = user.get("plan_expires_at_ms")
+    if not plan_id or (expires and expires < now_ms()):
+        return admission.TaskPriority.LOW
+    row = con.execute("SELECT priority FROM plans WHERE id = ?", (plan_id,)).fetchone()
+    if row and row["priority"] is not None:
+        return admission.normalize_priority(row["priority"])
+    return admission.PLAN_PRIORITY.get(plan_id, admission.TaskPriority.NORMAL)
+
+
+def _pool_load(con: sqlite3.Connection, kind: str, pool: str) -> "admission.PoolLoad":
+    """Capacity (sum of concurrent_limit over active keys), in-flight jobs on those keys and the
+    queue depth (queued + pending batch items) of jobs bound for this pool."""
+    capacity = con.execute(
+        "SELECT COALESCE(SUM(concurrent_limit), 0) FROM api_keys WHERE is_active = 1 AND provider = ?", (pool,)
+    ).fetchone()[0]
+    if not capacity and pool == "whisk" and os.getenv("WHISK_API_KEY"):
+        capacity = MAX_CONCURRENT_PER_KEY
+    in_flight = con.execute(
+        """SELECT COUNT(*) FROM jobs WHERE status = 'processing'
+           AND (api_key_id IN (SELECT id FROM api_keys WHERE provider = ?) OR (? = 'whisk' AND api_key_id = 'env'))""",
+        (pool, pool)
+    ).fetchone()[0]
+    job_filter, params = _VOICE_JOB_FILTER, []
+    if kind == "image":
+        # Queued jobs hold no key yet: their pool is the metadata provider's (whisk / flow / grok share one)
+        providers = [p for p, p_pool in IMAGE_KEY_PROVIDER.items() if p_pool == pool] or [pool]
+        job_filter = _IMAGE_JOB_FILTER + " AND (" + " OR ".join(
+            ["metadata_json LIKE ? OR metadata_json LIKE ?"] * len(providers)) + ")"
+        for p in providers:
+            params += [f'%"provider":"{p}"%', f'%"provider": "{p}"%']
+    queued = con.execute(f"SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'pending') AND {job_filter}", params).fetchone()[0]
+    return admission.PoolLoad(kind, pool, capacity, in_flight, queued)
+
+
+def _admission_check(con: sqlite3.Connection, user: Dict, kind: str, pool: str, units: int = 1) -> "admission.Decision":
+    """Admit, defer (caller queues the job) or reject with 503 + Retry-After before anything is charged."""
+    priority = _user_priority(con, user)
+    decision = admission.controller.decide(_pool_load(con, kind, pool), priority, units)
+    if decision.action == admission.REJECT:
+        # Counted in admission.controller; no per-request log row while shedding load
+        raise HTTPException(
+            503,
+            "Service is at capacity, please retry shortly",
+            headers={"Retry-After": str(decision.retry_after)},
+        )
+    if API_ONLY:
+        # Upstream calls belong to the worker tier: the job is queued and the scheduler there starts it
+        return admission.Decision(admission.DEFER, "worker")
+    return decision
+
+
+def _admission_can_start(con: sqlite3.Connection, user: Dict, kind: str, pool: str) -> bool:
+    """Queued jobs start only while their class's share of upstream capacity is free."""
+    return admission.controller.can_start(_pool_load(con, kind, pool), _user_priority(con, user))
+
+
+@app.get("/api/admin/admission")
+async def admin_admission_stats(x_admin_token: Optional[str] = Header(None)):
+    """Admission controller policies, decision counters and current load per provider pool"""
+    _require_admin(x_admin_token)
+    
+    con = db_conn()
+    try:
+        loads = [_pool_load(con, "voice", "voicer").to_dict()]
+        loads += [_pool_load(con, "image", pool).to_dict() for pool in sorted(set(IMAGE_KEY_PROVIDER.values()))]
+    finally:
+        con.close()
+    return {"ok": True, **admission.controller.snapshot(), "pools": loads, "scheduler": _scheduler_snapshot()}
+
+
+# =============================================================================
+# Fair-Share Scheduler (starts queued jobs across users by plan weight)
+# =============================================================================
+
+_scheduler_stats: Dict[str, Any] = {"ticks": 0, "started": {}, "last_tick_ms": None}
+
+
+def _job_cost(kind: str, char_count: Optional[int], metadata: Dict) -> float:
+    """Fair-share cost of one job: images per request, or characters / VOICE_COST_CHARS for voice."""
+    if kind == "image":
+        return float(metadata.get("num_images") or 1)
+    return max(1.0, (char_count or 0) / max(1, VOICE_COST_CHARS))
+
+
+def _job_pool(kind: str, metadata: Dict) -> str:
+    return IMAGE_KEY_PROVIDER.get(metadata.get("provider"), "whisk") if kind == "image" else "voicer"
+
+
+def _plan_queued_starts(con: sqlite3.Connection) -> List[Tuple[str, str]]:
+    """One scheduler tick: (kind, task_id) of queued jobs to start now, per provider pool in
+    fair-share order, within pool capacity, per-user slots and the admission class ceilings."""
+    now = now_ms()
+    claim_cutoff = now - SCHEDULER_CLAIM_SECONDS * 1000
+    starts: List[Tuple[str, str]] = []
+    for kind, job_filter, slots_column in (
+        ("voice", _VOICE_JOB_FILTER, "concurrent_slots"),
+        ("image", _IMAGE_JOB_FILTER, "image_concurrent_slots"),
+    ):
+        # Head of every user's queue (not the globally oldest N, which one big backlog could fill)
+        queued = con.execute(
+            f"""SELECT id, user_id, created_at_ms, width, metadata_json FROM (
+                    SELECT id, user_id, created_at_ms, width, metadata_json,
+                           ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY created_at_ms) AS rn
+                    FROM jobs
+                    WHERE status = 'queued' AND {job_filter} AND (claimed_at_ms IS NULL OR claimed_at_ms < ?)
+                ) WHERE rn <= ?""",
+            (claim_cutoff, SCHEDULER_USER_SCAN_LIMIT)
+        ).fetchall()
+        if not queued:
+            continue
+        
+        # Work each user already holds: running jobs plus jobs another tick / poll is starting
+        held: Dict[str, float] = {}
+        active: Dict[str, int] = {}
+        claimed_by_pool: Dict[str, int] = {}
+        for row in con.execute(
+            f"""SELECT user_id, status, width, metadata_json FROM jobs
+                WHERE {job_filter} AND (status = 'processing' OR (status = 'queued' AND claimed_at_ms >= ?))""",
+            (claim_cutoff,)
+        ).fetchall():
+            meta = _json_loads(row["metadata_json"] or "{}")
+            held[row["user_id"]] = held.get(row["user_id"], 0.0) + _job_cost(kind, row["width"], meta)
+            active[row["user_id"]] = active.get(row["user_id"], 0) + 1
+            if row["status"] == "queued":
+                pool = _job_pool(kind, meta)
+                claimed_by_pool[pool] = claimed_by_pool.get(pool, 0) + 1
+        
+        users: Dict[str, Dict] = {}
+        by_pool: Dict[str, List[Candidate]] = {}
+        for row in queued:
+            uid = row["user_id"]
+            if uid not in users:
+                u = con.execute("SELECT * FROM users WHERE id = ?", (uid,)).fetchone()
+                if not u:
+                    continue
+                u = dict(u)
+                users[uid] = {"priority": _user_priority(con, u), "slots": u.get(slots_column) or (3 if kind == "image" else 1)}
+            meta = _json_loads(row["metadata_json"] or "{}")
+            pool = _job_pool(kind, meta)
+            by_pool.setdefault(pool, []).append(
+                Candidate(row["id"], uid, row["created_at_ms"], _job_cost(kind, row["width"], meta), users[uid]["priority"], pool)
+            )
+        user_free = {uid: info["slots"] - active.get(uid, 0) for uid, info in users.items()}
+        
+        for pool, candidates in sorted(by_pool.items()):
+            if _provider_circuit_open(pool):
+                continue  # Starting would only bounce back to the queue; wait for a half-open probe
+            load = _pool_load(con, kind, pool)
+            if not load.capacity:
+                continue
+            in_flight = load.in_flight + claimed_by_pool.get(pool, 0)
+            ceiling = None
+            if admission.controller.enabled:
+                ceiling = lambda p, cap=load.capacity: cap * admission.controller.policy(p).start_utilization
+            picks = fair_scheduler.plan(
+                candidates, load.capacity - in_flight, now,
+                user_held=held, user_free_slots=user_free, in_flight=in_flight, class_ceiling=ceiling,
+            )
+            for c in picks:
+                # Per-user slots are per kind, shared across pools
+                user_free[c.user_id] -= 1
+                held[c.user_id] = held.get(c.user_id, 0.0) + c.cost
+                starts.append((kind, c.task_id))
+    return starts
+
+
+async def scheduler_dispatch_loop():
+    """Start queued image/voice jobs in weighted fair-share order (replaces start-on-poll)"""
+    while True:
+        await asyncio.sleep(SCHEDULER_TICK_SECONDS)
+        try:
+            con = db_conn()
+            try:
+                starts = _plan_queued_starts(con)
+            finally:
+                con.close()
+            for kind, task_id in starts:
+                _spawn(_start_queued_image_job(task_id) if kind == "image" else _start_queued_voice_job(task_id))
+                _scheduler_stats["started"][kind] = _scheduler_stats["started"].get(kind, 0) + 1
+            _scheduler_stats["ticks"] += 1
+            _scheduler_stats["last_tick_ms"] = now_ms()
+        except Exception as e:
+            log_event("error", "scheduler_error", str(e))
+
+
+def _scheduler_snapshot() -> Dict:
+    return {
+        "enabled": SCHEDULER_ENABLED,
+        "tick_seconds": SCHEDULER_TICK_SECONDS,
+        "max_wait_seconds": SCHEDULER_MAX_WAIT_SECONDS,
+        "weights": {admission.PRIORITY_NAMES[p]: w for p, w in sorted(fair_scheduler.weights.items())},
+        **_scheduler_stats,
+    }
+
+
+# =============================================================================
+# Durable Work Queue (background work and restart recovery)
+# =============================================================================
+
+# In-flight jobs without an owner (rows from before jobs.worker_id) are only recovered after this
+ORPHAN_GRACE_MS = 10 * 60 * 1000
+
+
+def _wake_work():
+    if work_runner:
+        work_runner.wake()
+
+
+def _poll_item_kind(metadata: Dict) -> Optional[str]:
+    """Work item that polls this processing job's upstream operation, if it has one."""
+    if metadata.get("type") == "image":
+        return "image.poll" if metadata.get("whisk_operation_id") else None
+    return "voice.poll" if metadata.get("voicer_task_id") and not metadata.get("long_form") else None
+
+
+def _watch_upstream(con: sqlite3.Connection, task_id: str, metadata: Dict):
+    """In split mode, queue the upstream poll for a job that just went processing (caller commits).
+    In "all" mode the owner's status requests poll instead, unless a webhook is waiting on the job."""
+    kind = _poll_item_kind(metadata) if UPSTREAM_IN_WORKER or metadata.get("webhook") else None
+    if kind:
+        work_queue.enqueue(con, kind, {"task_id": task_id}, job_id=task_id, dedupe_key=f"{kind}:{task_id}",
+                           max_attempts=WORK_MAX_ATTEMPTS)
+
+
+def _enqueue_work(kind: str, payload: Dict, job_id: str):
+    """Queue one item for a job (at most one active per kind and job) and wake the runner."""
+    con = db_conn()
+    try:
+        work_queue.enqueue(con, kind, payload, job_id=job_id, dedupe_key=f"{kind}:{job_id}",
+                           max_attempts=WORK_MAX_ATTEMPTS)
+        con.commit()
+    finally:
+        con.close()
+    _wake_work()
+
+
+async def _work_image_generate(payload: Dict):
+    await generate_image_task(payload["job_id"], payload["api_key_id"], payload["user_id"])
+
+
+async def _work_voice_long_form(payload: Dict):
+    await _run_long_form_voice(payload["task_id"])
+
+
+async def _work_voice_download(payload: Dict):
+    task_id = payload["task_id"]
+    con = db_conn()
+    try:
+        job = con.execute("SELECT status, metadata_json FROM jobs WHERE id = ?", (task_id,)).fetchone()
+        key = con.execute(
+            "SELECT api_key FROM api_keys WHERE id = ? AND provider = 'voicer' AND is_active = 1",
+            (payload.get("key_id"),)
+        ).fetchone()
+    finally:
+        con.close()
+    if not job or job["status"] != "completed":
+        return
+    if key:
+        voicer_key = key["api_key"]
+    else:
+        key_data = get_voicer_api_key(claim=False)
+        if not key_data:
+            raise RuntimeError("No Voicer API keys available")
+        voicer_key = key_data[1]
+    if await ensure_audio_downloaded(task_id, voicer_key) is None:
+        if _json_loads(job["metadata_json"] or "{}").get("long_form"):
+            return
+        raise RuntimeError(f"Audio download failed for {task_id}")
+
+
+async def _work_voice_poll(payload: Dict):
+    """Poll a Voicer job until it finishes (split mode and recovered jobs; otherwise status requests poll)."""
+    task_id = payload["task_id"]
+    con = db_conn()
+    try:
+        job = con.execute("SELECT status, metadata_json FROM jobs WHERE id = ?", (task_id,)).fetchone()
+    finally:
+        con.close()
+    if not job or job["status"] != "processing":
+        return
+    try:
+        result = await _poll_voicer_job(task_id, _json_loads(job["metadata_json"] or "{}"))
+    except HTTPException:
+        raise RetryLater(30)  # No keys configured right now
+    if result.get("status") not in ("completed", "failed"):
+        raise RetryLater(WORK_POLL_SECONDS)
+
+
+async def _work_image_poll(payload: Dict):
+    """Poll a Fast Gen operation until it finishes (split mode and recovered jobs)."""
+    task_id = payload["task_id"]
+    con = db_conn()
+    try:
+        job = con.execute("SELECT status, prompt, metadata_json FROM jobs WHERE id = ?", (task_id,)).fetchone()
+        if not job or job["status"] != "processing":
+            return
+        finished = await _poll_fast_gen_job(con, task_id, _json_loads(job["metadata_json"] or "{}"), job["prompt"])
+    finally:
+        con.close()
+    if finished is None:
+        raise RetryLater(WORK_POLL_SECONDS)
+
+
+WORK_HANDLERS = {
+    "image.generate": _work_image_generate,
+    "image.poll": _work_image_poll,
+    "voice.download": _work_voice_download,
+    "voice.long_form": _work_voice_long_form,
+    "voice.poll": _work_voice_poll,
+}
+
+
+def _work_on_error(item, exc: BaseException, dead: bool):
+    if item is None:
+        log_event("error", "work_queue_error", str(exc))
+        return
+    log_event(
+        "error" if dead else "warning",
+        "work_item_dead" if dead else "work_item_failed",
+        f"{item.kind} #{item.id} failed (attempt {item.attempts}): {exc}",
+        meta={"item_id": item.id, "kind": item.kind, "job_id": item.job_id},
+    )
+
+
+def _requeue_job(con: sqlite3.Connection, task_id: str):
+    """Send an interrupted job back to the queue; the scheduler (or the owner's status poll) restarts it."""
+    row = con.execute("SELECT user_id FROM jobs WHERE id = ?", (task_id,)).fetchone()
+    con.execute(
+        """UPDATE jobs SET status = 'queued', api_key_id = NULL, worker_id = NULL, claimed_at_ms = NULL, started_at_ms = NULL
+           WHERE id = ?""",
+        (task_id,)
+    )
+    if row:
+        _job_status_changed(task_id, row["user_id"])
+
+
+def _recover_job(con: sqlite3.Connection, job: sqlite3.Row) -> str:
+    """Pick how to resume one orphaned job (caller commits). Returns the action taken."""
+    task_id = job["id"]
+    metadata = _json_loads(job["metadata_json"] or "{}")
+
+    def enqueue(kind: str, payload: Dict) -> str:
+        work_queue.enqueue(con, kind, payload, job_id=task_id, dedupe_key=f"{kind}:{task_id}",
+                           max_attempts=WORK_MAX_ATTEMPTS)
+        return kind
+
+    if metadata.get("type") == "image":
+        if metadata.get("whisk_operation_id"):
+            return enqueue("image.poll", {"task_id": task_id})
+        if metadata.get("provider") and metadata.get("full_prompt"):
+            _requeue_job(con, task_id)
+            return "requeued"
+        if not metadata.get("provider") and job["api_key_id"]:
+            # Legacy /api/generate job
+            return enqueue("image.generate", {"job_id": task_id, "api_key_id": job["api_key_id"], "user_id": job["user_id"]})
+    else:
+        if metadata.get("long_form") and metadata.get("full_text"):
+            return enqueue("voice.long_form", {"task_id": task_id})
+        if metadata.get("voicer_task_id"):
+            return enqueue("voice.poll", {"task_id": task_id})
+        if metadata.get("full_text"):
+            _requeue_job(con, task_id)
+            return "requeued"
+
+    # Nothing to resume from: fail and refund like a user cancel
+    con.execute(
+        "UPDATE jobs SET status = 'failed', error = 'Interrupted by server restart', completed_at_ms = ? WHERE id = ?",
+        (now_ms(), task_id)
+    )
+    if job["credits_charged"] and job["credits_charged"] > 0:
+        _add_credit_package(con, job["user_id"], job["credits_charged"], 7, "refund", apply_referral=False)
+        con.execute(
+            "UPDATE users SET credits_used = credits_used - ? WHERE id = ?",
+            (job["credits_charged"], job["user_id"])
+        )
+        _user_changed(job["user_id"])
+    return "failed"
+
+
+def _unfinished_jobs(con: sqlite3.Connection, page: int = 500):
+    """Every pending/processing job, oldest first, read in rowid pages so a sweep never stops at
+    the first `page` rows (live jobs would otherwise hide the orphans behind them)."""
+    cursor = 0
+    while True:
+        rows = con.execute("""
+            SELECT rowid, id, user_id, status, api_key_id, credits_charged, worker_id, metadata_json, created_at_ms, started_at_ms
+            FROM jobs WHERE status IN ('pending', 'processing') AND rowid > ?
+            ORDER BY rowid LIMIT ?
+        """, (cursor, page)).fetchall()
+        yield from rows
+        if len(rows) < page:
+            return
+        cursor = rows[-1]["rowid"]
+
+
+def _recover_orphaned_jobs() -> Dict[str, int]:
+    """Resume pending/processing jobs whose worker is gone (restart, deploy or crash).
+
+    A job is adopted with a compare-and-set on jobs.worker_id, so when several processes sweep
+    at once each job is recovered by exactly one of them.
+    """
+    counts: Dict[str, int] = {}
+    con = db_conn()
+    try:
+        live = work_queue.live_workers(con)
+        con.commit()
+        grace_cutoff = now_ms() - ORPHAN_GRACE_MS
+        for job in _unfinished_jobs(con):
+            owner = job["worker_id"]
+            if owner in live:
+                if UPSTREAM_IN_WORKER and job["status"] == "processing" and not work_queue.has_active(con, job["id"]):
+                    # Backstop for a missed watch: nobody else polls this job in split mode
+                    metadata = _json_loads(job["metadata_json"] or "{}")
+                    _watch_upstream(con, job["id"], metadata)
+                    con.commit()
+                continue
+            if owner is None and (job["started_at_ms"] or job["created_at_ms"] or 0) > grace_cutoff:
+                continue
+            if work_queue.has_active(con, job["id"]):
+                continue
+            cur = con.execute(
+                "UPDATE jobs SET worker_id = ? WHERE id = ? AND status = ? AND worker_id IS ?",
+                (WORKER_ID, job["id"], job["status"], owner)
+            )
+            if cur.rowcount != 1:
+                continue
+            action = _recover_job(con, job)
+            con.commit()
+            counts[action] = counts.get(action, 0) + 1
+    finally:
+        con.close()
+    if counts:
+        _wake_work()
+        log_event("info", "jobs_recovered", f"Recovered {sum(counts.values())} interrupted job(s)", meta=counts)
+    return counts
+
+
+async def work_recovery_loop():
+    """Sweep for orphaned jobs at startup and then once per lease period; purge old finished items,
+    delivered webhooks and expired idempotency keys"""
+    while True:
+        try:
+            _recover_orphaned_jobs()
+            con = db_conn()
+            try:
+                work_queue.purge(con, now_ms() - DAY_MS)
+                con.commit()
+            finally:
+                con.close()
+            await webhook_dispatcher.purge(now_ms() - WEBHOOK_RETENTION_DAYS * DAY_MS)
+            await idempotency_store.purge()
+        except Exception as e:
+            log_event("error", "work_recovery_error", str(e))
+        await asyncio.sleep(WORK_LEASE_SECONDS)
+
+
+@app.get("/api/admin/work-queue")
+async def admin_work_queue(x_admin_token: Optional[str] = Header(None)):
+    """Work queue depth by kind and status, dead letters and live workers"""
+    _require_admin(x_admin_token)
+    
+    con = db_conn()
+    try:
+        return {"ok": True, "worker_id": WORKER_ID, **work_queue.snapshot(con)}
+    finally:
+        con.close()
+
+
+@app.post("/api/admin/work-queue/{item_id}/retry")
+async def admin_retry_work_item(item_id: int, x_admin_token: Optional[str] = Header(None)):
+    """Give a dead work item a fresh set of attempts"""
+    _require_admin(x_admin_token)
+    
+    con = db_conn()
+    try:
+        if not work_queue.retry_dead(con, item_id):
+            raise HTTPException(404, "Dead work item not found")
+        con.commit()
+        job = con.execute(
+            "SELECT j.id, j.user_id FROM work_items w JOIN jobs j ON j.id = w.job_id WHERE w.id = ?", (item_id,)
+        ).fetchone()
+    finally:
+        con.close()
+    if job:
+        _job_status_changed(job["id"], job["user_id"])
+    _wake_work()
+    return {"ok": True}
+
+
+# =============================================================================
+# Result Cache (deduplication of identical requests)
+# =============================================================================
+
+def _image_cache_policy(model_id: str) -> str:
+    """cache_policy for an image model from the registry (off when unset)."""
+    spec = model_registry.get(model_id)
+    return result_cache.normalize_policy(spec.cache_policy if spec else None)
+
+
+def _find_cached_job(con: sqlite3.Connection, request_hash: str, user_id: str) -> Optional[sqlite3.Row]:
+    """The user's most recent reusable job with this fingerprint inside RESULT_CACHE_TTL_SECONDS
+    (never another user's: a hit hands over the job's output).
+
+    Completed jobs are preferred and need their output on disk (or the image data in metadata).
+    In-flight jobs qualify only if they carry an upstream handle a new job can poll on its own.
+    """
+    now = now_ms()
+    rows = con.execute("""
+        SELECT * FROM jobs
+        WHERE request_hash = ? AND user_id = ? AND created_at_ms > ? AND status IN ('completed', 'processing')
+        ORDER BY (status = 'completed') DESC, created_at_ms DESC
+        LIMIT 5
+    """, (request_hash, user_id, now - RESULT_CACHE_TTL_SECONDS * 1000)).fetchall()
+    for row in rows:
+        if row["expires_at_ms"] and now > row["expires_at_ms"]:
+            continue
+        metadata = _json_loads(row["metadata_json"] or "{}")
+        has_file = bool(row["image_path"]) and Path(row["image_path"]).exists()
+        if row["status"] == "completed":
+            if has_file or metadata.get("data_uri"):
+                return row
+            if metadata.get("voicer_task_id") and not metadata.get("long_form"):
+                return row
+        elif metadata.get("whisk_operation_id") or (metadata.get("voicer_task_id") and not metadata.get("long_form")):
+            return row
+    return None
+
+
+def _clone_cached_job(con: sqlite3.Connection, src: sqlite3.Row, task_id: str, user_id: str,
+                      api_key_id: Optional[str], credits_cost: int, request_hash: str,
+                      extra_metadata: Optional[Dict] = None, user_api_key_id: Optional[str] = None) -> Dict:
+    """Insert a new job that reuses src's output (or joins its upstream operation). Caller commits.
+    The output file is copied so each job keeps its own expiry. Returns the new job's metadata."""
+    metadata = _json_loads(src["metadata_json"] or "{}")
+    metadata.update(extra_metadata or {})
+    metadata["cached_from"] = src["id"]
+    metadata.pop("full_text", None)
+    metadata.pop("full_prompt", None)
+    metadata.pop("batch_id", None)
+    metadata.pop("batch_index", None)
+
+    image_path = None
+    if src["status"] == "completed" and src["image_path"] and Path(src["image_path"]).exists():
+        src_path = Path(src["image_path"])
+        dest = src_path.with_name(f"{task_id}{src_path.suffix}")
+        try:
+            shutil.copyfile(src_path, dest)
+            image_path = str(dest)
+        except OSError:
+            image_path = None
+
+    now = now_ms()
+    con.execute("""
+        INSERT INTO jobs (id, user_id, api_key_id, status, prompt, model, width, height, credits_charged, char_count,
+                          created_at_ms, started_at_ms, completed_at_ms, expires_at_ms, image_path, metadata_json, request_hash, worker_id,
+                          user_api_key_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (
+        task_id,
+        user_id,
+        api_key_id or src["api_key_id"],
+        src["status"],
+        src["prompt"],
+        src["model"],
+        src["width"],
+        src["height"],
+        credits_cost,
+        src["char_count"],
+        now,
+        now,
+        now if src["status"] == "completed" else None,
+        now + (12 * 60 * 60 * 1000),
+        image_path,
+        _json_dumps(metadata),
+        request_hash,
+        WORKER_ID,
+        user_api_key_id,
+    ))
+    if src["status"] == "processing":
+        _watch_upstream(con, task_id, metadata)
+    return metadata
+
+
+def _voice_request_hash(body: Dict, text: str, long_form: bool = False) -> Optional[str]:
+    """Fingerprint for a voice request, or None when the voice cache policy does not apply."""
+    if body.get("cache", True) is False:
+        return None
+    if not result_cache.policy_allows(RESULT_CACHE_VOICE_POLICY, body.get("seed")):
+        return None
+    return result_cache.voice_request_hash(
+        body.get("model_id", "eleven_multilingual_v2"), body.get("voice_id"), text, body.get("voice_settings"), long_form
+    )
+
+
+@app.get("/api/admin/result-cache")
+async def admin_result_cache_stats(x_admin_token: Optional[str] = Header(None)):
+    """Result cache hit metrics (in-process counters plus reused jobs in the DB)"""
+    _require_admin(x_admin_token)
+    
     con = db_conn()
     try:
-        job = con.execute("SELECT metadata_json FROM jobs WHERE id = ?", (task_id,)).fetchone()
-        if not job:
-            log_event("error", "task_not_found", f"Task {task_id} not found in database")
-            return None
-        
-        metadata = json.loads(job["metadata_json"] or "{}")
-        voicer_task_id = metadata.get("voicer_task_id")
-        
-        # If no voicer_task_id in metadata, this is an old-style job, use task_id directly
-        if not voicer_task_id:
-            voicer_task_id = task_id
+        since = now_ms() - DAY_MS
+        reused = con.execute("""
+            SELECT COUNT(*) as jobs, COALESCE(SUM(credits_charged), 0) as credits
+            FROM jobs WHERE created_at_ms > ? AND metadata_json LIKE '%"cached_from"%'
+        """, (since,)).fetchone()
+        policies = con.execute(
+            "SELECT model_id, cache_policy FROM model_pricing WHERE cache_policy IS NOT NULL AND cache_policy != 'off'"
+        ).fetchall()
     finally:
         con.close()
     
-    # Try to download from Voicer API with retries
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            async with httpx.AsyncClient(timeout=120) as client:
-                response = await client.get(
-                    f"{VOICER_API_BASE}/voice/download/{voicer_task_id}",
-                    headers={"Authorization": f"Bearer {voicer_key}"}
-                )
-                
-                if response.status_code == 200:
-                    # Save to local file
-                    with open(local_path, "wb") as f:
-                        f.write(response.content)
-                    
-                    # Verify file was written
-                    if Path(local_path).exists() and Path(local_path).stat().st_size > 0:
-                        log_event("info", "audio_downloaded", f"Audio downloaded for task {task_id}", meta={"path": local_path, "attempt": attempt + 1, "task_id": task_id})
-                        
-                        # Update database
-                        con = db_conn()
-                        try:
-                            con.execute("UPDATE jobs SET image_path = ? WHERE id = ?", (local_path, task_id))
-                            con.commit()
-                        finally:
-                            con.close()
-                        
-                        return local_path
-                    else:
-                        log_event("error", "audio_write_failed", f"File write failed for task {task_id}")
-                else:
-                    log_event("error", "audio_download_failed", f"Voicer returned {response.status_code} for task {task_id}", meta={"attempt": attempt + 1, "task_id": task_id})
-        except Exception as e:
-            log_event("error", "audio_download_error", f"Error downloading audio: {e}", meta={"task_id": task_id, "attempt": attempt + 1})
-        
-        # Wait before retry
-        if attempt < max_retries - 1:
-            await asyncio.sleep(2)
-    
-    return None
+    return {
+        "ok": True,
+        "ttl_seconds": RESULT_CACHE_TTL_SECONDS,
+        "voice_policy": result_cache.normalize_policy(RESULT_CACHE_VOICE_POLICY),
+        "image_policies": {p["model_id"]: p["cache_policy"] for p in policies},
+        "process": result_cache.stats.snapshot(),
+        "last_24h": {"reused_jobs": reused["jobs"], "credits_billed_without_upstream_call": reused["credits"]},
+    }
 
 # =============================================================================
 # Image Generation Endpoints (Fast Gen: Imagen 4, Nano Banana, Grok + VoidAI + Naga)
@@ -4619,10 +6968,11 @@ def _naga_resolve_size(aspect_ratio: str) -> str:
     return "1024x1024"
 
 
-async def _naga_images_generate(api_key: str, model: str, prompt: str, size: str) -> dict:
+async def _naga_images_generate(api_key: str, model: str, prompt: str, size: str, key_id: Any = None) -> dict:
     """
     POST /v1/images/generations. Body: model, prompt, size, n=1, response_format=url.
     size from aspect_ratio: 1792x1024, 1024x1792, 1024x1024.
+    Retries provider-side failures through the key's circuit breaker; raises UpstreamError.
     """
     api_url = f"{NAGA_API_BASE.rstrip('/')}/images/generations"
     payload = {
@@ -4636,37 +6986,306 @@ async def _naga_images_generate(api_key: str, model: str, prompt: str, size: str
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json",
     }
-    last_err = None
-    for attempt in range(2):
-        async with httpx.AsyncClient(timeout=120) as client:
-            resp = await client.post(api_url, headers=headers, json=payload)
-        if resp.status_code == 200:
-            return resp.json()
-        err_body = (resp.text or "")[:500]
+    async with httpx.AsyncClient(timeout=120) as client:
+        resp = await _upstream_request(client, "POST", api_url, "naga", key_id or _pool_key_id("naga", api_key), headers=headers, json=payload)
+    if resp.status_code == 200:
+        return resp.json()
+    msg = _upstream_error_message(resp, f"Naga API {resp.status_code}")
+    raise UpstreamError(msg, resp.status_code, is_retryable_status(resp.status_code) or "upstream" in msg.lower())
+
+
+# Pool name in api_keys.provider for each image provider (Flow and Grok share the Fast Gen key)
+IMAGE_KEY_PROVIDER = {"whisk": "whisk", "flow": "whisk", "grok": "whisk", "voidai": "voidai", "naga": "naga"}
+# Providers that return several images for one request ("n"); the others always produce one
+IMAGE_MULTI_PROVIDERS = {"voidai"}
+VOIDAI_SIZE_MAP = {"landscape": "1536x1024", "portrait": "1024x1536", "square": "1024x1024"}
+GROK_ASPECT_MAP = {"landscape": "16:9", "portrait": "9:16", "square": "1:1"}
+
+
+NAGA_SIZE_MAP = {"landscape": "1792x1024", "portrait": "1024x1792", "square": "1024x1024"}
+
+
+def _default_model_routes() -> List[Tuple[str, str, str, Optional[Dict[str, str]]]]:
+    """Built-in (model_id, provider, upstream_model, size_map) rows used to seed model_routes."""
+    routes = [("IMAGEN_4", "whisk", "imagen4", None)]
+    routes += [(m, "flow", m, None) for m in FLOW_MODELS]
+    routes.append((GROK_MODEL, "grok", "grok", GROK_ASPECT_MAP))
+    routes += [(m, "voidai", m, VOIDAI_SIZE_MAP) for m in VOIDAI_MODELS]
+    routes += [(m, "naga", NAGA_MODEL_MAP[m], NAGA_SIZE_MAP) for m in NAGA_MODELS]
+    return routes
+
+
+def _select_image_route(model_old: str):
+    """Pick a route for a model from the registry: weighted pick among active routes,
+    falling back to the next route when a provider has no active keys.
+    Returns (spec, route) or raises HTTPException."""
+    spec = model_registry.get(model_old)
+    if not spec or not spec.routes:
+        raise HTTPException(400, f"Unknown model: {model_old}")
+    if not spec.is_active:
+        raise HTTPException(400, f"Model {model_old} is currently disabled")
+    routes = spec.ordered_routes()
+    if not routes:
+        raise HTTPException(503, f"No active provider route for {model_old}")
+    if len(routes) == 1:
+        return spec, routes[0]
+    for route in routes:
+        if _list_provider_api_keys(IMAGE_KEY_PROVIDER.get(route.provider, route.provider)):
+            return spec, route
+    return spec, routes[0]
+
+
+
+def _normalize_aspect_ratio(value: Optional[str]) -> Tuple[str, str]:
+    """Return (Fast Gen enum, landscape/portrait/square) for a requested aspect ratio."""
+    if value not in ("IMAGE_ASPECT_RATIO_PORTRAIT", "IMAGE_ASPECT_RATIO_LANDSCAPE", "IMAGE_ASPECT_RATIO_SQUARE"):
+        value = "IMAGE_ASPECT_RATIO_LANDSCAPE"
+    if value == "IMAGE_ASPECT_RATIO_LANDSCAPE":
+        return value, "landscape"
+    if value == "IMAGE_ASPECT_RATIO_PORTRAIT":
+        return value, "portrait"
+    return value, "square"
+
+
+def _list_provider_api_keys(provider: str) -> List[Dict]:
+    """All active pool keys for a provider, least recently used first.
+    Fast Gen falls back to env WHISK_API_KEY like get_whisk_api_key()."""
+    con = db_conn()
+    try:
+        rows = con.execute("""
+            SELECT id, api_key, concurrent_limit FROM api_keys
+            WHERE is_active = 1 AND provider = ?
+            ORDER BY last_used_ms ASC NULLS FIRST
+        """, (provider,)).fetchall()
+        keys = [dict(r) for r in rows]
+    finally:
+        con.close()
+    if not keys and provider == "whisk":
+        env_key = os.getenv("WHISK_API_KEY")
+        if env_key:
+            keys.append({"id": "env", "api_key": env_key, "concurrent_limit": MAX_CONCURRENT_PER_KEY})
+    return keys
+
+
+def _upstream_error_message(resp: "httpx.Response", default: str) -> str:
+    """Best-effort error text from an upstream JSON error body."""
+    try:
+        j = resp.json()
+        err = j.get("error") or j.get("detail") or j.get("message")
+        if isinstance(err, dict):
+            msg = err.get("message", default)
+            return f"{err.get('code')}: {msg}" if err.get("code") else msg
+        if isinstance(err, list):
+            return err[0].get("msg", str(err)) if err else default
+        return str(err) if err else default
+    except Exception:
+        return (resp.text or "")[:500] or default
+
+
+async def _voidai_images_generate(api_key: str, model: str, prompt: str, size: str, n: int = 1,
+                                  key_id: Any = None) -> dict:
+    """POST /v1/images/generations on VoidAI (b64_json). Raises UpstreamError with the upstream message."""
+    payload = {
+        "model": model,
+        "prompt": prompt,
+        "n": min(n, 10),
+        "size": size,
+        "response_format": "b64_json",
+        "quality": "standard",
+    }
+    async with httpx.AsyncClient(timeout=120) as client:
+        resp = await _upstream_request(
+            client, "POST", f"{VOIDAI_API_BASE}/images/generations", "voidai", key_id or _pool_key_id("voidai", api_key),
+            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+            json=payload,
+        )
+    if resp.status_code == 200:
+        return resp.json()
+    raise UpstreamError(_upstream_error_message(resp, f"VoidAI API error: {resp.status_code}"),
+                        resp.status_code, is_retryable_status(resp.status_code))
+
+
+def _fast_gen_request(provider: str, model: str, prompt: str, aspect_ratio: str,
+                      aspect_ratio_enum: str, seed: Optional[int], size: Optional[str] = None) -> Tuple[str, Dict]:
+    """Build (url, payload) for a Fast Gen submit (Imagen 4 / Flow / Grok)."""
+    if provider == "flow":
+        flow_ar = aspect_ratio_enum if aspect_ratio_enum in ("IMAGE_ASPECT_RATIO_PORTRAIT", "IMAGE_ASPECT_RATIO_LANDSCAPE") else "IMAGE_ASPECT_RATIO_LANDSCAPE"
+        payload = {"prompt": prompt, "aspect_ratio": flow_ar, "model": model or "GEM_PIX_2"}
+        if seed is not None:
+            payload["seed"] = seed
+        return f"{WHISK_API_BASE}/api/v4/flow/image/generate", payload
+    if provider == "grok":
+        payload = {"prompt": prompt, "aspect_ratio": size or GROK_ASPECT_MAP.get(aspect_ratio, "3:2")}
+        return f"{WHISK_API_BASE}/api/v4/grok/image/generate", payload
+    payload = {"prompt": prompt, "aspect_ratio": aspect_ratio_enum}
+    if seed is not None:
+        payload["seed"] = seed
+    return f"{WHISK_API_BASE}/api/v4/whisk/image/generate", payload
+
+
+async def _fast_gen_submit(api_key: str, url: str, payload: Dict, key_id: Any = None) -> str:
+    """Submit a Fast Gen generation and return its operation_id."""
+    async with httpx.AsyncClient(timeout=120) as client:
+        resp = await _upstream_request(client, "POST", url, "whisk", key_id or _pool_key_id("whisk", api_key),
+                                       headers={"Content-Type": "application/json", "X-API-Key": api_key}, json=payload)
+    if resp.status_code not in (200, 201):
+        raise UpstreamError(_upstream_error_message(resp, f"Fast Gen API error: {resp.status_code}"),
+                            resp.status_code, is_retryable_status(resp.status_code))
+    operation_id = resp.json().get("operation_id")
+    if not operation_id:
+        raise RuntimeError("No operation_id in Fast Gen API response")
+    return operation_id
+
+
+async def _fast_gen_wait(api_key: str, operation_id: str, timeout_s: float, interval_s: float = 3.0) -> List[str]:
+    """Poll GET /api/v4/operations/{id} until success; returns the result data URIs."""
+    deadline = time.monotonic() + timeout_s
+    async with httpx.AsyncClient(timeout=30) as client:
+        while True:
+            resp = await client.get(f"{WHISK_API_BASE}/api/v4/operations/{operation_id}", headers={"X-API-Key": api_key})
+            if resp.status_code == 404:
+                raise RuntimeError("Operation expired or not found")
+            if resp.status_code == 200:
+                op = resp.json()
+                if op.get("status") == "success":
+                    raw = op.get("result")
+                    uris = raw if isinstance(raw, list) else ([raw] if isinstance(raw, str) else [])
+                    if not uris:
+                        raise RuntimeError("No images in Fast Gen result")
+                    return uris
+                if op.get("status") == "error":
+                    err = op.get("error") or op.get("message") or "Generation failed"
+                    raise RuntimeError(err.get("message", str(err)) if isinstance(err, dict) else str(err))
+            if time.monotonic() >= deadline:
+                raise RuntimeError("Timed out waiting for Fast Gen operation")
+            await asyncio.sleep(interval_s)
+
+
+async def _save_image_items(task_id: str, items: List[Any], auth_key: Optional[str] = None) -> List[Dict]:
+    """Store VoidAI/Naga style items ({b64_json} or {url}) under IMAGES_DIR.
+    Decode, validation and writes run in the media pool, all items at once.
+    Returns [{path, url, data_uri, sha256, revised_prompt}] for the items that could be saved."""
+
+    async def save(idx: int, item: Dict) -> Optional[Dict]:
+        b64_raw = item.get("b64_json")
+        url = item.get("url")
+        if b64_raw:
+            source = b64_raw
+        elif url:
+            try:
+                async with httpx.AsyncClient(timeout=60) as dc:
+                    headers = {"User-Agent": "Mozilla/5.0"}
+                    if auth_key:
+                        headers["Authorization"] = f"Bearer {auth_key}"
+                    r = await dc.get(url, headers=headers)
+                    if r.status_code == 403 and auth_key:
+                        r = await dc.get(url, headers={"User-Agent": "Mozilla/5.0"})
+                    if r.status_code != 200:
+                        return None
+                    source = r.content
+            except Exception:
+                return None
+        else:
+            return None
+        suf = f"_{idx}" if len(items) > 1 else ""
         try:
-            j = resp.json()
-            err = j.get("error")
-            msg = err.get("message", err_body) if isinstance(err, dict) else (j.get("message") or err_body)
-        except Exception:
-            msg = err_body or f"Naga API {resp.status_code}"
-        last_err = msg or f"Naga API {resp.status_code}"
-        if attempt == 0 and "upstream" in (last_err or "").lower():
-            await asyncio.sleep(2)
-            continue
-        raise RuntimeError(last_err)
-    raise RuntimeError(last_err)
+            stored = await media_processor.process(source, IMAGES_DIR / f"{task_id}{suf}.png", want_b64=not b64_raw)
+        except (MediaError, OSError) as e:
+            _debug_log(f"[IMAGE] {task_id}: image {idx} rejected: {e}")
+            return None
+        return {
+            "path": stored["path"],
+            "url": url,
+            "data_uri": data_uri(stored.get("b64") or b64_raw, stored["mime"]),
+            "sha256": stored["sha256"],
+            "revised_prompt": item.get("revised_prompt"),
+        }
+
+    saved = await asyncio.gather(*(save(idx, item) for idx, item in enumerate(items) if isinstance(item, dict)))
+    return [p for p in saved if p]
+
+
+async def _save_data_uris(task_id: str, uris: List[str]) -> List[Dict]:
+    """Store Fast Gen result data URIs under IMAGES_DIR (in the media pool). Returns [{path, data_uri, sha256}]."""
+
+    async def save(idx: int, uri: str) -> Dict:
+        suf = f"_{idx}" if idx else ""
+        try:
+            stored = await media_processor.process(uri, IMAGES_DIR / f"{task_id}{suf}.png")
+            return {"path": stored["path"], "data_uri": uri, "sha256": stored["sha256"]}
+        except (MediaError, OSError):
+            return {"path": None, "data_uri": uri, "sha256": None}
+
+    return list(await asyncio.gather(*(save(idx, uri) for idx, uri in enumerate(uris))))
+
+
+async def _execute_image_job(job: Dict, api_key: str, key_id: Any = None) -> List[Dict]:
+    """Run one image job end-to-end against its provider and return the stored images.
+    `job` carries task_id, provider, model, prompt, aspect_ratio, aspect_ratio_enum, seed, num_images.
+    Raises RuntimeError (UpstreamError for provider failures) with a user-facing message."""
+    provider = job["provider"]
+    if provider == "voidai":
+        size = job.get("size") or VOIDAI_SIZE_MAP.get(job["aspect_ratio"], "1024x1024")
+        result = await _voidai_images_generate(api_key, job["model"], job["prompt"], size, job.get("num_images") or 1, key_id)
+        images = await _save_image_items(job["task_id"], result.get("data") or [])
+    elif provider == "naga":
+        result = await _naga_images_generate(api_key, job["model"], job["prompt"], job.get("size") or _naga_resolve_size(job["aspect_ratio"]), key_id)
+        images = await _save_image_items(job["task_id"], result.get("data") or [], auth_key=api_key)
+    else:
+        url, payload = _fast_gen_request(provider, job["model"], job["prompt"], job["aspect_ratio"],
+                                         job["aspect_ratio_enum"], job.get("seed"), job.get("size"))
+        operation_id = await _fast_gen_submit(api_key, url, payload, key_id)
+        con = db_conn()
+        try:
+            row = con.execute("SELECT metadata_json FROM jobs WHERE id = ?", (job["task_id"],)).fetchone()
+            metadata = _json_loads(row["metadata_json"] or "{}") if row else {}
+            metadata["whisk_operation_id"] = operation_id
+            con.execute("UPDATE jobs SET metadata_json = ? WHERE id = ?", (_json_dumps(metadata), job["task_id"]))
+            con.commit()
+        finally:
+            con.close()
+        uris = await _fast_gen_wait(api_key, operation_id, IMAGE_BATCH_POLL_TIMEOUT)
+        images = await _save_data_uris(job["task_id"], uris)
+    if not images:
+        raise RuntimeError(f"No images in {provider} response")
+    return images
+
+
+def _requeue_image_job(task_id: str, metadata: Dict, prompt: str, reason: str):
+    """Put a just-started image job back in the queue after a provider outage. The owner's next
+    status poll restarts it once the provider's circuit breaker lets traffic through again."""
+    metadata["full_prompt"] = prompt
+    metadata.pop("whisk_operation_id", None)
+    con = db_conn()
+    try:
+        row = con.execute("SELECT user_id FROM jobs WHERE id = ?", (task_id,)).fetchone()
+        con.execute(
+            "UPDATE jobs SET status = 'queued', api_key_id = NULL, metadata_json = ? WHERE id = ? AND status = 'processing'",
+            (_json_dumps(metadata), task_id),
+        )
+        con.commit()
+    finally:
+        con.close()
+    if row:
+        _job_status_changed(task_id, row["user_id"])
+    log_event("info", "task_requeued", f"Task {task_id} requeued after provider outage: {reason[:200]}")
 
 
 @app.post("/api/image/generate")
 async def image_generate(
     request: Request,
     authorization: Optional[str] = Header(None),
-    token: Optional[str] = Query(None)
+    token: Optional[str] = Query(None),
+    idempotency_key: Optional[str] = Header(None)
 ):
-    """Generate image using Fast Gen (Imagen 4, Nano Banana, Grok), VoidAI or Naga API"""
+    """Generate image using Fast Gen (Imagen 4, Nano Banana, Grok), VoidAI or Naga API.
+    With an Idempotency-Key header, a repeat returns the first response instead of a new job."""
     tok = _extract_token(authorization, token)
-    user = require_user(tok)
-    
+    user = await require_user(tok)
+    return await _idempotent(request, idempotency_key, user["id"], "image.generate",
+                             lambda: _image_generate(request, user))
+
+async def _image_generate(request: Request, user: Dict):
     body = await request.json()
     prompt = body.get("prompt", "").strip()
     if not prompt:
@@ -4675,95 +7294,93 @@ async def image_generate(
     # Map model from frontend
     model_old = body.get("model", "IMAGEN_4")
     
-    # Determine provider based on model (same Fast Gen API base for Imagen 4, Flow, Grok)
-    is_whisk = model_old == "IMAGEN_4"
-    is_flow = model_old in FLOW_MODELS
-    is_grok = model_old == GROK_MODEL
-    is_voidai = model_old in VOIDAI_MODELS
-    is_naga = model_old in NAGA_MODELS
+    # Route via the model registry: one lookup gives provider, upstream model, price and limits
+    spec, route = _select_image_route(model_old)
+    provider = route.provider
+    model = route.upstream_model
+    
+    # Determine provider (same Fast Gen API base for Imagen 4, Flow, Grok)
+    is_whisk = provider == "whisk"
+    is_flow = provider == "flow"
+    is_grok = provider == "grok"
+    is_voidai = provider == "voidai"
+    is_naga = provider == "naga"
+    
+    _debug_log(f"[IMAGE] Model received: {model_old}, route: {provider}/{model}")
+    
+    # Aspect ratio: keep enum for Fast Gen API; map to landscape/portrait/square for metadata and other providers
+    aspect_ratio_old = body.get("aspect_ratio", "IMAGE_ASPECT_RATIO_LANDSCAPE")
+    if aspect_ratio_old not in ("IMAGE_ASPECT_RATIO_PORTRAIT", "IMAGE_ASPECT_RATIO_LANDSCAPE", "IMAGE_ASPECT_RATIO_SQUARE"):
+        aspect_ratio_old = "IMAGE_ASPECT_RATIO_LANDSCAPE"
+    if aspect_ratio_old == "IMAGE_ASPECT_RATIO_LANDSCAPE":
+        aspect_ratio = "landscape"
+    elif aspect_ratio_old == "IMAGE_ASPECT_RATIO_PORTRAIT":
+        aspect_ratio = "portrait"
+    else:
+        aspect_ratio = "square"
+    
+    seed = body.get("seed")
+    num_images = _parse_num_images(body.get("num_images", 1), spec, model_old, provider)
+    
+    # Result cache: only for models whose policy allows it; clients can opt out with "cache": false
+    request_hash = None
+    if body.get("cache", True) is not False and result_cache.policy_allows(_image_cache_policy(model_old), seed):
+        request_hash = result_cache.image_request_hash(provider, model, prompt, aspect_ratio, seed, num_images)
     
-    _debug_log(f"[IMAGE] Model received: {model_old}, is_whisk: {is_whisk}, is_flow: {is_flow}, is_grok: {is_grok}, is_voidai: {is_voidai}, is_naga: {is_naga}")
+    # A likely cache hit needs no key (picking one would claim a half-open probe for nothing)
+    likely_cached = False
+    if request_hash:
+        con = db_conn()
+        try:
+            likely_cached = _find_cached_job(con, request_hash, user["id"]) is not None
+        finally:
+            con.close()
     
     # Initialize variables
     api_key_id = None
     voidai_api_key = None
     naga_api_key = None
     whisk_api_key = None
-    provider = None
-    model = None
     
-    if is_whisk:
-        key_data = get_whisk_api_key()
-        if not key_data:
-            raise HTTPException(503, "No Fast Gen API key. Add a Fast Gen API key in admin or set WHISK_API_KEY.")
-        api_key_id, whisk_api_key = key_data
-        provider = "whisk"
-        model = "imagen4"
-    elif is_flow:
+    # Open-circuited provider (keys exist, all failing): queue the job until a probe succeeds
+    circuit_wait = False
+    if likely_cached:
+        circuit_wait = True  # Queues only if the cached job is gone by the time this one is saved
+    elif is_whisk or is_flow or is_grok:
         key_data = get_whisk_api_key()
-        if not key_data:
-            raise HTTPException(503, "No Fast Gen API key. Add a Fast Gen API key in admin or set WHISK_API_KEY.")
-        api_key_id, whisk_api_key = key_data
-        provider = "flow"
-        model = model_old  # GEM_PIX, GEM_PIX_2
-    elif is_grok:
-        key_data = get_whisk_api_key()
-        if not key_data:
+        if key_data:
+            api_key_id, whisk_api_key = key_data
+        elif _provider_circuit_open("whisk"):
+            circuit_wait = True
+        else:
             raise HTTPException(503, "No Fast Gen API key. Add a Fast Gen API key in admin or set WHISK_API_KEY.")
-        api_key_id, whisk_api_key = key_data
-        provider = "grok"
-        model = "grok"
     elif is_voidai:
         key_data = get_voidai_api_key()
-        if not key_data:
+        if key_data:
+            api_key_id, voidai_api_key = key_data
+        elif _provider_circuit_open("voidai"):
+            circuit_wait = True
+        else:
             raise HTTPException(503, "No VoidAI API keys configured. Please add a VoidAI API key in the admin panel.")
-        api_key_id, voidai_api_key = key_data
-        model = model_old
-        provider = "voidai"
     elif is_naga:
         key_data = get_naga_api_key()
-        if not key_data:
+        if key_data:
+            api_key_id, naga_api_key = key_data
+        elif _provider_circuit_open("naga"):
+            circuit_wait = True
+        else:
             raise HTTPException(503, "No Naga API keys configured. Please add a Naga API key in the admin panel.")
-        api_key_id, naga_api_key = key_data
-        model = NAGA_MODEL_MAP.get(model_old, "flux-1-schnell:free")
-        provider = "naga"
     else:
-        raise HTTPException(400, f"Unknown model: {model_old}. Use IMAGEN_4, GEM_PIX, GEM_PIX_2, GROK, VoidAI or Naga models.")
+        raise HTTPException(500, f"Model {model_old} is routed to unsupported provider {provider}")
     
     # Validate
-    if not api_key_id or not provider:
+    if (not api_key_id and not circuit_wait) or not provider:
         raise HTTPException(500, f"Failed to initialize provider. api_key_id={api_key_id}, provider={provider}")
     
-    # Aspect ratio: keep enum for Fast Gen API; map to landscape/portrait/square for metadata and other providers
-    aspect_ratio_old = body.get("aspect_ratio", "IMAGE_ASPECT_RATIO_LANDSCAPE")
-    if aspect_ratio_old not in ("IMAGE_ASPECT_RATIO_PORTRAIT", "IMAGE_ASPECT_RATIO_LANDSCAPE", "IMAGE_ASPECT_RATIO_SQUARE"):
-        aspect_ratio_old = "IMAGE_ASPECT_RATIO_LANDSCAPE"
-    if aspect_ratio_old == "IMAGE_ASPECT_RATIO_LANDSCAPE":
-        aspect_ratio = "landscape"
-    elif aspect_ratio_old == "IMAGE_ASPECT_RATIO_PORTRAIT":
-        aspect_ratio = "portrait"
-    else:
-        aspect_ratio = "square"
-    
-    seed = body.get("seed")
-    num_images = body.get("num_images", 1)
-    
     con = db_conn()
     
-    # Get dynamic cost per image from model pricing
-    try:
-        pricing = con.execute(
-            "SELECT credits_per_image FROM model_pricing WHERE model_id = ?",
-            (model_old,)
-        ).fetchone()
-        if pricing:
-            credits_per_image = pricing["credits_per_image"]
-        else:
-            # Default: 1 credit per image
-            credits_per_image = 1
-    except:
-        # Default: 1 credit per image if table doesn't exist or error
-        credits_per_image = 1
+    # Cost per image from the model registry
+    credits_per_image = spec.credits_per_image
     
     # Calculate total cost: credits_per_image * num_images
     credits_cost = credits_per_image * num_images
@@ -4784,7 +7401,11 @@ async def image_generate(
             (user["id"],)
         ).fetchone()["cnt"]
         
-        should_queue = active_processing >= image_concurrent_slots
+        should_queue = circuit_wait or active_processing >= image_concurrent_slots
+        
+        # Load shedding across all users: reject (503 + Retry-After) or defer by plan priority
+        if _admission_check(con, user, "image", IMAGE_KEY_PROVIDER.get(provider, provider)).action == admission.DEFER:
+            should_queue = True
         
         # Deduct credits
         if not _deduct_credits_from_packages(con, user["id"], credits_cost):
@@ -4794,6 +7415,29 @@ async def image_generate(
             "UPDATE users SET credits_used = credits_used + ? WHERE id = ?",
             (credits_cost, user["id"])
         )
+        _user_changed(user["id"])
+        
+        # Identical request already done (or running upstream): reuse it instead of a new upstream call
+        cached = _find_cached_job(con, request_hash, user["id"]) if request_hash else None
+        if cached:
+            cached_meta = _clone_cached_job(con, cached, task_id, user["id"], api_key_id, credits_cost, request_hash)
+            con.commit()
+            result_cache.stats.record_hit("image", model_old, cached["status"] != "completed", num_images)
+            log_event("info", "result_cache_hit", f"Task {task_id} reused {cached['id']}", user_id=user["id"])
+            if cached["status"] == "completed":
+                return {
+                    "ok": True,
+                    "task_id": task_id,
+                    "status": "completed",
+                    "data_uri": cached_meta.get("data_uri"),
+                    "result": cached_meta.get("data_uri") or cached_meta.get("result"),
+                    "all_images": cached_meta.get("all_images"),
+                    "prompt": (prompt or "")[:500],
+                    "cached": True,
+                }
+            return {"ok": True, "task_id": task_id, "status": "processing", "cached": True}
+        if request_hash:
+            result_cache.stats.record_miss("image", model_old)
         
         task_status = "queued" if should_queue else "processing"
         
@@ -4807,13 +7451,15 @@ async def image_generate(
             "aspect_ratio_enum": aspect_ratio_old,
             "model": model,
             "model_old": model_old,
+            "size": route.size_map.get(aspect_ratio),
             "seed": seed,
-            "full_prompt": prompt if task_status == "queued" else None
+            "num_images": num_images,
+            "full_prompt": prompt  # Kept for queued starts and for restarting after a crash
         }
         
         con.execute("""
-            INSERT INTO jobs (id, user_id, api_key_id, status, prompt, model, width, height, credits_charged, char_count, created_at_ms, expires_at_ms, metadata_json)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO jobs (id, user_id, api_key_id, status, prompt, model, width, height, credits_charged, char_count, created_at_ms, expires_at_ms, metadata_json, request_hash, worker_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, (
             task_id,
             user["id"],
@@ -4827,7 +7473,9 @@ async def image_generate(
             0,
             now_ms(),
             expires_at,
-            _json_dumps(metadata)
+            _json_dumps(metadata),
+            request_hash,
+            WORKER_ID
         ))
         
         con.execute(
@@ -4865,7 +7513,7 @@ async def image_generate(
                     "portrait": "1024x1536",
                     "square": "1024x1024"
                 }
-                voidai_size = size_map.get(aspect_ratio, "1024x1024")
+                voidai_size = route.size_map.get(aspect_ratio) or size_map.get(aspect_ratio, "1024x1024")
                 
                 # num_images is already defined earlier in the function
                 voidai_payload = {
@@ -4887,8 +7535,8 @@ async def image_generate(
                         full_url = f"{VOIDAI_API_BASE}/images/generations"
                         _debug_log(f"[IMAGE] VoidAI full URL: {full_url}")
                         
-                        response = await client.post(
-                            full_url,
+                        response = await _upstream_request(
+                            client, "POST", full_url, "voidai", api_key_id,
                             headers={
                                 "Authorization": f"Bearer {voidai_api_key}",
                                 "Content-Type": "application/json"
@@ -4900,6 +7548,10 @@ async def image_generate(
                         _debug_log(f"[IMAGE] VoidAI API response status: {response.status_code}")
                         _debug_log(f"[IMAGE] VoidAI API response body (first 1000 chars): {response_text[:1000]}")
                         
+                        if response.status_code != 200 and is_retryable_status(response.status_code):
+                            await rate_limiter.release_concurrent(api_key_id, user["id"])
+                            _requeue_image_job(task_id, metadata, prompt, f"VoidAI API error: {response.status_code}")
+                            return {"ok": True, "task_id": task_id, "status": "queued"}
                         if response.status_code != 200:
                             await rate_limiter.release_concurrent(api_key_id, user["id"])
                             
@@ -4933,6 +7585,11 @@ async def image_generate(
                                 con2.close()
                             
                             raise HTTPException(response.status_code, error_msg)
+                    except httpx.TransportError as req_err:
+                        # Network/DNS errors that survived the retries: wait in the queue for the provider
+                        await rate_limiter.release_concurrent(api_key_id, user["id"])
+                        _requeue_image_job(task_id, metadata, prompt, f"VoidAI API request failed: {req_err}")
+                        return {"ok": True, "task_id": task_id, "status": "queued"}
                     except httpx.RequestError as req_err:
                         # Network/DNS errors
                         await rate_limiter.release_concurrent(api_key_id, user["id"])
@@ -5019,60 +7676,9 @@ async def image_generate(
                             con2.close()
                         raise HTTPException(500, error_msg)
                     
-                    # Process all images from VoidAI response
-                    IMAGE_DIR = Path(DB_PATH).parent / "images"
-                    IMAGE_DIR.mkdir(exist_ok=True)
-                    
-                    processed_images = []
-                    for idx, image_obj in enumerate(images_data):
-                        img_b64_data = image_obj.get("b64_json")
-                        image_url = image_obj.get("url")
-                        revised_prompt = image_obj.get("revised_prompt")
-                        
-                        if not img_b64_data and not image_url:
-                            _debug_log(f"[IMAGE] VoidAI: Image {idx} has no data (b64_json or url), keys: {list(image_obj.keys())}")
-                            continue
-                        
-                        # Process image data
-                        if img_b64_data:
-                            # Use base64 data directly
-                            try:
-                                img_data = base64.b64decode(img_b64_data)
-                                _debug_log(f"[IMAGE] VoidAI: Image {idx} - Using b64_json data, decoded size: {len(img_data)} bytes")
-                            except Exception as decode_err:
-                                _debug_log(f"[IMAGE] VoidAI: Failed to decode base64 for image {idx}: {str(decode_err)}")
-                                continue
-                        else:
-                            # Download from URL
-                            _debug_log(f"[IMAGE] VoidAI: Image {idx} - Downloading from URL: {image_url[:50]}...")
-                            try:
-                                async with httpx.AsyncClient(timeout=60) as download_client:
-                                    img_response = await download_client.get(image_url)
-                                    if img_response.status_code != 200:
-                                        _debug_log(f"[IMAGE] VoidAI: Failed to download image {idx}: {img_response.status_code}")
-                                        continue
-                                    img_data = img_response.content
-                                    _debug_log(f"[IMAGE] VoidAI: Image {idx} - Downloaded, size: {len(img_data)} bytes")
-                            except Exception as download_err:
-                                _debug_log(f"[IMAGE] VoidAI: Error downloading image {idx}: {str(download_err)}")
-                                continue
-                        
-                        # Save image locally
-                        image_suffix = f"_{idx}" if len(images_data) > 1 else ""
-                        local_path = IMAGE_DIR / f"{task_id}{image_suffix}.png"
-                        with open(local_path, "wb") as f:
-                            f.write(img_data)
-                        
-                        # Convert to base64 data URI for frontend
-                        img_b64 = base64.b64encode(img_data).decode("utf-8")
-                        data_uri = f"data:image/png;base64,{img_b64}"
-                        
-                        processed_images.append({
-                            "path": str(local_path),
-                            "url": image_url,
-                            "data_uri": data_uri,
-                            "revised_prompt": revised_prompt
-                        })
+                    # Decode / download, validate and store all images (media pool)
+                    processed_images = await _save_image_items(task_id, images_data)
+                    _debug_log(f"[IMAGE] VoidAI: stored {len(processed_images)}/{len(images_data)} image(s) for {task_id}")
                     
                     if not processed_images:
                         await rate_limiter.release_concurrent(api_key_id, user["id"])
@@ -5129,12 +7735,15 @@ async def image_generate(
                     return out
             elif is_naga:
                 # Naga: minimal doc payload — model, prompt, 1024x1024, n=1, response_format=url.
-                naga_size = _naga_resolve_size(aspect_ratio)
+                naga_size = route.size_map.get(aspect_ratio) or _naga_resolve_size(aspect_ratio)
                 _debug_log(f"[IMAGE] Naga API: model={model} size={naga_size} n=1 response_format=url")
                 try:
-                    result = await _naga_images_generate(naga_api_key, model, prompt, naga_size)
+                    result = await _naga_images_generate(naga_api_key, model, prompt, naga_size, api_key_id)
                 except Exception as e:
                     await rate_limiter.release_concurrent(api_key_id, user["id"])
+                    if _is_provider_outage(e):
+                        _requeue_image_job(task_id, metadata, prompt, str(e))
+                        return {"ok": True, "task_id": task_id, "status": "queued"}
                     err_msg = str(e)
                     _debug_log(f"[IMAGE] Naga API error: {err_msg}")
                     con2 = db_conn()
@@ -5154,37 +7763,7 @@ async def image_generate(
                     finally:
                         con2.close()
                     raise HTTPException(500, "No images in Naga API response")
-                IMAGE_DIR = Path(DB_PATH).parent / "images"
-                IMAGE_DIR.mkdir(exist_ok=True)
-                processed = []
-                for idx, item in enumerate(data):
-                    b64_raw = getattr(item, "b64_json", None) or (item.get("b64_json") if isinstance(item, dict) else None)
-                    url = getattr(item, "url", None) or (item.get("url") if isinstance(item, dict) else None)
-                    if b64_raw:
-                        try:
-                            img_data = base64.b64decode(b64_raw)
-                        except Exception:
-                            continue
-                    elif url:
-                        try:
-                            async with httpx.AsyncClient(timeout=60) as dc:
-                                r = await dc.get(url, headers={"Authorization": f"Bearer {naga_api_key}", "User-Agent": "Mozilla/5.0"})
-                                if r.status_code == 403:
-                                    r = await dc.get(url, headers={"User-Agent": "Mozilla/5.0"})
-                                if r.status_code != 200:
-                                    continue
-                                img_data = r.content
-                        except Exception:
-                            continue
-                    else:
-                        continue
-                    suf = f"_{idx}" if len(data) > 1 else ""
-                    local_path = IMAGE_DIR / f"{task_id}{suf}.png"
-                    with open(local_path, "wb") as f:
-                        f.write(img_data)
-                    b64 = base64.b64encode(img_data).decode("utf-8")
-                    data_uri = f"data:image/png;base64,{b64}"
-                    processed.append({"path": str(local_path), "url": url, "data_uri": data_uri})
+                processed = await _save_image_items(task_id, data, naga_api_key)
                 if not processed:
                     await rate_limiter.release_concurrent(api_key_id, user["id"])
                     con2 = db_conn()
@@ -5233,13 +7812,17 @@ async def image_generate(
                 _debug_log(f"[IMAGE] Requesting Fast Gen Flow API: {WHISK_API_BASE}/api/v4/flow/image/generate")
                 async with httpx.AsyncClient(timeout=120) as client:
                     try:
-                        response = await client.post(
-                            f"{WHISK_API_BASE}/api/v4/flow/image/generate",
+                        response = await _upstream_request(
+                            client, "POST", f"{WHISK_API_BASE}/api/v4/flow/image/generate", "whisk", api_key_id,
                             headers=whisk_headers,
                             json=flow_payload,
                         )
                         response_text = response.text
                         _debug_log(f"[IMAGE] Flow API response: {response.status_code}, body: {response_text[:500]}")
+                        if response.status_code not in [200, 201] and is_retryable_status(response.status_code):
+                            await rate_limiter.release_concurrent(api_key_id, user["id"])
+                            _requeue_image_job(task_id, metadata, prompt, f"Fast Gen API error: {response.status_code}")
+                            return {"ok": True, "task_id": task_id, "status": "queued"}
                         if response.status_code not in [200, 201]:
                             await rate_limiter.release_concurrent(api_key_id, user["id"])
                             try:
@@ -5277,6 +7860,10 @@ async def image_generate(
                         _debug_log(f"[IMAGE] Flow operation_id: {operation_id}")
                     except HTTPException:
                         raise
+                    except httpx.TransportError as e:
+                        await rate_limiter.release_concurrent(api_key_id, user["id"])
+                        _requeue_image_job(task_id, metadata, prompt, str(e))
+                        return {"ok": True, "task_id": task_id, "status": "queued"}
                     except Exception as e:
                         await rate_limiter.release_concurrent(api_key_id, user["id"])
                         con2 = db_conn()
@@ -5289,7 +7876,7 @@ async def image_generate(
             elif is_grok:
                 # POST /api/v4/grok/image/generate - returns 4 images; aspect_ratio: 1:1, 2:3, 3:2, 9:16, 16:9
                 grok_ar_map = {"landscape": "16:9", "portrait": "9:16", "square": "1:1"}
-                grok_ar = grok_ar_map.get(aspect_ratio, "3:2")
+                grok_ar = route.size_map.get(aspect_ratio) or grok_ar_map.get(aspect_ratio, "3:2")
                 grok_payload = {"prompt": prompt, "aspect_ratio": grok_ar}
                 whisk_headers = {"Content-Type": "application/json"}
                 if whisk_api_key:
@@ -5297,13 +7884,17 @@ async def image_generate(
                 _debug_log(f"[IMAGE] Requesting Fast Gen Grok API: {WHISK_API_BASE}/api/v4/grok/image/generate")
                 async with httpx.AsyncClient(timeout=120) as client:
                     try:
-                        response = await client.post(
-                            f"{WHISK_API_BASE}/api/v4/grok/image/generate",
+                        response = await _upstream_request(
+                            client, "POST", f"{WHISK_API_BASE}/api/v4/grok/image/generate", "whisk", api_key_id,
                             headers=whisk_headers,
                             json=grok_payload,
                         )
                         response_text = response.text
                         _debug_log(f"[IMAGE] Grok API response: {response.status_code}, body: {response_text[:500]}")
+                        if response.status_code not in [200, 201] and is_retryable_status(response.status_code):
+                            await rate_limiter.release_concurrent(api_key_id, user["id"])
+                            _requeue_image_job(task_id, metadata, prompt, f"Fast Gen API error: {response.status_code}")
+                            return {"ok": True, "task_id": task_id, "status": "queued"}
                         if response.status_code not in [200, 201]:
                             await rate_limiter.release_concurrent(api_key_id, user["id"])
                             try:
@@ -5341,6 +7932,10 @@ async def image_generate(
                         _debug_log(f"[IMAGE] Grok operation_id: {operation_id}")
                     except HTTPException:
                         raise
+                    except httpx.TransportError as e:
+                        await rate_limiter.release_concurrent(api_key_id, user["id"])
+                        _requeue_image_job(task_id, metadata, prompt, str(e))
+                        return {"ok": True, "task_id": task_id, "status": "queued"}
                     except Exception as e:
                         await rate_limiter.release_concurrent(api_key_id, user["id"])
                         con2 = db_conn()
@@ -5364,13 +7959,17 @@ async def image_generate(
                 _debug_log(f"[IMAGE] Requesting Fast Gen Whisk (Imagen 4) API: {WHISK_API_BASE}/api/v4/whisk/image/generate")
                 async with httpx.AsyncClient(timeout=120) as client:
                     try:
-                        response = await client.post(
-                            f"{WHISK_API_BASE}/api/v4/whisk/image/generate",
+                        response = await _upstream_request(
+                            client, "POST", f"{WHISK_API_BASE}/api/v4/whisk/image/generate", "whisk", api_key_id,
                             headers=whisk_headers,
                             json=whisk_payload,
                         )
                         response_text = response.text
                         _debug_log(f"[IMAGE] Fast Gen Whisk API response status: {response.status_code}, body: {response_text[:500]}")
+                        if response.status_code not in [200, 201] and is_retryable_status(response.status_code):
+                            await rate_limiter.release_concurrent(api_key_id, user["id"])
+                            _requeue_image_job(task_id, metadata, prompt, f"Fast Gen API error: {response.status_code}")
+                            return {"ok": True, "task_id": task_id, "status": "queued"}
                         if response.status_code not in [200, 201]:
                             await rate_limiter.release_concurrent(api_key_id, user["id"])
                             try:
@@ -5409,6 +8008,10 @@ async def image_generate(
                         _debug_log(f"[IMAGE] Fast Gen operation_id: {operation_id}, task_id: {task_id}")
                     except HTTPException:
                         raise
+                    except httpx.TransportError as e:
+                        await rate_limiter.release_concurrent(api_key_id, user["id"])
+                        _requeue_image_job(task_id, metadata, prompt, str(e))
+                        return {"ok": True, "task_id": task_id, "status": "queued"}
                     except Exception as parse_error:
                         _debug_log(f"[IMAGE] Fast Gen request error: {parse_error}")
                         await rate_limiter.release_concurrent(api_key_id, user["id"])
@@ -5441,16 +8044,330 @@ async def image_generate(
     
     return {"ok": True, "task_id": task_id, "status": task_status}
 
-@app.get("/api/image/status/{task_id}")
-async def image_status(
-    task_id: str,
-    authorization: Optional[str] = Header(None),
-    token: Optional[str] = Query(None)
-):
-    """Get image generation status. Image tasks only."""
-    tok = _extract_token(authorization, token)
-    user = require_user(tok)
-    
+async def _poll_fast_gen_job(con: sqlite3.Connection, task_id: str, metadata: Dict, job_prompt: str) -> Optional[Dict]:
+    """Poll a processing Fast Gen (Whisk/Flow/Grok) operation once and record a final status
+    (image_status and the work queue's recovery polling). None while it is still running."""
+    # Poll Fast Gen API: GET /api/v4/operations/{operation_id}
+    whisk_operation_id = metadata.get("whisk_operation_id")
+    if whisk_operation_id and WHISK_API_BASE:
+        key_data = get_whisk_api_key(claim=False)
+        whisk_key = key_data[1] if key_data else None
+        try:
+            async with httpx.AsyncClient(timeout=30) as client:
+                headers = {"X-API-Key": whisk_key} if whisk_key else {}
+                poll_response = await client.get(
+                    f"{WHISK_API_BASE}/api/v4/operations/{whisk_operation_id}",
+                    headers=headers,
+                )
+                if poll_response.status_code == 404:
+                    # Operation not found or expired (per OpenAPI)
+                    con.execute(
+                        "UPDATE jobs SET status = 'failed', error = ? WHERE id = ?",
+                        ("Operation expired or not found", task_id),
+                    )
+                    con.commit()
+                    return {"status": "failed", "error": "Operation expired or not found", "progress": 0, "prompt": job_prompt}
+                if poll_response.status_code == 200:
+                    op_data = poll_response.json()
+                    op_status = op_data.get("status")
+                    if op_status == "success":
+                        # Per OpenAPI: result is "List of results" (array of strings, e.g. data URIs). Grok returns 4.
+                        raw_result = op_data.get("result")
+                        if isinstance(raw_result, list) and len(raw_result) > 0:
+                            image_data_uri = raw_result[0]
+                            all_uris = raw_result
+                        elif isinstance(raw_result, str):
+                            image_data_uri = raw_result
+                            all_uris = [raw_result]
+                        else:
+                            image_data_uri = None
+                            all_uris = []
+                        if image_data_uri:
+                            try:
+                                image_path = (await media_processor.process(image_data_uri, IMAGES_DIR / f"{task_id}.png"))["path"]
+                            except (MediaError, OSError):
+                                image_path = None
+                            metadata["result"] = image_data_uri
+                            metadata["data_uri"] = image_data_uri
+                            metadata["all_images"] = [{"data_uri": u} for u in all_uris]
+                            con.execute(
+                                "UPDATE jobs SET status = 'completed', error = NULL, completed_at_ms = ?, image_path = ?, metadata_json = ? WHERE id = ?",
+                                (now_ms(), str(image_path) if image_path else None, _json_dumps(metadata), task_id),
+                            )
+                            con.commit()
+                            return {
+                                "status": "completed",
+                                "result": image_data_uri,
+                                "data_uri": image_data_uri,
+                                "all_images": metadata.get("all_images", []),
+                                "progress": 100,
+                                "prompt": job_prompt,
+                            }
+                    elif op_status == "error":
+                        error_msg = op_data.get("error") or op_data.get("message") or "Generation failed"
+                        if isinstance(error_msg, dict):
+                            error_msg = error_msg.get("message", str(error_msg))
+                        con.execute("UPDATE jobs SET status = 'failed', error = ? WHERE id = ?", (error_msg, task_id))
+                        con.commit()
+                        return {"status": "failed", "error": error_msg, "progress": 0, "prompt": job_prompt}
+        except Exception as e:
+            _debug_log(f"[IMAGE] Error polling Fast Gen operation: {e}")
+    return None
+
+
+async def _start_queued_image_job(task_id: str) -> Optional[Dict]:
+    """Start one queued image job (from the fair-share scheduler, or the owner's status poll when the
+    scheduler is off). Returns the job's new status payload, or None if it stays queued."""
+    con = db_conn()
+    try:
+        if not _claim_queued_job(con, task_id):
+            return None
+        job = con.execute("SELECT * FROM jobs WHERE id = ?", (task_id,)).fetchone()
+        user = dict(con.execute("SELECT * FROM users WHERE id = ?", (job["user_id"],)).fetchone())
+        metadata = _json_loads(job["metadata_json"] or "{}")
+        prompt = metadata.get("full_prompt") or job["prompt"]
+        aspect_ratio = metadata.get("aspect_ratio", "landscape")
+        model_old = metadata.get("model_old")
+        is_naga_queued = metadata.get("provider") == "naga"
+
+        if is_naga_queued:
+            key_data = get_naga_api_key()
+            if not key_data:
+                return None
+            api_key_id, naga_api_key = key_data
+            naga_model = metadata.get("model") or NAGA_MODEL_MAP.get(model_old, "flux-1-schnell:free")
+            naga_size = metadata.get("size") or _naga_resolve_size(aspect_ratio)
+            try:
+                await rate_limiter.acquire_concurrent(api_key_id, user["id"])
+                result = await _naga_images_generate(naga_api_key, naga_model, prompt, naga_size, api_key_id)
+            except Exception as e:
+                try:
+                    await rate_limiter.release_concurrent(api_key_id, user["id"])
+                except Exception:
+                    pass
+                if _is_provider_outage(e):
+                    # Provider is down, not the request: stay queued until the breaker lets a probe through
+                    _debug_log(f"[IMAGE] Queued {task_id} waiting on Naga outage: {e}")
+                    return None
+                err_msg = str(e)
+                con.execute("UPDATE jobs SET status = 'failed', error = ? WHERE id = ?", (err_msg, task_id))
+                con.commit()
+                return {"status": "failed", "error": err_msg, "progress": 0, "prompt": (prompt or "")[:500]}
+            data = result.get("data") or []
+            if not data:
+                await rate_limiter.release_concurrent(api_key_id, user["id"])
+                con.execute("UPDATE jobs SET status = 'failed', error = ? WHERE id = ?", ("No images in Naga response", task_id))
+                con.commit()
+                return {"status": "failed", "error": "No images in Naga response", "progress": 0, "prompt": (prompt or "")[:500]}
+            processed = await _save_image_items(task_id, data, naga_api_key)
+            if not processed:
+                await rate_limiter.release_concurrent(api_key_id, user["id"])
+                con.execute("UPDATE jobs SET status = 'failed', error = ? WHERE id = ?", ("Failed to process Naga images", task_id))
+                con.commit()
+                return {"status": "failed", "error": "Failed to process Naga images", "progress": 0, "prompt": (prompt or "")[:500]}
+            primary = processed[0]
+            metadata["data_uri"] = primary["data_uri"]
+            if len(processed) > 1:
+                metadata["all_images"] = processed
+            metadata.pop("full_prompt", None)
+            con.execute(
+                "UPDATE jobs SET status = 'completed', error = NULL, image_path = ?, completed_at_ms = ?, metadata_json = ? WHERE id = ?",
+                (primary["path"], now_ms(), _json_dumps(metadata), task_id),
+            )
+            con.commit()
+            await rate_limiter.release_concurrent(api_key_id, user["id"])
+            all_imgs = [{"data_uri": p["data_uri"], "url": p.get("url")} for p in processed]
+            return {"status": "completed", "result": primary["data_uri"], "data_uri": primary["data_uri"], "all_images": all_imgs, "progress": 100, "prompt": (prompt or "")[:500]}
+
+        if metadata.get("provider") == "voidai":
+            key_data = get_voidai_api_key()
+            if not key_data:
+                return None
+            api_key_id, voidai_api_key = key_data
+            con.execute("UPDATE jobs SET status = 'processing', api_key_id = ?, started_at_ms = ?, worker_id = ? WHERE id = ?",
+                        (api_key_id, now_ms(), WORKER_ID, task_id))
+            con.commit()
+            queued_job = {
+                "task_id": task_id,
+                "provider": "voidai",
+                "model": metadata.get("model") or model_old,
+                "prompt": prompt,
+                "aspect_ratio": aspect_ratio,
+                "size": metadata.get("size"),
+                "num_images": metadata.get("num_images") or 1,
+            }
+            try:
+                await rate_limiter.acquire_concurrent(api_key_id, user["id"])
+                images = await _execute_image_job(queued_job, voidai_api_key, api_key_id)
+            except Exception as e:
+                if _is_provider_outage(e):
+                    con.execute("UPDATE jobs SET status = 'queued', api_key_id = NULL WHERE id = ?", (task_id,))
+                    con.commit()
+                    _debug_log(f"[IMAGE] Queued {task_id} waiting on VoidAI outage: {e}")
+                    return None
+                con.execute("UPDATE jobs SET status = 'failed', error = ? WHERE id = ?", (str(e), task_id))
+                con.commit()
+                return {"status": "failed", "error": str(e), "progress": 0, "prompt": (prompt or "")[:500]}
+            finally:
+                await rate_limiter.release_concurrent(api_key_id, user["id"])
+            _finish_image_job(queued_job, images)
+            all_imgs = [{"data_uri": p["data_uri"], "url": p.get("url")} for p in images]
+            return {"status": "completed", "result": images[0]["data_uri"], "data_uri": images[0]["data_uri"],
+                    "all_images": all_imgs, "progress": 100, "prompt": (prompt or "")[:500]}
+
+        # Queued Fast Gen (Whisk/Flow/Grok): start via same API base
+        is_whisk_queued = metadata.get("provider") == "whisk"
+        is_flow_queued = metadata.get("provider") == "flow"
+        is_grok_queued = metadata.get("provider") == "grok"
+        aspect_ratio_enum = metadata.get("aspect_ratio_enum") or (
+            "IMAGE_ASPECT_RATIO_LANDSCAPE" if aspect_ratio == "landscape" else
+            "IMAGE_ASPECT_RATIO_PORTRAIT" if aspect_ratio == "portrait" else
+            "IMAGE_ASPECT_RATIO_SQUARE"
+        )
+        seed = metadata.get("seed")
+        model_queued = metadata.get("model") or metadata.get("model_old")
+        if is_whisk_queued or is_flow_queued or is_grok_queued:
+            key_data = get_whisk_api_key()
+            if not key_data:
+                return None
+            api_key_id, whisk_api_key = key_data
+            try:
+                await rate_limiter.acquire_concurrent(api_key_id, user["id"])
+                headers = {"Content-Type": "application/json"}
+                if whisk_api_key:
+                    headers["X-API-Key"] = whisk_api_key
+                if is_flow_queued:
+                    flow_ar = aspect_ratio_enum if aspect_ratio_enum in ("IMAGE_ASPECT_RATIO_PORTRAIT", "IMAGE_ASPECT_RATIO_LANDSCAPE") else "IMAGE_ASPECT_RATIO_LANDSCAPE"
+                    payload = {"prompt": prompt, "aspect_ratio": flow_ar, "model": model_queued or "GEM_PIX_2"}
+                    if seed is not None:
+                        payload["seed"] = seed
+                    url = f"{WHISK_API_BASE}/api/v4/flow/image/generate"
+                elif is_grok_queued:
+                    grok_ar = metadata.get("size") or {"landscape": "16:9", "portrait": "9:16", "square": "1:1"}.get(aspect_ratio, "3:2")
+                    payload = {"prompt": prompt, "aspect_ratio": grok_ar}
+                    url = f"{WHISK_API_BASE}/api/v4/grok/image/generate"
+                else:
+                    payload = {"prompt": prompt, "aspect_ratio": aspect_ratio_enum}
+                    if seed is not None:
+                        payload["seed"] = seed
+                    url = f"{WHISK_API_BASE}/api/v4/whisk/image/generate"
+                async with httpx.AsyncClient(timeout=120) as client:
+                    response = await _upstream_request(client, "POST", url, "whisk", api_key_id, headers=headers, json=payload)
+                if response.status_code in [200, 201]:
+                    result = response.json()
+                    operation_id = result.get("operation_id")
+                    if operation_id:
+                        metadata["whisk_operation_id"] = operation_id
+                        metadata.pop("full_prompt", None)
+                        con.execute(
+                            "UPDATE jobs SET status = 'processing', api_key_id = ?, metadata_json = ?, worker_id = ? WHERE id = ?",
+                            (api_key_id, _json_dumps(metadata), WORKER_ID, task_id)
+                        )
+                        _watch_upstream(con, task_id, metadata)
+                        con.commit()
+                        _debug_log(f"[IMAGE] Queued {task_id} → processing (Fast Gen operation_id: {operation_id})")
+                        return {"status": "processing", "progress": 50}
+                await rate_limiter.release_concurrent(api_key_id, user["id"])
+            except Exception as e:
+                try:
+                    await rate_limiter.release_concurrent(api_key_id, user["id"])
+                except Exception:
+                    pass
+                _debug_log(f"[IMAGE] Error starting queued Fast Gen task {task_id}: {e}")
+                if not _is_provider_outage(e):
+                    con.execute("UPDATE jobs SET status = 'failed', error = ? WHERE id = ?", (str(e), task_id))
+                    con.commit()
+                    return {"status": "failed", "error": str(e), "progress": 0, "prompt": (prompt or "")[:500]}
+        return None
+    finally:
+        _release_queued_claim(con, task_id)
+        con.close()
+
+def _compact_image_status(job: Any, metadata: Dict, job_prompt: str) -> Dict:
+    """Completed image status without image bytes: signed URLs (fetched once, browser-cached) and
+    content hashes where the stored image has one."""
+    images = [img for img in metadata.get("all_images") or [] if isinstance(img, dict)] or [{}]
+    entries = []
+    for i, img in enumerate(images):
+        links = _image_links(job["id"], i)
+        entry = {"index": i, "url": links["full_url"], "thumb_url": links["thumb_url"], "preview_url": links["preview_url"]}
+        if img.get("sha256"):
+            entry["sha256"] = img["sha256"]
+        entries.append(entry)
+    return {
+        "status": "completed",
+        "result": entries[0]["url"],
+        "thumb_url": entries[0]["thumb_url"],
+        "preview_url": entries[0]["preview_url"],
+        "all_images": entries,
+        "progress": 100,
+        "prompt": job_prompt
+    }
+
+
+@app.get("/api/image/status/{task_id}")
+async def image_status(
+    task_id: str,
+    request: Request,
+    inline: bool = Query(False),  # true = legacy body with base64 data URIs in result / data_uri / all_images
+    authorization: Optional[str] = Header(None),
+    token: Optional[str] = Query(None)
+):
+    """Get image generation status. Image tasks only.
+
+    By default completed images come back as URLs, and the body carries a "version" that is also
+    its ETag: a poll with If-None-Match gets 304 while nothing has changed."""
+    tok = _extract_token(authorization, token)
+    user = await require_user(tok)
+    
+    if inline:
+        return await _image_status_body(task_id, user)
+    # Finished jobs are served from read_cache; polls of a running job share one read
+    body = await read_cache.get(JOB_STATUS, f"image:{user['id']}:{task_id}",
+                                lambda: _image_status_poll_body(task_id, user), cache_if=_job_finished)
+    headers = {"ETag": f'"{body["version"]}"', "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(body, headers=headers)
+
+
+def _finished_image_status(task_id: str, user: Dict) -> Optional[Dict]:
+    """Compact body of a finished image job from one narrow SELECT (no inline body is built),
+    or None while the job is still running."""
+    con = db_conn()
+    try:
+        job = con.execute("SELECT id, user_id, status, error, prompt, metadata_json FROM jobs WHERE id = ?",
+                          (task_id,)).fetchone()
+    finally:
+        con.close()
+    if not job:
+        raise HTTPException(404, "Task not found")
+    if job["user_id"] != user["id"]:
+        raise HTTPException(403, "Access denied")
+    metadata = _json_loads(job["metadata_json"] or "{}")
+    if metadata.get("type") != "image":
+        raise HTTPException(400, "Not an image task. Use /api/voice/status for voice synthesis.")
+    job_prompt = (job["prompt"] or "")[:500]
+    if job["status"] == "completed" or (job["status"] == "processing" and (metadata.get("data_uri") or metadata.get("result"))):
+        return _compact_image_status(job, metadata, job_prompt)
+    if job["status"] in ("failed", "cancelled"):
+        default = "Generation failed" if job["status"] == "failed" else "Cancelled by user"
+        return {"status": job["status"], "error": job["error"] or default, "progress": 0, "prompt": job_prompt}
+    return None
+
+
+async def _image_status_poll_body(task_id: str, user: Dict) -> Dict:
+    body = _finished_image_status(task_id, user)
+    if body is None:
+        # Running: _image_status_body polls or starts it, and re-reading is only needed if that finished it
+        body = await _image_status_body(task_id, user)
+        if body.get("status") == "completed":
+            body = _finished_image_status(task_id, user) or body
+    body["version"] = hashlib.sha1(_json_dumps(body).encode()).hexdigest()[:16]
+    return body
+
+
+async def _image_status_body(task_id: str, user: Dict) -> Dict:
     con = db_conn()
     try:
         job = con.execute("SELECT * FROM jobs WHERE id = ?", (task_id,)).fetchone()
@@ -5460,7 +8377,7 @@ async def image_status(
         if job["user_id"] != user["id"]:
             raise HTTPException(403, "Access denied")
         
-        metadata = json.loads(job["metadata_json"] or "{}")
+        metadata = _json_loads(job["metadata_json"] or "{}")
         
         # Voice tasks must use /api/voice/status, not image provider
         if metadata.get("type") != "image":
@@ -5474,6 +8391,8 @@ async def image_status(
                 "result": metadata.get("data_uri") or metadata.get("result"),
                 "data_uri": metadata.get("data_uri"),
                 "all_images": metadata.get("all_images"),
+                "thumb_url": _image_url(task_id, "thumb"),
+                "preview_url": _image_url(task_id, "preview"),
                 "progress": 100,
                 "prompt": job_prompt
             }
@@ -5500,80 +8419,16 @@ async def image_status(
                     "result": result,
                     "data_uri": metadata.get("data_uri"),
                     "all_images": metadata.get("all_images"),
+                    "thumb_url": _image_url(task_id, "thumb"),
+                    "preview_url": _image_url(task_id, "preview"),
                     "progress": 100,
                     "prompt": job_prompt
                 }
             
-            # Poll Fast Gen API: GET /api/v4/operations/{operation_id}
-            whisk_operation_id = metadata.get("whisk_operation_id")
-            if whisk_operation_id and WHISK_API_BASE:
-                key_data = get_whisk_api_key()
-                whisk_key = key_data[1] if key_data else None
-                try:
-                    async with httpx.AsyncClient(timeout=30) as client:
-                        headers = {"X-API-Key": whisk_key} if whisk_key else {}
-                        poll_response = await client.get(
-                            f"{WHISK_API_BASE}/api/v4/operations/{whisk_operation_id}",
-                            headers=headers,
-                        )
-                        if poll_response.status_code == 404:
-                            # Operation not found or expired (per OpenAPI)
-                            con.execute(
-                                "UPDATE jobs SET status = 'failed', error = ? WHERE id = ?",
-                                ("Operation expired or not found", task_id),
-                            )
-                            con.commit()
-                            return {"status": "failed", "error": "Operation expired or not found", "progress": 0, "prompt": job_prompt}
-                        if poll_response.status_code == 200:
-                            op_data = poll_response.json()
-                            op_status = op_data.get("status")
-                            if op_status == "success":
-                                # Per OpenAPI: result is "List of results" (array of strings, e.g. data URIs). Grok returns 4.
-                                raw_result = op_data.get("result")
-                                if isinstance(raw_result, list) and len(raw_result) > 0:
-                                    image_data_uri = raw_result[0]
-                                    all_uris = raw_result
-                                elif isinstance(raw_result, str):
-                                    image_data_uri = raw_result
-                                    all_uris = [raw_result]
-                                else:
-                                    image_data_uri = None
-                                    all_uris = []
-                                if image_data_uri:
-                                    _IMAGES_DIR = Path(DB_PATH).parent / "images"
-                                    _IMAGES_DIR.mkdir(exist_ok=True)
-                                    image_path = _IMAGES_DIR / f"{task_id}.png"
-                                    try:
-                                        raw = base64.b64decode(image_data_uri.split(",", 1)[-1]) if "," in image_data_uri else base64.b64decode(image_data_uri)
-                                        with open(image_path, "wb") as f:
-                                            f.write(raw)
-                                    except Exception:
-                                        image_path = None
-                                    metadata["result"] = image_data_uri
-                                    metadata["data_uri"] = image_data_uri
-                                    metadata["all_images"] = [{"data_uri": u} for u in all_uris]
-                                    con.execute(
-                                        "UPDATE jobs SET status = 'completed', error = NULL, completed_at_ms = ?, image_path = ?, metadata_json = ? WHERE id = ?",
-                                        (now_ms(), str(image_path) if image_path else None, _json_dumps(metadata), task_id),
-                                    )
-                                    con.commit()
-                                    return {
-                                        "status": "completed",
-                                        "result": image_data_uri,
-                                        "data_uri": image_data_uri,
-                                        "all_images": metadata.get("all_images", []),
-                                        "progress": 100,
-                                        "prompt": job_prompt,
-                                    }
-                            elif op_status == "error":
-                                error_msg = op_data.get("error") or op_data.get("message") or "Generation failed"
-                                if isinstance(error_msg, dict):
-                                    error_msg = error_msg.get("message", str(error_msg))
-                                con.execute("UPDATE jobs SET status = 'failed', error = ? WHERE id = ?", (error_msg, task_id))
-                                con.commit()
-                                return {"status": "failed", "error": error_msg, "progress": 0, "prompt": job_prompt}
-                except Exception as e:
-                    _debug_log(f"[IMAGE] Error polling Fast Gen operation: {e}")
+            # In split mode an "image.poll" work item polls the operation instead
+            finished = None if UPSTREAM_IN_WORKER else await _poll_fast_gen_job(con, task_id, metadata, job_prompt)
+            if finished:
+                return finished
             
             # Still processing
             return {"status": "processing", "progress": 50}
@@ -5601,159 +8456,12 @@ async def image_status(
                 ).fetchone()["pos"]
                 return {"status": "queued", "progress": 0, "queue_position": position + 1}
 
-            if active_processing < image_concurrent_slots:
-                metadata = json.loads(job["metadata_json"] or "{}")
-                prompt = metadata.get("full_prompt") or job["prompt"]
-                aspect_ratio = metadata.get("aspect_ratio", "landscape")
-                model_old = metadata.get("model_old")
-                is_naga_queued = metadata.get("provider") == "naga" and model_old in NAGA_MODELS
-
-                if is_naga_queued:
-                    key_data = get_naga_api_key()
-                    if not key_data:
-                        position = con.execute(
-                            f"""SELECT COUNT(*) as pos FROM jobs WHERE user_id = ? AND status = 'queued' AND {image_filter}
-                                AND created_at_ms < ?""",
-                            (user["id"], job["created_at_ms"])
-                        ).fetchone()["pos"]
-                        return {"status": "queued", "progress": 0, "queue_position": position + 1}
-                    api_key_id, naga_api_key = key_data
-                    naga_model = NAGA_MODEL_MAP.get(model_old, "flux-1-schnell:free")
-                    naga_size = _naga_resolve_size(aspect_ratio)
-                    try:
-                        await rate_limiter.acquire_concurrent(api_key_id, user["id"])
-                        result = await _naga_images_generate(naga_api_key, naga_model, prompt, naga_size)
-                    except Exception as e:
-                        try:
-                            await rate_limiter.release_concurrent(api_key_id, user["id"])
-                        except Exception:
-                            pass
-                        err_msg = str(e)
-                        con.execute("UPDATE jobs SET status = 'failed', error = ? WHERE id = ?", (err_msg, task_id))
-                        con.commit()
-                        return {"status": "failed", "error": err_msg, "progress": 0, "prompt": (prompt or "")[:500]}
-                    data = result.get("data") or []
-                    if not data:
-                        await rate_limiter.release_concurrent(api_key_id, user["id"])
-                        con.execute("UPDATE jobs SET status = 'failed', error = ? WHERE id = ?", ("No images in Naga response", task_id))
-                        con.commit()
-                        return {"status": "failed", "error": "No images in Naga response", "progress": 0, "prompt": (prompt or "")[:500]}
-                    IMAGE_DIR = Path(DB_PATH).parent / "images"
-                    IMAGE_DIR.mkdir(exist_ok=True)
-                    processed = []
-                    for idx, item in enumerate(data):
-                        b64_raw = getattr(item, "b64_json", None) or (item.get("b64_json") if isinstance(item, dict) else None)
-                        url = getattr(item, "url", None) or (item.get("url") if isinstance(item, dict) else None)
-                        if b64_raw:
-                            try:
-                                img_data = base64.b64decode(b64_raw)
-                            except Exception:
-                                continue
-                        elif url:
-                            try:
-                                async with httpx.AsyncClient(timeout=60) as dc:
-                                    dr = await dc.get(url, headers={"Authorization": f"Bearer {naga_api_key}", "User-Agent": "Mozilla/5.0"})
-                                    if dr.status_code == 403:
-                                        dr = await dc.get(url, headers={"User-Agent": "Mozilla/5.0"})
-                                    if dr.status_code != 200:
-                                        continue
-                                    img_data = dr.content
-                            except Exception:
-                                continue
-                        else:
-                            continue
-                        suf = f"_{idx}" if len(data) > 1 else ""
-                        lp = IMAGE_DIR / f"{task_id}{suf}.png"
-                        with open(lp, "wb") as f:
-                            f.write(img_data)
-                        b64 = base64.b64encode(img_data).decode("utf-8")
-                        du = f"data:image/png;base64,{b64}"
-                        processed.append({"path": str(lp), "url": url, "data_uri": du})
-                    if not processed:
-                        await rate_limiter.release_concurrent(api_key_id, user["id"])
-                        con.execute("UPDATE jobs SET status = 'failed', error = ? WHERE id = ?", ("Failed to process Naga images", task_id))
-                        con.commit()
-                        return {"status": "failed", "error": "Failed to process Naga images", "progress": 0, "prompt": (prompt or "")[:500]}
-                    primary = processed[0]
-                    metadata["data_uri"] = primary["data_uri"]
-                    if len(processed) > 1:
-                        metadata["all_images"] = processed
-                    metadata.pop("full_prompt", None)
-                    con.execute(
-                        "UPDATE jobs SET status = 'completed', error = NULL, image_path = ?, completed_at_ms = ?, metadata_json = ? WHERE id = ?",
-                        (primary["path"], now_ms(), _json_dumps(metadata), task_id),
-                    )
-                    con.commit()
-                    await rate_limiter.release_concurrent(api_key_id, user["id"])
-                    all_imgs = [{"data_uri": p["data_uri"], "url": p.get("url")} for p in processed]
-                    return {"status": "completed", "result": primary["data_uri"], "data_uri": primary["data_uri"], "all_images": all_imgs, "progress": 100, "prompt": (prompt or "")[:500]}
-
-                # Queued Fast Gen (Whisk/Flow/Grok): start via same API base
-                is_whisk_queued = metadata.get("provider") == "whisk"
-                is_flow_queued = metadata.get("provider") == "flow"
-                is_grok_queued = metadata.get("provider") == "grok"
-                aspect_ratio_enum = metadata.get("aspect_ratio_enum") or (
-                    "IMAGE_ASPECT_RATIO_LANDSCAPE" if aspect_ratio == "landscape" else
-                    "IMAGE_ASPECT_RATIO_PORTRAIT" if aspect_ratio == "portrait" else
-                    "IMAGE_ASPECT_RATIO_SQUARE"
-                )
-                seed = metadata.get("seed")
-                model_queued = metadata.get("model_old")
-                if is_whisk_queued or is_flow_queued or is_grok_queued:
-                    key_data = get_whisk_api_key()
-                    if not key_data:
-                        position = con.execute(
-                            f"""SELECT COUNT(*) as pos FROM jobs WHERE user_id = ? AND status = 'queued' AND {image_filter}
-                                AND created_at_ms < ?""",
-                            (user["id"], job["created_at_ms"])
-                        ).fetchone()["pos"]
-                        return {"status": "queued", "progress": 0, "queue_position": position + 1}
-                    api_key_id, whisk_api_key = key_data
-                    try:
-                        await rate_limiter.acquire_concurrent(api_key_id, user["id"])
-                        headers = {"Content-Type": "application/json"}
-                        if whisk_api_key:
-                            headers["X-API-Key"] = whisk_api_key
-                        if is_flow_queued:
-                            flow_ar = aspect_ratio_enum if aspect_ratio_enum in ("IMAGE_ASPECT_RATIO_PORTRAIT", "IMAGE_ASPECT_RATIO_LANDSCAPE") else "IMAGE_ASPECT_RATIO_LANDSCAPE"
-                            payload = {"prompt": prompt, "aspect_ratio": flow_ar, "model": model_queued or "GEM_PIX_2"}
-                            if seed is not None:
-                                payload["seed"] = seed
-                            url = f"{WHISK_API_BASE}/api/v4/flow/image/generate"
-                        elif is_grok_queued:
-                            grok_ar = {"landscape": "16:9", "portrait": "9:16", "square": "1:1"}.get(aspect_ratio, "3:2")
-                            payload = {"prompt": prompt, "aspect_ratio": grok_ar}
-                            url = f"{WHISK_API_BASE}/api/v4/grok/image/generate"
-                        else:
-                            payload = {"prompt": prompt, "aspect_ratio": aspect_ratio_enum}
-                            if seed is not None:
-                                payload["seed"] = seed
-                            url = f"{WHISK_API_BASE}/api/v4/whisk/image/generate"
-                        async with httpx.AsyncClient(timeout=120) as client:
-                            response = await client.post(url, headers=headers, json=payload)
-                        if response.status_code in [200, 201]:
-                            result = response.json()
-                            operation_id = result.get("operation_id")
-                            if operation_id:
-                                metadata["whisk_operation_id"] = operation_id
-                                metadata.pop("full_prompt", None)
-                                con.execute(
-                                    "UPDATE jobs SET status = 'processing', metadata_json = ? WHERE id = ?",
-                                    (_json_dumps(metadata), task_id)
-                                )
-                                con.commit()
-                                _debug_log(f"[IMAGE] Queued {task_id} → processing (Fast Gen operation_id: {operation_id})")
-                                return {"status": "processing", "progress": 50}
-                        await rate_limiter.release_concurrent(api_key_id, user["id"])
-                    except Exception as e:
-                        try:
-                            await rate_limiter.release_concurrent(api_key_id, user["id"])
-                        except Exception:
-                            pass
-                        _debug_log(f"[IMAGE] Error starting queued Fast Gen task {task_id}: {e}")
-                        con.execute("UPDATE jobs SET status = 'failed', error = ? WHERE id = ?", (str(e), task_id))
-                        con.commit()
-                        return {"status": "failed", "error": str(e), "progress": 0, "prompt": (prompt or "")[:500]}
+            # With the scheduler on, scheduler_dispatch_loop starts queued jobs in fair-share order
+            if not SCHEDULER_ENABLED and active_processing < image_concurrent_slots and _admission_can_start(
+                    con, user, "image", IMAGE_KEY_PROVIDER.get(metadata.get("provider"), "whisk")):
+                started = await _start_queued_image_job(task_id)
+                if started:
+                    return started
 
             position = con.execute(
                 f"""SELECT COUNT(*) as pos FROM jobs WHERE user_id = ? AND status = 'queued' AND {image_filter}
@@ -5773,7 +8481,7 @@ async def get_active_image_tasks(
 ):
     """Get user's active image generation tasks"""
     tok = _extract_token(authorization, token)
-    user = require_user(tok)
+    user = await require_user(tok)
     
     con = db_conn()
     try:
@@ -5787,7 +8495,7 @@ async def get_active_image_tasks(
         
         result = []
         for j in jobs:
-            metadata = json.loads(j["metadata_json"] or "{}")
+            metadata = _slim_image_metadata(j, _json_loads(j["metadata_json"] or "{}"))
             
             queue_position = None
             if j["status"] == "queued":
@@ -5807,6 +8515,8 @@ async def get_active_image_tasks(
                 "progress": 50 if j["status"] == "processing" else 0,
                 "created_at_ms": j["created_at_ms"],
                 "result": metadata.get("result"),
+                "thumb_url": metadata.get("thumb_url"),
+                "preview_url": metadata.get("preview_url"),
                 "queue_position": queue_position
             })
         
@@ -5816,6 +8526,472 @@ async def get_active_image_tasks(
     finally:
         con.close()
 
+# =============================================================================
+# Batch Image Generation
+# =============================================================================
+
+def _parse_num_images(value: Any, spec, model_old: str, provider: str, where: str = "") -> int:
+    """num_images from a request body as an int in 1..spec.max_images, and 1 for providers that
+    return a single image (400 otherwise, never a TypeError): credits are charged per image asked for."""
+    if isinstance(value, bool):
+        value = None
+    try:
+        num_images = int(value) if value is not None else 1
+    except (TypeError, ValueError, OverflowError):
+        raise HTTPException(400, f"{where}num_images must be an integer")
+    if num_images < 1:
+        raise HTTPException(400, f"{where}num_images must be at least 1")
+    if num_images > spec.max_images:
+        raise HTTPException(400, f"{where}num_images for {model_old} is limited to {spec.max_images}")
+    if num_images > 1 and provider not in IMAGE_MULTI_PROVIDERS:
+        raise HTTPException(400, f"{where}{model_old} returns one image per request; send num_images 1")
+    return num_images
+
+
+def _create_image_batch(user: Dict, body: Dict, user_api_key_id: Optional[str] = None) -> Tuple[str, List[Dict], int]:
+    """Validate a batch request, charge credits once and insert every job in one transaction.
+    user_api_key_id: the /api/v1 key, whose webhook (if any) then gets an event per finished job.
+
+    Body: {"prompts": [...]} or {"items": [{"prompt", "model", "aspect_ratio", "seed", "num_images"}]};
+    top-level model/aspect_ratio/seed/num_images are the defaults for every item.
+    Returns (batch_id, jobs, credits_cost). Jobs start as 'pending' and are dispatched by _run_image_batch,
+    or with WORKER_MODE=api as 'queued' for the worker tier's scheduler to start.
+    """
+    raw_items = body.get("items")
+    if raw_items is None:
+        raw_items = [{"prompt": p} for p in (body.get("prompts") or [])]
+    if not isinstance(raw_items, list) or not raw_items:
+        raise HTTPException(400, "Provide a non-empty 'prompts' or 'items' list")
+    if len(raw_items) > IMAGE_BATCH_MAX_ITEMS:
+        raise HTTPException(400, f"Too many items in batch. Max {IMAGE_BATCH_MAX_ITEMS}")
+
+    default_model = body.get("model", "IMAGEN_4")
+    default_aspect = body.get("aspect_ratio", "IMAGE_ASPECT_RATIO_LANDSCAPE")
+    default_seed = body.get("seed")
+    default_num = body.get("num_images", 1)
+
+    items = []
+    for idx, raw in enumerate(raw_items):
+        if isinstance(raw, str):
+            raw = {"prompt": raw}
+        if not isinstance(raw, dict):
+            raise HTTPException(400, f"Item {idx}: expected an object or a prompt string")
+        prompt = (raw.get("prompt") or "").strip()
+        if not prompt:
+            raise HTTPException(400, f"Item {idx}: prompt is required")
+        model_old = raw.get("model", default_model)
+        try:
+            spec, route = _select_image_route(model_old)
+        except HTTPException as e:
+            raise HTTPException(e.status_code, f"Item {idx}: {e.detail}")
+        aspect_enum, aspect_ratio = _normalize_aspect_ratio(raw.get("aspect_ratio", default_aspect))
+        num_images = _parse_num_images(raw.get("num_images", default_num), spec, model_old, route.provider, f"Item {idx}: ")
+        items.append({
+            "index": idx,
+            "prompt": prompt,
+            "model_old": model_old,
+            "provider": route.provider,
+            "model": route.upstream_model,
+            "size": route.size_map.get(aspect_ratio),
+            "aspect_ratio": aspect_ratio,
+            "aspect_ratio_enum": aspect_enum,
+            "seed": raw.get("seed", default_seed),
+            "num_images": num_images,
+            "credits": spec.credits_per_image * num_images,
+        })
+
+    # Fail fast if a provider has no keys at all, before anything is charged
+    for pool in {IMAGE_KEY_PROVIDER[it["provider"]] for it in items}:
+        if not _list_provider_api_keys(pool):
+            raise HTTPException(503, f"No {pool} API keys configured")
+
+    batch_id = f"batch_{uuid.uuid4().hex[:16]}"
+    credits_cost = sum(it["credits"] for it in items)
+    con = db_conn()
+    try:
+        # Batch items wait in the batch's own queue, so only a full queue (reject) applies
+        pool_units: Dict[str, int] = {}
+        for it in items:
+            pool = IMAGE_KEY_PROVIDER[it["provider"]]
+            pool_units[pool] = pool_units.get(pool, 0) + 1
+        for pool, units in pool_units.items():
+            _admission_check(con, user, "image", pool, units)
+
+        total_credits = _get_total_credits_from_packages(con, user["id"])
+        if total_credits < credits_cost:
+            raise HTTPException(402, f"Insufficient credits. Need {credits_cost}, have {total_credits}")
+        if not _deduct_credits_from_packages(con, user["id"], credits_cost):
+            raise HTTPException(402, "Failed to deduct credits")
+        con.execute("UPDATE users SET credits_used = credits_used + ? WHERE id = ?", (credits_cost, user["id"]))
+        _user_changed(user["id"])
+
+        created = now_ms()
+        expires_at = created + (12 * 60 * 60 * 1000)
+        # API-only processes make no upstream calls: the worker tier starts queued jobs
+        status, worker_id = ("queued", None) if API_ONLY else ("pending", WORKER_ID)
+        rows = []
+        for it in items:
+            it["task_id"] = _generate_task_id()
+            metadata = {
+                "type": "image",
+                "provider": it["provider"],
+                "aspect_ratio": it["aspect_ratio"],
+                "aspect_ratio_enum": it["aspect_ratio_enum"],
+                "model": it["model"],
+                "model_old": it["model_old"],
+                "size": it["size"],
+                "seed": it["seed"],
+                "full_prompt": it["prompt"],
+                "num_images": it["num_images"],
+                "batch_id": batch_id,
+                "batch_index": it["index"],
+            }
+            rows.append((
+                it["task_id"], user["id"], status, it["prompt"][:500], it["model"],
+                0, 0, it["credits"], 0, created, expires_at, _json_dumps(metadata), worker_id, user_api_key_id,
+            ))
+        con.executemany("""
+            INSERT INTO jobs (id, user_id, status, prompt, model, width, height, credits_charged, char_count, created_at_ms, expires_at_ms,
+                              metadata_json, worker_id, user_api_key_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        con.commit()
+    except HTTPException:
+        con.rollback()
+        raise
+    except Exception as e:
+        con.rollback()
+        raise HTTPException(500, f"Database error: {str(e)}")
+    finally:
+        con.close()
+
+    log_event("info", "batch_created", f"Image batch {batch_id}: {len(items)} item(s), {credits_cost} credits", user_id=user["id"])
+    return batch_id, items, credits_cost
+
+
+def _finish_image_job(job: Dict, images: List[Dict]):
+    """Mark a batch job completed with the same metadata shape as /api/image/generate. Images asked
+    for but not returned by the provider are refunded."""
+    con = db_conn()
+    try:
+        row = con.execute("SELECT user_id, credits_charged, metadata_json FROM jobs WHERE id = ?", (job["task_id"],)).fetchone()
+        metadata = _json_loads(row["metadata_json"] or "{}") if row else {}
+        primary = images[0]
+        metadata["result"] = primary["data_uri"]
+        metadata["data_uri"] = primary["data_uri"]
+        if primary.get("url"):
+            metadata["result_url"] = primary["url"]
+        if primary.get("revised_prompt"):
+            metadata["revised_prompt"] = primary["revised_prompt"]
+        metadata["all_images"] = [
+            {"data_uri": p["data_uri"], "url": p.get("url"), "sha256": p.get("sha256"), "revised_prompt": p.get("revised_prompt")}
+            for p in images
+        ]
+        metadata.pop("full_prompt", None)
+        missing = max(0, (job.get("num_images") or 1) - len(images))
+        refund = (row["credits_charged"] or 0) * missing // (job.get("num_images") or 1) if row and missing else 0
+        if refund:
+            metadata["images_missing"] = missing
+            _add_credit_package(con, row["user_id"], refund, 7, "refund", apply_referral=False)
+            con.execute("UPDATE users SET credits_used = credits_used - ? WHERE id = ?", (refund, row["user_id"]))
+        con.execute(
+            """UPDATE jobs SET status = 'completed', error = NULL, image_path = ?, completed_at_ms = ?, metadata_json = ?,
+                   credits_charged = credits_charged - ? WHERE id = ?""",
+            (primary.get("path"), now_ms(), _json_dumps(metadata), refund, job["task_id"]),
+        )
+        con.commit()
+        if refund:
+            _user_changed(row["user_id"])
+    finally:
+        con.close()
+
+
+def _fail_image_job(job: Dict, api_key_id: Optional[str], error: str):
+    con = db_conn()
+    try:
+        con.execute(
+            "UPDATE jobs SET status = 'failed', error = ?, completed_at_ms = ? WHERE id = ?",
+            (error[:1000], now_ms(), job["task_id"]),
+        )
+        if api_key_id and api_key_id != "env":
+            con.execute("UPDATE api_keys SET failed_requests = failed_requests + 1 WHERE id = ?", (api_key_id,))
+        con.commit()
+    finally:
+        con.close()
+
+
+async def _run_image_batch(user_id: str, batch_id: str, jobs: List[Dict], events: "asyncio.Queue"):
+    """Fan batch jobs out over every active key of their provider pool.
+
+    Each key gets `concurrent_limit` workers pulling from a shared per-pool queue, and a semaphore
+    caps in-flight upstream calls for the batch at the user's image_concurrent_slots (the limit
+    single /api/image/generate requests get) and IMAGE_BATCH_MAX_CONCURRENCY. A result event is
+    put on `events` for every job, followed by None once the batch is drained.
+    """
+    con = db_conn()
+    try:
+        row = con.execute("SELECT image_concurrent_slots FROM users WHERE id = ?", (user_id,)).fetchone()
+    finally:
+        con.close()
+    slots = row["image_concurrent_slots"] if row and row["image_concurrent_slots"] is not None else 3
+    global_sem = asyncio.Semaphore(max(1, min(IMAGE_BATCH_MAX_CONCURRENCY, slots)))
+    pools: Dict[str, "asyncio.Queue"] = {}
+    for job in jobs:
+        pools.setdefault(IMAGE_KEY_PROVIDER[job["provider"]], asyncio.Queue()).put_nowait(job)
+
+    async def run_one(job: Dict, key: Dict):
+        api_key_id = key["id"]
+        con = db_conn()
+        try:
+            con.execute(
+                "UPDATE jobs SET status = 'processing', api_key_id = ?, started_at_ms = ?, worker_id = ? WHERE id = ? AND status = 'pending'",
+                (api_key_id, now_ms(), WORKER_ID, job["task_id"]),
+            )
+            if api_key_id != "env":
+                con.execute(
+                    "UPDATE api_keys SET total_requests = total_requests + 1, last_used_ms = ? WHERE id = ?",
+                    (now_ms(), api_key_id),
+                )
+            con.commit()
+        finally:
+            con.close()
+        try:
+            images = await _execute_image_job(job, key["api_key"], api_key_id)
+        except Exception as e:
+            _fail_image_job(job, api_key_id, str(e) or e.__class__.__name__)
+            return {"task_id": job["task_id"], "index": job["index"], "status": "failed", "error": str(e)}
+        _finish_image_job(job, images)
+        return {
+            "task_id": job["task_id"],
+            "index": job["index"],
+            "status": "completed",
+            "data_uri": images[0]["data_uri"],
+            "result": images[0]["data_uri"],
+            "all_images": [{"data_uri": p["data_uri"], "url": p.get("url")} for p in images],
+        }
+
+    async def key_worker(queue: "asyncio.Queue", pool: str, key: Dict):
+        while True:
+            try:
+                job = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            # Acquired only with a job in hand: a half-open probe taken here always gets its outcome recorded
+            if not breakers.acquire(pool, key["id"]):
+                # Open circuit: healthy keys drain the queue; this one waits for its half-open probe
+                queue.put_nowait(job)
+                await asyncio.sleep(1.0)
+                continue
+            async with global_sem:
+                try:
+                    event = await run_one(job, key)
+                except Exception as e:
+                    _fail_image_job(job, key["id"], str(e))
+                    event = {"task_id": job["task_id"], "index": job["index"], "status": "failed", "error": str(e)}
+            await events.put(event)
+
+    workers = []
+    for pool, queue in pools.items():
+        keys = _list_provider_api_keys(pool)
+        if not keys:
+            while not queue.empty():
+                job = queue.get_nowait()
+                _fail_image_job(job, None, f"No {pool} API keys available")
+                await events.put({"task_id": job["task_id"], "index": job["index"], "status": "failed",
+                                  "error": f"No {pool} API keys available"})
+            continue
+        for key in keys:
+            slots = min(queue.qsize(), max(1, key.get("concurrent_limit") or MAX_CONCURRENT_PER_KEY))
+            workers.extend(key_worker(queue, pool, key) for _ in range(slots))
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        log_event("info", "batch_finished", f"Image batch {batch_id} finished", user_id=user_id)
+        await events.put(None)
+
+
+def _parse_stream_flag(value: Any) -> bool:
+    """The batch "stream" option: a JSON boolean, or "true"/"false", "1"/"0", "yes"/"no" (400 otherwise)."""
+    if value is None:
+        return True
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in ("true", "1", "yes", "false", "0", "no"):
+        return value.strip().lower() in ("true", "1", "yes")
+    raise HTTPException(400, "stream must be true or false")
+
+
+def _batch_job_events(task_ids: List[str]) -> Tuple[List[Dict], Dict[str, str]]:
+    """Result events for the listed batch jobs that have finished, and id -> status for the rest."""
+    con = db_conn()
+    try:
+        rows = con.execute(
+            f"SELECT id, status, error, metadata_json FROM jobs WHERE id IN ({','.join('?' * len(task_ids))})",
+            task_ids,
+        ).fetchall()
+    finally:
+        con.close()
+    found = {r["id"]: r for r in rows}
+    events, running = [], {}
+    for task_id in task_ids:
+        row = found.get(task_id)
+        if row is None:
+            events.append({"task_id": task_id, "status": "failed", "error": "Task not found"})
+        elif row["status"] not in _FINISHED_JOB_STATUSES:
+            running[task_id] = row["status"]
+        elif row["status"] != "completed":
+            events.append({"task_id": task_id, "status": "failed", "error": row["error"] or row["status"]})
+        else:
+            metadata = _json_loads(row["metadata_json"] or "{}")
+            data_uri = metadata.get("data_uri") or metadata.get("result")
+            images = metadata.get("all_images") or [{"data_uri": data_uri, "url": metadata.get("result_url")}]
+            events.append({
+                "task_id": task_id,
+                "status": "completed",
+                "data_uri": data_uri,
+                "result": data_uri,
+                "all_images": [{"data_uri": p.get("data_uri"), "url": p.get("url")} for p in images if isinstance(p, dict)],
+            })
+    return events, running
+
+
+async def _follow_image_batch(jobs: List[Dict]):
+    """Yield a result event as the worker tier finishes each batch job (WORKER_MODE=api). Waits on
+    status_watcher, so every streaming batch in the process shares one status query per tick."""
+    index = {j["task_id"]: j["index"] for j in jobs}
+    running = dict.fromkeys(index)
+    while running:
+        finished, running = await asyncio.to_thread(_batch_job_events, list(running))
+        for event in finished:
+            yield {**event, "index": index[event["task_id"]]}
+        if running:
+            await status_watcher.wait(list(running), running, STATUS_WAIT_MAX_SECONDS)
+
+
+async def _drain_batch_events(events: "asyncio.Queue"):
+    while True:
+        event = await events.get()
+        if event is None:
+            return
+        yield event
+
+
+def _image_batch_response(batch_id: str, jobs: List[Dict], credits_cost: int, user_id: str, stream: bool):
+    """Start the batch and either stream NDJSON events as items finish or return the task ids.
+    With WORKER_MODE=api the jobs are already queued for the worker tier; the stream follows their status."""
+    events: asyncio.Queue = asyncio.Queue()
+    if not API_ONLY:
+        _spawn(_run_image_batch(user_id, batch_id, jobs, events))
+    header = {
+        "ok": True,
+        "type": "batch",
+        "batch_id": batch_id,
+        "credits_charged": credits_cost,
+        "tasks": [{"index": j["index"], "task_id": j["task_id"]} for j in jobs],
+    }
+    if not stream:
+        return {**header, "status": "queued" if API_ONLY else "pending",
+                "message": "Poll /api/image/status/{task_id} for each task"}
+
+    async def ndjson():
+        yield _json_dumps(header) + "\n"
+        done = failed = 0
+        async for event in _follow_image_batch(jobs) if API_ONLY else _drain_batch_events(events):
+            done += 1
+            failed += event["status"] == "failed"
+            yield _json_dumps({"type": "item", "batch_id": batch_id, **event}) + "\n"
+        yield _json_dumps({"type": "done", "batch_id": batch_id, "total": len(jobs), "completed": done - failed, "failed": failed}) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson", headers={"Cache-Control": "no-cache"})
+
+
+@app.post("/api/image/batch")
+async def image_batch(
+    request: Request,
+    authorization: Optional[str] = Header(None),
+    token: Optional[str] = Query(None)
+):
+    """Generate many images in one request.
+
+    Credits are reserved once for the whole batch and all jobs are inserted in one transaction,
+    then work fans out across every active provider key (with WORKER_MODE=api the jobs are queued for
+    the worker tier instead). With "stream": true (default) the response
+    is NDJSON: a header line with task ids, one line per finished item, and a final summary line.
+    Items keep running if the client disconnects; each task is also visible via /api/image/status.
+    """
+    tok = _extract_token(authorization, token)
+    user = await require_user(tok)
+    body = await request.json()
+    stream = _parse_stream_flag(body.get("stream"))
+    batch_id, jobs, credits_cost = _create_image_batch(user, body)
+    return _image_batch_response(batch_id, jobs, credits_cost, user["id"], stream)
+
+
+@app.post("/api/v1/image/batch")
+async def api_v1_image_batch(
+    request: Request,
+    x_api_key: Optional[str] = Header(None)
+):
+    """
+    Public API endpoint for batch image generation using user API keys
+
+    Request body:
+    {
+        "prompts": ["a red fox", "a blue whale"],   // or "items": [{"prompt": ..., "model": ..., "seed": ...}]
+        "model": "IMAGEN_4",                          // default for every item
+        "aspect_ratio": "IMAGE_ASPECT_RATIO_LANDSCAPE",
+        "stream": true                                // NDJSON progress; false returns task ids only
+    }
+
+    Error codes:
+    - 400: Invalid items or too many items
+    - 401: Invalid or missing API key
+    - 402: Insufficient credits
+    - 429: Rate limit exceeded
+    - 503: No provider keys available
+    """
+    if not x_api_key:
+        raise HTTPException(401, "API key required. Provide X-API-Key header.")
+
+    con = db_conn()
+    try:
+        key_record = con.execute(
+            "SELECT * FROM user_api_keys WHERE api_key = ? AND is_active = 1",
+            (x_api_key,)
+        ).fetchone()
+        if not key_record:
+            raise HTTPException(401, "Invalid API key")
+
+        user = con.execute("SELECT * FROM users WHERE id = ?", (key_record["user_id"],)).fetchone()
+        if not user or not user["is_active"]:
+            raise HTTPException(403, "User account is inactive")
+
+        hour_ago = now_ms() - (60 * 60 * 1000)
+        recent_requests = con.execute(
+            "SELECT COUNT(*) as cnt FROM jobs WHERE user_id = ? AND created_at_ms > ?",
+            (user["id"], hour_ago)
+        ).fetchone()["cnt"]
+        hourly_limit = key_record["hourly_limit"] or 100
+        body = await request.json()
+        stream = _parse_stream_flag(body.get("stream"))
+        batch_size = len(body.get("items") or body.get("prompts") or [])
+        if recent_requests + batch_size > hourly_limit:
+            raise HTTPException(429, f"Hourly limit exceeded. Limit: {hourly_limit} requests/hour")
+
+        con.execute(
+            "UPDATE user_api_keys SET total_requests = total_requests + ?, last_used_ms = ? WHERE id = ?",
+            (batch_size, now_ms(), key_record["id"])
+        )
+        con.commit()
+    finally:
+        con.close()
+
+    user = dict(user)
+    batch_id, jobs, credits_cost = _create_image_batch(user, body, user_api_key_id=key_record["id"])
+    return _image_batch_response(batch_id, jobs, credits_cost, user["id"], stream)
+
 @app.get("/api/voice/download/{task_id}")
 async def voice_download(
     task_id: str,
@@ -5824,7 +9000,7 @@ async def voice_download(
 ):
     """Download voice audio from local storage"""
     tok = _extract_token(authorization, token)
-    user = require_user(tok)
+    user = await require_user(tok)
     
     # Check if job exists and not expired
     con = db_conn()
@@ -5852,7 +9028,7 @@ async def voice_download(
             )
     
     # Audio not available locally - try to download from Voicer API
-    key_data = get_voicer_api_key()
+    key_data = get_voicer_api_key(claim=False)
     if not key_data:
         raise HTTPException(503, "No API keys configured")
     _, voicer_key = key_data
@@ -5869,6 +9045,225 @@ async def voice_download(
     
     raise HTTPException(503, "Audio file temporarily unavailable. Please try again.")
 
+# =============================================================================
+# Export (streaming ZIP of a user's outputs)
+# =============================================================================
+
+_EXPORT_ID_CHUNK = 500  # Ids per IN list: SQLite builds before 3.32 allow 999 bound variables per statement
+_EXPORT_RESOLVE_BATCH = 4  # Jobs whose missing files are stored / fetched together while the archive streams
+
+
+def _export_index(jobs: List[Any]) -> Dict[str, List[Path]]:
+    """Files already on disk per job, from one scan each of IMAGES_DIR and AUDIO_DIR rather than
+    lookups per job. Images are the stored originals in order: image #0, then <id>_<n>.png (not
+    the derivatives). Blocking: run it in a thread."""
+    wanted = {job["id"] for job in jobs}
+    present: set = set()
+    numbered: Dict[str, List[Tuple[int, Path]]] = {}
+    with os.scandir(IMAGES_DIR) as it:
+        for entry in it:
+            if not entry.name.endswith(".png"):
+                continue
+            present.add(entry.name)
+            task_id, _, n = entry.name[:-4].rpartition("_")
+            if task_id in wanted and n.isdigit() and n[0] != "0":
+                numbered.setdefault(task_id, []).append((int(n), Path(entry.path)))
+    audio: Dict[str, Path] = {}
+    with os.scandir(AUDIO_DIR) as it:
+        for entry in it:
+            task_id = entry.name[:-4]
+            if entry.name.endswith(".mp3") and task_id in wanted and entry.stat().st_size > 0:
+                audio[task_id] = Path(entry.path)
+
+    def exists(path: Path) -> bool:
+        return path.name in present if path.parent == IMAGES_DIR else path.exists()
+
+    files: Dict[str, List[Path]] = {}
+    for job in jobs:
+        task_id = job["id"]
+        stored = [Path(job["image_path"])] if job["image_path"] else []
+        if job["kind"] == "image":
+            first = [p for p in stored + [IMAGES_DIR / f"{task_id}.png", IMAGES_DIR / f"{task_id}_0.png"] if exists(p)][:1]
+            files[task_id] = first + [p for _, p in sorted(numbered.get(task_id, []))]
+        else:
+            local = [p for p in stored if p.exists() and p.stat().st_size > 0] + ([audio[task_id]] if task_id in audio else [])
+            files[task_id] = local[:1]
+    return files
+
+
+async def _export_resolve(jobs: List[Any], files: Dict[str, List[Path]]):
+    """Store images only kept inline in metadata and fetch audio never downloaded from Voicer for
+    the jobs that have no file yet, as the single downloads would; updates `files`."""
+    images = [job["id"] for job in jobs if job["kind"] == "image" and not files[job["id"]]]
+    voices = [job["id"] for job in jobs if job["kind"] != "image" and not files[job["id"]]]
+    if images:
+        con = db_conn()
+        try:
+            for task_id in images:
+                row = con.execute("SELECT id, image_path, metadata_json FROM jobs WHERE id = ?", (task_id,)).fetchone()
+                if not row:
+                    continue
+                metadata = _json_loads(row["metadata_json"] or "{}")
+                count = len([img for img in metadata.get("all_images") or [] if isinstance(img, dict)]) or 1
+                stored = [await _image_original(con, row, metadata, i) for i in range(count)]
+                files[task_id] = [p for p in stored if p is not None]
+        finally:
+            con.close()
+    key_data = get_voicer_api_key(claim=False) if voices else None
+    if key_data:
+        async def fetch(task_id: str):
+            try:
+                path = await ensure_audio_downloaded(task_id, key_data[1])
+            except Exception as e:
+                _debug_log(f"[EXPORT] {task_id}: audio fetch failed: {e}")
+                return
+            if path and Path(path).exists():
+                files[task_id] = [Path(path)]
+
+        await asyncio.gather(*(fetch(task_id) for task_id in voices))
+
+
+def _export_entries(jobs: List[Any], files: Dict[str, List[Path]], loop: asyncio.AbstractEventLoop):
+    """(name in archive, path) for every file of the jobs, in job order. Runs in the thread that
+    writes the archive: jobs with no file yet are resolved on the event loop a few at a time as the
+    archive gets to them, so the first bytes go out at once. Ends with skipped.txt listing the jobs
+    that had nothing to export."""
+    skipped = []
+    for start in range(0, len(jobs), _EXPORT_RESOLVE_BATCH):
+        batch = jobs[start:start + _EXPORT_RESOLVE_BATCH]
+        if any(not files[job["id"]] for job in batch):
+            try:
+                asyncio.run_coroutine_threadsafe(_export_resolve(batch, files), loop).result()
+            except Exception as e:
+                _debug_log(f"[EXPORT] cannot resolve files: {e}")
+        for job in batch:
+            paths = files[job["id"]]
+            if not paths:
+                skipped.append(job["id"])
+            prefix = "image" if job["kind"] == "image" else "voice"
+            for i, path in enumerate(paths):
+                suffix = f"_{i + 1}" if len(paths) > 1 else ""
+                yield f"{prefix}_{job['id']}{suffix}{path.suffix}", str(path)
+    if skipped:
+        yield "skipped.txt", ("No file left for these jobs:\n" + "\n".join(skipped) + "\n").encode()
+
+
+async def _export_response(user: Dict, type: Optional[str], task_ids: Optional[List[str]],
+                           from_ms: Optional[int], to_ms: Optional[int]) -> StreamingResponse:
+    if type not in (None, "", "image", "voice"):
+        raise HTTPException(400, "type must be 'image' or 'voice'")
+    where = ["user_id = ?", "status = 'completed'", "(expires_at_ms IS NULL OR expires_at_ms > ?)"]
+    params: List[Any] = [user["id"], now_ms()]
+    if type:
+        where.append(f"COALESCE(kind, {_JOB_KIND_SQL}) = ?")
+        params.append(type)
+    if from_ms is not None:
+        where.append("created_at_ms >= ?")
+        params.append(from_ms)
+    if to_ms is not None:
+        where.append("created_at_ms < ?")
+        params.append(to_ms)
+    if task_ids is not None:
+        task_ids = list(dict.fromkeys(i.strip() for i in task_ids if isinstance(i, str) and i.strip()))
+        if not task_ids:
+            raise HTTPException(400, "ids is empty")
+        if len(task_ids) > EXPORT_MAX_JOBS:
+            raise HTTPException(400, f"At most {EXPORT_MAX_JOBS} ids per export")
+        chunks = [task_ids[i:i + _EXPORT_ID_CHUNK] for i in range(0, len(task_ids), _EXPORT_ID_CHUNK)]
+    else:
+        chunks = [None]
+
+    sql = f"SELECT id, image_path, created_at_ms, COALESCE(kind, {_JOB_KIND_SQL}) AS kind FROM jobs WHERE {' AND '.join(where)}"
+    con = db_conn()
+    try:
+        jobs = []
+        for chunk in chunks:
+            if chunk is None:
+                jobs += con.execute(sql + " ORDER BY created_at_ms LIMIT ?", (*params, EXPORT_MAX_JOBS + 1)).fetchall()
+            else:
+                jobs += con.execute(sql + f" AND id IN ({','.join('?' * len(chunk))})", (*params, *chunk)).fetchall()
+    finally:
+        con.close()
+    if len(jobs) > EXPORT_MAX_JOBS:
+        raise HTTPException(400, f"More than {EXPORT_MAX_JOBS} jobs match; narrow the date range or type")
+    if not jobs:
+        raise HTTPException(404, "No files to export")
+    jobs.sort(key=lambda job: job["created_at_ms"])
+    files = await asyncio.to_thread(_export_index, jobs)
+
+    filename = f"fiftyfive_{type or 'outputs'}_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}.zip"
+    entries = _export_entries(jobs, files, asyncio.get_running_loop())
+    return StreamingResponse(
+        iter_zip(entries, EXPORT_CHUNK_KB * 1024),  # Plain iterator: read in a worker thread
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store",
+                 "X-Export-Jobs": str(len(jobs))}
+    )
+
+
+async def _export_user(authorization: Optional[str], token: Optional[str], x_api_key: Optional[str]) -> Dict:
+    if x_api_key:
+        user, _ = await require_api_key(x_api_key)
+        return user
+    return await require_user(_extract_token(authorization, token))
+
+
+@app.get("/api/export/zip")
+async def export_zip(
+    type: Optional[str] = Query(None),  # 'voice' or 'image'
+    ids: Optional[str] = Query(None, description="Comma-separated job ids"),
+    from_ms: Optional[int] = Query(None, description="Created at or after (ms since epoch)"),
+    to_ms: Optional[int] = Query(None, description="Created before (ms since epoch)"),
+    authorization: Optional[str] = Header(None),
+    token: Optional[str] = Query(None),
+    x_api_key: Optional[str] = Header(None)
+):
+    """
+    Download completed, unexpired outputs as one ZIP, streamed straight from disk
+    
+    Filters combine: type, explicit ids, and a created_at window (POST the same filters for id
+    lists too long for a URL). Files are stored uncompressed (the media is compressed already) as
+    voice_<id>.mp3 and image_<id>[_<n>].png; jobs with no file left are listed in skipped.txt.
+    404 when no job matches.
+    """
+    user = await _export_user(authorization, token, x_api_key)
+    return await _export_response(user, type, ids.split(",") if ids is not None else None, from_ms, to_ms)
+
+
+@app.post("/api/export/zip")
+async def export_zip_post(
+    request: Request,
+    authorization: Optional[str] = Header(None),
+    token: Optional[str] = Query(None),
+    x_api_key: Optional[str] = Header(None)
+):
+    """
+    The same export with the filters in the body: JSON {"type", "ids": [...], "from_ms", "to_ms"},
+    or a form post (ids comma-separated, and `token`, since a browser form cannot send headers)
+    """
+    body = await request.body()
+    if request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            data = _json_loads(body or b"{}")
+        except ValueError:
+            raise HTTPException(400, "Invalid JSON body")
+        if not isinstance(data, dict):
+            raise HTTPException(400, "Body must be a JSON object")
+    else:
+        data = {k: v[-1] for k, v in parse_qs(body.decode("utf-8", "replace")).items()}
+    user = await _export_user(authorization, token or data.get("token"), x_api_key)
+
+    ids = data.get("ids")
+    if isinstance(ids, str):
+        ids = ids.split(",")
+    elif ids is not None and not isinstance(ids, list):
+        raise HTTPException(400, "ids must be a list or a comma-separated string")
+    try:
+        window = [int(data[k]) if data.get(k) not in (None, "") else None for k in ("from_ms", "to_ms")]
+    except (TypeError, ValueError):
+        raise HTTPException(400, "from_ms and to_ms must be integers")
+    return await _export_response(user, data.get("type") or None, ids, *window)
+
 @app.get("/api/admin/realtime-stats")
 async def admin_realtime_stats(x_admin_token: Optional[str] = Header(None)):
     """Get real-time concurrent usage stats"""
@@ -5914,6 +9309,16 @@ async def admin_realtime_stats(x_admin_token: Optional[str] = Header(None)):
             "users": user_stats,
             "api_keys": key_stats,
             "voicer_total_concurrent": total_concurrent,
+            "event_loop": loop_lag.snapshot(),
+            "media": media_processor.snapshot(),
+            "static_assets": static_assets.snapshot() if static_assets else None,
+            "backups": backup_manager.snapshot_stats(),
+            "db_writer": db_writer.snapshot(),
+            "singletons": [s.snapshot() for s in singletons],
+            "cache": read_cache.snapshot(),
+            "status_watch": status_watcher.snapshot(),
+            "webhooks": webhook_dispatcher.snapshot(),
+            "idempotency": idempotency_store.snapshot(),
             "timestamp": now_ms()
         }
     finally:
@@ -5940,7 +9345,7 @@ async def admin_active_tasks(x_admin_token: Optional[str] = Header(None)):
         for t in tasks:
             metadata = {}
             try:
-                metadata = json.loads(t["metadata_json"] or "{}")
+                metadata = _json_loads(t["metadata_json"] or "{}")
             except:
                 pass
             
@@ -6019,6 +9424,7 @@ async def admin_cancel_task(task_id: str, x_admin_token: Optional[str] = Header(
                 "UPDATE users SET credits_balance = credits_balance + ?, credits_used = credits_used - ? WHERE id = ? AND credits_balance != -1",
                 (job["credits_charged"], job["credits_charged"], job["user_id"])
             )
+            _user_changed(job["user_id"])
         
         con.commit()
         log_event("info", "task_cancelled", f"Task {task_id} cancelled by admin", user_id=job["user_id"], meta={"task_id": task_id})
@@ -6060,9 +9466,9 @@ async def voice_stats(
 ):
     """Proxy user stats from Voicer API"""
     tok = _extract_token(authorization, token)
-    user = require_user(tok)
+    user = await require_user(tok)
     
-    key_data = get_voicer_api_key()
+    key_data = get_voicer_api_key(claim=False)
     if not key_data:
         raise HTTPException(503, "No Voicer API keys configured")
     _, voicer_key = key_data
@@ -6095,37 +9501,25 @@ try:
 except Exception:
     pass
 
-if DIST_DIR:
-    assets_dir = DIST_DIR / 'assets'
-    if assets_dir.exists():
-        app.mount("/assets", StaticFiles(directory=str(assets_dir)), name="assets")
-    
-    @app.get("/favicon.ico")
-    async def favicon():
-        favicon_path = DIST_DIR / "favicon.ico"
-        if favicon_path.exists():
-            return FileResponse(favicon_path)
-        raise HTTPException(404)
-    
-    @app.get("/favicon.svg")
-    async def favicon_svg():
-        favicon_path = DIST_DIR / "favicon.svg"
-        if favicon_path.exists():
-            return FileResponse(favicon_path)
-        raise HTTPException(404)
-    
-    @app.get("/{full_path:path}")
-    async def serve_spa(full_path: str):
+static_assets: Optional[StaticAssets] = StaticAssets(str(DIST_DIR)) if DIST_DIR else None
+
+if static_assets:
+    @app.api_route("/{full_path:path}", methods=["GET", "HEAD"])
+    async def serve_spa(full_path: str, request: Request):
+        """Built frontend from the in-memory index (see server/static_assets.py): no per-request
+        file I/O, precompressed br/gzip bodies, immutable caching for hashed /assets files."""
         if full_path.startswith("api"):
             raise HTTPException(404, "Not found")
         
-        if full_path:
-            file_path = DIST_DIR / full_path
-            if file_path.is_file():
-                return FileResponse(file_path)
-        
-        index_path = DIST_DIR / "index.html"
-        if index_path.is_file():
-            return FileResponse(index_path)
-        
-        raise HTTPException(404, "Not found")
+        asset = static_assets.lookup(full_path)
+        if not asset:
+            raise HTTPException(404, "Not found")
+        encoding, body = asset.select(request.headers.get("accept-encoding"))
+        headers = asset.headers(encoding)
+        if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+            return Response(status_code=304, headers={k: v for k, v in headers.items() if k != "Content-Encoding"})
+        media_type = headers.pop("Content-Type")
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(len(body))
+            body = b""
+        return Response(content=body, media_type=media_type, headers=headers)
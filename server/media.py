@@ -0,0 +1,473 @@
+"""
+Media Processing
+Off-loop image stage (base64 decode, magic-byte / dimension validation, optional re-encode, file write,
+WebP/AVIF thumbnail and preview derivatives) in a worker pool, plus an event-loop lag monitor
+
+Run `python -m server.media` for a benchmark of loop lag with decoding on the loop vs. in the pool.
+"""
+import asyncio
+import base64
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple, Union
+
+# Magic bytes -> MIME type
+SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+_JPEG_SOF = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# Derivative name -> (longest side in px, encoder quality). Stored next to the original as X.<name>.<fmt>
+DERIVATIVES = {
+    "thumb": (256, 70),
+    "preview": (1024, 80),
+}
+
+DERIVATIVE_MIME = {"webp": "image/webp", "avif": "image/avif"}
+
+
+class MediaError(ValueError):
+    """Payload is not a usable image (bad base64, unknown format, bad dimensions)."""
+
+
+def sniff_mime(data: bytes) -> Optional[str]:
+    for magic, mime in SIGNATURES:
+        if data.startswith(magic):
+            return mime
+    if len(data) >= 12 and data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def image_dimensions(data: bytes, mime: str) -> Optional[Tuple[int, int]]:
+    """(width, height) from the image header, without decoding pixels."""
+    try:
+        if mime == "image/png":
+            return int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big")
+        if mime == "image/gif":
+            return int.from_bytes(data[6:8], "little"), int.from_bytes(data[8:10], "little")
+        if mime == "image/webp":
+            chunk = data[12:16]
+            if chunk == b"VP8 ":
+                return int.from_bytes(data[26:28], "little") & 0x3FFF, int.from_bytes(data[28:30], "little") & 0x3FFF
+            if chunk == b"VP8L":
+                bits = int.from_bytes(data[21:25], "little")
+                return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            if chunk == b"VP8X":
+                return int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+            return None
+        if mime == "image/jpeg":
+            i = 2
+            while i + 9 < len(data):
+                if data[i] != 0xFF:
+                    return None
+                marker = data[i + 1]
+                if marker == 0xFF:
+                    i += 1  # Fill byte
+                    continue
+                if marker in _JPEG_SOF:
+                    return int.from_bytes(data[i + 7:i + 9], "big"), int.from_bytes(data[i + 5:i + 7], "big")
+                if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+                    i += 2  # Standalone marker
+                    continue
+                i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+    except (IndexError, ValueError):
+        return None
+    return None
+
+
+def _reencode(data: bytes, mime: str) -> bytes:
+    from PIL import Image  # Optional dependency; only needed when re-encoding is requested
+    import io
+    fmt = mime.split("/", 1)[1].upper()
+    with Image.open(io.BytesIO(data)) as im:
+        out = io.BytesIO()
+        if fmt == "JPEG" and im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        im.save(out, format=fmt)
+        return out.getvalue()
+
+
+def derivative_format(preferred: str = "webp") -> str:
+    """"avif" when asked for and the installed Pillow can encode it, else "webp"."""
+    if preferred != "avif":
+        return "webp"
+    try:
+        from PIL import features
+        if features.check("avif"):
+            return "avif"
+        import pillow_avif  # noqa: F401  Plugin for Pillow builds without AVIF support
+        return "avif"
+    except ImportError:
+        return "webp"
+
+
+def derivative_path(path: str, name: str, fmt: str = "webp") -> str:
+    root, _ = os.path.splitext(str(path))
+    return f"{root}.{name}.{fmt}"
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def make_derivatives(data: bytes, path: str, variants: Optional[Dict[str, Tuple[int, int]]] = None,
+                     fmt: str = "webp") -> Dict[str, Dict]:
+    """Write downscaled copies of the image next to path, one per variant.
+
+    Decodes once and shrinks largest-first so each step resamples the previous result, not the
+    original. Images already smaller than a variant are only re-encoded. Returns
+    {name: {path, mime, width, height, bytes}}; empty when Pillow is not installed.
+    """
+    try:
+        from PIL import Image
+        if fmt == "avif":
+            try:
+                import pillow_avif  # noqa: F401
+            except ImportError:
+                pass
+    except ImportError:
+        return {}
+    import io
+    out: Dict[str, Dict] = {}
+    with Image.open(io.BytesIO(data)) as im:
+        im.draft("RGB", (2048, 2048))  # JPEG: let the decoder skip work it would throw away
+        im = im.convert("RGBA" if im.mode in ("RGBA", "LA", "P", "PA") else "RGB")
+        for name, (side, quality) in sorted((variants or DERIVATIVES).items(), key=lambda kv: -kv[1][0]):
+            im.thumbnail((side, side), Image.LANCZOS)
+            buf = io.BytesIO()
+            im.save(buf, format=fmt.upper(), quality=quality, **({"method": 4} if fmt == "webp" else {}))
+            encoded = buf.getvalue()
+            target = derivative_path(path, name, fmt)
+            _write_atomic(target, encoded)
+            out[name] = {"path": target, "mime": DERIVATIVE_MIME.get(fmt, f"image/{fmt}"),
+                         "width": im.width, "height": im.height, "bytes": len(encoded)}
+    return out
+
+
+def derive_file(path: str, variants: Optional[Dict[str, Tuple[int, int]]] = None, fmt: str = "webp",
+                max_pixels: int = 50_000_000) -> Dict[str, Dict]:
+    """make_derivatives for an image already on disk (backfill for files stored before derivatives)."""
+    with open(path, "rb") as f:
+        data = f.read()
+    mime = sniff_mime(data)
+    size = image_dimensions(data, mime) if mime else None
+    if not size or size[0] * size[1] > max_pixels:
+        raise MediaError(f"Cannot derive from {path}")
+    return make_derivatives(data, path, variants, fmt)
+
+
+def process_image(source: Union[str, bytes], path: str, max_pixels: int = 50_000_000,
+                  want_b64: bool = False, reencode: Optional[str] = None,
+                  derivatives: Optional[Dict[str, Tuple[int, int]]] = None, derivative_fmt: str = "webp") -> Dict:
+    """Decode (base64 string / data URI, or raw bytes), validate, optionally re-encode, and write to path.
+
+    Runs in a pool worker, so it only takes and returns plain values. The write goes to a temp
+    file first so readers never see a partial image. Returns {path, mime, width, height, bytes, sha256}
+    plus "b64" (the stored bytes, base64) when want_b64 is set or the bytes changed, and
+    "derivatives" (see make_derivatives) when derivatives are requested. A failed derivative
+    does not fail the original; it can be rebuilt later with derive_file.
+    """
+    b64_in: Optional[str] = None
+    if isinstance(source, str):
+        b64_in = source.split(",", 1)[-1] if source.startswith("data:") else source
+        try:
+            data = base64.b64decode(b64_in)
+        except (ValueError, TypeError) as e:
+            raise MediaError(f"Invalid base64 image data: {e}")
+    else:
+        data = bytes(source)
+
+    mime = sniff_mime(data)
+    if not mime:
+        raise MediaError("Unrecognized image format")
+    size = image_dimensions(data, mime)
+    if not size or size[0] <= 0 or size[1] <= 0:
+        raise MediaError(f"Unreadable {mime} dimensions")
+    if size[0] * size[1] > max_pixels:
+        raise MediaError(f"Image too large: {size[0]}x{size[1]}")
+
+    changed = False
+    if reencode and reencode != mime:
+        try:
+            data, mime, changed = _reencode(data, reencode), reencode, True
+        except ImportError:
+            pass  # Pillow not installed: keep the original bytes
+
+    _write_atomic(path, data)
+
+    result = {"path": path, "mime": mime, "width": size[0], "height": size[1], "bytes": len(data),
+              "sha256": hashlib.sha256(data).hexdigest()}
+    if want_b64 or changed:
+        result["b64"] = base64.b64encode(data).decode("ascii")
+    if derivatives:
+        try:
+            result["derivatives"] = make_derivatives(data, path, derivatives, derivative_fmt)
+        except Exception as e:
+            result["derivatives"] = {}
+            result["derivative_error"] = str(e)
+    return result
+
+
+def data_uri(b64: str, mime: str = "image/png") -> str:
+    return f"data:{mime};base64,{b64}"
+
+
+class MediaProcessor:
+    """Runs process_image off the event loop.
+
+    executor: "process" (default; CPU work does not hold the API's GIL), "thread", or "inline".
+    Payloads up to inline_max_bytes are handled on the loop, where the pool round trip costs more
+    than the work. A crashed pool is replaced and the item retried once, then run inline.
+    With derivatives set, every stored image also gets its thumbnail/preview files in the same call.
+    """
+
+    def __init__(self, workers: int = 2, executor: str = "process", inline_max_bytes: int = 64 * 1024,
+                 max_pixels: int = 50_000_000, derivatives: Optional[Dict[str, Tuple[int, int]]] = None,
+                 derivative_fmt: str = "webp"):
+        self.workers = max(1, workers)
+        self.executor = executor
+        self.inline_max_bytes = inline_max_bytes
+        self.max_pixels = max_pixels
+        self.derivatives = derivatives
+        self.derivative_fmt = derivative_fmt
+        self._pool: Optional[concurrent.futures.Executor] = None
+        self._lock = threading.Lock()
+        self._stats = {"processed": 0, "inline": 0, "errors": 0, "bytes": 0, "seconds": 0.0, "pool_restarts": 0,
+                       "derivatives": 0, "derivative_bytes": 0}
+
+    def _get_pool(self) -> concurrent.futures.Executor:
+        with self._lock:
+            if self._pool is None:
+                if self.executor == "process":
+                    # spawn: forking a process that runs an event loop and DB threads is not safe
+                    self._pool = concurrent.futures.ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+                else:
+                    self._pool = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=self.workers, thread_name_prefix="media")
+            return self._pool
+
+    def _reset_pool(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+            self._stats["pool_restarts"] += 1
+        if pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _run(self, call: functools.partial, inline: bool) -> Tuple[Dict, bool]:
+        if inline:
+            return call(), True
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._get_pool(), call), False
+        except BrokenProcessPool:
+            self._reset_pool()
+            try:
+                return await loop.run_in_executor(self._get_pool(), call), False
+            except BrokenProcessPool:
+                # Pool cannot start workers here: keep serving, on the loop
+                self._reset_pool()
+                return call(), True
+
+    def _count_derivatives(self, derived: Dict[str, Dict]):
+        self._stats["derivatives"] += len(derived)
+        self._stats["derivative_bytes"] += sum(d["bytes"] for d in derived.values())
+
+    async def process(self, source: Union[str, bytes], path: str, want_b64: bool = False,
+                      reencode: Optional[str] = None) -> Dict:
+        """Validate and store one image; raises MediaError for unusable payloads."""
+        call = functools.partial(process_image, source, str(path), max_pixels=self.max_pixels, want_b64=want_b64,
+                                 reencode=reencode, derivatives=self.derivatives,
+                                 derivative_fmt=self.derivative_fmt)
+        # Decoding for derivatives is the expensive part, so small payloads only stay inline without it
+        inline = self.executor == "inline" or (len(source) <= self.inline_max_bytes and not self.derivatives)
+        started = time.perf_counter()
+        try:
+            result, inline = await self._run(call, inline)
+        except Exception:
+            self._stats["errors"] += 1
+            raise
+        self._stats["processed"] += 1
+        self._stats["inline"] += int(inline)
+        self._stats["bytes"] += result["bytes"]
+        self._stats["seconds"] += time.perf_counter() - started
+        self._count_derivatives(result.get("derivatives") or {})
+        return result
+
+    async def derive(self, path: str) -> Dict[str, Dict]:
+        """Build the configured derivatives for an image already on disk (lazy backfill)."""
+        call = functools.partial(derive_file, str(path), self.derivatives, self.derivative_fmt, self.max_pixels)
+        try:
+            derived, _ = await self._run(call, self.executor == "inline")
+        except Exception:
+            self._stats["errors"] += 1
+            raise
+        self._count_derivatives(derived)
+        return derived
+
+    async def process_many(self, items: List[Tuple[Union[str, bytes], str]], want_b64: bool = False
+                           ) -> List[Union[Dict, BaseException]]:
+        """Process (source, path) pairs concurrently; failures are returned in place, not raised."""
+        return await asyncio.gather(*(self.process(src, path, want_b64) for src, path in items),
+                                    return_exceptions=True)
+
+    def snapshot(self) -> Dict:
+        stats = dict(self._stats)
+        stats["seconds"] = round(stats["seconds"], 3)
+        return {"executor": self.executor, "workers": self.workers, "inline_max_bytes": self.inline_max_bytes,
+                "derivative_format": self.derivative_fmt if self.derivatives else None, **stats}
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+class LoopLagMonitor:
+    """Measures event-loop lag: how late a sleep(interval) wakes up. Anything blocking the loop
+    (CPU work, sync I/O) shows up here as latency every other request on the process also pays."""
+
+    def __init__(self, interval: float = 0.1, window: int = 3000, threshold_ms: float = 50.0):
+        self.interval = interval
+        self.threshold_ms = threshold_ms
+        self._samples: "collections.deque[float]" = collections.deque(maxlen=window)
+        self.total_samples = 0
+        self.over_threshold = 0
+        self.max_ms = 0.0
+
+    def record(self, lag_ms: float):
+        self._samples.append(lag_ms)
+        self.total_samples += 1
+        self.max_ms = max(self.max_ms, lag_ms)
+        if lag_ms >= self.threshold_ms:
+            self.over_threshold += 1
+
+    async def run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.record(max(0.0, (time.perf_counter() - started - self.interval) * 1000))
+
+    def snapshot(self) -> Dict:
+        xs = sorted(self._samples)
+
+        def pct(p: float) -> float:
+            return round(xs[min(len(xs) - 1, int(p * len(xs)))], 2) if xs else 0.0
+
+        return {
+            "interval_ms": self.interval * 1000,
+            "window_samples": len(xs),
+            "p50_ms": pct(0.5),
+            "p95_ms": pct(0.95),
+            "p99_ms": pct(0.99),
+            "window_max_ms": round(xs[-1], 2) if xs else 0.0,
+            "max_ms": round(self.max_ms, 2),
+            "threshold_ms": self.threshold_ms,
+            "over_threshold": self.over_threshold,
+            "total_samples": self.total_samples,
+        }
+
+
+# =============================================================================
+# Benchmark
+# =============================================================================
+
+def _fake_png(n_bytes: int, width: int = 1024, height: int = 1024) -> bytes:
+    header = b"\x89PNG\r\n\x1a\n" + (13).to_bytes(4, "big") + b"IHDR"
+    header += width.to_bytes(4, "big") + height.to_bytes(4, "big") + b"\x08\x06\x00\x00\x00"
+    return header + os.urandom(max(0, n_bytes - len(header)))
+
+
+async def _bench(processor: Optional[MediaProcessor], completions: int, images: int, image_bytes: int,
+                 out_dir: str) -> Dict:
+    monitor = LoopLagMonitor(interval=0.005, window=100_000)
+    payloads = [base64.b64encode(_fake_png(image_bytes)).decode("ascii") for _ in range(images)]
+
+    async def completion(n: int):
+        if processor is None:
+            for i, b64 in enumerate(payloads):
+                process_image(b64, os.path.join(out_dir, f"c{n}_{i}.png"))
+                await asyncio.sleep(0)
+        else:
+            await processor.process_many([(b64, os.path.join(out_dir, f"c{n}_{i}.png")) for i, b64 in enumerate(payloads)])
+
+    async def request_probe(latencies: List[float]):
+        # Stand-in for unrelated API requests: tiny handlers arriving every 10 ms
+        while True:
+            t = time.perf_counter()
+            await asyncio.sleep(0)
+            latencies.append((time.perf_counter() - t) * 1000)
+            await asyncio.sleep(0.01)
+
+    latencies: List[float] = []
+    lag_task = asyncio.create_task(monitor.run())
+    probe_task = asyncio.create_task(request_probe(latencies))
+    await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    await asyncio.gather(*(completion(n) for n in range(completions)))
+    wall = time.perf_counter() - started
+    lag_task.cancel()
+    probe_task.cancel()
+    latencies.sort()
+    snap = monitor.snapshot()
+    return {
+        "wall_s": round(wall, 2),
+        "lag_p50_ms": snap["p50_ms"],
+        "lag_p99_ms": snap["p99_ms"],
+        "lag_max_ms": snap["max_ms"],
+        "probe_p99_ms": round(latencies[int(0.99 * (len(latencies) - 1))], 2) if latencies else 0.0,
+    }
+
+
+def main():
+    import tempfile
+    completions, images, image_bytes = 8, 4, 3 * 1024 * 1024  # Grok-style: 4 images of ~3 MB each
+    print(f"{completions} completions x {images} images x {image_bytes // 1024} KB (base64 decode + validate + write)")
+    print(f"  {'mode':<10}{'wall s':>8}{'lag p50':>10}{'lag p99':>10}{'lag max':>10}{'probe p99':>11}")
+    with tempfile.TemporaryDirectory() as out_dir:
+        for mode in ("loop", "thread", "process"):
+            processor = None if mode == "loop" else MediaProcessor(workers=4, executor=mode, inline_max_bytes=0)
+            if processor and mode == "process":
+                # Warm the pool so worker start-up is not counted
+                asyncio.run(processor.process(_fake_png(1024), os.path.join(out_dir, "warm.png")))
+            try:
+                r = asyncio.run(_bench(processor, completions, images, image_bytes, out_dir))
+            finally:
+                if processor:
+                    processor.shutdown()
+            print(f"  {mode:<10}{r['wall_s']:>8}{r['lag_p50_ms']:>10}{r['lag_p99_ms']:>10}{r['lag_max_ms']:>10}{r['probe_p99_ms']:>11}")
+
+
+__all__ = [
+    "DERIVATIVES",
+    "MediaError",
+    "sniff_mime",
+    "image_dimensions",
+    "derivative_format",
+    "derivative_path",
+    "make_derivatives",
+    "derive_file",
+    "process_image",
+    "data_uri",
+    "MediaProcessor",
+    "LoopLagMonitor",
+]
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""
+Schema Migrations
+Versioned, ordered schema steps recorded in schema_version and applied once under a cross-process
+lock, plus resumable backfills that run online in small batches
+
+The steps themselves live next to the code that uses the tables (server/main.py, MIGRATIONS).
+Run `python -m server.migrate [status|up|backfill [name]]` against DB_PATH.
+"""
+import os
+import sqlite3
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at_ms INTEGER NOT NULL,
+    duration_ms INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS schema_backfills (
+    name TEXT PRIMARY KEY,
+    cursor INTEGER NOT NULL DEFAULT 0,
+    rows_done INTEGER NOT NULL DEFAULT 0,
+    done INTEGER NOT NULL DEFAULT 0,
+    updated_at_ms INTEGER
+);
+"""
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def add_column(con: sqlite3.Connection, table: str, column: str, decl: str) -> bool:
+    """ALTER TABLE ... ADD COLUMN unless the column exists; True if it was added."""
+    if column in {r[1] for r in con.execute(f"PRAGMA table_info({table})")}:
+        return False
+    con.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    return True
+
+
+class Migration:
+    """One schema step. apply(con) must be idempotent: a step interrupted before its version row
+    was written runs again from the start."""
+
+    __slots__ = ("version", "name", "apply")
+
+    def __init__(self, version: int, name: str, apply: Callable[[sqlite3.Connection], None]):
+        self.version = version
+        self.name = name
+        self.apply = apply
+
+
+class Backfill:
+    """Data change too large for one transaction. batch(con, cursor, size) updates the rows after
+    cursor (a rowid) and returns the new cursor, or None when nothing is left."""
+
+    __slots__ = ("name", "batch", "after_version")
+
+    def __init__(self, name: str, batch: Callable[[sqlite3.Connection, int, int], Optional[int]], after_version: int = 0):
+        self.name = name
+        self.batch = batch
+        self.after_version = after_version
+
+
+class MigrationLock:
+    """Exclusive advisory file lock, so only one process migrates at a time."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    def acquire(self, timeout: float = 60.0, blocking: bool = True) -> bool:
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                if fcntl:
+                    fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    msvcrt.locking(self._fd, msvcrt.LK_NBLCK, 1)
+                return True
+            except OSError:
+                if not blocking or time.monotonic() >= deadline:
+                    os.close(self._fd)
+                    self._fd = None
+                    if blocking:
+                        raise TimeoutError(f"Timed out waiting for migration lock {self.path}")
+                    return False
+                time.sleep(0.1)
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            if fcntl:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class Migrator:
+    """Applies pending migrations in version order and drives backfills.
+
+    ensure_current() is the boot path: a single SELECT when the schema is current. Otherwise it
+    takes the file lock, re-reads the version (another process may have just migrated) and applies
+    each pending step in its own transaction together with its schema_version row.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], lock_path: str,
+                 migrations: List[Migration], backfills: Optional[List[Backfill]] = None):
+        versions = [m.version for m in migrations]
+        if versions != sorted(set(versions)):
+            raise ValueError("Migration versions must be unique and ascending")
+        self.connect = connect
+        self.lock_path = lock_path
+        self.migrations = migrations
+        self.backfills = backfills or []
+        self._done_backfills: set = set()
+        self._stop = threading.Event()
+
+    @property
+    def latest(self) -> int:
+        return self.migrations[-1].version if self.migrations else 0
+
+    def current_version(self, con: sqlite3.Connection) -> int:
+        try:
+            row = con.execute("SELECT MAX(version) FROM schema_version").fetchone()
+        except sqlite3.OperationalError:
+            return 0  # Table missing: database from before versioning, or empty
+        return row[0] or 0
+
+    def pending(self, con: sqlite3.Connection) -> List[Migration]:
+        current = self.current_version(con)
+        return [m for m in self.migrations if m.version > current]
+
+    def ensure_current(self, apply: bool = True, lock_timeout: float = 120.0) -> List[str]:
+        """Bring the schema to the latest version; returns the names of the steps applied.
+        With apply=False, raises if anything is pending (for deployments that migrate separately)."""
+        con = self.connect()
+        try:
+            if self.current_version(con) >= self.latest:
+                return []
+        finally:
+            con.close()
+        if not apply:
+            raise RuntimeError(f"Database schema is behind v{self.latest}: run `python -m server.migrate up`")
+        lock = MigrationLock(self.lock_path)
+        lock.acquire(timeout=lock_timeout)
+        try:
+            return self._apply_pending()
+        finally:
+            lock.release()
+
+    def _apply_pending(self) -> List[str]:
+        con = self.connect()
+        con.isolation_level = None  # Explicit transactions below
+        applied = []
+        try:
+            con.executescript(SCHEMA)
+            for m in self.pending(con):
+                started = time.perf_counter()
+                con.execute("BEGIN IMMEDIATE")
+                try:
+                    m.apply(con)
+                    if not con.in_transaction:
+                        con.execute("BEGIN IMMEDIATE")  # apply() used executescript, which commits
+                    con.execute(
+                        "INSERT INTO schema_version (version, name, applied_at_ms, duration_ms) VALUES (?, ?, ?, ?)",
+                        (m.version, m.name, _now_ms(), int((time.perf_counter() - started) * 1000)))
+                    con.execute("COMMIT")
+                except BaseException:
+                    if con.in_transaction:
+                        con.execute("ROLLBACK")
+                    raise
+                applied.append(f"{m.version:04d}_{m.name}")
+        finally:
+            con.close()
+        return applied
+
+    # -- backfills ------------------------------------------------------------
+
+    def backfill_state(self, con: sqlite3.Connection) -> Dict[str, Dict]:
+        try:
+            rows = con.execute("SELECT name, cursor, rows_done, done, updated_at_ms FROM schema_backfills").fetchall()
+        except sqlite3.OperationalError:
+            rows = []
+        state = {b.name: {"cursor": 0, "rows_done": 0, "done": False, "updated_at_ms": None} for b in self.backfills}
+        for name, cursor, rows_done, done, updated in rows:
+            state[name] = {"cursor": cursor, "rows_done": rows_done, "done": bool(done), "updated_at_ms": updated}
+        return state
+
+    def backfill_done(self, name: str) -> bool:
+        """Cheap after the first True: callers use it to switch to the new column."""
+        if name in self._done_backfills:
+            return True
+        con = self.connect()
+        try:
+            if self.backfill_state(con).get(name, {}).get("done"):
+                self._done_backfills.add(name)
+                return True
+        finally:
+            con.close()
+        return False
+
+    def run_backfill(self, backfill: Backfill, batch_size: int = 500, pause: float = 0.0,
+                     max_batches: Optional[int] = None) -> bool:
+        """Run batches until the backfill is done (True) or stopped / out of batches (False).
+        Progress is committed with each batch, so a restart resumes where it left off."""
+        con = self.connect()
+        try:
+            con.executescript(SCHEMA)
+            if self.current_version(con) < backfill.after_version:
+                return False  # Column it fills does not exist yet
+            row = con.execute("SELECT cursor, done FROM schema_backfills WHERE name = ?", (backfill.name,)).fetchone()
+            if row and row[1]:
+                self._done_backfills.add(backfill.name)
+                return True
+            cursor = row[0] if row else 0
+            batches = 0
+            while not self._stop.is_set():
+                if max_batches is not None and batches >= max_batches:
+                    return False
+                before = con.total_changes
+                new_cursor = backfill.batch(con, cursor, batch_size)
+                changed = con.total_changes - before
+                done = new_cursor is None
+                con.execute(
+                    """INSERT INTO schema_backfills (name, cursor, rows_done, done, updated_at_ms) VALUES (?, ?, ?, ?, ?)
+                       ON CONFLICT(name) DO UPDATE SET cursor = excluded.cursor, rows_done = rows_done + ?,
+                       done = excluded.done, updated_at_ms = excluded.updated_at_ms""",
+                    (backfill.name, cursor if done else new_cursor, changed, int(done), _now_ms(), changed))
+                con.commit()
+                batches += 1
+                if done:
+                    self._done_backfills.add(backfill.name)
+                    return True
+                cursor = new_cursor
+                if pause:
+                    self._stop.wait(pause)  # Let foreground writers in between batches
+            return False
+        finally:
+            con.close()
+
+    def run_backfills(self, batch_size: int = 500, pause: float = 0.05) -> Dict[str, bool]:
+        """Every pending backfill, one process at a time (the others return immediately)."""
+        lock = MigrationLock(self.lock_path + ".backfill")
+        if not lock.acquire(blocking=False):
+            return {}
+        try:
+            return {b.name: self.run_backfill(b, batch_size, pause) for b in self.backfills}
+        finally:
+            lock.release()
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self) -> Dict:
+        con = self.connect()
+        try:
+            current = self.current_version(con)
+            try:
+                history = [dict(zip(("version", "name", "applied_at_ms", "duration_ms"), r)) for r in con.execute(
+                    "SELECT version, name, applied_at_ms, duration_ms FROM schema_version ORDER BY version")]
+            except sqlite3.OperationalError:
+                history = []
+            return {
+                "version": current,
+                "latest": self.latest,
+                "pending": [f"{m.version:04d}_{m.name}" for m in self.migrations if m.version > current],
+                "applied": history,
+                "backfills": self.backfill_state(con),
+            }
+        finally:
+            con.close()
+
+
+def main():
+    # Imported here: the schema steps live in server.main (and it reads the environment)
+    from server import main as app
+
+    args = sys.argv[1:] or ["status"]
+    migrator = app.migrator
+    if args[0] == "status":
+        s = migrator.status()
+        print(f"schema v{s['version']} (latest v{s['latest']})")
+        for m in s["applied"]:
+            print(f"  applied {m['version']:04d}_{m['name']} in {m['duration_ms']} ms")
+        for name in s["pending"]:
+            print(f"  pending {name}")
+        for name, b in s["backfills"].items():
+            print(f"  backfill {name}: {'done' if b['done'] else 'pending'}, {b['rows_done']} rows, cursor {b['cursor']}")
+    elif args[0] == "up":
+        applied = migrator.ensure_current()
+        print("\n".join(f"applied {name}" for name in applied) or f"already at v{migrator.latest}")
+    elif args[0] == "backfill":
+        names = args[1:] or [b.name for b in migrator.backfills]
+        for b in migrator.backfills:
+            if b.name in names:
+                print(f"{b.name}: {'done' if migrator.run_backfill(b, batch_size=2000) else 'incomplete'}")
+    else:
+        print("usage: python -m server.migrate [status|up|backfill [name ...]]")
+        sys.exit(2)
+
+
+__all__ = ["Migration", "Backfill", "MigrationLock", "Migrator", "add_column"]
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Model Registry
+In-memory map of image model_id -> provider routes, pricing and limits, loaded from SQLite
+"""
+import json
+import random
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+
+class ModelRoute:
+    """One way to serve a logical model: a provider plus its upstream model name."""
+
+    __slots__ = ("id", "model_id", "provider", "upstream_model", "weight", "is_active", "size_map")
+
+    def __init__(self, id: int, model_id: str, provider: str, upstream_model: str,
+                 weight: int = 1, is_active: bool = True, size_map: Optional[Dict[str, str]] = None):
+        self.id = id
+        self.model_id = model_id
+        self.provider = provider
+        self.upstream_model = upstream_model
+        self.weight = max(0, int(weight or 0))
+        self.is_active = bool(is_active)
+        self.size_map = size_map or {}
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "model_id": self.model_id,
+            "provider": self.provider,
+            "upstream_model": self.upstream_model,
+            "weight": self.weight,
+            "is_active": self.is_active,
+            "size_map": self.size_map,
+        }
+
+
+class ModelSpec:
+    """A logical model as exposed to clients (e.g. GEM_PIX_2) with its price, limits and routes."""
+
+    __slots__ = ("model_id", "credits_per_image", "cache_policy", "is_active", "max_images", "routes")
+
+    def __init__(self, model_id: str, credits_per_image: int = 1, cache_policy: Optional[str] = None,
+                 is_active: bool = True, max_images: int = 10, routes: Optional[List[ModelRoute]] = None):
+        self.model_id = model_id
+        self.credits_per_image = credits_per_image or 1
+        self.cache_policy = cache_policy
+        self.is_active = bool(is_active)
+        self.max_images = max_images or 10
+        self.routes = routes or []
+
+    @property
+    def active_routes(self) -> List[ModelRoute]:
+        return [r for r in self.routes if r.is_active and r.weight > 0]
+
+    def ordered_routes(self) -> List[ModelRoute]:
+        """Active routes in weighted-random order: the first is the traffic-split pick,
+        the rest are fallbacks if that provider has no usable key."""
+        pool = self.active_routes
+        ordered = []
+        while pool:
+            pick = random.choices(pool, weights=[r.weight for r in pool])[0]
+            ordered.append(pick)
+            pool = [r for r in pool if r is not pick]
+        return ordered
+
+    def to_dict(self) -> Dict:
+        return {
+            "model_id": self.model_id,
+            "credits_per_image": self.credits_per_image,
+            "cache_policy": self.cache_policy,
+            "is_active": self.is_active,
+            "max_images": self.max_images,
+            "routes": [r.to_dict() for r in self.routes],
+        }
+
+
+class ModelRegistry:
+    """Snapshot of model_pricing + model_routes. Reads are a dict lookup; load() swaps atomically."""
+
+    def __init__(self):
+        self._models: Dict[str, ModelSpec] = {}
+        self._lock = threading.Lock()
+        self.version: Optional[tuple] = None
+        self.loaded_at_ms: Optional[int] = None
+
+    @staticmethod
+    def current_version(con: sqlite3.Connection) -> tuple:
+        """Cheap change marker: (max updated_at, row count) of both tables."""
+        p = con.execute("SELECT MAX(updated_at_ms), COUNT(*) FROM model_pricing").fetchone()
+        r = con.execute("SELECT MAX(updated_at_ms), COUNT(*) FROM model_routes").fetchone()
+        return (p[0], p[1], r[0], r[1])
+
+    def load(self, con: sqlite3.Connection, now_ms: Optional[int] = None):
+        """(Re)build the registry from the database."""
+        routes: Dict[str, List[ModelRoute]] = {}
+        for row in con.execute(
+            "SELECT id, model_id, provider, upstream_model, weight, is_active, size_map_json FROM model_routes ORDER BY id"
+        ).fetchall():
+            try:
+                size_map = json.loads(row[6]) if row[6] else {}
+            except (TypeError, ValueError):
+                size_map = {}
+            routes.setdefault(row[1], []).append(
+                ModelRoute(row[0], row[1], row[2], row[3], row[4], row[5], size_map)
+            )
+
+        models: Dict[str, ModelSpec] = {}
+        for row in con.execute(
+            "SELECT model_id, credits_per_image, cache_policy, is_active, max_images FROM model_pricing"
+        ).fetchall():
+            models[row[0]] = ModelSpec(
+                row[0],
+                credits_per_image=row[1],
+                cache_policy=row[2],
+                is_active=row[3] if row[3] is not None else 1,
+                max_images=row[4],
+                routes=routes.get(row[0], []),
+            )
+        version = self.current_version(con)
+        with self._lock:
+            self._models = models
+            self.version = version
+            self.loaded_at_ms = now_ms
+
+    def get(self, model_id: str) -> Optional[ModelSpec]:
+        return self._models.get(model_id)
+
+    def all(self) -> List[ModelSpec]:
+        return sorted(self._models.values(), key=lambda m: m.model_id)
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+
+registry = ModelRegistry()
+
+__all__ = ["ModelRoute", "ModelSpec", "ModelRegistry", "registry"]
@@ -0,0 +1,39 @@
+"""
+Response Cache
+Pre-serialized JSON response bodies with strong ETags, and If-None-Match matching
+
+Caching itself lives in server.cache.TwoTierCache; this module only shapes what gets cached.
+"""
+import hashlib
+import time
+from typing import Optional
+
+
+class CachedResponse:
+    """Serialized response body plus its strong ETag."""
+
+    __slots__ = ("body", "etag", "built_at")
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+        self.built_at = time.monotonic()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True if an If-None-Match header matches etag (weak comparison, RFC 9110)."""
+    if not if_none_match:
+        return False
+    bare = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == bare:
+            return True
+    return False
+
+
+__all__ = ["CachedResponse", "etag_matches"]
@@ -0,0 +1,151 @@
+"""
+Result Cache
+Request fingerprinting, per-model cache policy and hit metrics for deduplicated generations
+"""
+import hashlib
+import json
+import threading
+from typing import Any, Dict, Optional
+
+# Cache policies (model_pricing.cache_policy / RESULT_CACHE_VOICE_POLICY)
+POLICY_OFF = "off"          # Never reuse results
+POLICY_SEEDED = "seeded"    # Reuse only when the request pins a seed (deterministic output)
+POLICY_ALWAYS = "always"    # Reuse any identical request (deterministic model)
+POLICIES = (POLICY_OFF, POLICY_SEEDED, POLICY_ALWAYS)
+
+VOICE_SETTING_KEYS = ("stability", "similarity_boost", "style", "use_speaker_boost", "speed")
+
+
+def normalize_policy(value: Optional[str]) -> str:
+    """Return a known policy name, defaulting to off."""
+    value = (value or "").strip().lower()
+    return value if value in POLICIES else POLICY_OFF
+
+
+def policy_allows(policy: Optional[str], seed: Any = None) -> bool:
+    """Whether a request may be served from / recorded in the cache under this policy."""
+    policy = normalize_policy(policy)
+    if policy == POLICY_ALWAYS:
+        return True
+    if policy == POLICY_SEEDED:
+        return seed is not None and seed != ""
+    return False
+
+
+def _normalize_text(text: Optional[str]) -> str:
+    # Collapse whitespace only; case and punctuation change the output
+    return " ".join((text or "").split())
+
+
+def _normalize_voice_settings(settings: Optional[Dict]) -> Dict:
+    out = {}
+    for k in VOICE_SETTING_KEYS:
+        v = (settings or {}).get(k)
+        if v is None:
+            continue
+        out[k] = round(v, 4) if isinstance(v, float) else v
+    return out
+
+
+def image_request_hash(provider: str, model: str, prompt: str, aspect_ratio: str,
+                       seed: Any = None, num_images: int = 1) -> str:
+    """Fingerprint of an image request (sha256 hex)."""
+    return _digest({
+        "kind": "image",
+        "provider": provider,
+        "model": model,
+        "prompt": _normalize_text(prompt),
+        "aspect_ratio": aspect_ratio,
+        "seed": seed,
+        "n": int(num_images or 1),
+    })
+
+
+def voice_request_hash(model_id: str, voice_id: str, text: str, voice_settings: Optional[Dict] = None,
+                       long_form: bool = False) -> str:
+    """Fingerprint of a voice request (sha256 hex)."""
+    return _digest({
+        "kind": "voice",
+        "provider": "voicer",
+        "model": model_id,
+        "voice_id": voice_id,
+        "text": _normalize_text(text),
+        "voice_settings": _normalize_voice_settings(voice_settings),
+        "long_form": bool(long_form),
+    })
+
+
+def _digest(fields: Dict) -> str:
+    raw = json.dumps(fields, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResultCacheStats:
+    """In-process hit/miss counters per (kind, model)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: Dict[str, Dict[str, int]] = {}
+
+    def _entry(self, kind: str, model: str) -> Dict[str, int]:
+        key = f"{kind}:{model}"
+        if key not in self._models:
+            self._models[key] = {
+                "lookups": 0,
+                "hits_completed": 0,
+                "hits_inflight": 0,
+                "misses": 0,
+                "upstream_calls_saved": 0,
+                "units_saved": 0,
+            }
+        return self._models[key]
+
+    def record_miss(self, kind: str, model: str):
+        with self._lock:
+            e = self._entry(kind, model)
+            e["lookups"] += 1
+            e["misses"] += 1
+
+    def record_hit(self, kind: str, model: str, inflight: bool, units: int):
+        """units: images (image) or characters (voice) that were not sent upstream again."""
+        with self._lock:
+            e = self._entry(kind, model)
+            e["lookups"] += 1
+            e["hits_inflight" if inflight else "hits_completed"] += 1
+            e["upstream_calls_saved"] += 1
+            e["units_saved"] += int(units or 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            models = {k: dict(v) for k, v in self._models.items()}
+        totals: Dict[str, int] = {}
+        for v in models.values():
+            for k, n in v.items():
+                totals[k] = totals.get(k, 0) + n
+        lookups = totals.get("lookups", 0)
+        hits = totals.get("hits_completed", 0) + totals.get("hits_inflight", 0)
+        return {
+            "totals": totals,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "models": models,
+        }
+
+    def reset(self):
+        with self._lock:
+            self._models.clear()
+
+
+stats = ResultCacheStats()
+
+__all__ = [
+    "POLICY_OFF",
+    "POLICY_SEEDED",
+    "POLICY_ALWAYS",
+    "POLICIES",
+    "normalize_policy",
+    "policy_allows",
+    "image_request_hash",
+    "voice_request_hash",
+    "ResultCacheStats",
+    "stats",
+]
@@ -0,0 +1,220 @@
+"""
+Fair-Share Scheduler
+Weighted fair queueing of queued jobs across users by plan priority, with aging to bound wait time
+
+Run `python -m server.scheduler` for a simulation of a heavy user against light users
+(fair-share vs. the old per-user FIFO start order).
+"""
+import heapq
+import random
+from typing import Callable, Dict, List, Optional
+
+from server.config import TaskPriority
+
+# Share of upstream capacity per backlogged user, relative to LOW
+DEFAULT_WEIGHTS = {
+    TaskPriority.LOW: 1.0,
+    TaskPriority.NORMAL: 2.0,
+    TaskPriority.HIGH: 4.0,
+    TaskPriority.URGENT: 8.0,
+}
+
+
+class Candidate:
+    """A queued job that could be started."""
+
+    __slots__ = ("task_id", "user_id", "created_at_ms", "cost", "priority", "pool")
+
+    def __init__(self, task_id: str, user_id: str, created_at_ms: int, cost: float = 1.0,
+                 priority: int = TaskPriority.NORMAL, pool: str = ""):
+        self.task_id = task_id
+        self.user_id = user_id
+        self.created_at_ms = created_at_ms
+        self.cost = max(0.001, float(cost or 1.0))
+        self.priority = priority
+        self.pool = pool
+
+    def __repr__(self):
+        return f"Candidate({self.task_id!r}, user={self.user_id!r}, cost={self.cost})"
+
+
+class FairScheduler:
+    """Chooses which queued jobs get free upstream slots.
+
+    Start-time fair queueing over users: a user's next job is tagged with
+    (cost already held + cost of the job) / weight, and the lowest tag goes first, so every
+    backlogged user receives at least weight / sum(weights) of the dispatches no matter how many
+    jobs anyone else has queued. Within a user the order stays FIFO. A user with nothing in
+    flight whose oldest job has waited longer than max_wait_ms is served first and ignores class
+    ceilings, which bounds wait time for low-priority users under sustained load.
+    """
+
+    def __init__(self, weights: Optional[Dict[int, float]] = None, max_wait_ms: int = 300_000):
+        self.weights = dict(weights or DEFAULT_WEIGHTS)
+        self.max_wait_ms = max_wait_ms
+
+    def weight(self, priority: int) -> float:
+        return self.weights.get(priority, self.weights.get(TaskPriority.NORMAL, 1.0))
+
+    def plan(self, candidates: List[Candidate], free_slots: int, now_ms: int,
+             user_held: Optional[Dict[str, float]] = None,
+             user_free_slots: Optional[Dict[str, int]] = None,
+             in_flight: int = 0,
+             class_ceiling: Optional[Callable[[int], float]] = None) -> List[Candidate]:
+        """Return the candidates to start now, in start order.
+
+        user_held: cost each user already has in flight (their "service" so far).
+        user_free_slots: per-user concurrency still available (missing = unlimited).
+        class_ceiling(priority): max pool in-flight count at which that class may still start.
+        """
+        if free_slots <= 0 or not candidates:
+            return []
+        held = dict(user_held or {})
+        free_by_user = dict(user_free_slots or {})
+
+        queues: Dict[str, List[Candidate]] = {}
+        for c in sorted(candidates, key=lambda c: c.created_at_ms):
+            queues.setdefault(c.user_id, []).append(c)
+        cursor = {u: 0 for u in queues}
+
+        def tag(c: Candidate):
+            # Overdue = waited past max_wait with nothing in flight, i.e. actually starved.
+            # A user already being served never jumps the fair order just because their backlog is old.
+            overdue = now_ms - c.created_at_ms >= self.max_wait_ms and held.get(c.user_id, 0.0) <= 0
+            vft = (held.get(c.user_id, 0.0) + c.cost) / self.weight(c.priority)
+            # Overdue jobs sort first, oldest first; the rest by virtual finish time
+            return (0, c.created_at_ms, 0.0) if overdue else (1, vft, c.created_at_ms)
+
+        heap = []
+        for u, q in queues.items():
+            heapq.heappush(heap, (tag(q[0]), u))
+
+        picked: List[Candidate] = []
+        while heap and len(picked) < free_slots:
+            (rank, _, _), u = heapq.heappop(heap)
+            c = queues[u][cursor[u]]
+            if free_by_user.get(u, 1) <= 0:
+                continue  # User is at their own concurrency limit: nothing more from them this round
+            if rank and class_ceiling and in_flight >= class_ceiling(c.priority):
+                continue  # Class is over its share of capacity; higher classes keep their headroom
+            picked.append(c)
+            in_flight += 1
+            held[u] = held.get(u, 0.0) + c.cost
+            if u in free_by_user:
+                free_by_user[u] -= 1
+            cursor[u] += 1
+            if cursor[u] < len(queues[u]):
+                heapq.heappush(heap, (tag(queues[u][cursor[u]]), u))
+        return picked
+
+
+# =============================================================================
+# Simulation
+# =============================================================================
+
+def _fifo_plan(candidates: List[Candidate], free_slots: int, user_free_slots: Dict[str, int], **_) -> List[Candidate]:
+    """Previous behaviour: oldest job whose owner has a free slot goes first."""
+    picked = []
+    free = dict(user_free_slots)
+    for c in sorted(candidates, key=lambda c: c.created_at_ms):
+        if len(picked) >= free_slots:
+            break
+        if free.get(c.user_id, 0) > 0:
+            picked.append(c)
+            free[c.user_id] -= 1
+    return picked
+
+
+def simulate(users: Dict[str, Dict], capacity: int, duration_s: int, service_s: float,
+             scheduler: Optional[FairScheduler] = None, seed: int = 7) -> Dict[str, Dict]:
+    """Discrete-time (1s ticks) simulation of one provider pool.
+
+    users: name -> {"priority", "slots", "burst" (jobs queued at t=0), "rate" (jobs/s after)}.
+    Returns per-user completed jobs, share of throughput and wait percentiles (seconds).
+    With scheduler=None the FIFO baseline is used.
+    """
+    rng = random.Random(seed)
+    queue: List[Candidate] = []
+    running: List[tuple] = []  # (finish_s, user)
+    waits: Dict[str, List[float]] = {u: [] for u in users}
+    done: Dict[str, int] = {u: 0 for u in users}
+    seq = 0
+    for u, cfg in users.items():
+        for _ in range(cfg.get("burst", 0)):
+            seq += 1
+            queue.append(Candidate(f"{u}-{seq}", u, 0, 1.0, cfg["priority"]))
+
+    for t in range(duration_s):
+        now_ms = t * 1000
+        for u, cfg in users.items():
+            if rng.random() < cfg.get("rate", 0.0):
+                seq += 1
+                queue.append(Candidate(f"{u}-{seq}", u, now_ms, 1.0, cfg["priority"]))
+        finished = [r for r in running if r[0] <= t]
+        running = [r for r in running if r[0] > t]
+        for _, u in finished:
+            done[u] += 1
+
+        held: Dict[str, float] = {}
+        for _, u in running:
+            held[u] = held.get(u, 0.0) + 1
+        user_free = {u: cfg["slots"] - int(held.get(u, 0)) for u, cfg in users.items()}
+        free = capacity - len(running)
+        if scheduler:
+            picks = scheduler.plan(queue, free, now_ms, user_held=held, user_free_slots=user_free, in_flight=len(running))
+        else:
+            picks = _fifo_plan(queue, free, user_free)
+        picked_ids = {c.task_id for c in picks}
+        for c in picks:
+            waits[c.user_id].append(t - c.created_at_ms / 1000)
+            running.append((t + service_s * rng.uniform(0.8, 1.2), c.user_id))
+        queue = [c for c in queue if c.task_id not in picked_ids]
+
+    total = sum(done.values()) or 1
+
+    def pct(xs: List[float], p: float) -> float:
+        if not xs:
+            return 0.0
+        xs = sorted(xs)
+        return round(xs[min(len(xs) - 1, int(p * len(xs)))], 1)
+
+    return {
+        u: {
+            "completed": done[u],
+            "share": round(done[u] / total, 3),
+            "wait_p50": pct(waits[u], 0.5),
+            "wait_p95": pct(waits[u], 0.95),
+            "wait_max": pct(waits[u], 1.0),
+            "still_queued": sum(1 for c in queue if c.user_id == u),
+        }
+        for u in users
+    }
+
+
+def _print_report(title: str, result: Dict[str, Dict]):
+    print(title)
+    print(f"  {'user':<16}{'done':>6}{'share':>8}{'p50 s':>8}{'p95 s':>8}{'max s':>8}{'queued':>8}")
+    for u, r in result.items():
+        print(f"  {u:<16}{r['completed']:>6}{r['share']:>8}{r['wait_p50']:>8}{r['wait_p95']:>8}{r['wait_max']:>8}{r['still_queued']:>8}")
+
+
+def main():
+    # One shared Voicer pool with 10 slots; a heavy STARTER user dumps 300 jobs at t=0 using
+    # all 10 of their slots, while light users submit steadily.
+    users = {
+        "heavy_starter": {"priority": TaskPriority.NORMAL, "slots": 10, "burst": 300, "rate": 0.0},
+        "light_free": {"priority": TaskPriority.LOW, "slots": 1, "rate": 0.03},
+        "light_starter": {"priority": TaskPriority.NORMAL, "slots": 2, "rate": 0.05},
+        "light_pro": {"priority": TaskPriority.HIGH, "slots": 3, "rate": 0.08},
+        "light_unlimited": {"priority": TaskPriority.URGENT, "slots": 5, "rate": 0.08},
+    }
+    kwargs = dict(users=users, capacity=10, duration_s=900, service_s=20.0)
+    _print_report("FIFO (previous behaviour)", simulate(**kwargs))
+    print()
+    _print_report("Weighted fair queueing", simulate(scheduler=FairScheduler(max_wait_ms=120_000), **kwargs))
+
+
+__all__ = ["DEFAULT_WEIGHTS", "Candidate", "FairScheduler", "simulate"]
+
+if __name__ == "__main__":
+    main()
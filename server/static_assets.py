@@ -0,0 +1,224 @@
+"""
+Static Assets
+In-memory index of the built SPA (dist/) with precompressed brotli / gzip variants, ETags and
+immutable caching for content-hashed files
+
+Run `python -m server.static_assets [dist]` after `npm run build` to write .br / .gz files next to
+the originals, so the server only has to read them at startup instead of compressing.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import sys
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# Worth compressing; images and fonts are already compressed formats
+COMPRESSIBLE = re.compile(r"^(text/|application/(javascript|json|xml|manifest\+json|wasm)|image/svg\+xml)")
+# Vite output names: <name>-<8 char content hash>.<ext>
+HASHED_NAME = re.compile(r"-[0-9A-Za-z_]{8}\.[0-9A-Za-z]+$")
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"  # index.html and unhashed files: always revalidate, usually a 304
+
+_EXTRA_TYPES = {".js": "application/javascript", ".mjs": "application/javascript", ".webmanifest": "application/manifest+json",
+                ".svg": "image/svg+xml", ".woff2": "font/woff2", ".wasm": "application/wasm"}
+
+
+def _brotli():
+    try:
+        import brotli  # Optional: without it only gzip variants are produced
+        return brotli
+    except ImportError:
+        return None
+
+
+def guess_type(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    mime = _EXTRA_TYPES.get(ext) or mimetypes.guess_type(path)[0] or "application/octet-stream"
+    if mime.startswith("text/") or mime in ("application/javascript", "application/json"):
+        mime += "; charset=utf-8"
+    return mime
+
+
+def compress(data: bytes) -> Dict[str, bytes]:
+    """{"br": ..., "gzip": ...} at maximum settings (run once, not per request)."""
+    out = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    br = _brotli()
+    if br:
+        out["br"] = br.compress(data, quality=11)
+    return out
+
+
+class Asset:
+    """One file, with every encoding held in memory."""
+
+    __slots__ = ("path", "mime", "etag", "cache_control", "bodies")
+
+    def __init__(self, path: str, mime: str, data: bytes, cache_control: str):
+        self.path = path
+        self.mime = mime
+        self.etag = hashlib.sha1(data).hexdigest()[:20]
+        self.cache_control = cache_control
+        self.bodies: Dict[str, bytes] = {"identity": data}
+
+    def add_encoding(self, encoding: str, body: bytes):
+        # Only keep a variant that actually saves bytes
+        if len(body) < len(self.bodies["identity"]):
+            self.bodies[encoding] = body
+
+    def select(self, accept_encoding: Optional[str]) -> Tuple[str, bytes]:
+        """(encoding, body) for the request's Accept-Encoding: br, then gzip, then identity."""
+        accepted = parse_accept_encoding(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in self.bodies and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+                return encoding, self.bodies[encoding]
+        return "identity", self.bodies["identity"]
+
+    def headers(self, encoding: str) -> Dict[str, str]:
+        # Each encoding is a different representation, so it gets its own ETag
+        etag = f'"{self.etag}"' if encoding == "identity" else f'"{self.etag}-{encoding}"'
+        h = {"Content-Type": self.mime, "ETag": etag, "Cache-Control": self.cache_control}
+        if len(self.bodies) > 1:
+            h["Vary"] = "Accept-Encoding"
+        if encoding != "identity":
+            h["Content-Encoding"] = encoding
+        return h
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        out[token] = q
+    return out
+
+
+class StaticAssets:
+    """Relative path -> Asset for everything under root, loaded once.
+
+    Requests never touch the filesystem. Hashed files get a year of immutable caching; everything
+    else is revalidated against its ETag. Precompressed .br / .gz files written at build time are
+    used as-is; missing variants are compressed at load.
+    """
+
+    def __init__(self, root: str, min_compress_bytes: int = 1024, index: str = "index.html"):
+        self.root = os.path.abspath(root)
+        self.min_compress_bytes = min_compress_bytes
+        self.index = index
+        self._assets: Dict[str, Asset] = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.stats = {"files": 0, "bytes": 0, "compressed_bytes": 0, "precompressed": 0, "compressed_at_load": 0}
+
+    def load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            assets: Dict[str, Asset] = {}
+            for rel in _walk(self.root):
+                if rel.endswith((".br", ".gz")) and os.path.exists(os.path.join(self.root, rel[:-3])):
+                    continue  # Precompressed sibling, picked up with its original
+                assets[rel] = self._load_file(rel)
+            self._assets = assets
+            self._loaded = True
+
+    def _load_file(self, rel: str) -> Asset:
+        full = os.path.join(self.root, rel)
+        with open(full, "rb") as f:
+            data = f.read()
+        mime = guess_type(rel)
+        hashed = rel.startswith("assets/") or bool(HASHED_NAME.search(rel))
+        asset = Asset(rel, mime, data, IMMUTABLE if hashed and rel != self.index else REVALIDATE)
+        self.stats["files"] += 1
+        self.stats["bytes"] += len(data)
+        if len(data) >= self.min_compress_bytes and COMPRESSIBLE.match(mime):
+            missing = []
+            for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+                pre = full + suffix
+                if os.path.exists(pre) and os.path.getmtime(pre) >= os.path.getmtime(full):
+                    with open(pre, "rb") as f:
+                        asset.add_encoding(encoding, f.read())
+                    self.stats["precompressed"] += 1
+                else:
+                    missing.append(encoding)
+            if missing:
+                for encoding, body in compress(data).items():
+                    if encoding in missing:
+                        asset.add_encoding(encoding, body)
+                        self.stats["compressed_at_load"] += 1
+            self.stats["compressed_bytes"] += min(len(b) for b in asset.bodies.values())
+        return asset
+
+    def lookup(self, path: str) -> Optional[Asset]:
+        """Asset for a URL path, or the SPA index for client-side routes.
+
+        Paths with a file extension are real files or nothing: a missing /assets/x.js is a 404,
+        not index.html served as JavaScript.
+        """
+        if not self._loaded:
+            self.load()
+        rel = path.lstrip("/")
+        asset = self._assets.get(rel)
+        if asset or not rel:
+            return asset or self._assets.get(self.index)
+        if "." in rel.rsplit("/", 1)[-1]:
+            return None
+        return self._assets.get(self.index)
+
+    def snapshot(self) -> Dict:
+        return {"root": self.root, "loaded": self._loaded, "brotli": _brotli() is not None, **self.stats}
+
+
+def _walk(root: str) -> List[str]:
+    out = []
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            out.append(os.path.relpath(os.path.join(dirpath, name), root).replace(os.sep, "/"))
+    return sorted(out)
+
+
+def precompress(root: str, min_compress_bytes: int = 1024) -> List[Tuple[str, int, Dict[str, int]]]:
+    """Write <file>.br / <file>.gz for every compressible file under root (build step)."""
+    done = []
+    for rel in _walk(root):
+        if rel.endswith((".br", ".gz")):
+            continue
+        full = os.path.join(root, rel)
+        if not COMPRESSIBLE.match(guess_type(rel)) or os.path.getsize(full) < min_compress_bytes:
+            continue
+        with open(full, "rb") as f:
+            data = f.read()
+        sizes = {}
+        for encoding, body in compress(data).items():
+            with open(full + (".br" if encoding == "br" else ".gz"), "wb") as f:
+                f.write(body)
+            sizes[encoding] = len(body)
+        done.append((rel, len(data), sizes))
+    return done
+
+
+def main():
+    root = sys.argv[1] if len(sys.argv) > 1 else "dist"
+    if not _brotli():
+        print("brotli not installed: writing gzip only")
+    for rel, size, sizes in precompress(root):
+        print(f"  {rel:<48}{size:>10}" + "".join(f"{enc:>6} {n:>9}" for enc, n in sizes.items()))
+
+
+__all__ = ["Asset", "StaticAssets", "compress", "precompress", "parse_accept_encoding", "guess_type"]
+
+if __name__ == "__main__":
+    main()
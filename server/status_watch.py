@@ -0,0 +1,93 @@
+"""
+Status Watch
+Parks long-poll status requests until one of their jobs changes state, with one query per tick for
+every parked request in the process instead of one per client poll
+
+A request hands over its job ids and the states it has seen; while any request is parked, a single
+task reads the current states of all watched ids every `interval` seconds (or at once after poke())
+and wakes each request whose jobs moved on. Changes made by other processes (workers) are seen on
+the next tick; call poke() after a state change in this process to skip the wait.
+"""
+import asyncio
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+
+class _Waiter:
+    __slots__ = ("ids", "baseline", "future")
+
+    def __init__(self, ids: List[str], baseline: Dict[str, Any], future: asyncio.Future):
+        self.ids = ids
+        self.baseline = baseline
+        self.future = future
+
+
+class StatusWatcher:
+    """fetch(ids) -> {id: state} for the ids that exist; it runs in a thread, so it must open its
+    own connection. States are compared with ==; a missing id counts as state None."""
+
+    def __init__(self, fetch: Callable[[List[str]], Dict[str, Any]], interval: float = 0.5):
+        self.fetch = fetch
+        self.interval = interval
+        self._waiters: set = set()
+        self._task: Optional[asyncio.Task] = None
+        self._poke = asyncio.Event()
+        self.stats = {"waits": 0, "woken": 0, "timeouts": 0, "ticks": 0, "ids_checked": 0,
+                      "errors": 0, "last_tick_ms": 0.0, "last_error": None}
+
+    def states(self, ids: Iterable[str]) -> Dict[str, Any]:
+        return self.fetch(list(ids))
+
+    async def wait(self, ids: Iterable[str], baseline: Dict[str, Any], timeout: float) -> bool:
+        """Wait until the state of any id differs from baseline; False if timeout came first."""
+        waiter = _Waiter(list(ids), baseline, asyncio.get_running_loop().create_future())
+        self._waiters.add(waiter)
+        self.stats["waits"] += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+            self.stats["woken"] += 1
+            return True
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            return False
+        finally:
+            self._waiters.discard(waiter)
+
+    def poke(self):
+        """Check now instead of at the next tick (something in this process changed a job)."""
+        if self._waiters:
+            self._poke.set()
+
+    async def _run(self):
+        while self._waiters:
+            try:
+                await asyncio.wait_for(self._poke.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._poke.clear()
+            waiters = [w for w in self._waiters if not w.future.done()]
+            if not waiters:
+                continue
+            ids = sorted({i for w in waiters for i in w.ids})
+            started = time.perf_counter()
+            try:
+                current = await asyncio.to_thread(self.fetch, ids)
+            except Exception as e:
+                self.stats["errors"] += 1
+                self.stats["last_error"] = str(e)
+                continue
+            self.stats["ticks"] += 1
+            self.stats["ids_checked"] += len(ids)
+            self.stats["last_tick_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            for w in waiters:
+                if not w.future.done() and any(current.get(i) != w.baseline.get(i) for i in w.ids):
+                    w.future.set_result(True)
+
+    def snapshot(self) -> Dict:
+        return {**self.stats, "parked": len(self._waiters),
+                "watched_ids": len({i for w in self._waiters for i in w.ids}), "interval": self.interval}
+
+
+__all__ = ["StatusWatcher"]
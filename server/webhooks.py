@@ -0,0 +1,446 @@
+"""
+Webhooks
+Signed completion callbacks for API-key clients: an outbox filled by a database trigger, a delivery
+worker with jittered exponential backoff and a dead-letter state, and a local receiver for tests
+
+When a job submitted through a key with a webhook reaches completed / failed / cancelled, the
+trigger on jobs adds a webhook_deliveries row in the same transaction as the status change, so no
+code path that finishes a job can forget to notify. Dispatchers (one per worker process) claim due
+rows through Storage.claim, freeze the payload on the first attempt so retries send the same bytes,
+and POST it. A 2xx marks the row delivered; anything else is retried until max_attempts, after which
+the row is dead and stays in the table (the dead-letter store) until a client or admin retries it.
+
+Delivery is at least once: a dispatcher that dies mid-request loses its claim after lease_seconds
+and the row is sent again. Receivers should deduplicate on the X-Webhook-Id header.
+
+Signature: X-Webhook-Signature: t=<unix seconds>,v1=<hex HMAC-SHA256(secret, "<t>.<raw body>")>.
+Run `python -m server.webhooks receive [port] [--secret S] [--fail N]` for a local receiver that
+verifies signatures and prints what it gets (--fail answers 500 to the first N, to watch retries).
+"""
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import secrets
+import socket
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+import httpx
+
+from server.circuit_breaker import backoff_delay
+
+PENDING, SENDING, DELIVERED, DEAD = "pending", "sending", "delivered", "dead"
+TASK_EVENTS = ("completed", "failed", "cancelled")
+SIGNATURE_HEADER = "X-Webhook-Signature"
+
+# Applied after jobs.user_api_key_id and user_api_keys.webhook_url exist (migration api_key_webhooks)
+_NOW_MS_SQL = "CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)"
+_OUTBOX_INSERT = f"""
+            INSERT OR IGNORE INTO webhook_deliveries (api_key_id, user_id, task_id, event, status, next_attempt_ms, created_at_ms)
+            SELECT k.id, NEW.user_id, NEW.id, 'task.' || NEW.status, 'pending', {_NOW_MS_SQL}, {_NOW_MS_SQL}
+            FROM user_api_keys k WHERE k.id = NEW.user_api_key_id AND k.webhook_url IS NOT NULL;"""
+_FINISHED_SQL = "NEW.status IN ({})".format(", ".join(f"'{s}'" for s in TASK_EVENTS))
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS webhook_deliveries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    api_key_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    task_id TEXT,
+    event TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    payload_json TEXT,
+    url TEXT,
+    next_attempt_ms INTEGER NOT NULL,
+    lease_expires_ms INTEGER,
+    last_attempt_ms INTEGER,
+    last_status_code INTEGER,
+    last_error TEXT,
+    last_duration_ms INTEGER,
+    created_at_ms INTEGER NOT NULL,
+    delivered_at_ms INTEGER
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_webhook_deliveries_event ON webhook_deliveries(api_key_id, task_id, event);
+CREATE INDEX IF NOT EXISTS idx_webhook_deliveries_due ON webhook_deliveries(status, next_attempt_ms);
+CREATE INDEX IF NOT EXISTS idx_webhook_deliveries_key ON webhook_deliveries(api_key_id, id);
+CREATE TRIGGER IF NOT EXISTS trg_jobs_webhook_insert AFTER INSERT ON jobs
+WHEN NEW.user_api_key_id IS NOT NULL AND {_FINISHED_SQL}
+BEGIN{_OUTBOX_INSERT}
+END;
+CREATE TRIGGER IF NOT EXISTS trg_jobs_webhook_update AFTER UPDATE OF status ON jobs
+WHEN NEW.user_api_key_id IS NOT NULL AND {_FINISHED_SQL} AND OLD.status IS NOT NEW.status
+BEGIN{_OUTBOX_INSERT}
+END;
+"""
+
+# The same outbox trigger for `python -m server.storage copy` targets
+POSTGRES_DDL = [
+    f"""CREATE OR REPLACE FUNCTION jobs_webhook_outbox() RETURNS trigger AS $$
+        BEGIN
+            IF NEW.user_api_key_id IS NOT NULL AND {_FINISHED_SQL}
+               AND (TG_OP = 'INSERT' OR OLD.status IS DISTINCT FROM NEW.status) THEN
+                INSERT INTO webhook_deliveries (api_key_id, user_id, task_id, event, status, next_attempt_ms, created_at_ms)
+                SELECT k.id, NEW.user_id, NEW.id, 'task.' || NEW.status, 'pending',
+                       (extract(epoch FROM clock_timestamp()) * 1000)::bigint, (extract(epoch FROM clock_timestamp()) * 1000)::bigint
+                FROM user_api_keys k WHERE k.id = NEW.user_api_key_id AND k.webhook_url IS NOT NULL
+                ON CONFLICT DO NOTHING;
+            END IF;
+            RETURN NEW;
+        END $$ LANGUAGE plpgsql""",
+    "DROP TRIGGER IF EXISTS trg_jobs_webhook ON jobs",
+    "CREATE TRIGGER trg_jobs_webhook AFTER INSERT OR UPDATE OF status ON jobs FOR EACH ROW EXECUTE FUNCTION jobs_webhook_outbox()",
+]
+
+
+class WebhookError(ValueError):
+    pass
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def new_secret() -> str:
+    return "whsec_" + secrets.token_urlsafe(32)
+
+
+def sign(secret: str, body: bytes, timestamp: Optional[int] = None) -> str:
+    t = int(time.time()) if timestamp is None else timestamp
+    digest = hmac.new(secret.encode(), f"{t}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"t={t},v1={digest}"
+
+
+def verify(secret: str, header: str, body: bytes, tolerance: float = 300.0) -> bool:
+    """Check a signature header against the raw body; stale timestamps (replays) fail."""
+    try:
+        parts = dict(p.split("=", 1) for p in (header or "").split(","))
+        t = int(parts["t"])
+    except (KeyError, ValueError):
+        return False
+    if abs(time.time() - t) > tolerance:
+        return False
+    expected = sign(secret, body, t).split("v1=", 1)[1]
+    return hmac.compare_digest(expected, parts.get("v1", ""))
+
+
+def _public_addresses(hostname: str, port: int) -> List[Any]:
+    """Every address hostname resolves to, all of which must be public; raises WebhookError."""
+    try:
+        infos = socket.getaddrinfo(hostname, port, proto=socket.IPPROTO_TCP)
+    except socket.gaierror:
+        raise WebhookError(f"Cannot resolve {hostname}")
+    addresses = []
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%", 1)[0])
+        if not address.is_global:
+            raise WebhookError(f"{hostname} resolves to a non-public address")
+        addresses.append(address)
+    return addresses
+
+
+def check_url(url: str, allow_private: bool = False, require_https: bool = True) -> str:
+    """Validate a webhook URL; unless allow_private, every address it resolves to must be public.
+    Blocks. Raises WebhookError with a message fit for the client."""
+    parts = urlsplit((url or "").strip())
+    if parts.scheme not in ("https", "http") or not parts.hostname:
+        raise WebhookError("Webhook URL must be an absolute http(s) URL")
+    if require_https and parts.scheme != "https" and not allow_private:
+        raise WebhookError("Webhook URL must use https")
+    if len(url) > 2000:
+        raise WebhookError("Webhook URL is too long")
+    if not allow_private:
+        _public_addresses(parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+    return url.strip()
+
+
+def pin_url(url: str) -> Tuple[str, Dict[str, str], Dict[str, str]]:
+    """Resolve url once and check the addresses, as check_url does; returns (url with the host
+    replaced by a checked address, headers, httpx request extensions) to send to. Connecting to
+    the address that was checked means a second lookup (DNS rebinding) cannot swap in a private
+    one. The Host header and TLS server name (certificate check included) stay the hostname's.
+    Blocks; raises WebhookError."""
+    parts = urlsplit(url.strip())
+    if parts.scheme not in ("https", "http") or not parts.hostname:
+        raise WebhookError("Webhook URL must be an absolute http(s) URL")
+    host = parts.hostname
+    address = _public_addresses(host, parts.port or (443 if parts.scheme == "https" else 80))[0]
+    ip = f"[{address}]" if address.version == 6 else str(address)
+    port = f":{parts.port}" if parts.port else ""
+    userinfo = parts.netloc.rpartition("@")[0]
+    netloc = f"{userinfo}@{ip}{port}" if userinfo else f"{ip}{port}"
+    host_header = (f"[{host}]" if ":" in host else host) + port
+    return urlunsplit(parts._replace(netloc=netloc)), {"Host": host_header}, {"sni_hostname": host}
+
+
+class WebhookDispatcher:
+    """Sends due webhook_deliveries rows.
+
+    `storage` is a server.storage.Storage; describe(row) -> dict is the event's data (the task's
+    status payload), called once per delivery in a thread. wake() after adding rows in this
+    process; rows written by the trigger in other processes are picked up within poll_interval.
+    """
+
+    def __init__(self, storage, describe: Callable[[Dict], Optional[Dict]], max_attempts: int = 8,
+                 base_delay: float = 10.0, max_delay: float = 3600.0, timeout: float = 10.0,
+                 concurrency: int = 16, poll_interval: float = 1.0, lease_seconds: float = 60.0,
+                 allow_private: bool = False, on_event: Optional[Callable[..., None]] = None):
+        self.storage = storage
+        self.describe = describe
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.allow_private = allow_private
+        self.on_event = on_event  # (level, event_type, message, meta=...)
+        self._running: Set[asyncio.Task] = set()
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self.stats = {"attempts": 0, "delivered": 0, "failed_attempts": 0, "dead": 0, "errors": 0,
+                      "last_error": None, "last_duration_ms": 0}
+
+    def wake(self):
+        self._wake.set()
+
+    # -- dispatch loop ----------------------------------------------------------
+
+    async def run(self):
+        async with httpx.AsyncClient(timeout=self.timeout, follow_redirects=False,
+                                     headers={"User-Agent": "FiftyFive-Webhooks/1.0"}) as client:
+            while not self._stopping:
+                try:
+                    free = self.concurrency - len(self._running)
+                    for row in await self._claim(free) if free > 0 else []:
+                        task = asyncio.create_task(self._deliver(client, row))
+                        self._running.add(task)
+                        task.add_done_callback(self._running.discard)
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    self.stats["last_error"] = str(e)
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+            if self._running:
+                await asyncio.wait(list(self._running), timeout=self.timeout)
+
+    async def stop(self):
+        self._stopping = True
+        self._wake.set()
+
+    async def _claim(self, limit: int):
+        now = _now_ms()
+        return await self.storage.claim(
+            "webhook_deliveries",
+            "status = 'sending', attempts = attempts + 1, lease_expires_ms = ?, last_attempt_ms = ?",
+            "(status = 'pending' AND next_attempt_ms <= ?) OR (status = 'sending' AND lease_expires_ms < ?)",
+            params=(now, now), set_params=(now + int(self.lease_seconds * 1000), now),
+            order_by="next_attempt_ms", limit=limit,
+        )
+
+    async def _deliver(self, client: httpx.AsyncClient, row: Dict):
+        try:
+            await self._send(client, row)
+        except Exception as e:
+            # Bookkeeping failed (database busy): the claim lapses and the row is sent again
+            self.stats["errors"] += 1
+            self.stats["last_error"] = str(e)
+
+    async def _send(self, client: httpx.AsyncClient, row: Dict):
+        target = await self.storage.fetchone(
+            "SELECT webhook_url, webhook_secret FROM user_api_keys WHERE id = ?", (row["api_key_id"],))
+        if not target or not target["webhook_url"]:
+            await self._finish(row, DEAD, error="Webhook removed from the API key")
+            return
+        url = target["webhook_url"]
+        send_url, pinned_headers, extensions = url, {}, {}
+        try:
+            body = await self._payload(row)
+            if not self.allow_private:
+                # Re-checked (DNS may have changed since the URL was saved) and sent to the checked address
+                send_url, pinned_headers, extensions = await asyncio.to_thread(pin_url, url)
+        except Exception as e:
+            await self._failed(row, url, None, str(e))
+            return
+
+        headers = {
+            "Content-Type": "application/json",
+            "X-Webhook-Id": f"evt_{row['id']}",
+            "X-Webhook-Event": row["event"],
+            "X-Webhook-Attempt": str(row["attempts"]),
+            SIGNATURE_HEADER: sign(target["webhook_secret"] or "", body),
+            **pinned_headers,
+        }
+        started = time.perf_counter()
+        self.stats["attempts"] += 1
+        try:
+            response = await client.post(send_url, content=body, headers=headers, extensions=extensions)
+        except httpx.HTTPError as e:
+            await self._failed(row, url, None, f"{type(e).__name__}: {e}", started)
+            return
+        if 200 <= response.status_code < 300:
+            self.stats["delivered"] += 1
+            await self._finish(row, DELIVERED, url, response.status_code, None, started)
+        else:
+            await self._failed(row, url, response.status_code, f"HTTP {response.status_code}: {response.text[:200]}", started)
+
+    async def _payload(self, row: Dict) -> bytes:
+        """The body sent on every attempt: built and stored on the first one."""
+        if row["payload_json"]:
+            return row["payload_json"].encode()
+        data = {}
+        if row["task_id"]:
+            data = await asyncio.to_thread(self.describe, row) or {"id": row["task_id"]}  # Job deleted since
+        payload = {"id": f"evt_{row['id']}", "type": row["event"], "created_at_ms": row["created_at_ms"], "data": data}
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+        await self.storage.execute("UPDATE webhook_deliveries SET payload_json = ? WHERE id = ? AND payload_json IS NULL",
+                                   (body, row["id"]))
+        row["payload_json"] = body
+        return body.encode()
+
+    async def _failed(self, row: Dict, url: str, status_code: Optional[int], error: str,
+                      started: Optional[float] = None):
+        self.stats["failed_attempts"] += 1
+        if row["attempts"] >= self.max_attempts:
+            self.stats["dead"] += 1
+            await self._finish(row, DEAD, url, status_code, error, started)
+            if self.on_event:
+                self.on_event("warning", "webhook_dead", f"Webhook {row['event']} for {row['task_id']} dead after "
+                              f"{row['attempts']} attempts: {error}",
+                              meta={"delivery_id": row["id"], "api_key_id": row["api_key_id"]})
+            return
+        delay = max(1.0, backoff_delay(row["attempts"] - 1, self.base_delay, self.max_delay))
+        await self._finish(row, PENDING, url, status_code, error, started, next_attempt_ms=_now_ms() + int(delay * 1000))
+
+    async def _finish(self, row: Dict, status: str, url: Optional[str] = None, status_code: Optional[int] = None,
+                      error: Optional[str] = None, started: Optional[float] = None, next_attempt_ms: Optional[int] = None):
+        duration = int((time.perf_counter() - started) * 1000) if started is not None else None
+        if duration is not None:
+            self.stats["last_duration_ms"] = duration
+        now = _now_ms()
+        await self.storage.execute(
+            """UPDATE webhook_deliveries SET status = ?, url = COALESCE(?, url), last_status_code = ?, last_error = ?,
+                   last_duration_ms = ?, next_attempt_ms = COALESCE(?, next_attempt_ms), lease_expires_ms = NULL,
+                   delivered_at_ms = ?
+               WHERE id = ? AND status = 'sending'""",
+            (status, url, status_code, (error or None) and error[:1000], duration, next_attempt_ms,
+             now if status == DELIVERED else None, row["id"])
+        )
+
+    # -- management -------------------------------------------------------------
+
+    async def ping(self, api_key_id: str, user_id: str) -> int:
+        """Queue a test event for the key's webhook; returns the delivery id."""
+        now = _now_ms()
+        async with self.storage.transaction() as tx:
+            await tx.execute(
+                """INSERT INTO webhook_deliveries (api_key_id, user_id, task_id, event, status, next_attempt_ms, created_at_ms)
+                   VALUES (?, ?, NULL, 'ping', 'pending', ?, ?)""",
+                (api_key_id, user_id, now, now)
+            )
+            row = await tx.fetchone(
+                "SELECT MAX(id) AS id FROM webhook_deliveries WHERE api_key_id = ? AND event = 'ping'", (api_key_id,))
+        self.wake()
+        return row["id"]
+
+    async def retry(self, delivery_id: int, api_key_id: str) -> bool:
+        """Send a dead (or already delivered) row again with a fresh set of attempts."""
+        now = _now_ms()
+        changed = await self.storage.execute(
+            """UPDATE webhook_deliveries SET status = 'pending', attempts = 0, next_attempt_ms = ?, delivered_at_ms = NULL
+               WHERE id = ? AND api_key_id = ? AND status IN ('dead', 'delivered')""",
+            (now, delivery_id, api_key_id)
+        )
+        if changed:
+            self.wake()
+        return changed == 1
+
+    async def purge(self, older_than_ms: int) -> int:
+        """Drop delivered rows created before older_than_ms (dead ones are kept for retry)."""
+        return await self.storage.execute(
+            "DELETE FROM webhook_deliveries WHERE status = 'delivered' AND created_at_ms < ?", (older_than_ms,))
+
+    def snapshot(self) -> Dict:
+        return {**self.stats, "in_flight": len(self._running), "concurrency": self.concurrency,
+                "max_attempts": self.max_attempts}
+
+
+def delivery_view(row: Dict) -> Dict:
+    """A webhook_deliveries row as shown in the delivery log."""
+    out = {k: row[k] for k in ("id", "task_id", "event", "status", "attempts", "url", "last_status_code",
+                               "last_error", "last_duration_ms", "created_at_ms", "last_attempt_ms", "delivered_at_ms")}
+    out["id"] = f"evt_{row['id']}"
+    out["next_attempt_ms"] = row["next_attempt_ms"] if row["status"] == PENDING else None
+    return out
+
+
+# -- local receiver ---------------------------------------------------------------
+
+def receive(port: int = 8099, secret: Optional[str] = None, fail: int = 0):
+    """Print webhook requests on http://127.0.0.1:<port>/, checking signatures when secret is given.
+    Register it with WEBHOOK_ALLOW_PRIVATE=true."""
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    state = {"count": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            state["count"] += 1
+            signature = self.headers.get(SIGNATURE_HEADER, "")
+            valid = verify(secret, signature, body) if secret else None
+            status = 500 if state["count"] <= fail else (401 if valid is False else 200)
+            check = {True: "signature ok", False: "BAD SIGNATURE", None: "unchecked"}[valid]
+            print(f"#{state['count']} {self.headers.get('X-Webhook-Event')} {self.headers.get('X-Webhook-Id')} "
+                  f"attempt {self.headers.get('X-Webhook-Attempt')} ({check}) -> {status}")
+            try:
+                print("   " + json.dumps(json.loads(body), ensure_ascii=False))
+            except ValueError:
+                print("   " + body[:500].decode(errors="replace"))
+            sys.stdout.flush()
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args: Any):
+            pass
+
+    server = HTTPServer(("127.0.0.1", port), Handler)
+    print(f"listening on http://127.0.0.1:{port}/" + (" (verifying signatures)" if secret else ""))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    args = sys.argv[1:]
+    if not args or args[0] != "receive":
+        print("usage: python -m server.webhooks receive [port] [--secret whsec_...] [--fail N]")
+        sys.exit(2)
+    opts: Dict[str, str] = {}
+    positional = []
+    rest = iter(args[1:])
+    for arg in rest:
+        if arg in ("--secret", "--fail"):
+            opts[arg] = next(rest, "")
+        else:
+            positional.append(arg)
+    receive(int(positional[0]) if positional else 8099, opts.get("--secret"), int(opts.get("--fail") or 0))
+
+
+__all__ = ["WebhookDispatcher", "WebhookError", "new_secret", "sign", "verify", "check_url", "pin_url", "delivery_view",
+           "receive", "SCHEMA", "POSTGRES_DDL", "TASK_EVENTS", "SIGNATURE_HEADER", "PENDING", "SENDING", "DELIVERED", "DEAD"]
+
+if __name__ == "__main__":
+    main()
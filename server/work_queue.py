@@ -0,0 +1,393 @@
+"""
+Work Queue
+Durable SQLite-backed background work with leases, heartbeats, retries and dead letters
+"""
+import asyncio
+import json
+import os
+import random
+import socket
+import sqlite3
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+READY = "ready"    # Waiting for run_after_ms
+LEASED = "leased"  # A worker holds it until lease_expires_ms (extended by heartbeats)
+DONE = "done"
+DEAD = "dead"      # Out of attempts; kept for inspection / manual retry
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS work_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload_json TEXT NOT NULL,
+    job_id TEXT,
+    dedupe_key TEXT,
+    status TEXT NOT NULL DEFAULT 'ready',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 5,
+    run_after_ms INTEGER NOT NULL,
+    lease_owner TEXT,
+    lease_token TEXT,
+    lease_expires_ms INTEGER,
+    last_error TEXT,
+    created_at_ms INTEGER NOT NULL,
+    updated_at_ms INTEGER NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_work_items_dedupe ON work_items(dedupe_key) WHERE status IN ('ready', 'leased');
+CREATE INDEX IF NOT EXISTS idx_work_items_due ON work_items(status, run_after_ms);
+CREATE INDEX IF NOT EXISTS idx_work_items_job ON work_items(job_id);
+CREATE TABLE IF NOT EXISTS work_workers (
+    worker_id TEXT PRIMARY KEY,
+    role TEXT,
+    hostname TEXT,
+    pid INTEGER,
+    started_at_ms INTEGER,
+    heartbeat_ms INTEGER
+);
+"""
+
+
+class RetryLater(Exception):
+    """Raised by a handler to run the item again after `delay` seconds without using an attempt
+    (e.g. an upstream operation is still running)."""
+
+    def __init__(self, delay: float = 5.0):
+        super().__init__(f"retry in {delay}s")
+        self.delay = delay
+
+
+def make_worker_id(role: str = "api") -> str:
+    return f"{role}:{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class WorkItem:
+    __slots__ = ("id", "kind", "payload", "job_id", "attempts", "max_attempts", "lease_token")
+
+    def __init__(self, id: int, kind: str, payload: Dict, job_id: Optional[str], attempts: int,
+                 max_attempts: int, lease_token: str):
+        self.id = id
+        self.kind = kind
+        self.payload = payload
+        self.job_id = job_id
+        self.attempts = attempts
+        self.max_attempts = max_attempts
+        self.lease_token = lease_token
+
+    def __repr__(self):
+        return f"WorkItem({self.id}, {self.kind!r}, job={self.job_id!r}, attempt={self.attempts})"
+
+
+class WorkQueue:
+    """Work items in the application database.
+
+    enqueue() takes the caller's connection and does not commit, so an item can be written in
+    the same transaction as the job row it belongs to. Leases are taken with a single UPDATE, so
+    any number of processes can pull from the queue; a worker that dies simply stops
+    heartbeating and its items become leasable again when the lease expires.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], lease_seconds: float = 60.0,
+                 clock: Callable[[], float] = time.time):
+        self.connect = connect
+        self.lease_seconds = lease_seconds
+        self.clock = clock
+
+    def _now_ms(self) -> int:
+        return int(self.clock() * 1000)
+
+    def ensure_schema(self, con: sqlite3.Connection):
+        con.executescript(SCHEMA)
+
+    # -- producers ------------------------------------------------------------
+
+    def enqueue(self, con: sqlite3.Connection, kind: str, payload: Dict, job_id: Optional[str] = None,
+                dedupe_key: Optional[str] = None, delay: float = 0.0, max_attempts: int = 5) -> bool:
+        """Add an item (caller commits). With dedupe_key, nothing is added while an item with
+        the same key is still ready or leased; returns False in that case."""
+        now = self._now_ms()
+        cur = con.execute(
+            """INSERT OR IGNORE INTO work_items
+               (kind, payload_json, job_id, dedupe_key, status, attempts, max_attempts, run_after_ms, created_at_ms, updated_at_ms)
+               VALUES (?, ?, ?, ?, 'ready', 0, ?, ?, ?, ?)""",
+            (kind, json.dumps(payload, ensure_ascii=False), job_id, dedupe_key, max(1, max_attempts),
+             now + int(delay * 1000), now, now)
+        )
+        return cur.rowcount == 1
+
+    def has_active(self, con: sqlite3.Connection, job_id: str) -> bool:
+        row = con.execute(
+            "SELECT 1 FROM work_items WHERE job_id = ? AND status IN ('ready', 'leased') LIMIT 1", (job_id,)
+        ).fetchone()
+        return row is not None
+
+    # -- consumers ------------------------------------------------------------
+
+    def lease(self, owner: str, limit: int = 1, kinds: Optional[List[str]] = None) -> List[WorkItem]:
+        """Claim up to `limit` due items (ready, or leased by a worker whose lease ran out)."""
+        if limit <= 0:
+            return []
+        now = self._now_ms()
+        token = uuid.uuid4().hex
+        kind_sql = ""
+        params: List[Any] = [owner, token, now + int(self.lease_seconds * 1000), now, now, now]
+        if kinds:
+            kind_sql = f" AND kind IN ({','.join('?' * len(kinds))})"
+            params.extend(kinds)
+        params.append(limit)
+        con = self.connect()
+        try:
+            con.execute(
+                f"""UPDATE work_items
+                    SET status = 'leased', lease_owner = ?, lease_token = ?, lease_expires_ms = ?,
+                        attempts = attempts + 1, updated_at_ms = ?
+                    WHERE id IN (
+                        SELECT id FROM work_items
+                        WHERE ((status = 'ready' AND run_after_ms <= ?) OR (status = 'leased' AND lease_expires_ms < ?)){kind_sql}
+                        ORDER BY run_after_ms ASC, id ASC LIMIT ?
+                    )""",
+                params
+            )
+            con.commit()
+            rows = con.execute(
+                "SELECT id, kind, payload_json, job_id, attempts, max_attempts FROM work_items WHERE lease_token = ?",
+                (token,)
+            ).fetchall()
+        finally:
+            con.close()
+        items = []
+        for r in rows:
+            try:
+                payload = json.loads(r[2] or "{}")
+            except ValueError:
+                payload = {}
+            items.append(WorkItem(r[0], r[1], payload, r[3], r[4], r[5], token))
+        return items
+
+    def _update_leased(self, item: WorkItem, sql: str, params: tuple) -> bool:
+        """Apply sql to the item only while we still hold its lease."""
+        con = self.connect()
+        try:
+            cur = con.execute(sql + " WHERE id = ? AND lease_token = ? AND status = 'leased'",
+                              params + (item.id, item.lease_token))
+            con.commit()
+            return cur.rowcount == 1
+        finally:
+            con.close()
+
+    def heartbeat(self, item: WorkItem) -> bool:
+        """Extend the lease; False means another worker took the item over."""
+        now = self._now_ms()
+        return self._update_leased(item, "UPDATE work_items SET lease_expires_ms = ?, updated_at_ms = ?",
+                                   (now + int(self.lease_seconds * 1000), now))
+
+    def complete(self, item: WorkItem) -> bool:
+        return self._update_leased(item, "UPDATE work_items SET status = 'done', lease_token = NULL, updated_at_ms = ?",
+                                   (self._now_ms(),))
+
+    def retry_later(self, item: WorkItem, delay: float) -> bool:
+        """Reschedule without using up an attempt (the lease already counted one)."""
+        now = self._now_ms()
+        return self._update_leased(
+            item,
+            "UPDATE work_items SET status = 'ready', attempts = attempts - 1, run_after_ms = ?, lease_token = NULL, updated_at_ms = ?",
+            (now + int(delay * 1000), now)
+        )
+
+    def release(self, item: WorkItem) -> bool:
+        """Hand the item back untouched (graceful shutdown)."""
+        return self.retry_later(item, 0)
+
+    def fail(self, item: WorkItem, error: str, base_delay: float = 5.0, max_delay: float = 300.0) -> bool:
+        """Record a failed attempt: retry with jittered exponential backoff, or dead-letter it.
+        Returns True when the item is now dead."""
+        now = self._now_ms()
+        dead = item.attempts >= item.max_attempts
+        delay = random.uniform(0.5, 1.0) * min(max_delay, base_delay * (2 ** max(0, item.attempts - 1)))
+        self._update_leased(
+            item,
+            "UPDATE work_items SET status = ?, last_error = ?, run_after_ms = ?, lease_token = NULL, updated_at_ms = ?",
+            (DEAD if dead else READY, (error or "")[:1000], now + int(delay * 1000), now)
+        )
+        return dead
+
+    def retry_dead(self, con: sqlite3.Connection, item_id: int) -> bool:
+        """Give a dead item a fresh set of attempts (caller commits)."""
+        now = self._now_ms()
+        cur = con.execute(
+            "UPDATE work_items SET status = 'ready', attempts = 0, run_after_ms = ?, updated_at_ms = ? WHERE id = ? AND status = 'dead'",
+            (now, now, item_id)
+        )
+        return cur.rowcount == 1
+
+    def purge(self, con: sqlite3.Connection, older_than_ms: int) -> int:
+        """Delete finished items last touched before older_than_ms (caller commits)."""
+        cur = con.execute("DELETE FROM work_items WHERE status = 'done' AND updated_at_ms < ?", (older_than_ms,))
+        return cur.rowcount
+
+    # -- worker registry ------------------------------------------------------
+
+    def register_worker(self, worker_id: str, role: str = "api"):
+        now = self._now_ms()
+        con = self.connect()
+        try:
+            con.execute(
+                """INSERT OR REPLACE INTO work_workers (worker_id, role, hostname, pid, started_at_ms, heartbeat_ms)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (worker_id, role, socket.gethostname(), os.getpid(), now, now)
+            )
+            con.commit()
+        finally:
+            con.close()
+
+    def worker_heartbeat(self, worker_id: str):
+        con = self.connect()
+        try:
+            con.execute("UPDATE work_workers SET heartbeat_ms = ? WHERE worker_id = ?", (self._now_ms(), worker_id))
+            con.commit()
+        finally:
+            con.close()
+
+    def unregister_worker(self, worker_id: str):
+        con = self.connect()
+        try:
+            con.execute("DELETE FROM work_workers WHERE worker_id = ?", (worker_id,))
+            con.commit()
+        finally:
+            con.close()
+
+    def live_workers(self, con: sqlite3.Connection) -> Set[str]:
+        """Workers that heartbeated within one lease period; long-dead rows are pruned (caller commits)."""
+        cutoff = self._now_ms() - int(self.lease_seconds * 1000)
+        con.execute("DELETE FROM work_workers WHERE heartbeat_ms < ?", (cutoff - int(self.lease_seconds * 1000 * 10),))
+        rows = con.execute("SELECT worker_id FROM work_workers WHERE heartbeat_ms >= ?", (cutoff,)).fetchall()
+        return {r[0] for r in rows}
+
+    # -- admin ----------------------------------------------------------------
+
+    def snapshot(self, con: sqlite3.Connection, dead_limit: int = 20) -> Dict:
+        counts: Dict[str, Dict[str, int]] = {}
+        for kind, status, cnt in con.execute(
+            "SELECT kind, status, COUNT(*) FROM work_items WHERE status != 'done' GROUP BY kind, status"
+        ).fetchall():
+            counts.setdefault(kind, {})[status] = cnt
+        dead = [
+            {"id": r[0], "kind": r[1], "job_id": r[2], "attempts": r[3], "last_error": r[4], "updated_at_ms": r[5]}
+            for r in con.execute(
+                "SELECT id, kind, job_id, attempts, last_error, updated_at_ms FROM work_items WHERE status = 'dead' ORDER BY updated_at_ms DESC LIMIT ?",
+                (dead_limit,)
+            ).fetchall()
+        ]
+        workers = [
+            {"worker_id": r[0], "role": r[1], "hostname": r[2], "pid": r[3], "heartbeat_age_seconds": round((self._now_ms() - r[4]) / 1000, 1)}
+            for r in con.execute("SELECT worker_id, role, hostname, pid, heartbeat_ms FROM work_workers ORDER BY worker_id").fetchall()
+        ]
+        return {"lease_seconds": self.lease_seconds, "counts": counts, "dead": dead, "workers": workers}
+
+
+Handler = Callable[[Dict], Awaitable[Any]]
+
+
+class WorkRunner:
+    """Pulls items from a WorkQueue and runs their handlers, heartbeating leases while they run.
+
+    Handlers must be idempotent: after a crash an item is run again from the start. A handler
+    returns normally when done, raises RetryLater to be polled again, or raises anything else
+    to use up an attempt.
+    """
+
+    def __init__(self, queue: WorkQueue, handlers: Dict[str, Handler], worker_id: str, role: str = "api",
+                 concurrency: int = 8, poll_interval: float = 1.0,
+                 on_error: Optional[Callable[[WorkItem, BaseException, bool], None]] = None):
+        self.queue = queue
+        self.handlers = handlers
+        self.worker_id = worker_id
+        self.role = role
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+        self.on_error = on_error
+        self._running: Dict[int, asyncio.Task] = {}
+        self._interrupted: Set[int] = set()
+        self._wake = asyncio.Event()
+        self._stopping = False
+
+    def wake(self):
+        """Check the queue now instead of at the next poll (call after enqueue + commit)."""
+        self._wake.set()
+
+    async def run(self):
+        self.queue.register_worker(self.worker_id, self.role)
+        last_beat = time.monotonic()
+        while not self._stopping:
+            try:
+                if time.monotonic() - last_beat >= self.queue.lease_seconds / 3:
+                    self.queue.worker_heartbeat(self.worker_id)
+                    last_beat = time.monotonic()
+                free = self.concurrency - len(self._running)
+                for item in self.queue.lease(self.worker_id, free, list(self.handlers)):
+                    task = asyncio.create_task(self._execute(item))
+                    self._running[item.id] = task
+                    task.add_done_callback(lambda _t, item_id=item.id: self._running.pop(item_id, None))
+            except Exception as e:
+                if self.on_error:
+                    self.on_error(None, e, False)
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _heartbeat(self, item: WorkItem):
+        while True:
+            await asyncio.sleep(self.queue.lease_seconds / 3)
+            if not self.queue.heartbeat(item):
+                return  # Lease lost; the new owner's result wins
+
+    async def _execute(self, item: WorkItem):
+        beat = asyncio.create_task(self._heartbeat(item))
+        try:
+            await self.handlers[item.kind](item.payload)
+        except RetryLater as e:
+            self.queue.retry_later(item, e.delay)
+        except asyncio.CancelledError:
+            self.queue.release(item)
+            raise
+        except Exception as e:
+            dead = self.queue.fail(item, f"{type(e).__name__}: {e}")
+            if self.on_error:
+                self.on_error(item, e, dead)
+        else:
+            if item.id in self._interrupted:
+                self.queue.release(item)  # Handler swallowed the shutdown cancel; run it again elsewhere
+            else:
+                self.queue.complete(item)
+        finally:
+            beat.cancel()
+
+    async def stop(self, grace_seconds: float = 5.0):
+        """Stop leasing, give running handlers a moment, then hand their items back."""
+        self._stopping = True
+        self._wake.set()
+        running = dict(self._running)
+        if running:
+            await asyncio.wait(list(running.values()), timeout=grace_seconds)
+            pending = [(item_id, t) for item_id, t in running.items() if not t.done()]
+            for item_id, task in pending:
+                self._interrupted.add(item_id)
+                task.cancel()
+            await asyncio.gather(*(t for _, t in pending), return_exceptions=True)
+        self.queue.unregister_worker(self.worker_id)
+
+
+__all__ = [
+    "READY",
+    "LEASED",
+    "DONE",
+    "DEAD",
+    "RetryLater",
+    "make_worker_id",
+    "WorkItem",
+    "WorkQueue",
+    "WorkRunner",
+]
@@ -0,0 +1,50 @@
+"""
+Worker
+Background tier: fair-share dispatch, upstream polling, downloads, storage writes and cleanup, without HTTP
+
+Run `python -m server.worker` next to API processes started with WORKER_MODE=api. Workers and API
+processes coordinate only through the database (jobs + work queue), so either tier can be scaled
+on its own; several workers share the queue through leases.
+"""
+import asyncio
+import os
+import signal
+
+# Must be set before server.main reads its configuration
+os.environ["WORKER_MODE"] = "worker"
+
+
+async def run():
+    # Imported here, not at module level: media pool processes re-import this module as __mp_main__
+    from server import main as app
+
+    app.init_db()
+    app._reload_model_registry()
+    app.log_event("info", "worker_start", f"Worker {app.WORKER_ID} started")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # Windows: Ctrl+C raises KeyboardInterrupt instead
+
+    services = app.start_services("worker")
+    try:
+        await stop.wait()
+    finally:
+        # Unfinished items go back to the queue for the next worker
+        await app.stop_services(services)
+        app.log_event("info", "worker_stop", f"Worker {app.WORKER_ID} stopped")
+        await asyncio.to_thread(app.db_writer.stop)
+
+
+def main():
+    asyncio.run(run())
+
+
+__all__ = ["run", "main"]
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Streaming ZIP
+Writes a ZIP archive of files on disk as a stream of chunks, with memory bounded by one read chunk
+whatever the archive size
+
+Entries are stored, not deflated: the outputs (PNG, MP3, WebP) are compressed already, so deflate
+would burn CPU for nothing. zipfile writes into a sink that cannot seek, which makes it emit each
+entry's CRC and sizes in a data descriptor after the data (ZIP64 where needed) instead of patching
+the local header; the sink is drained after every chunk. Iteration is blocking file I/O, so hand the
+generator to a thread (StreamingResponse does that for plain iterators).
+
+Run `python -m server.zipstream out.zip file...` to write an archive with it.
+"""
+import io
+import os
+import sys
+import time
+import zipfile
+from typing import Iterable, Iterator, List, Tuple, Union
+
+CHUNK_SIZE = 256 * 1024
+
+
+class _Sink(io.RawIOBase):
+    """Write-only, non-seekable buffer; zipfile falls back to streaming mode for it."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def _date_time(mtime: float) -> Tuple[int, ...]:
+    # ZIP timestamps start in 1980
+    return time.localtime(max(mtime, 315532800))[:6]
+
+
+def iter_zip(entries: Iterable[Tuple[str, Union[str, bytes]]], chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield the archive for (name in archive, path on disk) pairs; bytes in place of the path are
+    the entry's content (small generated files). Files that vanished since the caller listed them
+    are left out. `entries` is consumed lazily, so it may be a generator that finds files as the
+    archive reaches them."""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for name, path in entries:
+            if isinstance(path, bytes):
+                info = zipfile.ZipInfo(name, date_time=_date_time(time.time()))
+                info.external_attr = 0o644 << 16
+                archive.writestr(info, path)
+                yield sink.drain()
+                continue
+            try:
+                src = open(path, "rb")
+            except FileNotFoundError:
+                continue
+            with src:
+                stat = os.fstat(src.fileno())
+                info = zipfile.ZipInfo(name, date_time=_date_time(stat.st_mtime))
+                info.compress_type = zipfile.ZIP_STORED
+                info.file_size = stat.st_size  # Lets zipfile pick ZIP64 for this entry up front
+                info.external_attr = 0o644 << 16
+                with archive.open(info, "w") as dst:
+                    while True:
+                        chunk = src.read(chunk_size)
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                        yield sink.drain()
+            tail = sink.drain()  # Data descriptor
+            if tail:
+                yield tail
+    tail = sink.drain()  # Central directory
+    if tail:
+        yield tail
+
+
+def main(argv: List[str]) -> int:
+    if len(argv) < 2:
+        print("usage: python -m server.zipstream out.zip file...", file=sys.stderr)
+        return 2
+    started = time.perf_counter()
+    written = 0
+    with open(argv[0], "wb") as out:
+        for chunk in iter_zip((os.path.basename(p), p) for p in argv[1:]):
+            out.write(chunk)
+            written += len(chunk)
+    print(f"{argv[0]}: {written} bytes in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+__all__ = ["iter_zip", "CHUNK_SIZE"]
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -47,6 +47,24 @@ function getVoiceStreamUrl(taskId) {
   return `${API_BASE}/api/voice/download/${taskId}?token=${encodeURIComponent(t)}`;
 }
 
+// ZIP of finished outputs, streamed by the server straight to disk (filters: type, ids, from_ms, to_ms).
+// Posted as a form: long id lists do not fit in a URL, and the browser still saves the response as a download
+function downloadExportZip(filters) {
+  const form = document.createElement('form');
+  form.method = 'POST';
+  form.action = `${API_BASE}/api/export/zip`;
+  Object.entries({ ...filters, token: api.token || '' }).forEach(([name, value]) => {
+    const input = document.createElement('input');
+    input.type = 'hidden';
+    input.name = name;
+    input.value = value;
+    form.appendChild(input);
+  });
+  document.body.appendChild(form);
+  form.submit();
+  form.remove();
+}
+
 const PENDING_IMAGE_IDS_KEY = 'ff_image_pending_task_ids';
 function getPendingImageTaskIds() {
   try {
@@ -1314,39 +1332,14 @@ function VoiceTab({ user, refreshUser, showToast, onGoToLibrary }) {
             {completedTasks.length > 0 && (
               <div className="flex items-center gap-2">
                 <button
-                  onClick={async () => {
+                  onClick={() => {
                     const toZip = completedTasks.filter(t => t.status === 'completed' && !(t.completedAt && Date.now() > t.completedAt + 12 * 60 * 60 * 1000));
                     if (toZip.length === 0) {
                       showToast('No completed tasks to download', 'info');
                       return;
                     }
-                    try {
-                      showToast(`Preparing ${toZip.length} file${toZip.length !== 1 ? 's' : ''}…`, 'info');
-                      const JSZip = (await import('jszip')).default;
-                      const zip = new JSZip();
-                      let count = 0;
-                      for (const task of toZip) {
-                        try {
-                          const res = await fetchAudioWithRetry(task.id);
-                          const blob = await res.blob();
-                          zip.file(`voice_${task.id}.mp3`, blob);
-                          count++;
-                        } catch (_) {}
-                      }
-                      if (count === 0) {
-                        showToast('Could not fetch any audio files', 'error');
-                        return;
-                      }
-                      const blob = await zip.generateAsync({ type: 'blob' });
-                      const a = document.createElement('a');
-                      a.href = URL.createObjectURL(blob);
-                      a.download = `voice_recent_${Date.now()}.zip`;
-                      a.click();
-                      URL.revokeObjectURL(a.href);
-                      showToast(`Downloaded ${count} file${count !== 1 ? 's' : ''}`, 'success');
-                    } catch (err) {
-                      showToast(err?.message || 'Download failed', 'error');
-                    }
+                    downloadExportZip({ type: 'voice', ids: toZip.map(t => t.id).join(',') });
+                    showToast(`Downloading ${toZip.length} file${toZip.length !== 1 ? 's' : ''}…`, 'info');
                   }}
                   className="text-xs font-medium text-gray-500 hover:text-gray-700 transition-colors flex items-center gap-1"
                 >
@@ -1499,13 +1492,16 @@ function HistoryTab({ showToast }) {
       } catch { return false; }
       if (meta?.type !== 'image' || job.status !== 'completed') return false;
       if (job.expires_at_ms && now > job.expires_at_ms) return false;
-      return !!(meta.data_uri || meta.result);
+      return !!(meta.thumb_url || meta.data_uri || meta.result);
     }).map(job => {
       let meta = {};
       try {
         if (job.metadata_json) meta = typeof job.metadata_json === 'string' ? JSON.parse(job.metadata_json) : job.metadata_json;
       } catch {}
-      const allImages = meta.all_images || [{ data_uri: meta.data_uri || meta.result, url: meta.data_uri || meta.result }];
+      // Lightbox shows the mid-size preview; downloads use the full image URL
+      const allImages = meta.all_images
+        ? meta.all_images.map(img => ({ ...img, url: img.preview_url || img.url }))
+        : [{ data_uri: meta.data_uri, url: meta.preview_url || meta.result }];
       return { jobId: job.id, prompt: job.prompt, allImages };
     });
   }, [history, historyType]);
@@ -1665,67 +1661,11 @@ function HistoryTab({ showToast }) {
                 <Button
                   size="sm"
                   variant="secondary"
-                  onClick={async () => {
+                  onClick={() => {
                     // Download selected images as ZIP
-                    try {
-                      const JSZip = (await import('jszip')).default;
-                      const zip = new JSZip();
-                      let count = 0;
-                      
-                      for (const jobId of selectedImages) {
-                        const job = history.find(j => j.id === jobId);
-                        if (!job) continue;
-                        let metadata = {};
-                        try {
-                          if (job.metadata_json) {
-                            metadata = typeof job.metadata_json === 'string' ? JSON.parse(job.metadata_json) : job.metadata_json;
-                          }
-                        } catch (e) {
-                          continue;
-                        }
-                        
-                        const imgSrc = metadata.data_uri || metadata.result;
-                        if (imgSrc) {
-                          // Handle data URI or URL
-                          if (imgSrc.startsWith('data:')) {
-                            // Data URI - convert to blob
-                            const response = await fetch(imgSrc);
-                            const blob = await response.blob();
-                            zip.file(`image_${jobId}.png`, blob);
-                            count++;
-                          } else if (metadata.all_images && metadata.all_images.length > 1) {
-                            // Multiple images
-                            for (let idx = 0; idx < metadata.all_images.length; idx++) {
-                              const img = metadata.all_images[idx];
-                              const imgUrl = img.data_uri || img.url || imgSrc;
-                              const response = await fetch(imgUrl);
-                              const blob = await response.blob();
-                              zip.file(`image_${jobId}_${idx + 1}.png`, blob);
-                              count++;
-                            }
-                          } else {
-                            // Single image URL
-                            const response = await fetch(imgSrc);
-                            const blob = await response.blob();
-                            zip.file(`image_${jobId}.png`, blob);
-                            count++;
-                          }
-                        }
-                      }
-                      
-                      if (count > 0) {
-                        const zipBlob = await zip.generateAsync({ type: 'blob' });
-                        const link = document.createElement('a');
-                        link.href = URL.createObjectURL(zipBlob);
-                        link.download = `images_${Date.now()}.zip`;
-                        link.click();
-                        URL.revokeObjectURL(link.href);
-                        showToast(`Downloaded ${count} image${count !== 1 ? 's' : ''}`, 'success');
-                        setSelectedImages(new Set());
-                      }
-                    } catch {
-                      showToast('Failed to create ZIP archive', 'error');
-                    }
+                    downloadExportZip({ type: 'image', ids: [...selectedImages].join(',') });
+                    showToast(`Downloading ${selectedImages.size} image${selectedImages.size !== 1 ? 's' : ''}…`, 'info');
+                    setSelectedImages(new Set());
                   }}
                 >
                   <Download className="w-4 h-4" /> Download
@@ -1771,8 +1711,7 @@ function HistoryTab({ showToast }) {
               
               const isSelected = selectedImages.has(job.id);
               
-              const allImagesForPreview = metadata.all_images || [{ data_uri: metadata.data_uri || metadata.result }];
-              const imgSrc = metadata.data_uri || metadata.result;
+              const imgSrc = metadata.thumb_url || metadata.data_uri || metadata.result;
               return (
                 <Card key={job.id} className={`overflow-hidden group transition-all ${isExpired ? 'opacity-65' : ''} ${isSelected ? 'ring-2 ring-black ring-offset-2' : 'hover:shadow-md'}`}>
                   {isImage && job.status === 'completed' && !isExpired && imgSrc ? (
@@ -1796,6 +1735,8 @@ function HistoryTab({ showToast }) {
                       <img
                         src={imgSrc}
                         alt={job.prompt}
+                        loading="lazy"
+                        decoding="async"
                         className="w-full h-full object-cover cursor-pointer hover:scale-[1.02] transition-transform duration-200"
                         onClick={() => {
                           const idx = viewableImageList.findIndex(i => i.jobId === job.id);
@@ -1816,8 +1757,9 @@ function HistoryTab({ showToast }) {
                         <button
                           onClick={(e) => {
                             e.stopPropagation();
+                            // Thumbnail is only for the card; save the full-size original
                             const link = document.createElement('a');
-                            link.href = imgSrc;
+                            link.href = metadata.full_url || `${API_BASE}/api/jobs/${job.id}/image?token=${encodeURIComponent(api.token || '')}`;
                             link.download = `image_${job.id}.png`;
                             link.click();
                           }}
@@ -2663,6 +2605,7 @@ function ImageGenerationTab({ user, refreshUser, showToast }) {
                 prompt: st.prompt ?? '',
                 status,
                 result: status === 'completed' ? (st.data_uri || st.result) : null,
+                thumb: status === 'completed' ? st.thumb_url : null,
                 allImages: status === 'completed' ? (st.all_images || (st.data_uri || st.result ? [{ data_uri: st.data_uri || st.result }] : [])) : [],
                 error: status !== 'completed' ? (st.error || (status === 'cancelled' ? 'Cancelled' : 'Failed')) : null,
                 completedAt: Date.now()
@@ -2704,6 +2647,7 @@ function ImageGenerationTab({ user, refreshUser, showToast }) {
                 prompt: st.prompt ?? '',
                 status,
                 result: status === 'completed' ? (st.data_uri || st.result) : null,
+                thumb: status === 'completed' ? st.thumb_url : null,
                 allImages: status === 'completed' ? (st.all_images || (st.data_uri || st.result ? [{ data_uri: st.data_uri || st.result }] : [])) : [],
                 error: status !== 'completed' ? (st.error || (status === 'cancelled' ? 'Cancelled' : 'Failed')) : null,
                 completedAt: Date.now()
@@ -3311,70 +3255,15 @@ function ImageGenerationTab({ user, refreshUser, showToast }) {
             {completedTasks.length > 0 && (
               <div className="flex items-center gap-2">
                 <button
-                  onClick={async () => {
+                  onClick={() => {
                     const now = Date.now();
                     const toZip = completedTasks.filter(t => t.status === 'completed' && !(t.completedAt && now > t.completedAt + 12 * 60 * 60 * 1000));
                     if (toZip.length === 0) {
                       showToast('No completed images to download', 'info');
                       return;
                     }
-                    try {
-                      showToast(`Preparing ${toZip.length} image${toZip.length !== 1 ? 's' : ''}…`, 'info');
-                      const JSZip = (await import('jszip')).default;
-                      const zip = new JSZip();
-                      let count = 0;
-                      for (const task of toZip) {
-                        const imgSrc = task.result || fetchedImageUrls[task.id];
-                        const allImages = task.allImages || (imgSrc ? [{ data_uri: imgSrc, url: imgSrc }] : []);
-                        if (allImages.length === 0 && !imgSrc) {
-                          try {
-                            const res = await fetch(`${API_BASE}/api/jobs/${task.id}/image`, {
-                              headers: api.token ? { Authorization: `Bearer ${api.token}` } : {}
-                            });
-                            if (!res.ok) continue;
-                            const blob = await res.blob();
-                            zip.file(`image_${task.id}.png`, blob);
-                            count++;
-                          } catch (_) {}
-                          continue;
-                        }
-                        if (allImages.length > 1) {
-                          for (let i = 0; i < allImages.length; i++) {
-                            const img = allImages[i];
-                            const u = img?.data_uri || img?.url || imgSrc;
-                            if (!u) continue;
-                            try {
-                              const res = await fetch(u);
-                              const blob = await res.blob();
-                              zip.file(`image_${task.id}_${i + 1}.png`, blob);
-                              count++;
-                            } catch (_) {}
-                          }
-                        } else {
-                          const u = imgSrc || allImages[0]?.data_uri || allImages[0]?.url;
-                          if (!u) continue;
-                          try {
-                            const res = await fetch(u);
-                            const blob = await res.blob();
-                            zip.file(`image_${task.id}.png`, blob);
-                            count++;
-                          } catch (_) {}
-                        }
-                      }
-                      if (count === 0) {
-                        showToast('Could not fetch any images', 'error');
-                        return;
-                      }
-                      const blob = await zip.generateAsync({ type: 'blob' });
-                      const a = document.createElement('a');
-                      a.href = URL.createObjectURL(blob);
-                      a.download = `images_recent_${Date.now()}.zip`;
-                      a.click();
-                      URL.revokeObjectURL(a.href);
-                      showToast(`Downloaded ${count} image${count !== 1 ? 's' : ''}`, 'success');
-                    } catch (err) {
-                      showToast(err?.message || 'Download failed', 'error');
-                    }
+                    downloadExportZip({ type: 'image', ids: toZip.map(t => t.id).join(',') });
+                    showToast(`Downloading ${toZip.length} image${toZip.length !== 1 ? 's' : ''}…`, 'info');
                   }}
                   className="text-xs font-medium text-gray-500 hover:text-gray-700 transition-colors flex items-center gap-1"
                 >
@@ -3427,8 +3316,9 @@ function ImageGenerationTab({ user, refreshUser, showToast }) {
                     </div>
                     {imgSrc && !isExpired && task.status === 'completed' && (
                       <img
-                        src={imgSrc}
+                        src={task.thumb || imgSrc}
                         alt={task.prompt}
+                        loading="lazy"
                         className="w-full aspect-square object-cover rounded-xl border border-gray-200 mb-2 cursor-pointer hover:opacity-90 transition-opacity"
                         onClick={() => {
                           if (imgSrc) setPreviewImage({
@@ -3497,6 +3387,7 @@ function ApiKeysTab({ showToast, user }) {
   const [showCreate, setShowCreate] = useState(false);
   const [newName, setNewName] = useState('');
   const [newKey, setNewKey] = useState(null);
+  const [newSecret, setNewSecret] = useState(null);
   const [loading, setLoading] = useState(true);
 
   const loadKeys = useCallback(async () => {
@@ -3530,6 +3421,25 @@ function ApiKeysTab({ showToast, user }) {
     }
   };
 
+  const handleWebhook = async (k) => {
+    const url = prompt('Webhook URL for finished tasks (leave empty to remove)', k.webhook_url || 'https://');
+    if (url === null) return;
+    try {
+      if (!url.trim() || url.trim() === 'https://') {
+        if (!k.webhook_url) return;
+        await api.request(`/api/user/api-keys/${k.id}/webhook`, { method: 'DELETE' });
+        showToast('Webhook removed', 'success');
+      } else {
+        const data = await api.request(`/api/user/api-keys/${k.id}/webhook`, { method: 'PUT', body: JSON.stringify({ url: url.trim() }) });
+        if (data.webhook.secret) setNewSecret({ name: k.name, secret: data.webhook.secret });
+        showToast('Webhook saved', 'success');
+      }
+      loadKeys();
+    } catch (err) {
+      showToast(err.message, 'error');
+    }
+  };
+
   const handleDelete = async (id) => {
     if (!confirm('Delete this API key?')) return;
     try {
@@ -3573,6 +3483,25 @@ function ApiKeysTab({ showToast, user }) {
         </Card>
       )}
 
+      {newSecret && (
+        <Card className="p-4 bg-emerald-50 border-emerald-200">
+          <div className="flex items-start gap-3">
+            <Check className="w-5 h-5 text-emerald-600 mt-0.5" />
+            <div className="flex-1">
+              <p className="font-medium text-emerald-800">Webhook signing secret for {newSecret.name}</p>
+              <p className="text-sm text-emerald-600 mt-1">Verify the X-Webhook-Signature header with it. Copy it now — it won't be shown again.</p>
+              <div className="flex items-center gap-2 mt-3">
+                <code className="flex-1 px-3 py-2 bg-white rounded-lg text-sm font-mono border border-emerald-200">{newSecret.secret}</code>
+                <Button size="sm" onClick={() => { navigator.clipboard.writeText(newSecret.secret); showToast('Copied!', 'success'); }} className="bg-emerald-600 hover:bg-emerald-700">
+                  <Copy className="w-4 h-4" />
+                </Button>
+              </div>
+            </div>
+            <button onClick={() => setNewSecret(null)}><X className="w-5 h-5 text-emerald-600" /></button>
+          </div>
+        </Card>
+      )}
+
       {/* API Keys List */}
       <Card className="overflow-hidden border-2 border-gray-200">
         <div className="bg-gray-50 px-6 py-3 border-b border-gray-200">
@@ -3610,8 +3539,17 @@ function ApiKeysTab({ showToast, user }) {
                       </span>
                       <span>{k.total_requests.toLocaleString()} requests</span>
                       <span>Limit: {k.hourly_limit}/hour</span>
+                      {k.webhook_url && <span className="font-mono truncate max-w-xs">Webhook: {k.webhook_url}</span>}
                     </div>
                   </div>
+                  <Button
+                    variant="ghost"
+                    size="sm"
+                    onClick={() => handleWebhook(k)}
+                    title={k.webhook_url ? 'Change webhook' : 'Add webhook'}
+                  >
+                    <Globe className="w-4 h-4" />
+                  </Button>
                   <Button 
                     variant="ghost" 
                     size="sm" 
@@ -3932,9 +3870,11 @@ function ApiKeysTab({ showToast, user }) {
             <h4 className="font-bold text-lg mb-3">Quick Start Examples</h4>
             <div className="bg-black rounded-lg p-5 border-2 border-gray-800">
               <pre className="text-xs text-gray-300 font-mono leading-relaxed overflow-x-auto">
-{`# 1. Create task
+{`# 1. Create task (Idempotency-Key: retrying with the same key returns this task
+#    instead of creating and charging a second one)
 curl -X POST ${window.location.origin}/api/v1/synthesize \\
   -H "X-API-Key: your-key-here" \\
+  -H "Idempotency-Key: 3f1c9a2e-order-1842" \\
   -H "Content-Type: application/json" \\
   -d '{
     "text": "Hello world",
@@ -3952,6 +3892,17 @@ curl -X POST ${window.location.origin}/api/v1/synthesize \\
 curl ${window.location.origin}/api/v1/status/abc-123 \\
   -H "X-API-Key: your-key-here"
 
+# 2b. Many tasks at once; wait=30 holds the request until one of them changes
+#     (send the previous ETag as If-None-Match to pick up changes since then)
+curl "${window.location.origin}/api/v1/status?ids=abc-123,def-456&wait=30" \\
+  -H "X-API-Key: your-key-here"
+
+# 2c. Or skip polling: add a webhook to the key (globe icon above) and get a signed
+#     POST {"type": "task.completed", "data": {...status...}} when each task finishes.
+#     Delivery log (failed deliveries are retried with backoff, then kept as "dead"):
+curl "${window.location.origin}/api/v1/webhooks/deliveries?status=dead" \\
+  -H "X-API-Key: your-key-here"
+
 # 3. Check balance
 curl ${window.location.origin}/api/v1/balance \\
   -H "X-API-Key: your-key-here"
@@ -4610,6 +4561,17 @@ function AdminPanelPage({ showToast, onLogout }) {
     }
   };
 
+  // Close a key's circuit breaker by hand
+  const handleResetBreaker = async (k) => {
+    try {
+      await api.request('/api/admin/circuit-breakers/reset', { admin: true, method: 'POST', body: JSON.stringify({ provider: k.provider, key_id: k.id }) });
+      showToast('Breaker reset', 'success');
+      loadApiKeys();
+    } catch (err) {
+      showToast(err.message, 'error');
+    }
+  };
+
   // Delete API key
   const handleDeleteKey = async (id) => {
     if (!confirm('Delete this API key?')) return;
@@ -5438,6 +5400,14 @@ function AdminPanelPage({ showToast, onLogout }) {
                               ? 'Naga API'
                               : 'Voicer'}
                           </span>
+                          {k.breaker_state && k.breaker_state !== 'closed' && (
+                            <button onClick={() => handleResetBreaker(k)} title="Circuit breaker tripped by upstream errors. Click to reset."
+                              className={`px-1.5 py-0.5 text-[10px] font-medium rounded ${
+                                k.breaker_state === 'open' ? 'bg-red-100 text-red-700' : 'bg-amber-100 text-amber-700'
+                              }`}>
+                              {k.breaker_state === 'open' ? 'Circuit open' : 'Probing'}
+                            </button>
+                          )}
                         </div>
                         <p className="text-xs text-gray-400 font-mono">{k.api_key}</p>
                       </div>
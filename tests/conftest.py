@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# server/ is imported as a namespace package from the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
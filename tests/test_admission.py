@@ -0,0 +1,37 @@
+from server import admission
+from server.admission import AdmissionController, PoolLoad, ADMIT, DEFER, REJECT
+from server.config import TaskPriority
+
+
+def test_batch_larger_than_queue_limit_is_accepted_by_idle_pool():
+    controller = AdmissionController()
+    idle = PoolLoad("image", "whisk", capacity=10, in_flight=0, queued=0)
+    for priority in (TaskPriority.LOW, TaskPriority.NORMAL, TaskPriority.HIGH, TaskPriority.URGENT):
+        assert controller.decide(idle, priority, units=50).action == DEFER
+
+
+def test_small_request_on_idle_pool_is_admitted():
+    controller = AdmissionController()
+    idle = PoolLoad("image", "whisk", capacity=10, in_flight=0, queued=0)
+    assert controller.decide(idle, TaskPriority.LOW, units=1).action == ADMIT
+
+
+def test_full_queue_rejects_with_retry_after():
+    controller = AdmissionController()
+    busy = PoolLoad("voice", "voicer", capacity=10, in_flight=10, queued=10)
+    decision = controller.decide(busy, TaskPriority.LOW, units=1)
+    assert decision.action == REJECT
+    assert decision.retry_after >= 1
+
+
+def test_oversized_batch_rejected_once_queue_has_work():
+    controller = AdmissionController()
+    queued = PoolLoad("image", "whisk", capacity=10, in_flight=10, queued=1)
+    assert controller.decide(queued, TaskPriority.NORMAL, units=50).action == REJECT
+    assert controller.decide(queued, TaskPriority.NORMAL, units=5).action == DEFER
+
+
+def test_priorities_normalize():
+    assert admission.normalize_priority("urgent") == TaskPriority.URGENT
+    assert admission.normalize_priority(99) == TaskPriority.URGENT
+    assert admission.normalize_priority(None) == TaskPriority.NORMAL
@@ -0,0 +1,34 @@
+import sqlite3
+import subprocess
+import sys
+
+from server.backup import BackupManager
+
+
+def _count(path):
+    con = sqlite3.connect(path)
+    try:
+        return con.execute("SELECT COUNT(*) FROM t").fetchone()[0]
+    finally:
+        con.close()
+
+
+def test_restore_keeps_uncheckpointed_writes_in_the_replaced_copy(tmp_path):
+    db = tmp_path / "app.db"
+    con = sqlite3.connect(db)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("CREATE TABLE t (a)")
+    con.commit()
+    con.close()
+    manager = BackupManager(str(db), str(tmp_path / "backups"), compress=False)
+    snapshot = manager.snapshot()["file"]
+
+    # A process that dies without closing leaves its commits in the -wal file only
+    script = (f"import os, sqlite3; c = sqlite3.connect({str(db)!r}); c.execute('PRAGMA wal_autocheckpoint=0'); "
+              "c.executemany('INSERT INTO t VALUES (?)', [(i,) for i in range(50)]); c.commit(); os._exit(0)")
+    subprocess.run([sys.executable, "-c", script], check=True)
+    assert (tmp_path / "app.db-wal").stat().st_size > 0
+
+    kept = manager.restore(snapshot)
+    assert _count(db) == 0
+    assert _count(kept) == 50
@@ -0,0 +1,171 @@
+import asyncio
+import time
+
+from server.cache import TwoTierCache
+
+
+class FakeRedis:
+    """The slice of redis.asyncio the cache uses, kept in a dict."""
+
+    def __init__(self):
+        self.data = {}
+        self.published = []
+
+    async def ping(self):
+        return True
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, px=None):
+        self.data[key] = value
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    async def publish(self, channel, message):
+        self.published.append((channel, message))
+
+
+class FakeClient:
+    """Stands in for server.redis_client.RedisClient; `down` makes every call fail."""
+
+    def __init__(self, redis=None, down=False):
+        self.redis = redis or FakeRedis()
+        self.down = down
+        self.connects = 0
+        self.is_connected = False
+
+    async def connect(self):
+        self.connects += 1
+        if self.down:
+            raise ConnectionError("redis is down")
+        self.is_connected = True
+
+
+def counting_loader(values, calls):
+    def load(key):
+        def loader():
+            calls.append(key)
+            return values[key]
+        return loader
+    return load
+
+
+def test_l1_evicts_least_recently_used():
+    async def run():
+        cache = TwoTierCache(max_items=2)
+        cache.namespace("ns", ttl=60)
+        calls = []
+        load = counting_loader({"a": 1, "b": 2, "c": 3}, calls)
+        for key in ("a", "b", "a", "c"):  # "a" is touched again, so "b" is the oldest when "c" arrives
+            await cache.get("ns", key, load(key))
+        assert calls == ["a", "b", "c"]
+        assert cache.snapshot()["evictions"] == 1
+        assert cache.peek("ns", "b") is None
+        assert await cache.get("ns", "a", load("a")) == 1
+        assert await cache.get("ns", "b", load("b")) == 2
+        assert calls == ["a", "b", "c", "b"]
+    asyncio.run(run())
+
+
+def test_l2_serves_another_process_without_loading():
+    async def run():
+        shared = FakeRedis()
+        first = TwoTierCache(FakeClient(shared))
+        second = TwoTierCache(FakeClient(shared))
+        for cache in (first, second):
+            cache.namespace("ns", ttl=60)
+        calls = []
+        load = counting_loader({"k": {"v": 1}}, calls)
+        assert await first.get("ns", "k", load("k")) == {"v": 1}
+        assert await second.get("ns", "k", load("k")) == {"v": 1}
+        assert calls == ["k"]
+        assert second.snapshot()["namespaces"]["ns"]["hits_l2"] == 1
+    asyncio.run(run())
+
+
+def test_redis_down_falls_back_to_l1_with_capped_ttl():
+    async def run():
+        client = FakeClient(down=True)
+        cache = TwoTierCache(client, l1_ttl=5, retry_seconds=30)
+        cache.namespace("ns", ttl=600)
+        calls = []
+        load = counting_loader({"a": 1, "b": 2}, calls)
+        assert await cache.get("ns", "a", load("a")) == 1
+        assert await cache.get("ns", "b", load("b")) == 2
+        assert await cache.get("ns", "a", load("a")) == 1
+        assert calls == ["a", "b"]
+        snapshot = cache.snapshot()
+        assert snapshot["l2"] == "down"
+        assert snapshot["l2_outages"] == 1
+        assert client.connects == 1  # No reconnect attempt per call inside retry_seconds
+        # Nothing tells this process about other processes' changes: L1 keeps entries for l1_ttl at most
+        entry = cache._l1[("ns", "a")]
+        assert entry.l1_expires_at <= time.monotonic() + 5
+        # Invalidations Redis missed are replayed once it is back
+        cache.invalidate("ns", "a")
+        await asyncio.sleep(0)
+        assert cache.snapshot()["pending_invalidations"] == 1
+    asyncio.run(run())
+
+
+def test_invalidate_drops_key_here_and_in_redis():
+    async def run():
+        client = FakeClient()
+        cache = TwoTierCache(client)
+        cache.namespace("ns", ttl=60)
+        values = {"k": 1}
+        calls = []
+        load = counting_loader(values, calls)
+        assert await cache.get("ns", "k", load("k")) == 1
+        values["k"] = 2
+        cache.invalidate("ns", "k")
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert client.redis.data == {}
+        assert client.redis.published
+        assert await cache.get("ns", "k", load("k")) == 2
+        assert calls == ["k", "k"]
+    asyncio.run(run())
+
+
+def test_invalidation_during_load_is_not_stored():
+    async def run():
+        cache = TwoTierCache()
+        cache.namespace("ns", ttl=60)
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def slow():
+            started.set()
+            await release.wait()
+            return "old"
+
+        task = asyncio.create_task(cache.get("ns", "k", slow))
+        await started.wait()
+        cache.invalidate("ns", "k")
+        release.set()
+        assert await task == "old"  # The caller still gets what it loaded...
+        assert cache.peek("ns", "k") is None  # ...but it is not cached
+        assert cache.snapshot()["namespaces"]["ns"]["stale_loads"] == 1
+    asyncio.run(run())
+
+
+def test_concurrent_misses_share_one_load():
+    async def run():
+        cache = TwoTierCache()
+        cache.namespace("ns", ttl=60)
+        calls = []
+
+        async def loader():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "v"
+
+        results = await asyncio.gather(*(cache.get("ns", "k", loader) for _ in range(5)))
+        assert results == ["v"] * 5
+        assert calls == [1]
+        assert cache.snapshot()["namespaces"]["ns"]["coalesced"] == 4
+    asyncio.run(run())
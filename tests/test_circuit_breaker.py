@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+
+from server.circuit_breaker import (
+    STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, BreakerBoard, CircuitBreaker, backoff_delay, is_retryable_status,
+    retry_async,
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def open_breaker(breaker: CircuitBreaker, now: float):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure(now, "boom")
+
+
+def test_opens_after_threshold_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, base_cooldown=10)
+    breaker.record_failure(0)
+    breaker.record_failure(0)
+    breaker.record_success(0)  # A success resets the count
+    breaker.record_failure(0)
+    breaker.record_failure(0)
+    assert breaker.state == STATE_CLOSED
+    breaker.record_failure(0)
+    assert breaker.state == STATE_OPEN
+    assert not breaker.acquire(1)
+
+
+def test_half_open_lets_a_single_probe_through_then_closes():
+    breaker = CircuitBreaker(failure_threshold=1, base_cooldown=10)
+    open_breaker(breaker, 0)
+    assert not breaker.available(5)
+    # Cooldown is jittered by at most 20%
+    assert breaker.acquire(13)
+    assert breaker.state == STATE_HALF_OPEN
+    assert not breaker.acquire(13)
+    assert not breaker.available(14)
+    breaker.record_success(15)
+    assert breaker.state == STATE_CLOSED
+    assert breaker.acquire(15) and breaker.acquire(15)
+
+
+def test_failed_probe_reopens_with_longer_cooldown():
+    breaker = CircuitBreaker(failure_threshold=1, base_cooldown=10, max_cooldown=1000)
+    open_breaker(breaker, 0)
+    first = breaker.open_until
+    assert breaker.acquire(13)
+    breaker.record_failure(13, "still down")
+    assert breaker.state == STATE_OPEN
+    assert breaker.open_until - 13 > first  # 2x the base cooldown, jittered by at most 20%
+    assert not breaker.acquire(20)
+
+
+def test_unreported_probe_is_released_after_probe_timeout():
+    breaker = CircuitBreaker(failure_threshold=1, base_cooldown=10, probe_timeout=60)
+    open_breaker(breaker, 0)
+    assert breaker.acquire(13)
+    assert not breaker.acquire(60)
+    assert breaker.acquire(74)
+    assert breaker.snapshot(74)["probe_in_flight"]
+
+
+def test_board_tracks_keys_separately():
+    clock = Clock()
+    board = BreakerBoard(failure_threshold=2, base_cooldown=10, clock=clock)
+    board.record_failure("whisk", "k1")
+    board.record_failure("whisk", "k1")
+    assert board.state("whisk", "k1") == STATE_OPEN
+    assert board.state("whisk", "k2") == STATE_CLOSED
+    assert not board.all_open("whisk", ["k1", "k2"])
+    board.record_failure("whisk", "k2")
+    board.record_failure("whisk", "k2")
+    assert board.all_open("whisk", ["k1", "k2"])
+    clock.now += 13
+    assert board.state("whisk", "k1") == STATE_HALF_OPEN
+    assert board.acquire("whisk", "k1")
+    assert not board.acquire("whisk", "k1")
+    board.record_success("whisk", "k1")
+    assert board.snapshot()["providers"]["whisk"]["keys"]["k1"]["state"] == STATE_CLOSED
+
+
+def test_retry_async_retries_provider_failures_then_succeeds(monkeypatch):
+    monkeypatch.setattr("server.circuit_breaker.backoff_delay", lambda *a: 0)
+    board = BreakerBoard(failure_threshold=5)
+    results = iter([503, 502, 200])
+    calls = []
+
+    async def call():
+        calls.append(1)
+        return next(results)
+
+    classify = lambda status: f"HTTP {status}" if is_retryable_status(status) else None
+    assert asyncio.run(retry_async("p", "k", call, classify, board, max_attempts=3)) == 200
+    assert len(calls) == 3
+    assert board.state("p", "k") == STATE_CLOSED
+
+
+def test_retry_async_stops_when_budget_is_spent(monkeypatch):
+    monkeypatch.setattr("server.circuit_breaker.backoff_delay", lambda *a: 0)
+    board = BreakerBoard(failure_threshold=100, retry_ratio=0.0, retry_max_tokens=2)
+    calls = []
+
+    async def call():
+        calls.append(1)
+        return 503
+
+    classify = lambda status: "HTTP 503"
+    # Two retry tokens: the first request gets both retries, the next none
+    assert asyncio.run(retry_async("p", "k", call, classify, board, max_attempts=5)) == 503
+    assert len(calls) == 3
+    assert asyncio.run(retry_async("p", "k", call, classify, board, max_attempts=5)) == 503
+    assert len(calls) == 4
+    assert board.snapshot()["providers"]["p"]["retry_budget"]["denied"] == 2
+
+
+def test_retry_async_stops_when_breaker_opens(monkeypatch):
+    monkeypatch.setattr("server.circuit_breaker.backoff_delay", lambda *a: 0)
+    board = BreakerBoard(failure_threshold=2)
+    calls = []
+
+    async def call():
+        calls.append(1)
+        raise ConnectionError("refused")
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(retry_async("p", "k", call, lambda r: None, board, max_attempts=5, retry_on=(ConnectionError,)))
+    assert len(calls) == 2
+    assert board.state("p", "k") == STATE_OPEN
+
+
+def test_backoff_delay_is_capped():
+    for attempt in range(10):
+        assert 0 <= backoff_delay(attempt, 1.0, 5.0) <= 5.0
@@ -0,0 +1,93 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from server import idempotency
+from server.db_writer import DBWriter
+from server.idempotency import IdempotencyError, IdempotencyStore
+from server.storage import SQLiteStorage
+
+
+@pytest.fixture
+def make_store(tmp_path):
+    writers = []
+
+    def make(**kwargs):
+        path = tmp_path / "idem.db"
+
+        def connect():
+            con = sqlite3.connect(path, timeout=5, check_same_thread=False)
+            con.row_factory = sqlite3.Row
+            return con
+        con = connect()
+        con.executescript(idempotency.SCHEMA)
+        con.close()
+        writer = DBWriter(connect)
+        writers.append(writer)
+        return IdempotencyStore(SQLiteStorage(connect, writer=writer), poll_interval=0.02, **kwargs)
+    yield make
+    for writer in writers:
+        writer.stop()
+
+
+def test_handler_slower_than_lock_runs_once(make_store):
+    store = make_store(lock_seconds=0.3, wait_seconds=5)
+    other = make_store(lock_seconds=0.3, wait_seconds=5)  # Another process: no shared in-memory wakeup
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        await asyncio.sleep(1.0)  # Three lock lifetimes
+        return {"task_id": "t1"}
+
+    async def request(s, delay):
+        await asyncio.sleep(delay)
+        claim = await s.begin("u1:image.generate", "k1", "fp")
+        if claim.replay is not None:
+            return claim.replay
+        return await s.run(claim, handler)
+
+    async def main():
+        return await asyncio.gather(request(store, 0), request(other, 0.6))
+
+    first, retry = asyncio.run(main())
+    assert len(calls) == 1
+    assert first == retry == {"task_id": "t1"}
+    assert store.stats["renewals"] >= 2
+    assert other.stats["taken_over"] == 0
+
+
+def test_dead_owner_is_taken_over(make_store):
+    store = make_store(lock_seconds=0.2, wait_seconds=5)
+
+    async def main():
+        await store.begin("s", "k", "fp")  # Claimed, never run or renewed
+        await asyncio.sleep(0.3)
+        return await store.begin("s", "k", "fp")
+
+    claim = asyncio.run(main())
+    assert claim.replay is None and claim.owner
+    assert store.stats["claimed"] == 2
+
+
+def test_error_abandons_and_conflict_is_rejected(make_store):
+    store = make_store()
+
+    async def failing():
+        raise RuntimeError("provider down")
+
+    async def main():
+        claim = await store.begin("s", "k", "fp")
+        with pytest.raises(RuntimeError):
+            await store.run(claim, failing)
+        claim = await store.begin("s", "k", "fp")  # Retry runs for real
+        assert claim.replay is None
+        await store.run(claim, lambda: asyncio.sleep(0, {"task_id": "t2"}))
+        replay = await store.begin("s", "k", "fp")
+        assert replay.replay == {"task_id": "t2"}
+        with pytest.raises(IdempotencyError) as err:
+            await store.begin("s", "k", "other body")
+        assert err.value.status_code == 422
+
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+import asyncio
+import base64
+import hashlib
+import io
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from server import media
+from server.media import MediaError, MediaProcessor, process_image
+
+
+def png_bytes(width=64, height=48) -> bytes:
+    Image = pytest.importorskip("PIL.Image")
+    out = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 30, 30)).save(out, format="PNG")
+    return out.getvalue()
+
+
+def test_process_image_validates_and_writes(tmp_path):
+    data = png_bytes()
+    path = tmp_path / "a.png"
+    result = process_image("data:image/png;base64," + base64.b64encode(data).decode(), str(path))
+    assert (result["mime"], result["width"], result["height"]) == ("image/png", 64, 48)
+    assert result["sha256"] == hashlib.sha256(data).hexdigest()
+    assert "b64" not in result
+    assert path.read_bytes() == data
+
+
+@pytest.mark.parametrize("source, message", [
+    ("not base64!", "Invalid base64"),
+    (base64.b64encode(b"hello world").decode(), "Unrecognized image format"),
+    (media._fake_png(64, width=100_000, height=100_000), "too large"),
+])
+def test_process_image_rejects_unusable_payloads(tmp_path, source, message):
+    with pytest.raises(MediaError, match=message):
+        process_image(source, str(tmp_path / "x.png"))
+    assert not (tmp_path / "x.png").exists()
+
+
+def test_derivatives_are_written_next_to_the_original(tmp_path):
+    data = png_bytes(2000, 1000)
+    path = tmp_path / "big.png"
+    result = process_image(data, str(path), derivatives={"thumb": (256, 70), "preview": (1024, 80)})
+    derived = result["derivatives"]
+    assert (derived["preview"]["width"], derived["preview"]["height"]) == (1024, 512)
+    assert (derived["thumb"]["width"], derived["thumb"]["height"]) == (256, 128)
+    assert derived["thumb"]["path"] == str(tmp_path / "big.thumb.webp")
+    assert (tmp_path / "big.preview.webp").exists()
+
+
+def test_processor_runs_in_a_process_pool(tmp_path):
+    processor = MediaProcessor(workers=1, executor="process", inline_max_bytes=0)
+    items = [(png_bytes(), str(tmp_path / "ok.png")), (b"junk", str(tmp_path / "bad.png"))]
+    try:
+        ok, bad = asyncio.run(processor.process_many(items))
+    finally:
+        processor.shutdown()
+    assert ok["width"] == 64 and (tmp_path / "ok.png").exists()
+    assert isinstance(bad, MediaError)
+    stats = processor.snapshot()
+    assert (stats["processed"], stats["errors"], stats["inline"]) == (1, 1, 0)
+
+
+def test_processor_falls_back_inline_when_the_pool_breaks(tmp_path, monkeypatch):
+    processor = MediaProcessor(executor="thread", inline_max_bytes=0)
+
+    async def broken(executor, call):
+        raise BrokenProcessPool("worker died")
+
+    async def run():
+        monkeypatch.setattr(asyncio.get_running_loop(), "run_in_executor", broken)
+        return await processor.process(png_bytes(), str(tmp_path / "a.png"))
+
+    result = asyncio.run(run())
+    assert result["width"] == 64
+    stats = processor.snapshot()
+    assert stats["pool_restarts"] == 2 and stats["inline"] == 1
@@ -0,0 +1,131 @@
+import asyncio
+import os
+import sqlite3
+
+import pytest
+
+from server.db_writer import DBWriter
+from server.storage import PostgresStorage, SQLiteStorage, Storage, StorageError, to_postgres
+
+POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+
+SCHEMA = "CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT NOT NULL, owner TEXT)"
+
+
+def _sqlite(tmp_path):
+    path = tmp_path / "store.db"
+
+    def connect():
+        con = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        con.execute("PRAGMA journal_mode=WAL")
+        return con
+    con = connect()
+    con.execute(SCHEMA)
+    con.commit()
+    con.close()
+    writer = DBWriter(connect)
+    return SQLiteStorage(connect, writer=writer), writer.stop
+
+
+async def _postgres():
+    pytest.importorskip("asyncpg")
+    storage = PostgresStorage(POSTGRES_URL, max_size=4)
+    try:
+        await storage.open()
+    except (OSError, StorageError) as e:
+        pytest.skip(f"PostgreSQL unavailable: {e}")
+    await storage.execute("DROP TABLE IF EXISTS items")
+    await storage.execute(SCHEMA.replace("INTEGER PRIMARY KEY", "SERIAL PRIMARY KEY"))
+    return storage
+
+
+@pytest.fixture(params=["sqlite", pytest.param("postgres", marks=pytest.mark.skipif(
+    not POSTGRES_URL, reason="TEST_POSTGRES_URL not set"))])
+def run(request, tmp_path):
+    """run(fn) calls `await fn(storage)` on a fresh store of the parametrised backend."""
+    def runner(fn):
+        async def main():
+            if request.param == "sqlite":
+                storage, stop = _sqlite(tmp_path)
+                try:
+                    return await fn(storage)
+                finally:
+                    stop()
+            storage = await _postgres()
+            try:
+                return await fn(storage)
+            finally:
+                await storage.execute("DROP TABLE IF EXISTS items")
+                await storage.close()
+        return asyncio.run(main())
+    return runner
+
+
+def test_execute_and_fetch(run):
+    async def body(storage):
+        assert await storage.execute("INSERT INTO items (name, owner) VALUES (?, ?)", ("a", "u1")) == 1
+        assert await storage.execute("INSERT INTO items (name, owner) VALUES (?, ?)", ("b", "u2")) == 1
+        assert await storage.execute("UPDATE items SET owner = ? WHERE owner = ?", ("u3", "u1")) == 1
+        rows = await storage.fetchall("SELECT name, owner FROM items ORDER BY name")
+        assert rows == [{"name": "a", "owner": "u3"}, {"name": "b", "owner": "u2"}]
+        assert await storage.fetchone("SELECT name FROM items WHERE owner = ?", ("nobody",)) is None
+    run(body)
+
+
+def test_transaction_commits_and_sees_its_own_writes(run):
+    async def body(storage):
+        async with storage.transaction() as tx:
+            await tx.execute("INSERT INTO items (name) VALUES (?)", ("a",))
+            row = await tx.fetchone("SELECT COUNT(*) AS n FROM items")
+            assert row["n"] == 1
+        assert (await storage.fetchone("SELECT COUNT(*) AS n FROM items"))["n"] == 1
+    run(body)
+
+
+def test_transaction_rolls_back_on_error(run):
+    async def body(storage):
+        with pytest.raises(RuntimeError):
+            async with storage.transaction() as tx:
+                await tx.execute("INSERT INTO items (name) VALUES (?)", ("a",))
+                raise RuntimeError("boom")
+        assert (await storage.fetchone("SELECT COUNT(*) AS n FROM items"))["n"] == 0
+    run(body)
+
+
+def test_writes_outside_a_transaction_are_not_locked_out(run):
+    async def body(storage):
+        async def other_writes():
+            for i in range(20):
+                await storage.execute("INSERT INTO items (name) VALUES (?)", (f"w{i}",))
+
+        async def transactions():
+            for i in range(20):
+                async with storage.transaction() as tx:
+                    await tx.execute("INSERT INTO items (name) VALUES (?)", (f"t{i}",))
+                    await asyncio.sleep(0)
+
+        await asyncio.gather(other_writes(), transactions())
+        assert (await storage.fetchone("SELECT COUNT(*) AS n FROM items"))["n"] == 40
+    run(body)
+
+
+def test_claim_takes_each_row_once(run):
+    async def body(storage):
+        for i in range(5):
+            await storage.execute("INSERT INTO items (name) VALUES (?)", (f"n{i}",))
+        claims = await asyncio.gather(*(
+            storage.claim("items", "owner = ?", "owner IS NULL", set_params=(f"c{i}",), limit=2) for i in range(4)))
+        claimed = [row["id"] for rows in claims for row in rows]
+        assert sorted(claimed) == sorted(set(claimed))
+        assert len(claimed) == 5
+    run(body)
+
+
+def test_base_classes_are_abstract():
+    with pytest.raises(TypeError):
+        Storage()
+
+
+def test_to_postgres_placeholders_and_insert_or_ignore():
+    assert to_postgres("SELECT * FROM t WHERE a = ? AND b = '?'") == "SELECT * FROM t WHERE a = $1 AND b = '?'"
+    assert to_postgres("INSERT OR IGNORE INTO t (a) VALUES (?)") == "INSERT INTO t (a) VALUES ($1) ON CONFLICT DO NOTHING"
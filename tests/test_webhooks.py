@@ -0,0 +1,145 @@
+import asyncio
+import ipaddress
+import json
+import socket
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from server import webhooks
+from server.db_writer import DBWriter
+from server.storage import SQLiteStorage
+from server.webhooks import WebhookDispatcher, WebhookError, check_url, pin_url, sign, verify
+
+SECRET = "whsec_test"
+
+
+def _resolving_to(monkeypatch, address):
+    def getaddrinfo(host, port, *args, **kwargs):
+        return [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, "", (address, port))]
+    monkeypatch.setattr(webhooks.socket, "getaddrinfo", getaddrinfo)
+
+
+def test_signature_round_trip():
+    body = b'{"id":"evt_1"}'
+    header = sign(SECRET, body)
+    assert verify(SECRET, header, body)
+    assert not verify(SECRET, header, body + b" ")
+    assert not verify("whsec_other", header, body)
+    assert not verify(SECRET, sign(SECRET, body, int(time.time()) - 3600), body)
+    assert not verify(SECRET, "garbage", body)
+
+
+def test_check_url_rejects_private_and_plain_http(monkeypatch):
+    with pytest.raises(WebhookError):
+        check_url("ftp://example.com/hook")
+    with pytest.raises(WebhookError):
+        check_url("http://example.com/hook")
+    with pytest.raises(WebhookError):
+        check_url("https://127.0.0.1/hook")
+    _resolving_to(monkeypatch, "10.1.2.3")
+    with pytest.raises(WebhookError):
+        check_url("https://internal.example.com/hook")
+    _resolving_to(monkeypatch, "93.184.216.34")
+    assert check_url(" https://example.com/hook ") == "https://example.com/hook"
+
+
+def test_pin_url_sends_to_the_checked_address(monkeypatch):
+    _resolving_to(monkeypatch, "93.184.216.34")
+    url, headers, extensions = pin_url("https://hooks.example.com:8443/in?x=1")
+    assert url == "https://93.184.216.34:8443/in?x=1"
+    assert headers == {"Host": "hooks.example.com:8443"}
+    assert extensions == {"sni_hostname": "hooks.example.com"}
+
+    # Rebinding: the name now points inside; the address that would be connected to is refused
+    _resolving_to(monkeypatch, "169.254.169.254")
+    with pytest.raises(WebhookError):
+        pin_url("https://hooks.example.com/in")
+
+
+class _Receiver:
+    def __init__(self, fail: int):
+        self.requests = []
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                receiver.requests.append((dict(self.headers), body))
+                self.send_response(500 if len(receiver.requests) <= fail else 200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(("127.0.0.1", 0), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _store(tmp_path):
+    path = tmp_path / "hooks.db"
+
+    def connect():
+        con = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        con.row_factory = sqlite3.Row
+        return con
+    con = connect()
+    con.executescript("""
+        CREATE TABLE jobs (id TEXT PRIMARY KEY, user_id TEXT, status TEXT, user_api_key_id TEXT);
+        CREATE TABLE user_api_keys (id TEXT PRIMARY KEY, webhook_url TEXT, webhook_secret TEXT);
+    """ + webhooks.SCHEMA)
+    con.close()
+    return connect
+
+
+@pytest.mark.parametrize("returning", [True, False])
+def test_dispatcher_retries_then_delivers_to_pinned_address(tmp_path, monkeypatch, returning):
+    receiver = _Receiver(fail=1)
+    connect = _store(tmp_path)
+    con = connect()
+    # The hostname does not resolve anywhere: the request can only arrive through the pinned address
+    con.execute("INSERT INTO user_api_keys VALUES ('k1', ?, ?)", (f"http://hooks.invalid:{receiver.port}/in", SECRET))
+    con.execute("INSERT INTO jobs VALUES ('t1', 'u1', 'processing', 'k1')")
+    con.execute("UPDATE jobs SET status = 'completed' WHERE id = 't1'")
+    con.commit()
+    con.close()
+    monkeypatch.setattr(webhooks, "_public_addresses", lambda host, port: [ipaddress.ip_address("127.0.0.1")])
+
+    writer = DBWriter(connect)
+    storage = SQLiteStorage(connect, writer=writer, returning=returning)
+    dispatcher = WebhookDispatcher(storage, lambda row: {"id": row["task_id"], "status": "completed"},
+                                   base_delay=0.1, max_delay=0.1, poll_interval=0.05, timeout=5)
+
+    async def main():
+        runner = asyncio.create_task(dispatcher.run())
+        deadline = time.monotonic() + 10
+        while dispatcher.stats["delivered"] < 1 and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        await dispatcher.stop()
+        await runner
+    try:
+        asyncio.run(main())
+    finally:
+        writer.stop()
+        receiver.close()
+
+    assert len(receiver.requests) == 2
+    (first_headers, first_body), (headers, body) = receiver.requests
+    assert first_body == body  # Payload frozen on the first attempt
+    assert headers["Host"] == f"hooks.invalid:{receiver.port}"
+    assert headers["X-Webhook-Attempt"] == "2"
+    assert verify(SECRET, headers[webhooks.SIGNATURE_HEADER], body)
+    assert json.loads(body)["type"] == "task.completed"
+    con = connect()
+    row = con.execute("SELECT status, attempts FROM webhook_deliveries").fetchone()
+    con.close()
+    assert (row["status"], row["attempts"]) == ("delivered", 2)
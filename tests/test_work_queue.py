@@ -0,0 +1,163 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from server import work_queue
+from server.work_queue import RetryLater, WorkQueue, WorkRunner
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def make_queue(tmp_path):
+    def make(**kwargs):
+        path = tmp_path / "work.db"
+
+        def connect():
+            return sqlite3.connect(path, timeout=5)
+        con = connect()
+        con.executescript(work_queue.SCHEMA)
+        con.close()
+        return WorkQueue(connect, **kwargs)
+    return make
+
+
+def enqueue(queue, kind="job", payload=None, **kwargs):
+    con = queue.connect()
+    try:
+        added = queue.enqueue(con, kind, payload or {}, **kwargs)
+        con.commit()
+    finally:
+        con.close()
+    return added
+
+
+def status(queue, item_id):
+    con = queue.connect()
+    try:
+        return con.execute("SELECT status, attempts, last_error FROM work_items WHERE id = ?", (item_id,)).fetchone()
+    finally:
+        con.close()
+
+
+def test_dedupe_key_allows_one_active_item(make_queue):
+    queue = make_queue()
+    assert enqueue(queue, dedupe_key="job:1")
+    assert not enqueue(queue, dedupe_key="job:1")
+    [item] = queue.lease("w1")
+    queue.complete(item)
+    assert enqueue(queue, dedupe_key="job:1")  # Finished items don't block a new one
+
+
+def test_expired_lease_is_redelivered_and_old_owner_loses_it(make_queue):
+    clock = Clock()
+    queue = make_queue(lease_seconds=30, clock=clock)
+    enqueue(queue, payload={"n": 1})
+    [first] = queue.lease("w1")
+    assert first.payload == {"n": 1} and first.attempts == 1
+    assert queue.lease("w2") == []
+    clock.now += 31
+    [second] = queue.lease("w2")
+    assert second.id == first.id and second.attempts == 2
+    # The first worker's lease token is stale: it can neither extend nor finish the item
+    assert not queue.heartbeat(first)
+    assert not queue.complete(first)
+    assert queue.complete(second)
+    assert status(queue, first.id)[0] == work_queue.DONE
+
+
+def test_heartbeat_renews_the_lease(make_queue):
+    clock = Clock()
+    queue = make_queue(lease_seconds=30, clock=clock)
+    enqueue(queue)
+    [item] = queue.lease("w1")
+    clock.now += 20
+    assert queue.heartbeat(item)
+    clock.now += 20  # 40s after the lease was taken, 20s after the heartbeat
+    assert queue.lease("w2") == []
+    clock.now += 11
+    assert [i.id for i in queue.lease("w2")] == [item.id]
+
+
+def test_retry_later_does_not_use_an_attempt(make_queue):
+    clock = Clock()
+    queue = make_queue(clock=clock)
+    enqueue(queue, max_attempts=1)
+    [item] = queue.lease("w1")
+    assert queue.retry_later(item, 10)
+    assert queue.lease("w1") == []
+    clock.now += 10
+    [again] = queue.lease("w1")
+    assert again.attempts == 1
+
+
+def test_failures_back_off_then_dead_letter(make_queue):
+    clock = Clock()
+    queue = make_queue(clock=clock)
+    enqueue(queue, max_attempts=2)
+    [item] = queue.lease("w1")
+    assert not queue.fail(item, "boom", base_delay=10)
+    assert queue.lease("w1") == []  # Backing off
+    clock.now += 10
+    [item] = queue.lease("w1")
+    assert queue.fail(item, "boom again", base_delay=10)
+    assert tuple(status(queue, item.id)) == (work_queue.DEAD, 2, "boom again")
+    clock.now += 3600
+    assert queue.lease("w1") == []
+
+    con = queue.connect()
+    try:
+        assert queue.snapshot(con)["dead"][0]["id"] == item.id
+        assert queue.retry_dead(con, item.id)
+        con.commit()
+    finally:
+        con.close()
+    [revived] = queue.lease("w1")
+    assert revived.id == item.id and revived.attempts == 1
+
+
+def test_runner_completes_retries_and_dead_letters(make_queue):
+    queue = make_queue(lease_seconds=30)
+    for kind in ("ok", "poll", "broken"):
+        enqueue(queue, kind)
+    polls = []
+    errors = []
+
+    async def ok(payload):
+        pass
+
+    async def poll(payload):
+        polls.append(1)
+        if len(polls) < 3:
+            raise RetryLater(0)
+
+    async def broken(payload):
+        raise ValueError("bad payload")
+
+    async def run():
+        runner = WorkRunner(queue, {"ok": ok, "poll": poll, "broken": broken}, "w1", poll_interval=0.01,
+                            on_error=lambda item, exc, dead: errors.append((item.kind, dead)))
+        task = asyncio.create_task(runner.run())
+        for _ in range(200):
+            await asyncio.sleep(0.01)
+            if len(polls) >= 3 and errors:
+                break
+        await runner.stop()
+        await task
+
+    # The failing item dies at once: one attempt, and no backoff wait to sit through
+    con = queue.connect()
+    con.execute("UPDATE work_items SET max_attempts = 1 WHERE kind = 'broken'")
+    con.commit()
+    con.close()
+    asyncio.run(run())
+    assert [tuple(status(queue, i))[0] for i in (1, 2, 3)] == [work_queue.DONE, work_queue.DONE, work_queue.DEAD]
+    assert len(polls) == 3
+    assert errors == [("broken", True)]